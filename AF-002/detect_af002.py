@@ -4,75 +4,241 @@ AF-002: Selective Browser History Deletion Detection
 Uses RULE.rq to detect contradictions between IndexedDB and Chrome History
 
 Usage:
-    python3 detect_af002.py <mft_file> <history_file> <usn_file>
+    python3 detect_af002.py <mft_file> <history_file> <usn_file> [--first-hit]
+        [--load-workers N] [--cache-dir PATH | --no-cache]
+        [--metrics-json PATH] [--metrics-prom PATH] [--profile]
+        [--output ndjson [--host NAME] [--case-id ID]]
+
+The three graphs are parsed concurrently (one process each) and merged into
+the urn:graph:mft, urn:graph:history and urn:graph:usn named graphs.
+
+history_file may also be the Chrome History SQLite database itself: its urls
+table is then read directly (read-only, immutable) and matched against the
+MFT domains, with no JSON-LD conversion or RDF parsing of the history.
+
+Results are cached by RULE.rq, the input digests and the engine version;
+a rerun on unchanged inputs prints the cached report without loading
+anything (see af_common/result_cache.py).
 
 Example:
     python3 detect_af002.py ../baseline/mft_filled_case2.jsonld ../HISTORY_DB/history_filled.jsonld ../USN/usn_filled_case2.jsonld
+    python3 detect_af002.py mft_indexeddb_filtered.jsonld ../HISTORY_DB/History usn_history_filtered.jsonld
 """
 
+import argparse
 import sys
-from rdflib import Dataset
-
-# Check arguments
-if len(sys.argv) != 4:
-    print("Usage: python3 detect_af002.py <mft_file> <history_file> <usn_file>")
-    print("\nExample:")
-    print("  python3 detect_af002.py ../baseline/mft_filled_case2.jsonld ../HISTORY_DB/history_filled.jsonld ../USN/usn_filled_case2.jsonld")
-    sys.exit(1)
-
-mft_file = sys.argv[1]
-history_file = sys.argv[2]
-usn_file = sys.argv[3]
-
-# Load RULE.rq
-with open("RULE.rq", "r") as f:
-    query = f.read()
-
-# Create dataset with named graphs
-ds = Dataset()
-
-# Load MFT graph (IndexedDB folder structure)
-print(f"Loading MFT graph from: {mft_file}")
-mft_graph = ds.graph("urn:graph:mft")
-mft_graph.parse(mft_file, format="json-ld")
-print(f"  {len(mft_graph)} triples loaded")
-
-# Load History graph (Chrome History database)
-print(f"Loading History graph from: {history_file}")
-history_graph = ds.graph("urn:graph:history")
-history_graph.parse(history_file, format="json-ld")
-print(f"  {len(history_graph)} triples loaded")
-
-# Load USN graph (file system evidence)
-print(f"Loading USN graph from: {usn_file}")
-usn_graph = ds.graph("urn:graph:usn")
-usn_graph.parse(usn_file, format="json-ld")
-print(f"  {len(usn_graph)} triples loaded")
-
-# Execute RULE.rq
-print("\n" + "="*60)
-print("Running AF-002 Detection Query (RULE.rq)")
-print("="*60 + "\n")
-
-results = list(ds.query(query))
-
-if results:
-    print(f"🚨 AF-002 ALERT: Selective Browser History Deletion Detected!")
-    print(f"\nFound {len(results)} contradiction(s):\n")
-
-    for i, row in enumerate(results, 1):
-        print(f"Contradiction #{i}:")
-        print(f"  Domain:       {row.domain}")
-        print(f"  MFT File:     {row.mft_file}")
-        print(f"  USN Evidence: {row.usn_evidence}")
-        print()
-
-    print("="*60)
-    print("CONCLUSION: Domain exists in IndexedDB folders (MFT)")
-    print("            BUT missing from Chrome History database")
-    print("            AND USN Journal shows History file modification")
-    print("="*60)
-else:
-    print("✓ No selective deletion detected")
-    print("  All IndexedDB domains found in Chrome History")
-    print("  OR no USN tampering evidence")
+from pathlib import Path
+from typing import Dict
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from af_common.alerts import add_output_arguments, open_alerts
+from af_common.graph_load import Source, add_load_arguments, load_graphs
+from af_common.metrics import RunMetrics, add_metrics_arguments, profiled
+from af_common.query import run_query
+from af_common.result_cache import add_cache_arguments, engine_id, lookup, open_cache
+
+RULE_FILE = Path(__file__).resolve().parent / "RULE.rq"
+# Reads the History database in place of the JSON-LD export
+HISTORY_DB_CODE = Path(__file__).resolve().parent.parent / 'af_common' / 'history_db.py'
+
+# Step 1 of RULE.rq: the domains named by IndexedDB folders in the MFT graph
+MFT_DOMAINS_QUERY = """
+PREFIX core: <https://ontology.unifiedcyberontology.org/uco/core/>
+PREFIX observable: <https://ontology.unifiedcyberontology.org/uco/observable/>
+PREFIX dfc-ext: <https://www.w3.org/dfc-ext/>
+
+SELECT DISTINCT ?domain
+WHERE {
+  GRAPH <urn:graph:mft> {
+    ?mft_entry a observable:File ;
+               core:hasFacet ?file_facet, ?mft_facet .
+    ?file_facet a observable:FileFacet ;
+                observable:filePath ?mft_path .
+    ?mft_facet a dfc-ext:MftFacet ;
+               dfc-ext:parentPath ?parent_path .
+    FILTER(CONTAINS(?parent_path, "IndexedDB"))
+    BIND(STRBEFORE(STRAFTER(?parent_path, "https_www."), "_") AS ?domain)
+    FILTER(?domain != "")
+  }
+}
+"""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="AF-002 Selective Browser History Deletion Detection",
+        epilog="Example: python3 detect_af002.py ../baseline/mft_filled_case2.jsonld "
+               "../HISTORY_DB/history_filled.jsonld ../USN/usn_filled_case2.jsonld"
+    )
+    parser.add_argument('mft_file', help="MFT JSON-LD file (IndexedDB folders)")
+    parser.add_argument('history_file',
+                        help="Chrome History JSON-LD file, or the History SQLite database")
+    parser.add_argument('usn_file', help="USN JSON-LD file")
+    parser.add_argument('--first-hit', action='store_true',
+                        help="Stop at the first confirmed contradiction (triage)")
+    add_load_arguments(parser)
+    add_cache_arguments(parser)
+    add_metrics_arguments(parser)
+    add_output_arguments(parser)
+
+    return parser.parse_args()
+
+
+def load_history_db(history_file: Path, ds, stage) -> int:
+    """
+    Build urn:graph:history from a Chrome History SQLite database.
+
+    RULE.rq only asks whether any History URL contains a given MFT domain
+    (the OPTIONAL + FILTER(!BOUND(?url_entry))). So the urls table is
+    streamed once against the set of MFT domains, stopping as soon as every
+    domain has been seen. One URL per domain found is added, in the shape
+    of the JSON-LD export. The rule's rows are the same as with the full
+    export.
+
+    Returns:
+        Triples added to urn:graph:history
+    """
+    from rdflib import BNode, Literal, URIRef
+    from rdflib.namespace import RDF
+
+    from af_common.history_db import iter_urls
+
+    core = 'https://ontology.unifiedcyberontology.org/uco/core/'
+    observable = 'https://ontology.unifiedcyberontology.org/uco/observable/'
+
+    with stage.timed('query'):
+        pending = {str(row.domain) for row in ds.query(MFT_DOMAINS_QUERY)}
+    stage.extra['domains'] = len(pending)
+    found = {}
+
+    for url in iter_urls(history_file, stage) if pending else ():
+        for domain in [d for d in pending if d in url]:
+            pending.discard(domain)
+            found[domain] = url
+        if not pending:
+            break
+    stage.extra['domains_found'] = len(found)
+
+    graph = ds.graph(URIRef("urn:graph:history"))
+    for url in found.values():
+        entry, facet = BNode(), BNode()
+        graph.add((entry, RDF.type, URIRef(observable + 'URL')))
+        graph.add((entry, URIRef(core + 'hasFacet'), facet))
+        graph.add((facet, RDF.type, URIRef(observable + 'URLFacet')))
+        graph.add((facet, URIRef(observable + 'fullValue'), Literal(url)))
+    return len(graph)
+
+
+def report(results, triple_counts: Dict[str, int], alerts=None) -> int:
+    """
+    Print the AF-002 findings (and stream them to alerts, an AlertStream).
+    Returns 2 if detection is positive, else 0.
+    """
+    if results:
+        print(f"🚨 AF-002 ALERT: Selective Browser History Deletion Detected!")
+        print(f"\nFound {len(results)} contradiction(s):\n")
+
+        for i, row in enumerate(results, 1):
+            print(f"Contradiction #{i}:")
+            print(f"  Domain:       {row.domain}")
+            print(f"  MFT File:     {row.mft_file}")
+            print(f"  USN Evidence: {row.usn_evidence}")
+            print()
+            if alerts:
+                alerts.finding({'domain': str(row.domain), 'mft_file': str(row.mft_file),
+                                'usn_evidence': str(row.usn_evidence)})
+
+        print("="*60)
+        print("CONCLUSION: Domain exists in IndexedDB folders (MFT)")
+        print("            BUT missing from Chrome History database")
+        print("            AND USN Journal shows History file modification")
+        print("="*60)
+
+        return 2  # Exit code 2 = detection positive
+    else:
+        print("✓ No selective deletion detected")
+        print("  All IndexedDB domains found in Chrome History")
+        print("  OR no USN tampering evidence")
+
+        return 0
+
+
+def main():
+    args = parse_args()
+    alerts = open_alerts(args, 'AF-002')
+    mft_file, history_file, usn_file = args.mft_file, args.history_file, args.usn_file
+
+    for label, path in (("MFT", mft_file), ("History", history_file), ("USN", usn_file)):
+        if not Path(path).exists():
+            print(f"ERROR: {label} file not found: {path}", file=sys.stderr)
+            return 1
+
+    # Load RULE.rq (next to this script, so it works from any directory)
+    query = RULE_FILE.read_text()
+
+    run_metrics = RunMetrics('AF-002/detect_af002')
+    cache = open_cache(args)
+    key, hit = lookup(cache, run_metrics, query, [mft_file, history_file, usn_file],
+                      engine_id('sparql', Path(__file__), HISTORY_DB_CODE),
+                      {'first_hit': args.first_hit})
+    if hit:
+        exit_code = report(hit.rows, hit.counts, alerts)
+        if alerts:
+            alerts.summary(exit_code, hit.counts, run_metrics, cached=True)
+        run_metrics.emit(args.metrics_json, args.metrics_prom)
+        return exit_code
+
+    from af_common.history_db import is_history_db
+    history_db = is_history_db(Path(history_file))
+
+    # rdflib is imported only once inputs are validated; it dominates startup
+    from rdflib import Dataset
+
+    # Create dataset with named graphs
+    ds = Dataset()
+
+    with profiled(args.profile):
+        # MFT (IndexedDB folder structure), History (Chrome History database)
+        # and USN (file system evidence) are independent: parse them concurrently
+        inputs = (('mft', "MFT", mft_file), ('history', "History", history_file),
+                  ('usn', "USN", usn_file))
+        if history_db:
+            inputs = tuple(i for i in inputs if i[0] != 'history')
+        for _, label, path in inputs:
+            print(f"Loading {label} graph from: {path}")
+        counts = load_graphs([Source(name, path, "json-ld", ds.graph(f"urn:graph:{name}"))
+                              for name, _, path in inputs],
+                             run_metrics, args.load_workers)
+        for name, label, _ in inputs:
+            print(f"  {label}: {counts[name]} triples loaded")
+
+        if history_db:
+            # Needs the MFT graph: only URLs containing an MFT domain matter
+            print(f"Reading History database (SQLite) from: {history_file}")
+            with run_metrics.stage('history') as stage:
+                counts['history'] = load_history_db(Path(history_file), ds, stage)
+            print(f"  History: {stage.records:,} URLs read, {stage.extra['domains_found']} "
+                  f"of {stage.extra['domains']} MFT domains found")
+
+        # Execute RULE.rq
+        print("\n" + "="*60)
+        print("Running AF-002 Detection Query (RULE.rq)")
+        print("="*60 + "\n")
+
+        with run_metrics.stage('query') as stage, stage.timed('query'):
+            results = run_query(ds, query, first_hit=args.first_hit)
+        stage.records = len(results)
+        if args.first_hit and results:
+            print("First-hit mode: stopped at the first confirmed positive\n")
+
+    if cache:
+        cache.store(key, results, counts)
+    exit_code = report(results, counts, alerts)
+    if alerts:
+        alerts.summary(exit_code, counts, run_metrics)
+    run_metrics.emit(args.metrics_json, args.metrics_prom)
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -84,10 +84,11 @@ echo "Step 2: Running AF-002 Detection"
 echo "======================================================================"
 echo
 
+# Exit code 2 means detection positive, not a failure
 python3 detect_af002.py \
     "$OUTPUT_DIR/mft_indexeddb_filtered.jsonld" \
     "$OUTPUT_DIR/history_all.jsonld" \
-    "$OUTPUT_DIR/usn_history_filtered.jsonld"
+    "$OUTPUT_DIR/usn_history_filtered.jsonld" || [ $? -eq 2 ]
 
 echo
 echo "======================================================================"
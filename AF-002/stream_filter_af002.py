@@ -5,7 +5,8 @@ AF-002: Streaming Filter for Selective Browser History Deletion Detection
 Filters large MFT and USN files to extract only relevant entries:
 - MFT: IndexedDB folder entries (contain domain names)
 - USN: History file modifications (DataTruncation/DataOverwrite/DataExtend)
-- History: All entries (already small)
+- History: All entries (already small); a History SQLite database is not
+  copied at all, the detector reads it in place
 
 Usage:
     python3 stream_filter_af002.py \
@@ -13,87 +14,162 @@ Usage:
       --usn usn_filled_large.jsonld \
       --history history_filled.jsonld \
       --output-dir /tmp/af002_filtered/
+
+    # Continue an interrupted run from its last checkpoint
+    python3 stream_filter_af002.py --mft ... --usn ... --history ... \
+      --output-dir /tmp/af002_filtered/ --resume
+
+    # Write the USN output as one entry per History write (see
+    # af_common/usn_coalesce.py) instead of one per USN record
+    python3 stream_filter_af002.py --mft ... --usn ... --history ... \
+      --output-dir /tmp/af002_filtered/ --coalesce-usn
+
+    # Triage: estimate matching MFT/USN entries from 64 spread byte ranges
+    python3 stream_filter_af002.py --mft ... --usn ... --history ... \
+      --output-dir /tmp/af002_filtered/ --sample 64
+
+    # Match USN records on their full path (a Chromium profile's History),
+    # resolving parent directories through an MFT store built from --mft
+    python3 stream_filter_af002.py --mft ... --usn ... --history ... \
+      --output-dir /tmp/af002_filtered/ --mft-store mft_case.afms
 """
 
-import json
+import re
 import sys
 import argparse
 from pathlib import Path
-from typing import Dict, Any, Set
+from typing import Dict, Any, Optional, Set
 from datetime import datetime
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from af_common.checkpoint import CheckpointError, CheckpointStore
+from af_common.metrics import RunMetrics, StageMetrics, add_metrics_arguments, profiled
+from af_common.multimatch import FIELD_PATTERNS
+from af_common.parent_paths import ParentPaths, add_parent_path_arguments, open_parent_paths
+from af_common.pipeline import add_pipeline_arguments, configure, pipeline_config
+from af_common.sampling import add_sampling_arguments, sample_sources, sampling_config
+from af_common.stream_filter import filter_jsonld
+from af_common.usn_coalesce import add_coalesce_arguments, coalesce_usn_file
+
+# Literal masks on the shared multi-pattern matcher
+INDEXEDDB = FIELD_PATTERNS.register('IndexedDB')
+HISTORY_FILE = FIELD_PATTERNS.register('History')
+TAMPERING_KEYWORDS = FIELD_PATTERNS.register('DataTruncation', 'DataOverwrite', 'DataExtend')
 
-def filter_mft_indexeddb(mft_file: Path, output_file: Path):
+# Full path of a Chromium browser's History database (or its journal)
+HISTORY_PATH = re.compile(r'\\User Data\\[^\\]+\\History(-journal)?$', re.IGNORECASE)
+
+
+def is_indexeddb_mft(item: Dict[str, Any]) -> bool:
     """
-    Filter MFT to keep only IndexedDB folder entries.
+    Check if an MFT entry is an IndexedDB folder entry.
 
     IndexedDB paths contain domain names like:
     .\\Users\\...\\IndexedDB\\https_www.youtube.com_0.indexeddb.leveldb
     """
+    if item.get('@type') != 'observable:File' or 'core:hasFacet' not in item:
+        return False
+
+    facets = item['core:hasFacet']
+    if not isinstance(facets, list):
+        facets = [facets]
+
+    # Check if any facet has IndexedDB in path
+    for facet in facets:
+        if isinstance(facet, dict):
+            # Check FileFacet for filePath
+            if 'observable:filePath' in facet:
+                file_path = facet.get('observable:filePath', '')
+                if FIELD_PATTERNS.scan(file_path) & INDEXEDDB:
+                    return True
+            # Check MftFacet for parentPath
+            elif 'dfc-ext:parentPath' in facet:
+                parent_path = facet.get('dfc-ext:parentPath', '')
+                if FIELD_PATTERNS.scan(parent_path) & INDEXEDDB:
+                    return True
+
+    return False
+
+
+def is_history_tampering_usn(item: Dict[str, Any],
+                             paths: Optional[ParentPaths] = None) -> bool:
+    """
+    Check if a USN entry is a History file modification.
+
+    Looks for:
+    - fileName contains "History"
+    - updateReasons contains DataTruncation, DataOverwrite, or DataExtend
+    - with paths: the full path is a Chromium profile's History or
+      History-journal (...\\User Data\\<profile>\\History), when the
+      parent directory resolves
+    """
+    if item.get('@type') != 'observable:File' or 'core:hasFacet' not in item:
+        return False
+
+    facets = item['core:hasFacet']
+    if not isinstance(facets, list):
+        facets = [facets]
+
+    has_history_filename = False
+    has_tampering = False
+    history_name = usn_facet = None
+
+    for facet in facets:
+        if isinstance(facet, dict):
+            # Check FileFacet for fileName
+            if 'observable:fileName' in facet:
+                file_name = facet.get('observable:fileName', '')
+                if FIELD_PATTERNS.scan(file_name) & HISTORY_FILE:
+                    has_history_filename = True
+                    history_name = file_name
+
+            # Check UsnFacet for updateReasons
+            if 'dfc-ext:updateReasons' in facet:
+                update_reasons = facet.get('dfc-ext:updateReasons', '')
+                if FIELD_PATTERNS.scan(update_reasons) & TAMPERING_KEYWORDS:
+                    has_tampering = True
+                    usn_facet = facet
+
+    # Keep if both conditions met
+    if not (has_history_filename and has_tampering):
+        return False
+    if paths is None:
+        return True
+
+    # Narrow to the full path; an unresolved parent keeps the fileName match
+    path = paths.file_path(usn_facet, history_name)
+    return path is None or HISTORY_PATH.search(path) is not None
+
+
+def source_predicates(sources: Dict[str, Path]) -> Dict[str, Any]:
+    """Entry predicates per evidence source, for single-pass multi-rule prefiltering."""
+    return {'mft': is_indexeddb_mft, 'usn': is_history_tampering_usn}
+
+
+def filter_mft_indexeddb(mft_file: Path, output_file: Path,
+                         checkpoints: Optional[CheckpointStore] = None,
+                         metrics: Optional[StageMetrics] = None):
+    """
+    Filter MFT to keep only IndexedDB folder entries.
+    """
     print(f"Pass 1: Filtering MFT for IndexedDB entries...")
     print(f"  MFT file: {mft_file.name} ({mft_file.stat().st_size / (1024**2):.2f} MB)")
 
-    filtered_graph = []
-    total = 0
-    matched = 0
-    context = None
-
-    with open(mft_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-
-        # Extract context
-        if isinstance(data, dict) and '@context' in data:
-            context = data['@context']
-
-        # Get entries
-        if isinstance(data, dict) and '@graph' in data:
-            entries = data['@graph']
-        elif isinstance(data, list):
-            entries = data
-        else:
-            entries = [data]
-
-        # Filter for IndexedDB entries
-        for item in entries:
-            total += 1
-            if item.get('@type') == 'observable:File' and 'core:hasFacet' in item:
-                facets = item['core:hasFacet']
-                if not isinstance(facets, list):
-                    facets = [facets]
-
-                # Check if any facet has IndexedDB in path
-                for facet in facets:
-                    if isinstance(facet, dict):
-                        # Check FileFacet for filePath
-                        if 'observable:filePath' in facet:
-                            file_path = facet.get('observable:filePath', '')
-                            if 'IndexedDB' in str(file_path):
-                                filtered_graph.append(item)
-                                matched += 1
-                                if matched % 100 == 0:
-                                    print(f"  Progress: {matched} IndexedDB entries found (scanned {total:,})", end='\r')
-                                break
-                        # Check MftFacet for parentPath
-                        elif 'dfc-ext:parentPath' in facet:
-                            parent_path = facet.get('dfc-ext:parentPath', '')
-                            if 'IndexedDB' in str(parent_path):
-                                filtered_graph.append(item)
-                                matched += 1
-                                if matched % 100 == 0:
-                                    print(f"  Progress: {matched} IndexedDB entries found (scanned {total:,})", end='\r')
-                                break
+    def progress(scanned, matched, fraction):
+        print(f"  Progress: {matched} IndexedDB entries found (scanned {scanned:,})", end='\r')
+
+    total, matched = filter_jsonld(
+        mft_file,
+        output_file,
+        is_indexeddb_mft,
+        bare_list_without_context=True,
+        checkpoints=checkpoints,
+        on_progress=progress,
+        metrics=metrics
+    )
 
     print(f"\n  ✓ Filtered: {matched} IndexedDB entries / {total:,} total entries")
 
-    # Write filtered data
-    output_data = {
-        "@context": context,
-        "@graph": filtered_graph
-    } if context else filtered_graph
-
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(output_data, f, indent=2)
-
     output_size = output_file.stat().st_size / (1024**2)
     input_size = mft_file.stat().st_size / (1024**2)
     reduction = (1 - output_size / input_size) * 100 if input_size > 0 else 0
@@ -104,81 +180,38 @@ def filter_mft_indexeddb(mft_file: Path, output_file: Path):
     return matched, total
 
 
-def filter_usn_history(usn_file: Path, output_file: Path):
+def filter_usn_history(usn_file: Path, output_file: Path,
+                       checkpoints: Optional[CheckpointStore] = None,
+                       metrics: Optional[StageMetrics] = None,
+                       paths: Optional[ParentPaths] = None):
     """
     Filter USN to keep only History file modifications.
-
-    Looks for:
-    - fileName contains "History"
-    - updateReasons contains DataTruncation, DataOverwrite, or DataExtend
     """
     print(f"\nPass 2: Filtering USN for History file modifications...")
     print(f"  USN file: {usn_file.name} ({usn_file.stat().st_size / (1024**2):.2f} MB)")
-
-    filtered_graph = []
-    total = 0
-    matched = 0
-    context = None
-
-    tampering_keywords = ['DataTruncation', 'DataOverwrite', 'DataExtend']
-
-    with open(usn_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-
-        # Extract context
-        if isinstance(data, dict) and '@context' in data:
-            context = data['@context']
-
-        # Get entries
-        if isinstance(data, dict) and '@graph' in data:
-            entries = data['@graph']
-        elif isinstance(data, list):
-            entries = data
-        else:
-            entries = [data]
-
-        # Filter for History file modifications
-        for item in entries:
-            total += 1
-            if item.get('@type') == 'observable:File' and 'core:hasFacet' in item:
-                facets = item['core:hasFacet']
-                if not isinstance(facets, list):
-                    facets = [facets]
-
-                has_history_filename = False
-                has_tampering = False
-
-                for facet in facets:
-                    if isinstance(facet, dict):
-                        # Check FileFacet for fileName
-                        if 'observable:fileName' in facet:
-                            file_name = str(facet.get('observable:fileName', ''))
-                            if 'History' in file_name:
-                                has_history_filename = True
-
-                        # Check UsnFacet for updateReasons
-                        if 'dfc-ext:updateReasons' in facet:
-                            update_reasons = str(facet.get('dfc-ext:updateReasons', ''))
-                            if any(keyword in update_reasons for keyword in tampering_keywords):
-                                has_tampering = True
-
-                # Keep if both conditions met
-                if has_history_filename and has_tampering:
-                    filtered_graph.append(item)
-                    matched += 1
-                    if matched % 100 == 0:
-                        print(f"  Progress: {matched} History modifications found (scanned {total:,})", end='\r')
+    if paths:
+        print(f"  Matching full paths (parent directories from {paths.store.path.name})")
+
+    def progress(scanned, matched, fraction):
+        print(f"  Progress: {matched} History modifications found (scanned {scanned:,})", end='\r')
+
+    total, matched = filter_jsonld(
+        usn_file,
+        output_file,
+        (lambda item: is_history_tampering_usn(item, paths)) if paths else is_history_tampering_usn,
+        bare_list_without_context=True,
+        checkpoints=checkpoints,
+        on_progress=progress,
+        metrics=metrics
+    )
 
     print(f"\n  ✓ Filtered: {matched} History modifications / {total:,} total entries")
-
-    # Write filtered data
-    output_data = {
-        "@context": context,
-        "@graph": filtered_graph
-    } if context else filtered_graph
-
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(output_data, f, indent=2)
+    if paths:
+        stats = paths.stats()
+        print(f"  ✓ Parent paths: {stats['resolved']:,} resolved, "
+              f"{stats['unresolved']:,} unresolved (fileName match kept)")
+        if metrics:
+            metrics.extra['parent_paths'] = stats
 
     output_size = output_file.stat().st_size / (1024**2)
     input_size = usn_file.stat().st_size / (1024**2)
@@ -196,11 +229,28 @@ def main():
     )
     parser.add_argument('--mft', required=True, help="MFT JSON-LD file")
     parser.add_argument('--usn', required=True, help="USN JSON-LD file")
-    parser.add_argument('--history', required=True, help="History JSON-LD file")
+    parser.add_argument('--history', required=True,
+                        help="History JSON-LD file, or the Chrome History SQLite database")
     parser.add_argument('--output-dir', required=True, help="Output directory")
+    parser.add_argument('--resume', action='store_true',
+                        help="Resume an interrupted run from the checkpoint in --output-dir")
+    parser.add_argument('--checkpoint-interval', type=float, default=30.0,
+                        help="Seconds between checkpoints (default: 30)")
+    add_coalesce_arguments(parser)
+    add_parent_path_arguments(parser, builds_from_mft=True)
+    add_pipeline_arguments(parser)
+    add_sampling_arguments(parser)
+    add_metrics_arguments(parser)
 
     args = parser.parse_args()
 
+    try:
+        configure(pipeline_config(args))
+        sampling = sampling_config(args)
+    except ValueError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+
     # Setup paths
     mft_file = Path(args.mft)
     usn_file = Path(args.usn)
@@ -220,6 +270,17 @@ def main():
         print(f"ERROR: History file not found: {history_file}", file=sys.stderr)
         return 1
 
+    if sampling:
+        print("=" * 70)
+        print("AF-002: Sampled Triage for Browser History Deletion Detection")
+        print("=" * 70)
+        run_metrics = RunMetrics('AF-002/stream_filter_af002')
+        with profiled(args.profile):
+            results = sample_sources(source_predicates({}), {'mft': mft_file, 'usn': usn_file},
+                                     sampling, run_metrics)
+        run_metrics.emit(args.metrics_json, args.metrics_prom)
+        return 0 if results is not None else 1
+
     # Create output directory
     output_dir.mkdir(parents=True, exist_ok=True)
 
@@ -229,22 +290,64 @@ def main():
     print()
 
     start_time = datetime.now()
-
-    # Filter MFT for IndexedDB entries
-    mft_output = output_dir / "mft_indexeddb_filtered.jsonld"
-    mft_matched, mft_total = filter_mft_indexeddb(mft_file, mft_output)
-
-    # Filter USN for History modifications
-    usn_output = output_dir / "usn_history_filtered.jsonld"
-    usn_matched, usn_total = filter_usn_history(usn_file, usn_output)
-
-    # Copy History file (already small)
-    history_output = output_dir / "history_all.jsonld"
-    print(f"\nCopying History file...")
-    print(f"  ✓ {history_output.name} ({history_file.stat().st_size / 1024:.2f} KB)")
-
-    import shutil
-    shutil.copy2(history_file, history_output)
+    run_metrics = RunMetrics('AF-002/stream_filter_af002')
+
+    paths = None
+    try:
+        checkpoints = CheckpointStore(output_dir, resume=args.resume,
+                                      interval=args.checkpoint_interval)
+
+        with profiled(args.profile):
+            # Filter MFT for IndexedDB entries
+            mft_output = output_dir / "mft_indexeddb_filtered.jsonld"
+            with run_metrics.stage('mft') as stage:
+                mft_matched, mft_total = filter_mft_indexeddb(mft_file, mft_output, checkpoints, stage)
+
+            if args.mft_store:
+                print()
+                try:
+                    with run_metrics.stage('mft-store') as stage:
+                        paths = open_parent_paths(args.mft_store, mft_file, stage)
+                except (OSError, ValueError) as e:
+                    print(f"\nERROR: {e}", file=sys.stderr)
+                    return 1
+
+            # Filter USN for History modifications
+            usn_output = output_dir / "usn_history_filtered.jsonld"
+            with run_metrics.stage('usn') as stage:
+                usn_matched, usn_total = filter_usn_history(usn_file, usn_output, checkpoints, stage,
+                                                            paths)
+    except CheckpointError as e:
+        print(f"\nERROR: {e}", file=sys.stderr)
+        print("  Rerun without --resume to start over", file=sys.stderr)
+        return 1
+    finally:
+        if paths:
+            paths.close()
+
+    from af_common.history_db import is_history_db
+
+    if is_history_db(history_file):
+        # The detector reads the urls table straight from the database
+        history_output = history_file
+        print(f"\nHistory is an SQLite database: read in place by the detector")
+    else:
+        # Copy History file (already small)
+        history_output = output_dir / "history_all.jsonld"
+        print(f"\nCopying History file...")
+        print(f"  ✓ {history_output.name} ({history_file.stat().st_size / 1024:.2f} KB)")
+
+        import shutil
+        shutil.copy2(history_file, history_output)
+
+    checkpoints.clear()
+
+    if args.coalesce_usn:
+        # After the checkpoints are cleared: an interrupted coalescing leaves
+        # the filtered records in place and a rerun starts over
+        print()
+        with run_metrics.stage('coalesce:usn') as stage:
+            coalesce_usn_file(usn_output, usn_output, args.coalesce_span, stage)
 
     elapsed = (datetime.now() - start_time).total_seconds()
 
@@ -258,13 +361,17 @@ def main():
     print()
     print("Files created:")
     print(f"  • {mft_output.name} - IndexedDB entries from MFT")
-    print(f"  • {usn_output.name} - History file modifications from USN")
-    print(f"  • {history_output.name} - Chrome History database")
+    print(f"  • {usn_output.name} - History file modifications from USN"
+          + (" (coalesced)" if args.coalesce_usn else ""))
+    if history_output != history_file:
+        print(f"  • {history_output.name} - Chrome History database")
     print()
     print("Next step:")
     print(f"  python3 detect_af002.py {mft_output} {history_output} {usn_output}")
     print("=" * 70)
 
+    run_metrics.emit(args.metrics_json, args.metrics_prom)
+
     return 0
 
 
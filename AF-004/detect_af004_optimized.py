@@ -13,16 +13,42 @@ Usage:
     # Option 2: Direct detection on small files
     python3 detect_af004_optimized.py small_mft.jsonld small_usn.jsonld
 
-    # Option 3: Use N-Triples (faster parsing)
+    # The MFT and USN graphs are parsed concurrently; --load-workers 1 loads them in turn
+
+    # Option 3: Native engine: RULE.rq semantics evaluated directly on the
+    # JSON-LD files, without rdflib (see native_af004.py)
+    python3 detect_af004_optimized.py /tmp/vss/mft_vss_filtered.jsonld /tmp/vss/usn_vss_filtered.jsonld --engine native
+
+    # Bound the native engine's distinct sets; past the limit they spill to disk
+    python3 detect_af004_optimized.py mft.jsonld usn.jsonld --engine native --memory-limit 512M
+
+    # Option 4: Use N-Triples (faster parsing)
     python3 stream_filter_vss.py --mft mft.jsonld --usn usn.jsonld --output-format nt
     python3 detect_af004_optimized.py /tmp/vss_filtered/mft_vss_filtered.nt /tmp/vss_filtered/usn_vss_filtered.nt --format nt
+
+    # Results are cached by rule, input digests and engine: a rerun on
+    # unchanged inputs prints the cached report at once (--no-cache to rerun)
+    python3 detect_af004_optimized.py mft.jsonld usn.jsonld --cache-dir /tmp/af-cache
+
+    # One JSON object per finding on stdout, then a summary record
+    python3 detect_af004_optimized.py mft.jsonld usn.jsonld --output ndjson --case-id IR-2291
 """
 
 import sys
 import os
 import argparse
 from pathlib import Path
-from rdflib import Dataset
+from typing import Dict
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from af_common.alerts import add_output_arguments, open_alerts
+from af_common.graph_load import Source, add_load_arguments, load_graphs
+from af_common.metrics import RunMetrics, add_metrics_arguments, profiled
+from af_common.query import run_query
+from af_common.result_cache import add_cache_arguments, engine_id, lookup, open_cache
+from af_common.spill import add_memory_arguments, memory_budget
+
+SCRIPT_DIR = Path(__file__).resolve().parent
 
 
 def parse_args():
@@ -48,11 +74,28 @@ def parse_args():
         default='RULE_SIMPLE.rq',
         help="SPARQL rule file (default: RULE_SIMPLE.rq)"
     )
+    parser.add_argument(
+        '--engine',
+        choices=['sparql', 'native'],
+        default='sparql',
+        help="sparql: run --rule-file with rdflib (default); native: evaluate "
+             "RULE.rq semantics directly on JSON-LD input without rdflib"
+    )
+    parser.add_argument(
+        '--first-hit',
+        action='store_true',
+        help="Stop at the first confirmed positive (triage; exit code 2 on hit)"
+    )
     parser.add_argument(
         '--verbose',
         action='store_true',
         help="Show detailed loading information"
     )
+    add_load_arguments(parser)
+    add_cache_arguments(parser)
+    add_memory_arguments(parser)
+    add_metrics_arguments(parser)
+    add_output_arguments(parser)
 
     return parser.parse_args()
 
@@ -71,12 +114,115 @@ def detect_format(file_path: Path) -> str:
     return format_map.get(ext, 'json-ld')
 
 
+def report(results, triple_counts: Dict[str, int], unit: str = 'triples', alerts=None) -> int:
+    """
+    Print the AF-004 findings (and stream them to alerts, an AlertStream).
+    Returns 2 if detection is positive, else 0.
+    """
+    print()
+    if results:
+        print("🚨 " + "=" * 58)
+        print("   AF-004 ALERT: Volume Shadow Copy (VSS) Purge Detected!")
+        print("=" * 60)
+        print()
+        print(f"Found {len(results)} contradiction(s):")
+        print()
+
+        for i, row in enumerate(results, 1):
+            print(f"Contradiction #{i}:")
+            print(f"  VSS Infrastructure: {row.vss_infrastructure}")
+            print(f"  Deleted GUID:       {row.deleted_guid}")
+            print(f"  USN Evidence:       {row.usn_evidence}")
+            print()
+            if alerts:
+                alerts.finding({'vss_infrastructure': str(row.vss_infrastructure),
+                                'deleted_guid': str(row.deleted_guid),
+                                'usn_evidence': str(row.usn_evidence)})
+
+        print("=" * 60)
+        print("CONCLUSION:")
+        print("  ✓ VSS infrastructure files exist in MFT")
+        print("  ✓ GUID shadow copy directories were deleted")
+        print("  ✓ USN Journal confirms GUID deletion operations")
+        print()
+        print("  → Anti-forensic activity detected: VSS purge")
+        print("=" * 60)
+
+        return 2  # Exit code 2 = detection positive
+
+    else:
+        print("✓ " + "=" * 58)
+        print("   No VSS purge detected")
+        print("=" * 60)
+        print()
+        print("Analysis:")
+        for source, count in triple_counts.items():
+            print(f"  {source.upper()} {unit}: {count:,}")
+        print()
+        print("Possible reasons:")
+        print("  • VSS infrastructure matches existing GUID directories")
+        print("  • No USN deletion evidence found")
+        print("  • System has not experienced VSS purge activity")
+        print("=" * 60)
+
+        return 0  # Exit code 0 = no detection
+
+
+def run_native(args, mft_file: Path, usn_file: Path, alerts=None) -> int:
+    """Evaluate RULE.rq with native_af004 instead of rdflib."""
+    try:
+        budget = memory_budget(args)
+    except ValueError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+    run_metrics = RunMetrics('AF-004/detect_af004_optimized')
+    cache = open_cache(args)
+    key, hit = lookup(cache, run_metrics, (SCRIPT_DIR / 'RULE.rq').read_text(),
+                      [mft_file, usn_file],
+                      engine_id('native', SCRIPT_DIR / 'native_af004.py'),
+                      {'first_hit': args.first_hit})
+    if hit:
+        exit_code = report(hit.rows, hit.counts, unit='entries', alerts=alerts)
+        if alerts:
+            alerts.summary(exit_code, hit.counts, run_metrics, cached=True)
+        run_metrics.emit(args.metrics_json, args.metrics_prom)
+        return exit_code
+
+    sys.path.insert(0, str(SCRIPT_DIR))
+    from native_af004 import evaluate
+    from af_common.columns import open_columns
+
+    print("=" * 60)
+    print("Running AF-004 Detection (native RULE.rq evaluator)")
+    print("=" * 60)
+
+    with profiled(args.profile):
+        results = evaluate(mft_file, usn_file, run_metrics, first_hit=args.first_hit,
+                           columns=open_columns(cache), budget=budget)
+    if args.first_hit and results:
+        print("First-hit mode: stopped at the first confirmed positive")
+
+    entries = {stage.name: stage.records for stage in run_metrics.stages
+               if stage.name != 'cache'}
+    if cache:
+        cache.store(key, results, entries)
+    exit_code = report(results, entries, unit='entries', alerts=alerts)
+    if alerts:
+        alerts.summary(exit_code, entries, run_metrics)
+    run_metrics.emit(args.metrics_json, args.metrics_prom)
+    return exit_code
+
+
 def main():
     args = parse_args()
+    alerts = open_alerts(args, 'AF-004')
 
     mft_file = Path(args.mft_file)
     usn_file = Path(args.usn_file)
     rule_file = Path(args.rule_file)
+    if not rule_file.exists():
+        # Fall back to the rules shipped next to this script
+        rule_file = SCRIPT_DIR / args.rule_file
 
     # Validation
     if not mft_file.exists():
@@ -88,8 +234,8 @@ def main():
         return 1
 
     if not rule_file.exists():
-        print(f"ERROR: Rule file not found: {rule_file}", file=sys.stderr)
-        print(f"  Looking in current directory: {Path.cwd()}", file=sys.stderr)
+        print(f"ERROR: Rule file not found: {args.rule_file}", file=sys.stderr)
+        print(f"  Looked in: {Path.cwd()} and {SCRIPT_DIR}", file=sys.stderr)
         return 1
 
     # Detect format
@@ -111,88 +257,78 @@ def main():
     print(f"  Size: {usn_file.stat().st_size / (1024**2):.2f} MB")
     print(f"  Format: {usn_format}")
     print()
+    if args.engine == 'native':
+        if 'json-ld' not in (mft_format, usn_format) or mft_format != usn_format:
+            print("ERROR: --engine native reads JSON-LD input only", file=sys.stderr)
+            return 1
+        print("Rule: RULE.rq (native engine)")
+        print()
+        return run_native(args, mft_file, usn_file, alerts)
+
     print(f"Rule: {rule_file.name}")
     print()
 
     # Load SPARQL query
     query = rule_file.read_text()
 
+    run_metrics = RunMetrics('AF-004/detect_af004_optimized')
+    cache = open_cache(args)
+    key, hit = lookup(cache, run_metrics, query, [mft_file, usn_file],
+                      engine_id('sparql', Path(__file__)),
+                      {'first_hit': args.first_hit, 'formats': [mft_format, usn_format]})
+    if hit:
+        exit_code = report(hit.rows, hit.counts, alerts=alerts)
+        if alerts:
+            alerts.summary(exit_code, hit.counts, run_metrics, cached=True)
+        run_metrics.emit(args.metrics_json, args.metrics_prom)
+        return exit_code
+
     # Create dataset with named graphs
     print("=" * 60)
     print("Loading RDF Graphs")
     print("=" * 60)
     print()
 
-    ds = Dataset()
-
-    # Load MFT graph
-    print(f"Loading MFT graph from {mft_file.name}...")
-    mft_graph = ds.graph("urn:graph:mft")
-    mft_graph.parse(mft_file, format=mft_format)
-    print(f"  ✓ {len(mft_graph):,} triples loaded")
-
-    # Load USN graph
-    print(f"Loading USN graph from {usn_file.name}...")
-    usn_graph = ds.graph("urn:graph:usn")
-    usn_graph.parse(usn_file, format=usn_format)
-    print(f"  ✓ {len(usn_graph):,} triples loaded")
-    print()
-
-    # Execute query
-    print("=" * 60)
-    print("Running AF-004 Detection Query")
-    print("=" * 60)
-    print()
-
-    if args.verbose:
-        print("Executing SPARQL query...")
+    # rdflib is imported only once inputs are validated; it dominates startup
+    from rdflib import Dataset
 
-    results = list(ds.query(query))
+    ds = Dataset()
 
-    # Report results
-    print()
-    if results:
-        print("🚨 " + "=" * 58)
-        print("   AF-004 ALERT: Volume Shadow Copy (VSS) Purge Detected!")
-        print("=" * 60)
+    with profiled(args.profile):
+        # Load the MFT and USN graphs concurrently into their named graphs
+        print(f"Loading MFT graph from {mft_file.name}...")
+        print(f"Loading USN graph from {usn_file.name}...")
+        counts = load_graphs([
+            Source('mft', mft_file, mft_format, ds.graph("urn:graph:mft")),
+            Source('usn', usn_file, usn_format, ds.graph("urn:graph:usn")),
+        ], run_metrics, args.load_workers)
+        print(f"  ✓ MFT: {counts['mft']:,} triples loaded")
+        print(f"  ✓ USN: {counts['usn']:,} triples loaded")
         print()
-        print(f"Found {len(results)} contradiction(s):")
-        print()
-
-        for i, row in enumerate(results, 1):
-            print(f"Contradiction #{i}:")
-            print(f"  VSS Infrastructure: {row.vss_infrastructure}")
-            print(f"  Deleted GUID:       {row.deleted_guid}")
-            print(f"  USN Evidence:       {row.usn_evidence}")
-            print()
 
+        # Execute query
         print("=" * 60)
-        print("CONCLUSION:")
-        print("  ✓ VSS infrastructure files exist in MFT")
-        print("  ✓ GUID shadow copy directories were deleted")
-        print("  ✓ USN Journal confirms GUID deletion operations")
-        print()
-        print("  → Anti-forensic activity detected: VSS purge")
+        print("Running AF-004 Detection Query")
         print("=" * 60)
+        print()
 
-        return 2  # Exit code 2 = detection positive
+        if args.verbose:
+            print("Executing SPARQL query...")
 
-    else:
-        print("✓ " + "=" * 58)
-        print("   No VSS purge detected")
-        print("=" * 60)
-        print()
-        print("Analysis:")
-        print(f"  MFT triples: {len(mft_graph):,}")
-        print(f"  USN triples: {len(usn_graph):,}")
-        print()
-        print("Possible reasons:")
-        print("  • VSS infrastructure matches existing GUID directories")
-        print("  • No USN deletion evidence found")
-        print("  • System has not experienced VSS purge activity")
-        print("=" * 60)
+        with run_metrics.stage('query') as stage, stage.timed('query'):
+            results = run_query(ds, query, first_hit=args.first_hit)
+        stage.records = len(results)
+        if args.first_hit and results:
+            print("First-hit mode: stopped at the first confirmed positive")
+
+    if cache:
+        cache.store(key, results, counts)
+    exit_code = report(results, counts, alerts=alerts)
+    if alerts:
+        alerts.summary(exit_code, counts, run_metrics)
+    run_metrics.emit(args.metrics_json, args.metrics_prom)
+    return exit_code
 
-        return 0  # Exit code 0 = no detection
 
 if __name__ == '__main__':
     sys.exit(main())
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+AF-004: Native VSS Purge Evaluator (RULE.rq semantics without rdflib)
+
+Evaluates RULE.rq directly over the JSON-LD MFT and USN files:
+
+1. One pass over the MFT collects the VSS infrastructure files (FileFacet
+   names containing tracking.log / IndexerVolumeGuid / _OnDiskSnapshotProp
+   on a File with a System Volume Information MftFacet) and the existing
+   GUID directories there
+2. One pass over the USN collects GUID-named files (precompiled regex,
+   the same pattern as RULE.rq) with FileDelete/DataTruncation reasons
+3. The OPTIONAL { GUID directory } + FILTER(!BOUND) anti-join is a set test
+
+The anti-join shares no variable with the rest of RULE.rq, so a single
+remaining GUID directory under System Volume Information suppresses every
+row, exactly as in the SPARQL. As in RULE.rq, a directory only counts when
+its isDirectory value equals the plain string "true"; exporters that write
+"true"^^xsd:boolean never match that comparison. Rows are the DISTINCT
+(vss_infrastructure, deleted_guid, usn_evidence) combinations ordered by
+deleted_guid, identical to RULE.rq.
+
+Usage:
+    # Used by the detector
+    python3 detect_af004_optimized.py mft.jsonld usn.jsonld --engine native
+
+    # Compare with RULE.rq under rdflib (rows and timings)
+    python3 native_af004.py mft.jsonld usn.jsonld --verify
+"""
+
+import argparse
+import re
+import sys
+import time
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from af_common.metrics import RunMetrics, StageMetrics
+from af_common.native import typed_entries
+from af_common.spill import MemoryBudget, SpillingDistinct
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+
+OBSERVABLE = 'https://ontology.unifiedcyberontology.org/uco/observable/'
+DFC_EXT = 'https://www.w3.org/dfc-ext/'
+
+FILE = OBSERVABLE + 'File'
+FILE_FACET = OBSERVABLE + 'FileFacet'
+MFT_FACET = DFC_EXT + 'MftFacet'
+USN_FACET = DFC_EXT + 'UsnFacet'
+FILE_NAME = OBSERVABLE + 'fileName'
+IS_DIRECTORY = OBSERVABLE + 'isDirectory'
+PARENT_PATH = DFC_EXT + 'parentPath'
+UPDATE_REASONS = DFC_EXT + 'updateReasons'
+
+SVI = "System Volume Information"
+VSS_INDICATORS = ("tracking.log", "IndexerVolumeGuid", "_OnDiskSnapshotProp")
+DELETION_INDICATORS = ("FileDelete", "FileDeleteClose", "DataTruncation")
+
+# RULE.rq's REGEX pattern, compiled once (rdflib evaluates REGEX with re.search)
+GUID_PATTERN = re.compile(
+    r'^\{[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\}$')
+
+
+class Row(NamedTuple):
+    """One RULE.rq result row (attribute names match the SPARQL variables)."""
+    vss_infrastructure: str
+    deleted_guid: str
+    usn_evidence: str
+
+
+def scan_mft(mft_file: Path, metrics: Optional[StageMetrics] = None) -> Tuple[List[str], Set[str]]:
+    """
+    One MFT pass.
+
+    Returns:
+        (VSS infrastructure file names in first-seen order,
+         names of GUID directories under System Volume Information)
+    """
+    infrastructure: Dict[str, None] = {}
+    guid_dirs: Set[str] = set()
+
+    for terms, _, facets in typed_entries(mft_file, {FILE}, metrics):
+        in_svi = any(SVI in parent
+                     for facet in facets if MFT_FACET in terms.types(facet)
+                     for parent in terms.strings(terms.get(facet, PARENT_PATH)))
+        if not in_svi:
+            continue
+
+        for facet in facets:
+            if FILE_FACET not in terms.types(facet):
+                continue
+            names = list(terms.strings(terms.get(facet, FILE_NAME)))
+            for name in names:
+                if any(indicator in name for indicator in VSS_INDICATORS):
+                    infrastructure.setdefault(name)
+            # The GUID name and isDirectory must come from the same FileFacet
+            if terms.equals(terms.get(facet, IS_DIRECTORY), "true"):
+                guid_dirs.update(name for name in names if GUID_PATTERN.search(name))
+
+    return list(infrastructure), guid_dirs
+
+
+def scan_usn(usn_file: Path, metrics: Optional[StageMetrics] = None,
+             budget: Optional[MemoryBudget] = None) -> Iterable[Tuple[str, str]]:
+    """
+    One USN pass: distinct (GUID file name, update reasons) deletion records,
+    in first-seen order (deduplicated on disk past budget).
+    """
+    deletions = SpillingDistinct(budget, 'deletions')
+
+    for terms, _, facets in typed_entries(usn_file, {FILE}, metrics):
+        names = [name
+                 for facet in facets if FILE_FACET in terms.types(facet)
+                 for name in terms.strings(terms.get(facet, FILE_NAME))
+                 if GUID_PATTERN.search(name)]
+        if not names:
+            continue
+        reasons = [reason
+                   for facet in facets if USN_FACET in terms.types(facet)
+                   for reason in terms.strings(terms.get(facet, UPDATE_REASONS))
+                   if any(indicator in reason for indicator in DELETION_INDICATORS)]
+        for name in names:
+            for reason in reasons:
+                deletions.add((name, reason), (name, reason))
+
+    return deletions
+
+
+def scan_mft_columns(table) -> Tuple[List[str], Set[str]]:
+    """scan_mft() over the MFT's column table: rows selected with array masks."""
+    import numpy as np
+
+    in_svi = table.type_mask(FILE) & table.mask(
+        'parentPath', table.codes_containing('parentPath', SVI))
+    rows = np.flatnonzero(in_svi)
+    names = table.codes('fileName')[rows]
+    values = table.values('fileName')
+
+    indicators = np.unique(np.concatenate(
+        [table.codes_containing('fileName', indicator) for indicator in VSS_INDICATORS]))
+    infrastructure = dict.fromkeys(values[code] for code in names[np.isin(names, indicators)])
+
+    is_directory = table.mask('isDirectory', table.codes_where('isDirectory',
+                                                               lambda value: value == "true"))
+    guids = table.codes_where('fileName', GUID_PATTERN.search)
+    guid_dirs = {values[code] for code in names[is_directory[rows] & np.isin(names, guids)]}
+    return list(infrastructure), guid_dirs
+
+
+def scan_usn_columns(table) -> List[Tuple[str, str]]:
+    """scan_usn() over the USN's column table."""
+    import numpy as np
+
+    deleted = (table.type_mask(FILE)
+               & table.mask('fileName', table.codes_where('fileName', GUID_PATTERN.search))
+               & table.mask('updateReasons', table.codes_where(
+                   'updateReasons',
+                   lambda reason: any(indicator in reason for indicator in DELETION_INDICATORS))))
+    rows = np.flatnonzero(deleted)
+    names, reasons = table.values('fileName'), table.values('updateReasons')
+    return list(dict.fromkeys(
+        (names[name], reasons[reason])
+        for name, reason in zip(table.codes('fileName')[rows].tolist(),
+                                table.codes('updateReasons')[rows].tolist())))
+
+
+def evaluate(mft_file: Path, usn_file: Path, run_metrics: Optional[RunMetrics] = None,
+             first_hit: bool = False, columns=None,
+             budget: Optional[MemoryBudget] = None) -> List[Row]:
+    """
+    Evaluate RULE.rq over the MFT and USN JSON-LD files.
+
+    Args:
+        run_metrics: records the passes as stages 'mft' and 'usn' (the USN
+            pass is skipped when the MFT alone rules out a detection)
+        first_hit: return at most one row (any row confirms a positive)
+        columns: ColumnCache (af_common.columns); when both inputs have a
+            column table, they are evaluated on it instead of the JSON-LD
+        budget: MemoryBudget (af_common.spill) for the distinct USN
+            deletions; past it they are deduplicated on disk
+
+    Returns:
+        Result rows ordered by deleted_guid
+    """
+    def stage(name):
+        return run_metrics.stage(name) if run_metrics else nullcontext()
+
+    tables = {}
+    with stage('mft') as metrics:
+        if columns is not None:
+            tables['mft'] = columns.table(Path(mft_file), metrics)
+        if tables.get('mft'):
+            infrastructure, guid_dirs = scan_mft_columns(tables['mft'])
+        else:
+            infrastructure, guid_dirs = scan_mft(Path(mft_file), metrics)
+
+    # FILTER(!BOUND(?guid_entry)): any remaining GUID directory binds it for every row
+    if not infrastructure or guid_dirs:
+        return []
+
+    with stage('usn') as metrics:
+        if columns is not None:
+            tables['usn'] = columns.table(Path(usn_file), metrics)
+        if tables.get('usn'):
+            deletions = scan_usn_columns(tables['usn'])
+        else:
+            deletions = scan_usn(Path(usn_file), metrics, budget)
+    rows = [Row(infra, name, reason)
+            for name, reason in deletions
+            for infra in infrastructure]
+    if budget is not None and metrics is not None:
+        metrics.extra['memory'] = budget.to_dict()
+    rows.sort(key=lambda row: row.deleted_guid)
+    return rows[:1] if first_hit else rows
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="AF-004 native RULE.rq evaluator (no rdflib)"
+    )
+    parser.add_argument('mft_file', help="MFT JSON-LD file")
+    parser.add_argument('usn_file', help="USN JSON-LD file")
+    parser.add_argument(
+        '--verify',
+        action='store_true',
+        help="Also run RULE.rq with rdflib and compare the rows"
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    mft_file, usn_file = Path(args.mft_file), Path(args.usn_file)
+    for label, path in (("MFT", mft_file), ("USN", usn_file)):
+        if not path.exists():
+            print(f"ERROR: {label} file not found: {path}", file=sys.stderr)
+            return 1
+
+    print("=" * 60)
+    print("AF-004 Native Evaluator (RULE.rq)")
+    print("=" * 60)
+
+    start = time.perf_counter()
+    rows = evaluate(mft_file, usn_file)
+    native_seconds = time.perf_counter() - start
+    print(f"Native:  {len(rows):,} row(s) in {native_seconds:.3f}s")
+
+    if not args.verify:
+        return 0
+
+    from rdflib import Dataset
+
+    start = time.perf_counter()
+    ds = Dataset()
+    ds.graph("urn:graph:mft").parse(mft_file, format='json-ld')
+    ds.graph("urn:graph:usn").parse(usn_file, format='json-ld')
+    sparql = [Row(str(r.vss_infrastructure), str(r.deleted_guid), str(r.usn_evidence))
+              for r in ds.query((SCRIPT_DIR / 'RULE.rq').read_text())]
+    sparql_seconds = time.perf_counter() - start
+    print(f"SPARQL:  {len(sparql):,} row(s) in {sparql_seconds:.3f}s (load + query)")
+
+    if sorted(rows) == sorted(sparql) and \
+            [r.deleted_guid for r in rows] == [r.deleted_guid for r in sparql]:
+        print(f"✓ Identical results ({sparql_seconds / native_seconds:.0f}x faster)")
+        return 0
+
+    print("🚨 Results differ")
+    for row in sorted(set(rows) - set(sparql)):
+        print(f"  native only: {row}")
+    for row in sorted(set(sparql) - set(rows)):
+        print(f"  SPARQL only: {row}")
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
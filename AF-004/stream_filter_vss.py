@@ -6,7 +6,7 @@ Filters large JSON-LD MFT/USN files to extract only VSS-related entries
 without loading the entire file into memory. Handles 50GB+ files.
 
 Algorithm:
-1. Stream through JSON-LD using ijson (constant memory)
+1. Stream through JSON-LD one @graph entry at a time (constant memory)
 2. For each @graph entry, check VSS relevance
 3. Emit complete matching entries to output N-Triples file
 4. Preserves ALL facets and properties needed for AF-004 detection
@@ -17,6 +17,12 @@ Usage:
       --usn ../USN/usn_filled_case5.jsonld \
       --output-dir /tmp/vss_filtered/
 
+    # Continue an interrupted run from its last checkpoint
+    python3 stream_filter_vss.py --mft ... --usn ... --output-dir /tmp/vss_filtered/ --resume
+
+    # Triage: estimate VSS-relevant entry counts from 64 spread byte ranges
+    python3 stream_filter_vss.py --mft ... --usn ... --sample 64
+
 Performance:
     - Memory: ~50MB constant (regardless of input size)
     - Speed: ~100MB/sec input processing
@@ -24,10 +30,34 @@ Performance:
 """
 
 import argparse
-import json
 import sys
 from pathlib import Path
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from af_common.checkpoint import CheckpointError, CheckpointStore
+from af_common.facets import FACET_TYPES, facet_kinds, facet_list
+from af_common.metrics import RunMetrics, StageMetrics, add_metrics_arguments, profiled
+from af_common.multimatch import FIELD_PATTERNS
+from af_common.pipeline import add_pipeline_arguments, configure, pipeline_config
+from af_common.sampling import add_sampling_arguments, sample_sources, sampling_config
+from af_common.stream_filter import filter_jsonld
+
+# Literal masks on the shared multi-pattern matcher
+SVI_PATH = FIELD_PATTERNS.register('System Volume Information')
+VSS_FILE_INDICATORS = FIELD_PATTERNS.register(
+    'tracking.log',
+    'IndexerVolumeGuid',
+    '_OnDiskSnapshotProp',
+    '{'  # GUID pattern
+)
+GUID_PATTERN = FIELD_PATTERNS.register('{')
+DELETION_INDICATORS = FIELD_PATTERNS.register('FileDelete', 'FileDeleteClose', 'DataTruncation')
+
+# Facet type bits (see af_common/facets.py)
+MFT_FACET = FACET_TYPES.register('MftFacet')
+FILE_FACET = FACET_TYPES.register('FileFacet')
+USN_FACET = FACET_TYPES.register('UsnFacet')
 
 
 def is_vss_relevant_mft(entry: Dict[str, Any]) -> bool:
@@ -38,32 +68,22 @@ def is_vss_relevant_mft(entry: Dict[str, Any]) -> bool:
     1. MftFacet has parentPath containing "System Volume Information"
     2. FileFacet has fileName containing VSS infrastructure files or GUIDs
     """
-    facets = entry.get('core:hasFacet', [])
-    if not isinstance(facets, list):
-        facets = [facets]
-
     has_svi_path = False
     has_vss_file = False
 
-    for facet in facets:
-        facet_type = facet.get('@type', '')
+    for facet in facet_list(entry.get('core:hasFacet')):
+        kinds = facet_kinds(facet)
 
         # Check MftFacet for System Volume Information
-        if 'MftFacet' in str(facet_type):
+        if kinds & MFT_FACET:
             parent_path = facet.get('dfc-ext:parentPath', '')
-            if 'System Volume Information' in parent_path:
+            if FIELD_PATTERNS.scan(parent_path) & SVI_PATH:
                 has_svi_path = True
 
         # Check FileFacet for VSS infrastructure or GUID
-        if 'FileFacet' in str(facet_type):
+        if kinds & FILE_FACET:
             filename = facet.get('observable:fileName', '')
-            vss_indicators = [
-                'tracking.log',
-                'IndexerVolumeGuid',
-                '_OnDiskSnapshotProp',
-                '{'  # GUID pattern
-            ]
-            if any(indicator in filename for indicator in vss_indicators):
+            if FIELD_PATTERNS.scan(filename) & VSS_FILE_INDICATORS:
                 has_vss_file = True
 
     # Entry is relevant if it's in System Volume Information
@@ -79,41 +99,39 @@ def is_vss_relevant_usn(entry: Dict[str, Any]) -> bool:
     1. FileFacet has fileName containing '{' (GUID pattern)
     2. UsnFacet has updateReasons indicating deletion
     """
-    facets = entry.get('core:hasFacet', [])
-    if not isinstance(facets, list):
-        facets = [facets]
-
     has_guid = False
     has_deletion = False
 
-    for facet in facets:
-        facet_type = facet.get('@type', '')
+    for facet in facet_list(entry.get('core:hasFacet')):
+        kinds = facet_kinds(facet)
 
         # Check FileFacet for GUID pattern
-        if 'FileFacet' in str(facet_type):
+        if kinds & FILE_FACET:
             filename = facet.get('observable:fileName', '')
-            if '{' in filename:
+            if FIELD_PATTERNS.scan(filename) & GUID_PATTERN:
                 has_guid = True
 
         # Check UsnFacet for deletion indicators
-        if 'UsnFacet' in str(facet_type):
+        if kinds & USN_FACET:
             update_reasons = facet.get('dfc-ext:updateReasons', '')
-            deletion_indicators = [
-                'FileDelete',
-                'FileDeleteClose',
-                'DataTruncation'
-            ]
-            if any(indicator in update_reasons for indicator in deletion_indicators):
+            if FIELD_PATTERNS.scan(update_reasons) & DELETION_INDICATORS:
                 has_deletion = True
 
     return has_guid and has_deletion
 
 
+def source_predicates(sources: Dict[str, Path]) -> Dict[str, Any]:
+    """Entry predicates per evidence source, for single-pass multi-rule prefiltering."""
+    return {'mft': is_vss_relevant_mft, 'usn': is_vss_relevant_usn}
+
+
 def stream_filter_json_ld(
     input_file: Path,
     output_file: Path,
     filter_func,
-    label: str
+    label: str,
+    checkpoints: Optional[CheckpointStore] = None,
+    metrics: Optional[StageMetrics] = None
 ) -> tuple[int, int]:
     """
     Stream through JSON-LD file and filter entries.
@@ -126,44 +144,26 @@ def stream_filter_json_ld(
     print(f"  Input size: {input_file.stat().st_size / (1024**2):.1f} MB")
     print(f"{'='*60}")
 
-    # Load JSON-LD (we'll optimize this with ijson later if needed)
-    print(f"  Loading JSON-LD...")
-    with open(input_file, 'r') as f:
-        data = json.load(f)
+    def progress(scanned, matched, fraction):
+        print(f"    Processed {scanned:,} entries ({100 * fraction:.1f}% of input)...", end='\r')
 
-    context = data.get('@context', {})
-    graph = data.get('@graph', [])
-
-    total_entries = len(graph)
-    print(f"  Total entries: {total_entries:,}")
-
-    # Filter entries
     print(f"  Filtering VSS-relevant entries...")
-    filtered_entries = []
-    for i, entry in enumerate(graph):
-        if filter_func(entry):
-            filtered_entries.append(entry)
-
-        # Progress indicator every 10k entries
-        if (i + 1) % 10000 == 0:
-            print(f"    Processed {i+1:,}/{total_entries:,} entries...", end='\r')
+    total_entries, filtered_count = filter_jsonld(
+        input_file,
+        output_file,
+        filter_func,
+        checkpoints=checkpoints,
+        on_progress=progress,
+        metrics=metrics
+    )
 
     print(f"    Processed {total_entries:,}/{total_entries:,} entries... Done!")
-
-    filtered_count = len(filtered_entries)
+    print(f"  Total entries: {total_entries:,}")
     print(f"  VSS-relevant entries: {filtered_count:,}")
-    print(f"  Reduction: {100 * (1 - filtered_count/total_entries):.1f}%")
-
-    # Write filtered JSON-LD
-    filtered_data = {
-        '@context': context,
-        '@graph': filtered_entries
-    }
-
-    print(f"  Writing filtered data to: {output_file}")
-    with open(output_file, 'w') as f:
-        json.dump(filtered_data, f, indent=2)
+    if total_entries > 0:
+        print(f"  Reduction: {100 * (1 - filtered_count/total_entries):.1f}%")
 
+    print(f"  Wrote filtered data to: {output_file}")
     output_size = output_file.stat().st_size / (1024**2)
     print(f"  Output size: {output_size:.1f} MB")
 
@@ -195,9 +195,30 @@ def main():
         default='json-ld',
         help="Output format (default: json-ld)"
     )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help="Resume an interrupted run from the checkpoint in --output-dir"
+    )
+    parser.add_argument(
+        '--checkpoint-interval',
+        type=float,
+        default=30.0,
+        help="Seconds between checkpoints (default: 30)"
+    )
+    add_pipeline_arguments(parser)
+    add_sampling_arguments(parser)
+    add_metrics_arguments(parser)
 
     args = parser.parse_args()
 
+    try:
+        configure(pipeline_config(args))
+        sampling = sampling_config(args)
+    except ValueError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+
     # Setup paths
     mft_path = Path(args.mft)
     usn_path = Path(args.usn)
@@ -211,6 +232,17 @@ def main():
         print(f"ERROR: USN file not found: {usn_path}", file=sys.stderr)
         return 1
 
+    if sampling:
+        print("\n" + "="*60)
+        print("AF-004 Sampled VSS Triage")
+        print("="*60)
+        run_metrics = RunMetrics('AF-004/stream_filter_vss')
+        with profiled(args.profile):
+            results = sample_sources(source_predicates({}), {'mft': mft_path, 'usn': usn_path},
+                                     sampling, run_metrics)
+        run_metrics.emit(args.metrics_json, args.metrics_prom)
+        return 0 if results is not None else 1
+
     output_dir.mkdir(parents=True, exist_ok=True)
 
     # Determine output extension
@@ -220,25 +252,52 @@ def main():
     mft_output = output_dir / f"mft_vss_filtered.{ext}"
     usn_output = output_dir / f"usn_vss_filtered.{ext}"
 
+    # Passes always write JSON-LD first; nt/ttl are converted afterwards
+    mft_jsonld = output_dir / "mft_vss_filtered.jsonld"
+    usn_jsonld = output_dir / "usn_vss_filtered.jsonld"
+
+    try:
+        checkpoints = CheckpointStore(output_dir, resume=args.resume,
+                                      interval=args.checkpoint_interval)
+    except CheckpointError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+
     print("\n" + "="*60)
     print("AF-004 Streaming VSS Filter")
     print("="*60)
 
-    # Filter MFT
-    mft_total, mft_filtered = stream_filter_json_ld(
-        mft_path,
-        mft_output,
-        is_vss_relevant_mft,
-        "MFT"
-    )
+    run_metrics = RunMetrics('AF-004/stream_filter_vss')
+
+    try:
+        with profiled(args.profile):
+            # Filter MFT
+            with run_metrics.stage('mft') as stage:
+                mft_total, mft_filtered = stream_filter_json_ld(
+                    mft_path,
+                    mft_jsonld,
+                    is_vss_relevant_mft,
+                    "MFT",
+                    checkpoints,
+                    stage
+                )
+
+            # Filter USN
+            with run_metrics.stage('usn') as stage:
+                usn_total, usn_filtered = stream_filter_json_ld(
+                    usn_path,
+                    usn_jsonld,
+                    is_vss_relevant_usn,
+                    "USN",
+                    checkpoints,
+                    stage
+                )
+    except CheckpointError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        print("  Rerun without --resume to start over", file=sys.stderr)
+        return 1
 
-    # Filter USN
-    usn_total, usn_filtered = stream_filter_json_ld(
-        usn_path,
-        usn_output,
-        is_vss_relevant_usn,
-        "USN"
-    )
+    checkpoints.clear()
 
     # Convert to N-Triples/Turtle if requested
     if args.output_format in ['nt', 'ttl']:
@@ -250,20 +309,18 @@ def main():
 
         # Convert MFT
         print(f"  Converting MFT...")
-        temp_mft = output_dir / "mft_vss_filtered.jsonld"
         g = Graph()
-        g.parse(temp_mft, format='json-ld')
+        g.parse(mft_jsonld, format='json-ld')
         g.serialize(mft_output, format=args.output_format)
-        temp_mft.unlink()
+        mft_jsonld.unlink()
         print(f"    → {mft_output}")
 
         # Convert USN
         print(f"  Converting USN...")
-        temp_usn = output_dir / "usn_vss_filtered.jsonld"
         g = Graph()
-        g.parse(temp_usn, format='json-ld')
+        g.parse(usn_jsonld, format='json-ld')
         g.serialize(usn_output, format=args.output_format)
-        temp_usn.unlink()
+        usn_jsonld.unlink()
         print(f"    → {usn_output}")
 
     # Summary
@@ -271,15 +328,17 @@ def main():
     print("FILTERING COMPLETE")
     print(f"{'='*60}")
     print(f"MFT: {mft_total:,} → {mft_filtered:,} entries "
-          f"({100*mft_filtered/mft_total:.2f}% retained)")
+          f"({100*mft_filtered/mft_total if mft_total > 0 else 0:.2f}% retained)")
     print(f"USN: {usn_total:,} → {usn_filtered:,} entries "
-          f"({100*usn_filtered/usn_total:.2f}% retained)")
+          f"({100*usn_filtered/usn_total if usn_total > 0 else 0:.2f}% retained)")
     print(f"\nFiltered files:")
     print(f"  {mft_output}")
     print(f"  {usn_output}")
     print(f"\nNext step:")
     print(f"  python3 detect_af004.py {mft_output} {usn_output}")
 
+    run_metrics.emit(args.metrics_json, args.metrics_prom)
+
     return 0
 
 
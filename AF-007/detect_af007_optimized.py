@@ -18,14 +18,40 @@ Usage:
       --usn /tmp/evtx/usn_security_filtered.jsonld \
       --security /tmp/evtx/security_1102_filtered.jsonld \
       --system /tmp/evtx/system_events.jsonld
+
+    # Option 4: Native engine: RULE.rq semantics evaluated directly on the
+    # JSON-LD files, without rdflib (see native_af007.py)
+    python3 detect_af007_optimized.py /tmp/evtx/ --engine native
+
+    # Bound the native engine's distinct sets; past the limit they spill to disk
+    python3 detect_af007_optimized.py /tmp/evtx/ --engine native --memory-limit 512M
+
+    # One JSON object per finding on stdout, then a summary record
+    python3 detect_af007_optimized.py /tmp/evtx/ --output ndjson --case-id IR-2291
+
+The input files are parsed concurrently, one process each (--load-workers N;
+1 loads them one after another).
+
+Results are cached by rule, input digests and engine version: a rerun on
+unchanged inputs prints the cached report at once (--no-cache to rerun).
 """
 
 import sys
 import argparse
 from pathlib import Path
-from rdflib import Dataset
+from typing import Dict
 from datetime import datetime
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from af_common.alerts import add_output_arguments, open_alerts
+from af_common.graph_load import Source, add_load_arguments, load_graphs
+from af_common.metrics import RunMetrics, add_metrics_arguments, profiled
+from af_common.query import run_query
+from af_common.result_cache import add_cache_arguments, engine_id, lookup, open_cache
+from af_common.spill import add_memory_arguments, memory_budget
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+
 
 def parse_args():
     parser = argparse.ArgumentParser(
@@ -55,131 +81,98 @@ def parse_args():
         default='RULE.rq',
         help="SPARQL rule file (default: RULE.rq)"
     )
+    parser.add_argument(
+        '--engine',
+        choices=['sparql', 'native'],
+        default='sparql',
+        help="sparql: run --rule-file with rdflib (default); native: evaluate "
+             "RULE.rq semantics directly on the JSON-LD files without rdflib"
+    )
+    parser.add_argument(
+        '--first-hit',
+        action='store_true',
+        help="Stop at the first confirmed positive (triage; exit code 2 on hit)"
+    )
     parser.add_argument(
         '--verbose',
         action='store_true',
         help="Show detailed loading information"
     )
+    parser.add_argument(
+        '--timeline',
+        type=Path,
+        metavar='PATH',
+        help="Super-timeline file (af_timeline.py build): print the events of "
+             "every source around the findings"
+    )
+    parser.add_argument(
+        '--timeline-window',
+        type=float,
+        default=60.0,
+        metavar='SECONDS',
+        help="Seconds of timeline context before and after the findings (default: 60)"
+    )
+    add_load_arguments(parser)
+    add_cache_arguments(parser)
+    add_memory_arguments(parser)
+    add_metrics_arguments(parser)
+    add_output_arguments(parser)
 
     return parser.parse_args()
 
 
-def main():
-    args = parse_args()
+def _instant(time: str) -> datetime:
+    return datetime.fromisoformat(time.replace('Z', '+00:00'))
 
-    # Determine file paths
-    if args.filter_dir:
-        filter_dir = Path(args.filter_dir)
-        usn_file = filter_dir / "usn_security_filtered.jsonld"
-        security_file = filter_dir / "security_1102_filtered.jsonld"
-        system_file = filter_dir / "system_events.jsonld"
-    else:
-        usn_file = Path(args.usn) if args.usn else None
-        security_file = Path(args.security) if args.security else None
-        system_file = Path(args.system) if args.system else None
 
-    # Validation
-    if not usn_file or not usn_file.exists():
-        print(f"ERROR: USN file not found: {usn_file}", file=sys.stderr)
-        return 1
+def categorize(results):
+    """
+    Split query rows into the Event 1102 row and the USN truncation rows.
 
-    if not security_file or not security_file.exists():
-        print(f"ERROR: Security file not found: {security_file}", file=sys.stderr)
-        return 1
+    The Event 1102 row is the latest one (the last of equal times), as the
+    ORDER BY ?time of RULE.rq gives it; first-hit mode drops the ORDER BY,
+    so rows are compared rather than taken in the order they arrive.
+    """
+    event_1102 = None
+    usn_truncations = []
 
-    rule_file = Path(args.rule_file)
-    if not rule_file.exists():
-        print(f"ERROR: Rule file not found: {rule_file}", file=sys.stderr)
-        print(f"  Looking in current directory: {Path.cwd()}", file=sys.stderr)
-        return 1
+    for row in results:
+        event_type = str(row.event_type) if row.event_type else ""
+        time = str(row.time) if row.time else ""
 
-    print("=" * 70)
-    print("AF-007: Event Log Clearing Detection (Optimized)")
-    print("=" * 70)
-    print()
-    print(f"USN File: {usn_file.name}")
-    print(f"  Size: {usn_file.stat().st_size / (1024**2):.2f} MB")
-    print()
-    print(f"Security File: {security_file.name}")
-    print(f"  Size: {security_file.stat().st_size / (1024**2):.2f} MB")
-    print()
-    if system_file and system_file.exists():
-        print(f"System File: {system_file.name}")
-        print(f"  Size: {system_file.stat().st_size / (1024**2):.2f} MB")
-        print()
-    print(f"Rule: {rule_file.name}")
-    print()
+        if "Event 1102" in event_type:
+            if event_1102 is None or _instant(time) >= _instant(event_1102['time']):
+                event_1102 = {'time': time, 'row': row}
+        elif "USN DataTruncation" in event_type:
+            usn_truncations.append({'time': time, 'row': row})
 
-    # Load SPARQL query
-    query = rule_file.read_text()
+    return event_1102, usn_truncations
 
-    # Create dataset
-    print("=" * 70)
-    print("Loading RDF Data")
-    print("=" * 70)
-    print()
 
-    ds = Dataset()
+def find_contradiction(event_1102, usn_truncations) -> bool:
+    """True if a USN truncation of Security.evtx precedes the Event 1102."""
+    if not (event_1102 and usn_truncations):
+        return False
 
-    # Load USN data
-    print(f"Loading USN data from {usn_file.name}...")
-    ds.parse(usn_file, format='json-ld')
-    print(f"  ✓ Loaded")
+    # The earliest truncation decides, whatever order the rows came in
+    earliest = min(_instant(usn['time']) for usn in usn_truncations)
+    return earliest < _instant(event_1102['time'])
 
-    # Load Security event log
-    print(f"Loading Security event log from {security_file.name}...")
-    ds.parse(security_file, format='json-ld')
-    print(f"  ✓ Loaded")
 
-    # Load System event log if provided
-    if system_file and system_file.exists():
-        print(f"Loading System event log from {system_file.name}...")
-        ds.parse(system_file, format='json-ld')
-        print(f"  ✓ Loaded")
+def is_positive(rows) -> bool:
+    """First-hit check: do the rows seen so far already prove log clearing?"""
+    return find_contradiction(*categorize(rows))
 
-    total_triples = len(ds)
-    print(f"\n  Total triples: {total_triples:,}")
-    print()
 
-    # Execute query
-    print("=" * 70)
-    print("Running AF-007 Detection Query")
-    print("=" * 70)
-    print()
-
-    if args.verbose:
-        print("Executing SPARQL query...")
-
-    results = list(ds.query(query))
-
-    # Analyze results
+def report(results, triple_counts: Dict[str, int], unit: str = 'triples', alerts=None) -> int:
+    """
+    Print the AF-007 findings (and stream them to alerts, an AlertStream).
+    Returns 2 if detection is positive, else 0.
+    """
     print()
     if results:
-        # Categorize events
-        event_1102 = None
-        usn_truncations = []
-
-        for row in results:
-            event_type = str(row.event_type) if row.event_type else ""
-            time = str(row.time) if row.time else ""
-
-            if "Event 1102" in event_type:
-                event_1102 = {'time': time, 'row': row}
-            elif "USN DataTruncation" in event_type:
-                usn_truncations.append({'time': time, 'row': row})
-
-        # Check for contradiction
-        contradiction_detected = False
-        if event_1102 and usn_truncations:
-            clear_time = datetime.fromisoformat(
-                event_1102['time'].replace('Z', '+00:00'))
-
-            for usn in usn_truncations:
-                usn_time = datetime.fromisoformat(
-                    usn['time'].replace('Z', '+00:00'))
-                if usn_time < clear_time:
-                    contradiction_detected = True
-                    break
+        event_1102, usn_truncations = categorize(results)
+        contradiction_detected = find_contradiction(event_1102, usn_truncations)
 
         # Display results
         if contradiction_detected:
@@ -198,11 +191,19 @@ def main():
                 print()
 
             # Show USN truncations
+            clear_time = datetime.fromisoformat(
+                event_1102['time'].replace('Z', '+00:00'))
             print(f"USN Truncations ({len(usn_truncations)}):")
             for i, usn in enumerate(usn_truncations, 1):
                 time_diff = (clear_time - datetime.fromisoformat(usn['time'].replace('Z', '+00:00'))).total_seconds()
                 print(f"  {i}. {usn['time']} ({time_diff:.1f}s before Event 1102)")
                 print(f"     {usn['row'].details}")
+                if alerts:
+                    alerts.finding(
+                        {'event_1102_details': str(event_1102['row'].details),
+                         'usn_details': str(usn['row'].details),
+                         'seconds_before_clear': time_diff},
+                        {'log_cleared': event_1102['time'], 'usn_truncation': usn['time']})
             print()
 
             print("=" * 70)
@@ -244,7 +245,7 @@ def main():
         print("=" * 70)
         print()
         print("Analysis:")
-        print(f"  Total triples: {total_triples:,}")
+        print(f"  Total {unit}: {sum(triple_counts.values()):,}")
         print()
         print("Possible reasons:")
         print("  • No event log clearing occurred")
@@ -255,5 +256,205 @@ def main():
         return 0  # Exit code 0 = no detection
 
 
+def show_timeline(args, results):
+    """
+    With --timeline, print the events of every source from --timeline-window
+    seconds before the earliest to after the latest finding.
+    """
+    if not args.timeline or not results:
+        return
+    from af_common.timeline import parse_time_ns, print_context
+
+    times = [t for t in (parse_time_ns(str(row.time)) for row in results if row.time)
+             if t is not None]
+    if not times:
+        return
+    margin = int(args.timeline_window * 1_000_000_000)
+    print()
+    print_context(args.timeline, [("Event 1102 and USN truncations",
+                                   min(times) - margin, max(times) + margin)])
+
+
+def run_native(args, usn_file: Path, security_file: Path, system_file, alerts=None) -> int:
+    """Evaluate RULE.rq with native_af007 instead of rdflib."""
+    try:
+        budget = memory_budget(args)
+    except ValueError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+    run_metrics = RunMetrics('AF-007/detect_af007_optimized')
+    cache = open_cache(args)
+    inputs = [usn_file, security_file] + ([system_file] if system_file else [])
+    key, hit = lookup(cache, run_metrics, (SCRIPT_DIR / 'RULE.rq').read_text(), inputs,
+                      engine_id('native', SCRIPT_DIR / 'native_af007.py'),
+                      {'first_hit': args.first_hit})
+    if hit:
+        exit_code = report(hit.rows, hit.counts, unit='entries', alerts=alerts)
+        if alerts:
+            alerts.summary(exit_code, hit.counts, run_metrics, cached=True)
+        show_timeline(args, hit.rows)
+        run_metrics.emit(args.metrics_json, args.metrics_prom)
+        return exit_code
+
+    sys.path.insert(0, str(SCRIPT_DIR))
+    from native_af007 import evaluate
+    from af_common.columns import open_columns
+
+    print("=" * 70)
+    print("Running AF-007 Detection (native RULE.rq evaluator)")
+    print("=" * 70)
+
+    with profiled(args.profile):
+        results = evaluate(usn_file, security_file, system_file, run_metrics,
+                           first_hit=args.first_hit, columns=open_columns(cache),
+                           budget=budget)
+    if args.first_hit and results:
+        print("First-hit mode: stopped at the first confirmed positive")
+
+    entries = {stage.name: stage.records for stage in run_metrics.stages
+               if stage.name != 'cache'}
+    if cache:
+        cache.store(key, results, entries)
+    exit_code = report(results, entries, unit='entries', alerts=alerts)
+    if alerts:
+        alerts.summary(exit_code, entries, run_metrics)
+    show_timeline(args, results)
+    run_metrics.emit(args.metrics_json, args.metrics_prom)
+    return exit_code
+
+
+def main():
+    args = parse_args()
+    alerts = open_alerts(args, 'AF-007')
+
+    # Determine file paths
+    if args.filter_dir:
+        filter_dir = Path(args.filter_dir)
+        usn_file = filter_dir / "usn_security_filtered.jsonld"
+        security_file = filter_dir / "security_1102_filtered.jsonld"
+        system_file = filter_dir / "system_events.jsonld"
+    else:
+        usn_file = Path(args.usn) if args.usn else None
+        security_file = Path(args.security) if args.security else None
+        system_file = Path(args.system) if args.system else None
+
+    # Validation
+    if not usn_file or not usn_file.exists():
+        print(f"ERROR: USN file not found: {usn_file}", file=sys.stderr)
+        return 1
+
+    if not security_file or not security_file.exists():
+        print(f"ERROR: Security file not found: {security_file}", file=sys.stderr)
+        return 1
+
+    if args.timeline and not args.timeline.exists():
+        print(f"ERROR: Timeline file not found: {args.timeline}", file=sys.stderr)
+        return 1
+
+    rule_file = Path(args.rule_file)
+    if not rule_file.exists():
+        # Fall back to the rules shipped next to this script
+        rule_file = SCRIPT_DIR / args.rule_file
+    if not rule_file.exists():
+        print(f"ERROR: Rule file not found: {args.rule_file}", file=sys.stderr)
+        print(f"  Looked in: {Path.cwd()} and {SCRIPT_DIR}", file=sys.stderr)
+        return 1
+
+    print("=" * 70)
+    print("AF-007: Event Log Clearing Detection (Optimized)")
+    print("=" * 70)
+    print()
+    print(f"USN File: {usn_file.name}")
+    print(f"  Size: {usn_file.stat().st_size / (1024**2):.2f} MB")
+    print()
+    print(f"Security File: {security_file.name}")
+    print(f"  Size: {security_file.stat().st_size / (1024**2):.2f} MB")
+    print()
+    if system_file and system_file.exists():
+        print(f"System File: {system_file.name}")
+        print(f"  Size: {system_file.stat().st_size / (1024**2):.2f} MB")
+        print()
+    if args.engine == 'native':
+        print("Rule: RULE.rq (native engine)")
+        print()
+        return run_native(args, usn_file, security_file,
+                          system_file if system_file and system_file.exists() else None,
+                          alerts)
+    print(f"Rule: {rule_file.name}")
+    print()
+
+    # Load SPARQL query
+    query = rule_file.read_text()
+
+    run_metrics = RunMetrics('AF-007/detect_af007_optimized')
+    cache = open_cache(args)
+    inputs = [usn_file, security_file]
+    if system_file and system_file.exists():
+        inputs.append(system_file)
+    key, hit = lookup(cache, run_metrics, query, inputs, engine_id('sparql', Path(__file__)),
+                      {'first_hit': args.first_hit})
+    if hit:
+        exit_code = report(hit.rows, hit.counts, alerts=alerts)
+        if alerts:
+            alerts.summary(exit_code, hit.counts, run_metrics, cached=True)
+        show_timeline(args, hit.rows)
+        run_metrics.emit(args.metrics_json, args.metrics_prom)
+        return exit_code
+
+    # Create dataset
+    print("=" * 70)
+    print("Loading RDF Data")
+    print("=" * 70)
+    print()
+
+    # rdflib is imported only once inputs are validated; it dominates startup
+    from rdflib import Dataset
+
+    ds = Dataset()
+
+    # USN, Security and System logs are independent; parse them concurrently
+    # into the default graph the rule queries
+    sources = [Source('usn', usn_file, 'json-ld', ds.default_graph),
+               Source('security', security_file, 'json-ld', ds.default_graph)]
+    print(f"Loading USN data from {usn_file.name}...")
+    print(f"Loading Security event log from {security_file.name}...")
+
+    # Load System event log if provided
+    if system_file and system_file.exists():
+        sources.append(Source('system', system_file, 'json-ld', ds.default_graph))
+        print(f"Loading System event log from {system_file.name}...")
+
+    with profiled(args.profile):
+        load_graphs(sources, run_metrics, args.load_workers)
+        print(f"  ✓ Loaded")
+
+        total_triples = len(ds)
+        print(f"\n  Total triples: {total_triples:,}")
+        print()
+
+        # Execute query
+        print("=" * 70)
+        print("Running AF-007 Detection Query")
+        print("=" * 70)
+        print()
+
+        if args.verbose:
+            print("Executing SPARQL query...")
+
+        with run_metrics.stage('query') as stage, stage.timed('query'):
+            results = run_query(ds, query, first_hit=args.first_hit, is_positive=is_positive)
+        stage.records = len(results)
+        if args.first_hit and results:
+            print("First-hit mode: stopped at the first confirmed positive")
+
+    if cache:
+        cache.store(key, results, {'total': total_triples})
+    exit_code = report(results, {'total': total_triples}, alerts=alerts)
+    if alerts:
+        alerts.summary(exit_code, {'total': total_triples}, run_metrics)
+    show_timeline(args, results)
+    run_metrics.emit(args.metrics_json, args.metrics_prom)
+    return exit_code
+
 if __name__ == '__main__':
     sys.exit(main())
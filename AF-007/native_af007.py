@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+"""
+AF-007: Native Event Log Clearing Evaluator (RULE.rq semantics without rdflib)
+
+RULE.rq is a UNION over one default graph holding the USN, Security and
+System inputs: Security-channel Event 1102 records (eventID/channel as
+plain literals) and File entries whose name contains "Security" with a
+DataTruncation update reason, ordered by time. Instead of loading every
+triple into rdflib, each input is streamed once and reduced to two compact
+arrays, sorted by time:
+
+    events:      (time, text) of every Security Event 1102
+    truncations: (time, fileName, reasons) of every Security* truncation
+
+Update reasons are decoded into a USN_REASON bitmask once per distinct
+reasons string, so the DataTruncation test is a mask check. The 1102
+versus truncation decision is then a comparison of the last clear time
+with the earliest truncation. Both branches are evaluated over all inputs,
+as in the shared default graph, with one row per distinct binding (an
+entry exported twice under the same @id counts once, as in rdflib's triple
+set). Rows, including rdflib's normalised xsd:dateTime form and the
+event-branch-first order on equal times, match RULE.rq exactly. A facet's
+properties are taken from where it is embedded; the exporters never share
+one facet @id between entries.
+
+Usage:
+    # Used by the detector
+    python3 detect_af007_optimized.py /tmp/evtx/ --engine native
+
+    # Compare with RULE.rq under rdflib (rows and timings)
+    python3 native_af007.py --usn usn.jsonld --security security.jsonld \
+        [--system system.jsonld] --verify
+"""
+
+import argparse
+import sys
+import time
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from af_common.metrics import RunMetrics, StageMetrics
+from af_common.native import typed_entries
+from af_common.spill import MemoryBudget, SpillingDistinct
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+
+OBSERVABLE = 'https://ontology.unifiedcyberontology.org/uco/observable/'
+DFC_EXT = 'https://www.w3.org/dfc-ext/'
+
+EVENT_RECORD = OBSERVABLE + 'EventRecord'
+EVENT_RECORD_FACET = OBSERVABLE + 'EventRecordFacet'
+EVENT_ID = OBSERVABLE + 'eventID'
+START_TIME = OBSERVABLE + 'startTime'
+RECORD_TEXT = OBSERVABLE + 'eventRecordText'
+EVENT_LOG_FACET = DFC_EXT + 'EventLogFacet'
+CHANNEL = DFC_EXT + 'channel'
+FILE = OBSERVABLE + 'File'
+FILE_FACET = OBSERVABLE + 'FileFacet'
+FILE_NAME = OBSERVABLE + 'fileName'
+USN_FACET = DFC_EXT + 'UsnFacet'
+UPDATE_REASONS = DFC_EXT + 'updateReasons'
+UPDATE_TIMESTAMP = DFC_EXT + 'updateTimestamp'
+
+EVENT_1102 = "Event 1102 - Log Cleared"
+USN_TRUNCATION = "USN DataTruncation"
+
+# USN_REASON_* flags, by the names the USN exporter writes ("A|B|Close")
+USN_REASONS = {
+    'DataOverwrite': 0x00000001,
+    'DataExtend': 0x00000002,
+    'DataTruncation': 0x00000004,
+    'NamedDataOverwrite': 0x00000010,
+    'NamedDataExtend': 0x00000020,
+    'NamedDataTruncation': 0x00000040,
+    'FileCreate': 0x00000100,
+    'FileDelete': 0x00000200,
+    'EaChange': 0x00000400,
+    'SecurityChange': 0x00000800,
+    'RenameOldName': 0x00001000,
+    'RenameNewName': 0x00002000,
+    'IndexableChange': 0x00004000,
+    'BasicInfoChange': 0x00008000,
+    'HardLinkChange': 0x00010000,
+    'CompressionChange': 0x00020000,
+    'EncryptionChange': 0x00040000,
+    'ObjectIdChange': 0x00080000,
+    'ReparsePointChange': 0x00100000,
+    'StreamChange': 0x00200000,
+    'TransactedChange': 0x00400000,
+    'IntegrityChange': 0x00800000,
+    'Close': 0x80000000,
+}
+# Names containing "DataTruncation", i.e. what CONTAINS(?reasons, "DataTruncation") accepts
+TRUNCATION_MASK = USN_REASONS['DataTruncation'] | USN_REASONS['NamedDataTruncation']
+
+
+class Row(NamedTuple):
+    """One RULE.rq result row (attribute names match the SPARQL variables)."""
+    event_type: str
+    time: str
+    details: str
+
+
+class TimedRow(NamedTuple):
+    key: tuple
+    row: Row
+
+
+def reasons_mask(reasons: str) -> Tuple[int, bool]:
+    """(USN_REASON bitmask, True if some name was not recognised)."""
+    mask = 0
+    unknown = False
+    for name in reasons.split('|'):
+        bit = USN_REASONS.get(name.strip())
+        if bit is None:
+            unknown = True
+        else:
+            mask |= bit
+    return mask, unknown
+
+
+def time_key(text: str, value: Optional[datetime]) -> tuple:
+    """
+    ORDER BY ?time key: xsd:dateTime values by instant, anything else after
+    them by lexical form (rdflib gives no defined order for such mixes).
+    """
+    if value is None:
+        return (1, text)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return (0, value)
+
+
+def scan(path: Path, bindings: SpillingDistinct, truncation_cache: Dict[str, bool],
+         metrics: Optional[StageMetrics] = None):
+    """
+    One pass over an input, appending both UNION branches' rows.
+
+    RULE.rq has no DISTINCT, so there is one row per solution, i.e. per
+    distinct (?event, ?std_facet, ?custom_facet, ?time, ?text) or
+    (?file, ?file_facet, ?usn_facet, ?filename, ?reasons, ?time) binding.
+    bindings keeps the first row per binding (across all inputs, which share
+    the default graph), so repeated exports of a node count once.
+    """
+    def is_truncation(reasons: str) -> bool:
+        hit = truncation_cache.get(reasons)
+        if hit is None:
+            mask, unknown = reasons_mask(reasons)
+            hit = bool(mask & TRUNCATION_MASK) or (unknown and "DataTruncation" in reasons)
+            truncation_cache[reasons] = hit
+        return hit
+
+    before = len(bindings)
+    for terms, entry, facets in typed_entries(path, {EVENT_RECORD, FILE}, metrics):
+        types = terms.types(entry)
+
+        if EVENT_RECORD in types:
+            # Cheapest test first: almost no event in a Security log is a 1102
+            cleared = [facet for facet in facets
+                       if terms.matches(terms.get(facet, EVENT_ID), "1102")
+                       and EVENT_RECORD_FACET in terms.types(facet)]
+            channels = [terms.node_key(facet) for facet in facets if cleared
+                        and EVENT_LOG_FACET in terms.types(facet)
+                        and terms.matches(terms.get(facet, CHANNEL), "Security")]
+            node = terms.node_key(entry) if channels else None
+            for facet in cleared if channels else ():
+                facet_key = terms.node_key(facet)
+                texts = [text for text, _ in terms.literals(terms.get(facet, RECORD_TEXT))]
+                for text, value in terms.literals(terms.get(facet, START_TIME)):
+                    key = time_key(text, value)
+                    for details in texts:
+                        for channel in channels:
+                            bindings.add((node, facet_key, channel, text, details),
+                                         TimedRow(key, Row(EVENT_1102, text, details)))
+
+        if FILE in types:
+            names = [(terms.node_key(facet), name) for facet in facets
+                     if FILE_FACET in terms.types(facet)
+                     for name in terms.strings(terms.get(facet, FILE_NAME))
+                     if "Security" in name]
+            node = terms.node_key(entry) if names else None
+            for facet in facets if names else ():
+                if USN_FACET not in terms.types(facet):
+                    continue
+                facet_key = terms.node_key(facet)
+                reasons = [r for r in terms.strings(terms.get(facet, UPDATE_REASONS))
+                           if is_truncation(r)]
+                for text, value in terms.literals(terms.get(facet, UPDATE_TIMESTAMP)):
+                    key = time_key(text, value)
+                    for file_facet, name in names:
+                        for reason in reasons:
+                            bindings.add((node, file_facet, facet_key, name, reason, text),
+                                         TimedRow(key, Row(USN_TRUNCATION, text,
+                                                           f"File: {name} | Reasons: {reason}")))
+
+    if metrics is not None:
+        metrics.matched = (metrics.matched or 0) + len(bindings) - before
+
+
+def scan_columns(table, bindings: SpillingDistinct, truncation_cache: Dict[str, bool],
+                 metrics: Optional[StageMetrics] = None):
+    """
+    scan() over an input's column table (af_common.columns): the rows of
+    both branches are selected with array masks, then emitted in row order
+    as scan() emits them. A row's binding is (node, facets) plus its values;
+    a blank node or facet makes it unique, as Terms.node_key does.
+    """
+    import numpy as np
+    from af_common.columns import TIME_MISSING
+
+    def key_of(field: str, row: int, text: str) -> tuple:
+        has_time = table.ns(field)[row] != TIME_MISSING
+        return time_key(text, datetime.fromisoformat(text) if has_time else None)
+
+    def identity(row: int) -> tuple:
+        node, facets = table.value('node', row), table.value('facets', row)
+        return (node, facets) if node and facets else (object(),)
+
+    def is_truncation(reasons: str) -> bool:
+        hit = truncation_cache.get(reasons)
+        if hit is None:
+            mask, unknown = reasons_mask(reasons)
+            hit = bool(mask & TRUNCATION_MASK) or (unknown and "DataTruncation" in reasons)
+            truncation_cache[reasons] = hit
+        return hit
+
+    before = len(bindings)
+
+    cleared = (table.type_mask(EVENT_RECORD)
+               & table.mask('eventID', table.codes_where('eventID', lambda v: v == "1102"))
+               & table.mask('channel', table.codes_where('channel', lambda v: v == "Security"))
+               & (table.codes('startTime') >= 0) & (table.codes('eventRecordText') >= 0))
+    for row in np.flatnonzero(cleared).tolist():
+        text = table.value('startTime', row)
+        details = table.value('eventRecordText', row)
+        bindings.add(identity(row) + (text, details),
+                     TimedRow(key_of('startTime', row, text), Row(EVENT_1102, text, details)))
+
+    truncated = (table.type_mask(FILE)
+                 & table.mask('fileName', table.codes_containing('fileName', "Security"))
+                 & table.mask('updateReasons', table.codes_where('updateReasons', is_truncation))
+                 & (table.codes('updateTimestamp') >= 0))
+    for row in np.flatnonzero(truncated).tolist():
+        name = table.value('fileName', row)
+        reason = table.value('updateReasons', row)
+        text = table.value('updateTimestamp', row)
+        bindings.add(identity(row) + (name, reason, text),
+                     TimedRow(key_of('updateTimestamp', row, text),
+                              Row(USN_TRUNCATION, text, f"File: {name} | Reasons: {reason}")))
+
+    if metrics is not None:
+        metrics.matched = (metrics.matched or 0) + len(bindings) - before
+
+
+def contradiction(events: List[TimedRow], truncations: List[TimedRow]) -> bool:
+    """
+    The report's decision on the sorted arrays: the last Event 1102 in time
+    order is the clear time; positive if the earliest truncation precedes it.
+    """
+    return bool(events and truncations) and truncations[0].key < events[-1].key
+
+
+def evaluate(usn_file: Path, security_file: Path, system_file: Optional[Path] = None,
+             run_metrics: Optional[RunMetrics] = None, first_hit: bool = False,
+             columns=None, budget: Optional[MemoryBudget] = None) -> List[Row]:
+    """
+    Evaluate RULE.rq over the inputs that detect_af007_optimized.py loads.
+
+    Args:
+        run_metrics: records each input pass as a stage (usn, security, system)
+        first_hit: on a positive, return only the rows that prove it
+        columns: ColumnCache (af_common.columns); when every input has a
+            column table, they are evaluated on it instead of the JSON-LD
+            (all or none, so bindings deduplicate the same way across inputs)
+        budget: MemoryBudget (af_common.spill) for the distinct bindings;
+            past it they are deduplicated on disk, with the same rows
+
+    Returns:
+        Result rows ordered by time, as RULE.rq returns them
+    """
+    bindings = SpillingDistinct(budget, 'bindings')
+    cache: Dict[str, bool] = {}
+
+    inputs = [('usn', usn_file), ('security', security_file)]
+    if system_file is not None:
+        inputs.append(('system', system_file))
+    passes = []
+    for name, path in inputs:
+        with run_metrics.stage(name) if run_metrics else nullcontext() as stage:
+            table = columns.table(Path(path), stage) if columns is not None else None
+        passes.append((stage, Path(path), table))
+    use_columns = all(table for _, _, table in passes)
+
+    for stage, path, table in passes:
+        start = time.perf_counter()
+        if use_columns:
+            scan_columns(table, bindings, cache, stage)
+        else:
+            if stage is not None and table:
+                stage.records = stage.bytes = 0  # counted again by the JSON-LD pass
+            scan(path, bindings, cache, stage)
+        if stage is not None:
+            stage.wall_seconds += time.perf_counter() - start
+
+    events: List[TimedRow] = []
+    truncations: List[TimedRow] = []
+    for timed in bindings:
+        (events if timed.row.event_type == EVENT_1102 else truncations).append(timed)
+    if budget is not None and passes[-1][0] is not None:
+        passes[-1][0].extra['memory'] = budget.to_dict()
+
+    # Stable sorts keep each branch in input order on equal times
+    events.sort(key=lambda r: r.key)
+    truncations.sort(key=lambda r: r.key)
+
+    if first_hit and contradiction(events, truncations):
+        return [truncations[0].row, events[-1].row]
+
+    # UNION order: event rows precede truncation rows with the same time
+    rows = sorted(events + truncations, key=lambda r: r.key)
+    return [r.row for r in rows]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="AF-007 native RULE.rq evaluator (no rdflib)"
+    )
+    parser.add_argument('--usn', required=True, help="USN JSON-LD file")
+    parser.add_argument('--security', required=True, help="Security event log JSON-LD file")
+    parser.add_argument('--system', help="System event log JSON-LD file (optional)")
+    parser.add_argument(
+        '--verify',
+        action='store_true',
+        help="Also run RULE.rq with rdflib and compare the rows"
+    )
+
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    files = [Path(args.usn), Path(args.security)] + ([Path(args.system)] if args.system else [])
+    for path in files:
+        if not path.exists():
+            print(f"ERROR: File not found: {path}", file=sys.stderr)
+            return 1
+
+    print("=" * 70)
+    print("AF-007 Native Evaluator (RULE.rq)")
+    print("=" * 70)
+
+    start = time.perf_counter()
+    rows = evaluate(*files)
+    native_seconds = time.perf_counter() - start
+    print(f"Native:  {len(rows):,} row(s) in {native_seconds:.3f}s")
+
+    if not args.verify:
+        return 0
+
+    from rdflib import Dataset
+
+    start = time.perf_counter()
+    ds = Dataset()
+    for path in files:
+        ds.parse(path, format='json-ld')
+    sparql = [Row(str(r.event_type), str(r.time), str(r.details))
+              for r in ds.query((SCRIPT_DIR / 'RULE.rq').read_text())]
+    sparql_seconds = time.perf_counter() - start
+    print(f"SPARQL:  {len(sparql):,} row(s) in {sparql_seconds:.3f}s (load + query)")
+
+    if rows == sparql:
+        print(f"✓ Identical results ({sparql_seconds / native_seconds:.0f}x faster)")
+        return 0
+
+    print("🚨 Results differ")
+    for i, (native_row, sparql_row) in enumerate(zip(rows, sparql), 1):
+        if native_row != sparql_row:
+            print(f"  first difference at row {i}:")
+            print(f"    native: {native_row}")
+            print(f"    SPARQL: {sparql_row}")
+            break
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -6,11 +6,13 @@ Filters large JSON-LD event log files to extract only entries relevant
 for event log clearing detection without loading entire files into memory.
 
 Algorithm:
-1. Stream through JSON-LD using standard json module
+1. Stream through JSON-LD one @graph entry at a time
 2. For each entry, check AF-007 relevance:
    - Event 1102 (log cleared) from Security logs
    - USN entries for Security.evtx file operations
-   - Related system/security events (optional)
+   - System log context events (optional): service stops, EventLog
+     service start/stop, log cleared (104), system time changes and
+     Winlogon logons (SYSTEM_EVENTS)
 3. Emit complete matching entries to filtered output
 4. Memory usage stays constant (~50MB) regardless of input size
 
@@ -21,6 +23,23 @@ Usage:
       --system ../Systemevtx/evtx_all_filled.jsonld \
       --output-dir /tmp/evtx_filtered/
 
+    # Continue an interrupted run from its last checkpoint
+    python3 stream_filter_evtx.py --usn ... --security ... --output-dir /tmp/evtx_filtered/ --resume
+
+    # Run a single pass (e.g. as a separate job); only the given inputs are filtered
+    python3 stream_filter_evtx.py --security ... --output-dir /tmp/evtx_security/
+
+    # Write the USN output as one entry per Security.evtx write (see
+    # af_common/usn_coalesce.py) instead of one per USN record
+    python3 stream_filter_evtx.py --usn ... --security ... --output-dir /tmp/evtx_filtered/ --coalesce-usn
+
+    # Triage: estimate matching entries per input from 64 spread byte ranges
+    python3 stream_filter_evtx.py --usn ... --security ... --sample 64
+
+    # Keep only USN records of ...\winevt\Logs\Security.evtx, resolving
+    # parent directories through an MFT store (af_mftstore.py build)
+    python3 stream_filter_evtx.py --usn ... --security ... --mft-store mft_case.afms
+
 Performance:
     - Memory: ~50MB constant
     - Speed: ~100MB/sec
@@ -28,10 +47,49 @@ Performance:
 """
 
 import argparse
-import json
+import re
 import sys
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from af_common.checkpoint import CheckpointError, CheckpointStore
+from af_common.facets import FACET_TYPES, facet_kinds, facet_list
+from af_common.metrics import RunMetrics, StageMetrics, add_metrics_arguments, profiled
+from af_common.multimatch import FIELD_PATTERNS
+from af_common.parent_paths import ParentPaths, add_parent_path_arguments, open_parent_paths
+from af_common.pipeline import add_pipeline_arguments, configure, pipeline_config
+from af_common.sampling import add_sampling_arguments, sample_sources, sampling_config
+from af_common.stream_filter import filter_jsonld
+from af_common.usn_coalesce import add_coalesce_arguments, coalesce_usn_file
+
+# Literal masks on the shared multi-pattern matcher
+SECURITY = FIELD_PATTERNS.register('Security')
+SECURITY_EVTX = SECURITY | FIELD_PATTERNS.register('.evtx')
+
+# Full path of the Security event log
+SECURITY_LOG_PATH = re.compile(r'\\winevt\\Logs\\Security\.evtx$', re.IGNORECASE)
+
+# Facet type bits (see af_common/facets.py)
+EVENT_RECORD_FACET = FACET_TYPES.register('EventRecordFacet')
+EVENT_LOG_FACET = FACET_TYPES.register('EventLogFacet')
+FILE_FACET = FACET_TYPES.register('FileFacet')
+USN_FACET = FACET_TYPES.register('UsnFacet')
+
+
+# System log events kept as context for a log clearing, by (provider, event ID)
+SYSTEM_EVENTS = {
+    ('microsoft-windows-eventlog', '104'): "event log cleared",
+    ('eventlog', '6005'): "EventLog service started",
+    ('eventlog', '6006'): "EventLog service stopped (shutdown)",
+    ('eventlog', '6008'): "unexpected shutdown",
+    ('service control manager', '7034'): "service terminated unexpectedly",
+    ('service control manager', '7036'): "service entered the stopped state",
+    ('service control manager', '7040'): "service start type changed",
+    ('microsoft-windows-kernel-general', '1'): "system time changed",
+    ('microsoft-windows-winlogon', '7001'): "user logon (pairs with Security 4624)",
+    ('microsoft-windows-winlogon', '7002'): "user logoff",
+}
 
 
 def is_event_1102(entry: Dict[str, Any]) -> bool:
@@ -42,67 +100,106 @@ def is_event_1102(entry: Dict[str, Any]) -> bool:
     - EventRecordFacet with eventID "1102"
     - EventLogFacet with channel "Security"
     """
-    facets = entry.get('core:hasFacet', [])
-    if not isinstance(facets, list):
-        facets = [facets]
-
     has_1102 = False
     has_security = False
 
-    for facet in facets:
-        facet_type = facet.get('@type', '')
+    for facet in facet_list(entry.get('core:hasFacet')):
+        kinds = facet_kinds(facet)
 
         # Check for Event ID 1102
-        if 'EventRecordFacet' in str(facet_type):
+        if kinds & EVENT_RECORD_FACET:
             event_id = facet.get('observable:eventID', '')
             if event_id == '1102' or event_id == 1102:
                 has_1102 = True
 
         # Check for Security channel
-        if 'EventLogFacet' in str(facet_type):
+        if kinds & EVENT_LOG_FACET:
             channel = facet.get('dfc-ext:channel', '')
-            if 'Security' in channel:
+            if FIELD_PATTERNS.scan(channel) & SECURITY:
                 has_security = True
 
     return has_1102 and has_security
 
 
-def is_security_evtx_usn(entry: Dict[str, Any]) -> bool:
+def is_security_evtx_usn(entry: Dict[str, Any],
+                         paths: Optional[ParentPaths] = None) -> bool:
     """
     Check if USN entry is for Security.evtx file operations.
 
     Looks for:
     - FileFacet with fileName containing "Security.evtx"
     - UsnFacet with any update reasons
+    - with paths: the full path is ...\\winevt\\Logs\\Security.evtx (not
+      another channel's log), when the parent directory resolves
     """
-    facets = entry.get('core:hasFacet', [])
-    if not isinstance(facets, list):
-        facets = [facets]
-
     has_security_file = False
-    has_usn_facet = False
+    usn_facet = None
 
-    for facet in facets:
-        facet_type = facet.get('@type', '')
+    for facet in facet_list(entry.get('core:hasFacet')):
+        kinds = facet_kinds(facet)
 
         # Check for Security.evtx filename
-        if 'FileFacet' in str(facet_type):
+        if kinds & FILE_FACET:
             filename = facet.get('observable:fileName', '')
-            if 'Security' in filename and '.evtx' in filename:
+            if FIELD_PATTERNS.scan(filename) & SECURITY_EVTX == SECURITY_EVTX:
                 has_security_file = True
+                security_name = filename
 
         # Check for USN facet
-        if 'UsnFacet' in str(facet_type):
-            has_usn_facet = True
+        if kinds & USN_FACET:
+            usn_facet = facet
 
-    return has_security_file and has_usn_facet
+    if not (has_security_file and usn_facet is not None):
+        return False
+    if paths is None:
+        return True
+
+    # Narrow to the full path; an unresolved parent keeps the fileName match
+    path = paths.file_path(usn_facet, security_name)
+    return path is None or SECURITY_LOG_PATH.search(path) is not None
+
+
+def is_system_context_event(entry: Dict[str, Any]) -> bool:
+    """
+    Check if a System log entry is relevant context for log clearing.
+
+    Keeps the SYSTEM_EVENTS (provider, event ID) pairs; Service Control
+    Manager 7036 only when the service stopped. Entries RULE.rq itself can
+    match (Event 1102, Security.evtx USN records) are kept as well, since
+    the rule queries the System log together with the other inputs.
+    """
+    for facet in facet_list(entry.get('core:hasFacet')):
+        kinds = facet_kinds(facet)
+        if not kinds & EVENT_RECORD_FACET:
+            continue
+
+        event_id = str(facet.get('observable:eventID', ''))
+        provider = str(facet.get('observable:eventRecordServiceName', '')).lower()
+        if (provider, event_id) not in SYSTEM_EVENTS:
+            continue
+        if event_id == '7036':
+            text = f"{facet.get('observable:eventRecordText', '')} " \
+                   f"{facet.get('observable:eventRecordRaw', '')}"
+            return 'stopped' in text.lower()
+        return True
+
+    return is_event_1102(entry) or is_security_evtx_usn(entry)
+
+
+def source_predicates(sources: Dict[str, Path]) -> Dict[str, Any]:
+    """Entry predicates per evidence source, for single-pass multi-rule prefiltering."""
+    return {'usn': is_security_evtx_usn, 'security': is_event_1102,
+            'system': is_system_context_event}
 
 
 def stream_filter_json_ld(
     input_file: Path,
     output_file: Path,
     filter_func,
-    label: str
+    label: str,
+    checkpoints: Optional[CheckpointStore] = None,
+    metrics: Optional[StageMetrics] = None,
+    paths: Optional[ParentPaths] = None
 ) -> tuple[int, int]:
     """
     Stream through JSON-LD file and filter entries.
@@ -115,47 +212,34 @@ def stream_filter_json_ld(
     print(f"  Input size: {input_file.stat().st_size / (1024**2):.1f} MB")
     print(f"{'='*60}")
 
-    # Load JSON-LD
-    print(f"  Loading JSON-LD...")
-    with open(input_file, 'r') as f:
-        data = json.load(f)
-
-    context = data.get('@context', {})
-    graph = data.get('@graph', [])
-
-    total_entries = len(graph)
-    print(f"  Total entries: {total_entries:,}")
+    def progress(scanned, matched, fraction):
+        print(f"    Processed {scanned:,} entries ({100 * fraction:.1f}% of input)...", end='\r')
 
-    # Filter entries
     print(f"  Filtering relevant entries...")
-    filtered_entries = []
-    for i, entry in enumerate(graph):
-        if filter_func(entry):
-            filtered_entries.append(entry)
-
-        # Progress indicator every 10k entries
-        if (i + 1) % 10000 == 0:
-            print(f"    Processed {i+1:,}/{total_entries:,} entries...", end='\r')
+    total_entries, filtered_count = filter_jsonld(
+        input_file,
+        output_file,
+        filter_func,
+        checkpoints=checkpoints,
+        on_progress=progress,
+        metrics=metrics
+    )
 
     print(f"    Processed {total_entries:,}/{total_entries:,} entries... Done!")
-
-    filtered_count = len(filtered_entries)
+    print(f"  Total entries: {total_entries:,}")
     print(f"  Relevant entries: {filtered_count:,}")
+    if paths:
+        stats = paths.stats()
+        print(f"  Parent paths: {stats['resolved']:,} resolved, "
+              f"{stats['unresolved']:,} unresolved (fileName match kept)")
+        if metrics:
+            metrics.extra['parent_paths'] = stats
 
     if total_entries > 0:
         reduction = 100 * (1 - filtered_count/total_entries)
         print(f"  Reduction: {reduction:.1f}%")
 
-    # Write filtered JSON-LD
-    filtered_data = {
-        '@context': context,
-        '@graph': filtered_entries
-    }
-
-    print(f"  Writing filtered data to: {output_file}")
-    with open(output_file, 'w') as f:
-        json.dump(filtered_data, f, indent=2)
-
+    print(f"  Wrote filtered data to: {output_file}")
     output_size = output_file.stat().st_size / (1024**2)
     print(f"  Output size: {output_size:.2f} MB")
 
@@ -168,12 +252,10 @@ def main():
     )
     parser.add_argument(
         '--usn',
-        required=True,
         help="Path to USN JSON-LD file"
     )
     parser.add_argument(
         '--security',
-        required=True,
         help="Path to Security event log JSON-LD file"
     )
     parser.add_argument(
@@ -192,20 +274,47 @@ def main():
         default='json-ld',
         help="Output format (currently only json-ld supported)"
     )
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help="Resume an interrupted run from the checkpoint in --output-dir"
+    )
+    parser.add_argument(
+        '--checkpoint-interval',
+        type=float,
+        default=30.0,
+        help="Seconds between checkpoints (default: 30)"
+    )
+    add_coalesce_arguments(parser)
+    add_parent_path_arguments(parser)
+    add_pipeline_arguments(parser)
+    add_sampling_arguments(parser)
+    add_metrics_arguments(parser)
 
     args = parser.parse_args()
 
-    # Setup paths
-    usn_path = Path(args.usn)
-    security_path = Path(args.security)
+    try:
+        configure(pipeline_config(args))
+        sampling = sampling_config(args)
+    except ValueError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+
+    # Setup paths (each given input is one pass; the detector needs USN and Security)
+    usn_path = Path(args.usn) if args.usn else None
+    security_path = Path(args.security) if args.security else None
     system_path = Path(args.system) if args.system else None
     output_dir = Path(args.output_dir)
 
-    if not usn_path.exists():
+    if not (usn_path or security_path or system_path):
+        print("ERROR: Give at least one of --usn, --security, --system", file=sys.stderr)
+        return 1
+
+    if usn_path and not usn_path.exists():
         print(f"ERROR: USN file not found: {usn_path}", file=sys.stderr)
         return 1
 
-    if not security_path.exists():
+    if security_path and not security_path.exists():
         print(f"ERROR: Security event log not found: {security_path}", file=sys.stderr)
         return 1
 
@@ -213,61 +322,121 @@ def main():
         print(f"ERROR: System event log not found: {system_path}", file=sys.stderr)
         return 1
 
+    if sampling:
+        print("\n" + "="*60)
+        print("AF-007 Sampled Event Log Triage")
+        print("="*60)
+        run_metrics = RunMetrics('AF-007/stream_filter_evtx')
+        with profiled(args.profile):
+            sources = {'usn': usn_path, 'security': security_path, 'system': system_path}
+            results = sample_sources(source_predicates({}), sources, sampling, run_metrics)
+        run_metrics.emit(args.metrics_json, args.metrics_prom)
+        return 0 if results is not None else 1
+
     output_dir.mkdir(parents=True, exist_ok=True)
 
+    try:
+        checkpoints = CheckpointStore(output_dir, resume=args.resume,
+                                      interval=args.checkpoint_interval)
+    except CheckpointError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+
     print("\n" + "="*60)
     print("AF-007 Streaming Event Log Filter")
     print("="*60)
 
-    # Filter USN for Security.evtx operations
+    run_metrics = RunMetrics('AF-007/stream_filter_evtx')
     usn_output = output_dir / "usn_security_filtered.jsonld"
-    usn_total, usn_filtered = stream_filter_json_ld(
-        usn_path,
-        usn_output,
-        is_security_evtx_usn,
-        "USN Journal"
-    )
-
-    # Filter Security logs for Event 1102
     security_output = output_dir / "security_1102_filtered.jsonld"
-    sec_total, sec_filtered = stream_filter_json_ld(
-        security_path,
-        security_output,
-        is_event_1102,
-        "Security Event Log"
-    )
+    system_output = output_dir / "system_events.jsonld"
+    outputs = []
+
+    paths = None
+    try:
+        with profiled(args.profile):
+            # Filter USN for Security.evtx operations
+            if usn_path:
+                if args.mft_store:
+                    try:
+                        with run_metrics.stage('mft-store') as stage:
+                            paths = open_parent_paths(args.mft_store, metrics=stage)
+                    except (OSError, ValueError) as e:
+                        print(f"ERROR: {e}", file=sys.stderr)
+                        return 1
+                with run_metrics.stage('usn') as stage:
+                    usn_total, usn_filtered = stream_filter_json_ld(
+                        usn_path,
+                        usn_output,
+                        (lambda entry: is_security_evtx_usn(entry, paths)) if paths
+                        else is_security_evtx_usn,
+                        "USN Journal",
+                        checkpoints,
+                        stage,
+                        paths
+                    )
+                outputs.append((usn_path, usn_output))
+
+            # Filter Security logs for Event 1102
+            if security_path:
+                with run_metrics.stage('security') as stage:
+                    sec_total, sec_filtered = stream_filter_json_ld(
+                        security_path,
+                        security_output,
+                        is_event_1102,
+                        "Security Event Log",
+                        checkpoints,
+                        stage
+                    )
+                outputs.append((security_path, security_output))
+
+            # Filter System log for service stop / EventLog / time change context
+            if system_path:
+                with run_metrics.stage('system') as stage:
+                    sys_total, sys_filtered = stream_filter_json_ld(
+                        system_path,
+                        system_output,
+                        is_system_context_event,
+                        "System Event Log",
+                        checkpoints,
+                        stage
+                    )
+                outputs.append((system_path, system_output))
+    except CheckpointError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        print("  Rerun without --resume to start over", file=sys.stderr)
+        return 1
+    finally:
+        if paths:
+            paths.close()
 
-    # Optionally copy System event log (usually small)
-    if system_path:
-        import shutil
-        system_output = output_dir / "system_events.jsonld"
-        print(f"\n{'='*60}")
-        print(f"Copying System Event Log: {system_path.name}")
-        print(f"  Input size: {system_path.stat().st_size / (1024**2):.1f} MB")
-        print(f"{'='*60}")
-        shutil.copy(system_path, system_output)
-        print(f"  ✓ Copied to: {system_output}")
-        sys_size = system_output.stat().st_size / (1024**2)
-        print(f"  Output size: {sys_size:.2f} MB")
+    checkpoints.clear()
+
+    if usn_path and args.coalesce_usn:
+        # After the checkpoints are cleared: an interrupted coalescing leaves
+        # the filtered records in place and a rerun starts over
+        print()
+        with run_metrics.stage('coalesce:usn') as stage:
+            coalesce_usn_file(usn_output, usn_output, args.coalesce_span, stage)
+        usn_filtered = stage.matched
 
     # Summary
     print(f"\n{'='*60}")
     print("FILTERING COMPLETE")
     print(f"{'='*60}")
-    print(f"USN: {usn_total:,} → {usn_filtered:,} entries "
-          f"({100*usn_filtered/usn_total if usn_total > 0 else 0:.2f}% retained)")
-    print(f"Security: {sec_total:,} → {sec_filtered:,} entries "
-          f"({100*sec_filtered/sec_total if sec_total > 0 else 0:.2f}% retained)")
-
-    original_size = usn_path.stat().st_size + security_path.stat().st_size
-    if system_path:
-        original_size += system_path.stat().st_size
-
-    filtered_size = usn_output.stat().st_size + security_output.stat().st_size
+    if usn_path:
+        print(f"USN: {usn_total:,} → {usn_filtered:,} entries "
+              f"({100*usn_filtered/usn_total if usn_total > 0 else 0:.2f}% retained)")
+    if security_path:
+        print(f"Security: {sec_total:,} → {sec_filtered:,} entries "
+              f"({100*sec_filtered/sec_total if sec_total > 0 else 0:.2f}% retained)")
     if system_path:
-        filtered_size += (output_dir / "system_events.jsonld").stat().st_size
+        print(f"System: {sys_total:,} → {sys_filtered:,} entries "
+              f"({100*sys_filtered/sys_total if sys_total > 0 else 0:.2f}% retained)")
 
-    reduction_pct = 100 * (1 - filtered_size / original_size)
+    original_size = sum(source.stat().st_size for source, _ in outputs)
+    filtered_size = sum(output.stat().st_size for _, output in outputs)
+    reduction_pct = 100 * (1 - filtered_size / original_size) if original_size else 0
 
     print(f"\nData Reduction:")
     print(f"  Original: {original_size / (1024**2):.1f} MB")
@@ -275,16 +444,16 @@ def main():
     print(f"  Reduction: {reduction_pct:.1f}%")
 
     print(f"\nFiltered files:")
-    print(f"  {usn_output}")
-    print(f"  {security_output}")
-    if system_path:
-        print(f"  {output_dir / 'system_events.jsonld'}")
+    for _, output in outputs:
+        print(f"  {output}")
 
-    print(f"\nNext step:")
-    print(f"  python3 detect_af007_optimized.py --usn {usn_output} --security {security_output}")
+    if usn_path and security_path:
+        print(f"\nNext step:")
+        print(f"  python3 detect_af007_optimized.py --usn {usn_output} --security {security_output}")
 
-    return 0
+    run_metrics.emit(args.metrics_json, args.metrics_prom)
 
+    return 0
 
 if __name__ == '__main__':
     sys.exit(main())
@@ -11,14 +11,20 @@ metadata that persist even when filesystem timestamps are manipulated.
 Usage:
     python3 detect_xml_timestomp.py <office_xml_file.jsonld>
     python3 detect_xml_timestomp.py --file office_xml_filled.jsonld --rule rule_xml_timestomp.rq
+    python3 detect_xml_timestomp.py office_xml_filled.jsonld --output ndjson --case-id IR-2291
 """
 
 import sys
 import argparse
 from pathlib import Path
-from rdflib import Dataset
+from typing import Dict
 from datetime import datetime
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+from af_common.alerts import add_output_arguments, open_alerts
+from af_common.metrics import RunMetrics, add_metrics_arguments, profiled
+from af_common.query import run_query
+
 
 def parse_args():
     parser = argparse.ArgumentParser(
@@ -39,77 +45,27 @@ def parse_args():
         default='rule_xml_timestomp.rq',
         help="SPARQL rule file (default: rule_xml_timestomp.rq)"
     )
+    parser.add_argument(
+        '--first-hit',
+        action='store_true',
+        help="Stop at the first confirmed positive (triage; exit code 2 on hit)"
+    )
     parser.add_argument(
         '--verbose',
         action='store_true',
         help="Show detailed loading information"
     )
+    add_metrics_arguments(parser)
+    add_output_arguments(parser)
 
     return parser.parse_args()
 
 
-def main():
-    args = parse_args()
-
-    # Determine file path
-    data_file = Path(args.file) if args.file else (Path(args.file_path) if args.file_path else None)
-
-    # Validation
-    if not data_file or not data_file.exists():
-        print(f"ERROR: Data file not found: {data_file}", file=sys.stderr)
-        print("\nUsage: python3 detect_xml_timestomp.py <office_xml_file.jsonld>", file=sys.stderr)
-        return 1
-
-    rule_file = Path(args.rule)
-    if not rule_file.exists():
-        # Try relative to script directory
-        script_dir = Path(__file__).parent
-        rule_file = script_dir / args.rule
-        if not rule_file.exists():
-            print(f"ERROR: Rule file not found: {args.rule}", file=sys.stderr)
-            return 1
-
-    print("=" * 70)
-    print("AF-TIMESTOMPING-XML: Office Document Timestamp Manipulation Detection")
-    print("=" * 70)
-    print()
-    print(f"Data File: {data_file.name}")
-    print(f"  Size: {data_file.stat().st_size / 1024:.2f} KB")
-    print()
-    print(f"Rule: {rule_file.name}")
-    print()
-
-    # Load SPARQL query
-    query = rule_file.read_text()
-
-    # Create dataset
-    print("=" * 70)
-    print("Loading Office XML Metadata")
-    print("=" * 70)
-    print()
-
-    ds = Dataset()
-
-    print(f"Loading data from {data_file.name}...")
-    ds.parse(data_file, format='json-ld')
-    print(f"  ✓ Loaded")
-
-    total_triples = len(ds)
-    print(f"\n  Total triples: {total_triples:,}")
-    print()
-
-    # Execute query
-    print("=" * 70)
-    print("Running AF-TIMESTOMPING-XML Detection Query")
-    print("=" * 70)
-    print()
-
-    if args.verbose:
-        print("Executing SPARQL query...")
-
-    results = list(ds.query(query))
-
-    # Analyze results
+def report(results, triple_counts: Dict[str, int], alerts=None) -> int:
+    """
+    Print the AF-TIMESTOMPING-XML findings (and stream them to alerts, an
+    AlertStream). Returns 2 if detection is positive, else 0.
+    """
     print()
     if results:
         print("🚨 " + "=" * 68)
@@ -160,6 +116,12 @@ def main():
                 print(f"     • $SI differs from $FN by {si_fn_diff:.1f} seconds")
                 print(f"     • This indicates $STANDARD_INFORMATION was tampered")
                 print()
+                if alerts:
+                    alerts.finding(
+                        {'file_path': file_path, 'xml_vs_si_diff_seconds': xml_vs_si_diff,
+                         'si_fn_diff_seconds': si_fn_diff},
+                        {'xml_created': xml_created_str, 'mft_si_created': mft_si_str,
+                         'mft_fn_created': mft_fn_str})
             except Exception as e:
                 print(f"Error parsing dates for {file_path}: {e}")
                 continue
@@ -186,7 +148,7 @@ def main():
         print("=" * 70)
         print()
         print("Analysis:")
-        print(f"  Total triples: {total_triples:,}")
+        print(f"  Total triples: {sum(triple_counts.values()):,}")
         print()
         print("Result:")
         print("  • Office XML metadata matches MFT timestamps")
@@ -196,5 +158,84 @@ def main():
         return 0  # Exit code 0 = no detection
 
 
+def main():
+    args = parse_args()
+    alerts = open_alerts(args, 'AF-TIMESTOMPING-XML')
+
+    # Determine file path
+    data_file = Path(args.file) if args.file else (Path(args.file_path) if args.file_path else None)
+
+    # Validation
+    if not data_file or not data_file.exists():
+        print(f"ERROR: Data file not found: {data_file}", file=sys.stderr)
+        print("\nUsage: python3 detect_xml_timestomp.py <office_xml_file.jsonld>", file=sys.stderr)
+        return 1
+
+    rule_file = Path(args.rule)
+    if not rule_file.exists():
+        # Try relative to script directory
+        script_dir = Path(__file__).parent
+        rule_file = script_dir / args.rule
+        if not rule_file.exists():
+            print(f"ERROR: Rule file not found: {args.rule}", file=sys.stderr)
+            return 1
+
+    print("=" * 70)
+    print("AF-TIMESTOMPING-XML: Office Document Timestamp Manipulation Detection")
+    print("=" * 70)
+    print()
+    print(f"Data File: {data_file.name}")
+    print(f"  Size: {data_file.stat().st_size / 1024:.2f} KB")
+    print()
+    print(f"Rule: {rule_file.name}")
+    print()
+
+    # Load SPARQL query
+    query = rule_file.read_text()
+
+    # Create dataset
+    print("=" * 70)
+    print("Loading Office XML Metadata")
+    print("=" * 70)
+    print()
+
+    # rdflib is imported only once inputs are validated; it dominates startup
+    from rdflib import Dataset
+
+    ds = Dataset()
+    run_metrics = RunMetrics('AF-TIMESTOMPING-XML/detect_xml_timestomp')
+
+    with profiled(args.profile):
+        print(f"Loading data from {data_file.name}...")
+        with run_metrics.stage('office_xml') as stage, stage.timed('parse'):
+            ds.parse(data_file, format='json-ld')
+        stage.records, stage.bytes = len(ds), data_file.stat().st_size
+        print(f"  ✓ Loaded")
+
+        total_triples = len(ds)
+        print(f"\n  Total triples: {total_triples:,}")
+        print()
+
+        # Execute query
+        print("=" * 70)
+        print("Running AF-TIMESTOMPING-XML Detection Query")
+        print("=" * 70)
+        print()
+
+        if args.verbose:
+            print("Executing SPARQL query...")
+
+        with run_metrics.stage('query') as stage, stage.timed('query'):
+            results = run_query(ds, query, first_hit=args.first_hit)
+        stage.records = len(results)
+        if args.first_hit and results:
+            print("First-hit mode: stopped at the first confirmed positive")
+
+    exit_code = report(results, {'total': total_triples}, alerts=alerts)
+    if alerts:
+        alerts.summary(exit_code, {'total': total_triples}, run_metrics)
+    run_metrics.emit(args.metrics_json, args.metrics_prom)
+    return exit_code
+
 if __name__ == '__main__':
     sys.exit(main())
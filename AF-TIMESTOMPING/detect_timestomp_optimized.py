@@ -17,14 +17,39 @@ Usage:
     python3 detect_timestomp_optimized.py \
       --mft /tmp/timestomp/mft_lnk_filtered.jsonld \
       --lnk /tmp/timestomp/lnk_files.jsonld
+
+    # One JSON object per finding on stdout, then a summary record
+    python3 detect_timestomp_optimized.py /tmp/timestomp/ --output ndjson --case-id IR-2291
+
+The input files are parsed concurrently, one process each (--load-workers N;
+1 loads them one after another).
+
+Results are cached by rule, input digests and engine version: a rerun on
+unchanged inputs prints the cached report at once (--no-cache to rerun).
+
+There is no --memory-limit here. The detector joins LNK targets to MFT
+records in rdflib, and that graph has no structure a budget could spill.
+What grows with the evidence is the LNK-to-MFT join, which belongs to the
+filter pass: stream_filter_timestomp.py --memory-limit spills the LNK
+references and writes only the referenced MFT entries. Run the filter first
+on a large MFT, so that the detector loads just those entries.
 """
 
 import sys
 import argparse
 from pathlib import Path
-from rdflib import Dataset
+from typing import Dict
 from datetime import datetime
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from af_common.alerts import add_output_arguments, open_alerts
+from af_common.graph_load import Source, add_load_arguments, load_graphs
+from af_common.metrics import RunMetrics, add_metrics_arguments, profiled
+from af_common.query import run_query
+from af_common.result_cache import add_cache_arguments, engine_id, lookup, open_cache
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+
 
 def parse_args():
     parser = argparse.ArgumentParser(
@@ -50,92 +75,68 @@ def parse_args():
         default='rule_optimized.rq',
         help="SPARQL rule file (default: rule_optimized.rq)"
     )
+    parser.add_argument(
+        '--first-hit',
+        action='store_true',
+        help="Stop at the first confirmed positive (triage; exit code 2 on hit)"
+    )
     parser.add_argument(
         '--verbose',
         action='store_true',
         help="Show detailed loading information"
     )
+    parser.add_argument(
+        '--timeline',
+        type=Path,
+        metavar='PATH',
+        help="Super-timeline file (af_timeline.py build): print the events of "
+             "every source around the findings"
+    )
+    parser.add_argument(
+        '--timeline-window',
+        type=float,
+        default=60.0,
+        metavar='SECONDS',
+        help="Seconds of timeline context before and after the findings (default: 60)"
+    )
+    add_load_arguments(parser)
+    add_cache_arguments(parser)
+    add_metrics_arguments(parser)
+    add_output_arguments(parser)
 
     return parser.parse_args()
 
 
-def main():
-    args = parse_args()
-
-    # Determine file paths
-    if args.filter_dir:
-        filter_dir = Path(args.filter_dir)
-        mft_file = filter_dir / "mft_lnk_filtered.jsonld"
-        lnk_file = filter_dir / "lnk_files.jsonld"
-    else:
-        mft_file = Path(args.mft) if args.mft else None
-        lnk_file = Path(args.lnk) if args.lnk else None
-
-    # Validation
-    if not mft_file or not mft_file.exists():
-        print(f"ERROR: MFT file not found: {mft_file}", file=sys.stderr)
-        return 1
-
-    if not lnk_file or not lnk_file.exists():
-        print(f"ERROR: LNK file not found: {lnk_file}", file=sys.stderr)
-        return 1
-
-    rule_file = Path(args.rule_file)
-    if not rule_file.exists():
-        print(f"ERROR: Rule file not found: {rule_file}", file=sys.stderr)
-        print(f"  Looking in current directory: {Path.cwd()}", file=sys.stderr)
-        return 1
-
-    print("=" * 70)
-    print("AF-TIMESTOMPING: Timestamp Manipulation Detection (Optimized)")
-    print("=" * 70)
-    print()
-    print(f"MFT File: {mft_file.name}")
-    print(f"  Size: {mft_file.stat().st_size / (1024**2):.2f} MB")
-    print()
-    print(f"LNK File: {lnk_file.name}")
-    print(f"  Size: {lnk_file.stat().st_size / (1024**2):.2f} MB")
-    print()
-    print(f"Rule: {rule_file.name}")
-    print()
-
-    # Load SPARQL query
-    query = rule_file.read_text()
-
-    # Create dataset
-    print("=" * 70)
-    print("Loading RDF Data")
-    print("=" * 70)
-    print()
-
-    ds = Dataset()
-
-    # Load MFT data
-    print(f"Loading MFT data from {mft_file.name}...")
-    ds.parse(mft_file, format='json-ld')
-    print(f"  ✓ Loaded")
-
-    # Load LNK data
-    print(f"Loading LNK data from {lnk_file.name}...")
-    ds.parse(lnk_file, format='json-ld')
-    print(f"  ✓ Loaded")
-
-    total_triples = len(ds)
-    print(f"\n  Total triples: {total_triples:,}")
-    print()
-
-    # Execute query
-    print("=" * 70)
-    print("Running AF-TIMESTOMPING Detection Query")
-    print("=" * 70)
-    print()
-
-    if args.verbose:
-        print("Executing SPARQL query...")
-
-    results = list(ds.query(query))
-
-    # Analyze results
+def alert_fields(row):
+    """
+    The evidence and timestamps of a result row, as an AlertStream finding.
+    Raises if the row's created times are missing or do not parse.
+    """
+    lnk_path = str(row.lnkFile) if hasattr(row, 'lnkFile') else "Unknown"
+    target_path = str(row.lnkTargetPath) if hasattr(row, 'lnkTargetPath') else "Unknown"
+    lnk_created_str = str(row.lnkTargetCreated) if hasattr(row, 'lnkTargetCreated') else ""
+    mft_si_str = str(row.mftSiCreated) if hasattr(row, 'mftSiCreated') else ""
+    mft_fn_str = str(row.mftFnCreated) if hasattr(row, 'mftFnCreated') else ""
+    lnk_sc_str = str(row.lnkShortcutCreated) if hasattr(row, 'lnkShortcutCreated') else ""
+
+    datetime.fromisoformat(lnk_created_str.replace('Z', '+00:00'))
+    si_dt = datetime.fromisoformat(mft_si_str.replace('Z', '+00:00'))
+    fn_dt = datetime.fromisoformat(mft_fn_str.replace('Z', '+00:00'))
+    if lnk_sc_str:
+        datetime.fromisoformat(lnk_sc_str.replace('Z', '+00:00'))
+
+    return ({'target_path': target_path, 'lnk_file': lnk_path,
+             'si_fn_diff_seconds': abs((si_dt - fn_dt).total_seconds())},
+            {'lnk_shortcut_created': lnk_sc_str or None,
+             'lnk_target_created': lnk_created_str,
+             'mft_si_created': mft_si_str, 'mft_fn_created': mft_fn_str})
+
+
+def report(results, triple_counts: Dict[str, int], alerts=None) -> int:
+    """
+    Print the AF-TIMESTOMPING findings (and stream them to alerts, an
+    AlertStream). Returns 2 if detection is positive, else 0.
+    """
     print()
     if results:
         print("🚨 " + "=" * 68)
@@ -198,6 +199,8 @@ def main():
                     print(f"     • This indicates $STANDARD_INFORMATION was tampered")
                 print(f"     • MFT timestamp differs from LNK recorded timestamp")
                 print()
+                if alerts:
+                    alerts.finding(*alert_fields(row))
             except Exception as e:
                 print(f"Error parsing dates for {target_path}: {e}")
                 continue
@@ -216,7 +219,7 @@ def main():
         print("=" * 70)
         print()
         print("Analysis:")
-        print(f"  Total triples: {total_triples:,}")
+        print(f"  Total triples: {sum(triple_counts.values()):,}")
         print()
         print("Result:")
         print("  • All LNK target timestamps match MFT records")
@@ -226,5 +229,148 @@ def main():
         return 0  # Exit code 0 = no detection
 
 
+def show_timeline(args, results, instances: int = 10):
+    """
+    With --timeline, print the events of every source within
+    --timeline-window seconds of each instance's $FN created time (the
+    original creation time $SI was moved away from).
+    """
+    if not args.timeline or not results:
+        return
+    from af_common.timeline import parse_time_ns, print_context
+
+    margin = int(args.timeline_window * 1_000_000_000)
+    windows = []
+    for i, row in enumerate(results[:instances], 1):
+        created = parse_time_ns(str(row.mftFnCreated)) if getattr(row, 'mftFnCreated', None) else None
+        if created is not None:
+            windows.append((f"{i}. {getattr(row, 'lnkTargetPath', None) or 'Unknown'} ($FN created)",
+                            created - margin, created + margin))
+    if windows:
+        print()
+        print_context(args.timeline, windows, limit=20)
+
+
+def main():
+    args = parse_args()
+    alerts = open_alerts(args, 'AF-TIMESTOMPING')
+
+    # Determine file paths
+    if args.filter_dir:
+        filter_dir = Path(args.filter_dir)
+        mft_file = filter_dir / "mft_lnk_filtered.jsonld"
+        lnk_file = filter_dir / "lnk_files.jsonld"
+    else:
+        mft_file = Path(args.mft) if args.mft else None
+        lnk_file = Path(args.lnk) if args.lnk else None
+
+    # Validation
+    if not mft_file or not mft_file.exists():
+        print(f"ERROR: MFT file not found: {mft_file}", file=sys.stderr)
+        return 1
+
+    if not lnk_file or not lnk_file.exists():
+        print(f"ERROR: LNK file not found: {lnk_file}", file=sys.stderr)
+        return 1
+
+    if args.timeline and not args.timeline.exists():
+        print(f"ERROR: Timeline file not found: {args.timeline}", file=sys.stderr)
+        return 1
+
+    rule_file = Path(args.rule_file)
+    if not rule_file.exists():
+        # Fall back to the rules shipped next to this script
+        rule_file = SCRIPT_DIR / args.rule_file
+    if not rule_file.exists():
+        print(f"ERROR: Rule file not found: {args.rule_file}", file=sys.stderr)
+        print(f"  Looked in: {Path.cwd()} and {SCRIPT_DIR}", file=sys.stderr)
+        return 1
+
+    print("=" * 70)
+    print("AF-TIMESTOMPING: Timestamp Manipulation Detection (Optimized)")
+    print("=" * 70)
+    print()
+    print(f"MFT File: {mft_file.name}")
+    print(f"  Size: {mft_file.stat().st_size / (1024**2):.2f} MB")
+    print()
+    print(f"LNK File: {lnk_file.name}")
+    print(f"  Size: {lnk_file.stat().st_size / (1024**2):.2f} MB")
+    print()
+    print(f"Rule: {rule_file.name}")
+    print()
+
+    # Load SPARQL query
+    query = rule_file.read_text()
+
+    run_metrics = RunMetrics('AF-TIMESTOMPING/detect_timestomp_optimized')
+    cache = open_cache(args)
+    key, hit = lookup(cache, run_metrics, query, [mft_file, lnk_file],
+                      engine_id('sparql', Path(__file__)), {'first_hit': args.first_hit})
+    if hit:
+        exit_code = report(hit.rows, hit.counts, alerts=alerts)
+        if alerts:
+            alerts.summary(exit_code, hit.counts, run_metrics, cached=True)
+        show_timeline(args, hit.rows)
+        run_metrics.emit(args.metrics_json, args.metrics_prom)
+        return exit_code
+
+    # Create dataset
+    print("=" * 70)
+    print("Loading RDF Data")
+    print("=" * 70)
+    print()
+
+    # rdflib is imported only once inputs are validated; it dominates startup
+    from rdflib import Dataset
+
+    ds = Dataset()
+
+    with profiled(args.profile):
+        # Load MFT and LNK data concurrently into the default graph
+        print(f"Loading MFT data from {mft_file.name}...")
+        print(f"Loading LNK data from {lnk_file.name}...")
+        load_graphs([Source('mft', mft_file, 'json-ld', ds.default_graph),
+                     Source('lnk', lnk_file, 'json-ld', ds.default_graph)],
+                    run_metrics, args.load_workers)
+        print(f"  ✓ Loaded")
+
+        total_triples = len(ds)
+        print(f"\n  Total triples: {total_triples:,}")
+        print()
+
+        # Execute query
+        print("=" * 70)
+        print("Running AF-TIMESTOMPING Detection Query")
+        print("=" * 70)
+        print()
+
+        if args.verbose:
+            print("Executing SPARQL query...")
+
+        # The rule has no ORDER BY: findings are streamed as rdflib yields them
+        on_row = None
+        if alerts:
+            def on_row(row):
+                try:
+                    alerts.finding(*alert_fields(row))
+                except Exception:
+                    # report() prints the row's error once the query is done
+                    pass
+
+        with run_metrics.stage('query') as stage, stage.timed('query'):
+            results = run_query(ds, query, first_hit=args.first_hit, on_row=on_row)
+        stage.records = len(results)
+        if args.first_hit and results:
+            print("First-hit mode: stopped at the first confirmed positive")
+
+    if cache:
+        cache.store(key, results, {'total': total_triples})
+    exit_code = report(results, {'total': total_triples})
+    if alerts:
+        alerts.summary(exit_code, {'total': total_triples}, run_metrics)
+    show_timeline(args, results)
+    run_metrics.emit(args.metrics_json, args.metrics_prom)
+    return exit_code
+
 if __name__ == '__main__':
     sys.exit(main())
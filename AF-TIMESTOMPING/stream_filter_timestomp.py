@@ -8,59 +8,94 @@ Usage:
       --mft mft_filled_honest.jsonld \
       --lnk ../lnk-shortcut/lnk_filled_fixed.jsonld \
       --output-dir /tmp/timestomp/
+
+    # Continue an interrupted run from its last checkpoint
+    python3 stream_filter_timestomp.py --mft ... --lnk ... --output-dir /tmp/timestomp/ --resume
+
+    # Bound the LNK reference set; past the limit the MFT is joined on disk
+    python3 stream_filter_timestomp.py --mft ... --lnk ... --output-dir /tmp/timestomp/ \
+      --memory-limit 256M
+
+    # Triage: estimate LNK-referenced MFT entries from 64 spread byte ranges
+    python3 stream_filter_timestomp.py --mft ... --lnk ... --output-dir /tmp/timestomp/ \
+      --sample 64
+
+    # Fetch the referenced entries through an MFT store (built on first use)
+    python3 stream_filter_timestomp.py --mft ... --lnk ... --output-dir /tmp/timestomp/ \
+      --mft-store mft_case.afms
 """
 
-import json
 import sys
+import time
 import argparse
 from pathlib import Path
-from typing import Dict, Any, Set
+from typing import Any, Callable, Dict, Iterator, Optional, Set, Tuple
 from datetime import datetime
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from af_common.checkpoint import CheckpointError, CheckpointStore
+from af_common.facets import FACET_TYPES, facet_kinds, facet_list
+from af_common.jsonld_stream import JsonLdReader, JsonLdWriter
+from af_common.metrics import RunMetrics, StageMetrics, add_metrics_arguments, profiled
+from af_common.pipeline import add_pipeline_arguments, configure, pipeline_config
+from af_common.sampling import add_sampling_arguments, sample_sources, sampling_config
+from af_common.spill import (PARTITIONS, MemoryBudget, SpillingSet, add_memory_arguments,
+                             memory_budget, semi_join_positions)
+from af_common.stream_filter import filter_jsonld
 
-def extract_lnk_mft_refs(lnk_file: Path) -> Set[str]:
+# Facet type bits (see af_common/facets.py)
+MFT_FACET = FACET_TYPES.register('MftFacet')
+LNK_FACET = FACET_TYPES.register('WindowsLnkFacet')
+
+
+def extract_lnk_mft_refs(lnk_file: Path, metrics: Optional[StageMetrics] = None,
+                         budget: Optional[MemoryBudget] = None) -> Set[str]:
     """
     First pass: Extract all MFT entry numbers referenced by LNK files.
 
-    Returns: Set of MFT entry numbers as strings
+    Returns: Set of MFT entry numbers as strings (a SpillingSet charged
+    to budget when one is given)
     """
     print(f"Pass 1: Extracting MFT references from LNK file...")
     print(f"  LNK file: {lnk_file.name} ({lnk_file.stat().st_size / (1024**2):.2f} MB)")
 
-    mft_refs = set()
+    mft_refs = SpillingSet(budget, 'lnk-refs') if budget else set()
     lnk_count = 0
-
-    with open(lnk_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-
-        # Handle both single object and array
-        entries = data if isinstance(data, list) else [data]
-
-        for entry in entries:
-            # Look for WindowsLnkFacet with targetMftEntryNumber
-            if '@graph' in entry:
-                for item in entry['@graph']:
-                    # Check if this is a File with facets
-                    if item.get('@type') == 'observable:File' and 'core:hasFacet' in item:
-                        facets = item['core:hasFacet']
-                        if not isinstance(facets, list):
-                            facets = [facets]
-
-                        for facet in facets:
-                            if isinstance(facet, dict):
-                                facet_type = facet.get('@type', '')
-                                # Check if it's a WindowsLnkFacet (can be string or list)
-                                if 'WindowsLnkFacet' in str(facet_type):
-                                    mft_entry = facet.get('dfc-ext:targetMftEntryNumber')
-                                    if mft_entry:
-                                        # Handle both dict format and direct value
-                                        if isinstance(mft_entry, dict):
-                                            mft_refs.add(str(mft_entry.get('@value', mft_entry)))
-                                        else:
-                                            mft_refs.add(str(mft_entry))
-                                        lnk_count += 1
-
-    print(f"  ✓ Found {lnk_count} LNK files referencing {len(mft_refs)} unique MFT entries")
+    entries = 0
+
+    with JsonLdReader(lnk_file, canonical_keys=True) as reader:
+        for entry, _ in reader:
+            entries += 1
+            # Entries are @graph items; bare arrays may hold whole documents
+            items = entry['@graph'] if '@graph' in entry else [entry]
+            for item in items:
+                # Check if this is a File with facets
+                if item.get('@type') == 'observable:File':
+                    for facet in facet_list(item.get('core:hasFacet')):
+                        # WindowsLnkFacet (@type can be a string or a list)
+                        if facet_kinds(facet) & LNK_FACET:
+                            mft_entry = facet.get('dfc-ext:targetMftEntryNumber')
+                            if mft_entry:
+                                # Handle both dict format and direct value
+                                if isinstance(mft_entry, dict):
+                                    mft_refs.add(str(mft_entry.get('@value', mft_entry)))
+                                else:
+                                    mft_refs.add(str(mft_entry))
+                                lnk_count += 1
+
+        if metrics:
+            metrics.add('read', reader.read_seconds)
+            metrics.records += entries
+            metrics.matched = lnk_count
+            metrics.bytes += reader.offset
+            if budget:
+                metrics.extra['memory'] = budget.to_dict()
+
+    if budget and mft_refs.spilled:
+        print(f"  ✓ Found {lnk_count} LNK files referencing up to {len(mft_refs)} MFT entries "
+              f"(spilled to disk past --memory-limit)")
+    else:
+        print(f"  ✓ Found {lnk_count} LNK files referencing {len(mft_refs)} unique MFT entries")
     return mft_refs
 
 
@@ -98,75 +133,195 @@ def is_relevant_mft(entry: Dict[str, Any], mft_refs: Set[str]) -> bool:
     return False
 
 
-def filter_mft_stream(mft_file: Path, lnk_refs: Set[str], output_file: Path):
+def mft_entry_number(facet: Dict[str, Any]) -> str:
+    """entryNumber of an MftFacet as a string ('' if it has none)."""
+    entry_num = facet.get('dfc-ext:entryNumber')
+    # Handle both dict format and direct value
+    if isinstance(entry_num, dict):
+        return str(entry_num.get('@value', ''))
+    return str(entry_num) if entry_num else ''
+
+
+def mft_entry_numbers(item: Dict[str, Any]) -> Iterator[str]:
+    """
+    Entry numbers of the MftFacets of a streamed MFT File entry, as strings.
+    """
+    if item.get('@type') != 'observable:File':
+        return
+
+    for facet in facet_list(item.get('core:hasFacet')):
+        # MftFacet (@type can be a string or a list)
+        if facet_kinds(facet) & MFT_FACET:
+            entry_num = mft_entry_number(facet)
+            if entry_num:
+                yield entry_num
+
+
+def is_lnk_referenced_mft(item: Dict[str, Any], lnk_refs: Set[str]) -> bool:
+    """
+    Check if a streamed MFT File entry has an MftFacet whose entryNumber
+    is referenced by any LNK file.
+    """
+    if item.get('@type') != 'observable:File':
+        return False
+
+    for facet in facet_list(item.get('core:hasFacet')):
+        if facet_kinds(facet) & MFT_FACET:
+            entry_num = mft_entry_number(facet)
+            if entry_num and entry_num in lnk_refs:
+                return True
+    return False
+
+
+def source_predicates(sources: Dict[str, Path]) -> Dict[str, Any]:
+    """
+    Entry predicates per evidence source, for single-pass multi-rule prefiltering.
+
+    Runs the LNK pass first, since the MFT predicate depends on its references.
+    """
+    lnk_refs = extract_lnk_mft_refs(sources['lnk'])
+    return {'mft': lambda item: is_lnk_referenced_mft(item, lnk_refs)}
+
+
+def spilled_join_predicate(mft_file: Path, lnk_refs: SpillingSet,
+                           metrics: Optional[StageMetrics] = None) -> Callable[[Dict[str, Any]], bool]:
+    """
+    Grace semi-join of the MFT against LNK references that spilled to disk.
+
+    A first pass partitions every entry's MftFacet entry numbers like the
+    references and joins the partitions one at a time, giving the
+    positions of the referenced entries. The returned predicate keeps the
+    entries at those positions, so filter_jsonld() writes exactly what the
+    in-memory set test would have kept, in the same order.
+    """
+    print(f"  LNK references spilled past --memory-limit: grace hash join "
+          f"over {PARTITIONS} partitions")
+
+    def probe():
+        with JsonLdReader(mft_file, canonical_keys=True) as reader:
+            for position, (entry, _) in enumerate(reader):
+                yield position, list(mft_entry_numbers(entry))
+
+    start = time.perf_counter()
+    positions = semi_join_positions(lnk_refs, probe())
+    if metrics:
+        metrics.add('join', time.perf_counter() - start)
+
+    next_match = next(positions, None)
+    position = -1
+
+    def predicate(item: Dict[str, Any]) -> bool:
+        nonlocal next_match, position
+        position += 1
+        if position != next_match:
+            return False
+        next_match = next(positions, None)
+        return True
+
+    return predicate
+
+
+def store_join(store, mft_file: Path, lnk_refs: Set[str], output_file: Path,
+               metrics: Optional[StageMetrics] = None) -> Tuple[int, int]:
+    """
+    Second pass through an MFT store: probe the referenced entry numbers
+    and read only those entries from the MFT file.
+
+    The entries are written in file order and checked with the same
+    predicate as the scan, so the output is identical to filter_jsonld()'s.
+    The store must index every entry number (store.unindexed == 0).
+    """
+    clock = time.perf_counter
+    start = clock()
+    # References that are not decimal numbers cannot match an indexed entry
+    numbers = [int(ref) for ref in lnk_refs if ref.isascii() and ref.isdigit()]
+    records = list(store.probe(numbers))
+    probe_seconds = clock() - start
+
+    header = {'@context': store.context} if store.context else None
+    writer = JsonLdWriter(output_file, header)
+    fetch_seconds = write_seconds = 0.0
+    fetched = fetched_bytes = matched = 0
+    try:
+        t0 = clock()
+        for record, entry in store.entries(records, mft_file):
+            fetch_seconds += clock() - t0
+            fetched += 1
+            fetched_bytes += record.end - record.start
+            if is_lnk_referenced_mft(entry, lnk_refs):
+                t0 = clock()
+                writer.write(entry)
+                matched += 1
+                write_seconds += clock() - t0
+            t0 = clock()
+    except BaseException:
+        writer.abandon()
+        raise
+    writer.close()
+
+    if metrics:
+        metrics.add('probe', probe_seconds)
+        metrics.add('fetch', fetch_seconds)
+        metrics.add('write', write_seconds)
+        metrics.records += fetched
+        metrics.matched = (metrics.matched or 0) + matched
+        metrics.bytes += fetched_bytes
+        metrics.extra['store_records'] = len(records)
+    return store.source_entries, matched
+
+
+def filter_mft_stream(mft_file: Path, lnk_refs: Set[str], output_file: Path,
+                      checkpoints: Optional[CheckpointStore] = None,
+                      metrics: Optional[StageMetrics] = None,
+                      store=None):
     """
     Second pass: Stream through MFT file and extract only referenced entries.
+
+    Given an MftStore, the referenced entries are fetched through it
+    instead, unless the references spilled to disk or the store could not
+    index every entry number.
     """
     print(f"\nPass 2: Filtering MFT file...")
     print(f"  MFT file: {mft_file.name} ({mft_file.stat().st_size / (1024**2):.2f} MB)")
     print(f"  Looking for {len(lnk_refs)} referenced MFT entries")
 
-    filtered_graph = []
-    total = 0
-    matched = 0
-    context = None
-
-    with open(mft_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-
-        # Extract context if present
-        if isinstance(data, dict) and '@context' in data:
-            context = data['@context']
-
-        # Get the list of File entries from @graph
-        if isinstance(data, dict) and '@graph' in data:
-            entries = data['@graph']
-        elif isinstance(data, list):
-            entries = data
-        else:
-            entries = [data]
-
-        # Filter entries that are Files with matching MFT entry numbers
-        for item in entries:
-            total += 1
-            if item.get('@type') == 'observable:File' and 'core:hasFacet' in item:
-                facets = item['core:hasFacet']
-                if not isinstance(facets, list):
-                    facets = [facets]
-
-                # Check if any facet is MftFacet with matching entry number
-                for facet in facets:
-                    if isinstance(facet, dict):
-                        facet_type = facet.get('@type', '')
-                        # Check if facet_type contains 'MftFacet' (can be string or list)
-                        if 'MftFacet' in str(facet_type):
-                            entry_num = facet.get('dfc-ext:entryNumber')
-                            if isinstance(entry_num, dict):
-                                entry_num = str(entry_num.get('@value', ''))
-                            else:
-                                entry_num = str(entry_num) if entry_num else ''
-
-                            if entry_num and entry_num in lnk_refs:
-                                filtered_graph.append(item)
-                                matched += 1
-                                if matched % 10 == 0:
-                                    print(f"  Progress: {matched} relevant entries found (scanned {total:,})", end='\r')
-                                break  # Don't add same item twice
+    def progress(scanned, matched, fraction):
+        print(f"  Progress: {matched} relevant entries found (scanned {scanned:,})", end='\r')
+
+    spilled = isinstance(lnk_refs, SpillingSet) and lnk_refs.spilled
+    if store is not None and (spilled or store.unindexed):
+        reason = ("LNK references spilled to disk" if spilled else
+                  f"{store.unindexed:,} entry numbers are not indexed")
+        print(f"  MFT store not used ({reason}): scanning the MFT file")
+        store = None
+
+    if store is not None:
+        print(f"  Probing MFT store {store.path.name}")
+        total, matched = store_join(store, mft_file, lnk_refs, output_file, metrics)
+    else:
+        predicate = lambda item: is_lnk_referenced_mft(item, lnk_refs)
+        if spilled:
+            predicate = spilled_join_predicate(mft_file, lnk_refs, metrics)
+            # Entries are kept by position from the start of the file
+            checkpoints = None
+
+        total, matched = filter_jsonld(
+            mft_file,
+            output_file,
+            predicate,
+            bare_list_without_context=True,
+            checkpoints=checkpoints,
+            on_progress=progress,
+            metrics=metrics
+        )
 
     print(f"\n  ✓ Filtered: {matched} relevant / {total:,} total entries")
-
-    # Write filtered data
-    output_data = {
-        "@context": context,
-        "@graph": filtered_graph
-    } if context else filtered_graph
-
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(output_data, f, indent=2)
+    if metrics and isinstance(lnk_refs, SpillingSet):
+        metrics.extra['memory'] = lnk_refs.budget.to_dict()
 
     output_size = output_file.stat().st_size / (1024**2)
     input_size = mft_file.stat().st_size / (1024**2)
-    reduction = (1 - output_size / input_size) * 100
+    reduction = (1 - output_size / input_size) * 100 if input_size > 0 else 0
 
     print(f"  ✓ Output: {output_file.name} ({output_size:.2f} MB)")
     print(f"  ✓ Reduction: {reduction:.1f}% ({input_size:.1f} MB → {output_size:.2f} MB)")
@@ -181,9 +336,28 @@ def main():
     parser.add_argument('--mft', required=True, help="MFT JSON-LD file")
     parser.add_argument('--lnk', required=True, help="LNK JSON-LD file")
     parser.add_argument('--output-dir', required=True, help="Output directory")
+    parser.add_argument('--resume', action='store_true',
+                        help="Resume an interrupted run from the checkpoint in --output-dir")
+    parser.add_argument('--checkpoint-interval', type=float, default=30.0,
+                        help="Seconds between checkpoints (default: 30)")
+    parser.add_argument('--mft-store', type=Path,
+                        help="MFT store file (af_mftstore.py) to fetch referenced entries "
+                             "through; built from --mft if missing or out of date")
+    add_pipeline_arguments(parser)
+    add_memory_arguments(parser)
+    add_sampling_arguments(parser)
+    add_metrics_arguments(parser)
 
     args = parser.parse_args()
 
+    try:
+        configure(pipeline_config(args))
+        sampling = sampling_config(args)
+        budget = memory_budget(args)
+    except ValueError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+
     # Setup paths
     mft_file = Path(args.mft)
     lnk_file = Path(args.lnk)
@@ -198,6 +372,20 @@ def main():
         print(f"ERROR: LNK file not found: {lnk_file}", file=sys.stderr)
         return 1
 
+    if sampling:
+        # The LNK export is small and read in full; only the MFT is sampled
+        print("=" * 70)
+        print("AF-TIMESTOMPING: Sampled MFT Triage")
+        print("=" * 70)
+        run_metrics = RunMetrics('AF-TIMESTOMPING/stream_filter_timestomp')
+        with profiled(args.profile):
+            with run_metrics.stage('lnk') as stage:
+                lnk_refs = extract_lnk_mft_refs(lnk_file, stage)
+            results = sample_sources({'mft': lambda item: is_lnk_referenced_mft(item, lnk_refs)},
+                                     {'mft': mft_file}, sampling, run_metrics)
+        run_metrics.emit(args.metrics_json, args.metrics_prom)
+        return 0 if results is not None else 1
+
     # Create output directory
     output_dir.mkdir(parents=True, exist_ok=True)
 
@@ -207,17 +395,42 @@ def main():
     print()
 
     start_time = datetime.now()
-
-    # Pass 1: Extract LNK MFT references
-    lnk_refs = extract_lnk_mft_refs(lnk_file)
-
-    if not lnk_refs:
-        print("\nWARNING: No MFT references found in LNK file!", file=sys.stderr)
-        return 1
-
-    # Pass 2: Filter MFT file
-    mft_output = output_dir / "mft_lnk_filtered.jsonld"
-    matched, total = filter_mft_stream(mft_file, lnk_refs, mft_output)
+    run_metrics = RunMetrics('AF-TIMESTOMPING/stream_filter_timestomp')
+
+    with profiled(args.profile):
+        # Pass 1: Extract LNK MFT references
+        with run_metrics.stage('lnk') as stage:
+            lnk_refs = extract_lnk_mft_refs(lnk_file, stage, budget)
+
+        if not lnk_refs:
+            print("\nWARNING: No MFT references found in LNK file!", file=sys.stderr)
+            return 1
+
+        store = None
+        if args.mft_store:
+            from af_common.mft_store import open_store
+            try:
+                with run_metrics.stage('mft-store') as stage:
+                    store = open_store(args.mft_store, mft_file, stage)
+            except (OSError, ValueError) as e:
+                print(f"\nERROR: {e}", file=sys.stderr)
+                return 1
+
+        # Pass 2: Filter MFT file (pass 1 is cheap and always re-run on resume)
+        mft_output = output_dir / "mft_lnk_filtered.jsonld"
+        try:
+            checkpoints = CheckpointStore(output_dir, resume=args.resume,
+                                          interval=args.checkpoint_interval)
+            with run_metrics.stage('mft') as stage:
+                matched, total = filter_mft_stream(mft_file, lnk_refs, mft_output, checkpoints,
+                                                   stage, store)
+        except CheckpointError as e:
+            print(f"\nERROR: {e}", file=sys.stderr)
+            print("  Rerun without --resume to start over", file=sys.stderr)
+            return 1
+        finally:
+            if store is not None:
+                store.close()
 
     # Copy LNK file (small enough)
     lnk_output = output_dir / "lnk_files.jsonld"
@@ -227,6 +440,8 @@ def main():
     import shutil
     shutil.copy2(lnk_file, lnk_output)
 
+    checkpoints.clear()
+
     elapsed = (datetime.now() - start_time).total_seconds()
 
     print()
@@ -245,6 +460,8 @@ def main():
     print(f"  python3 detect_timestomp_optimized.py {output_dir}")
     print("=" * 70)
 
+    run_metrics.emit(args.metrics_json, args.metrics_prom)
+
     return 0
 
 
@@ -0,0 +1,603 @@
+#!/usr/bin/env python3
+"""
+Batch AF Detection: run af_detect.py for many hosts on a bounded worker pool
+
+Reads a manifest of cases (one evidence bundle per host), prefilters and
+runs every applicable rule for each case in its own af_detect.py process,
+and writes an aggregated per-host result table.
+
+- Bounded pool: at most --workers cases run at once
+- Memory-aware admission: a case only starts when its estimated peak
+  memory fits in the remaining --memory-budget (one case always runs, so
+  oversized cases are serialised rather than skipped)
+- Failure isolation: each case is a separate process with its own log, so
+  a bad input, crash or --timeout only fails that case
+- Distributed mode (--queue): instead of running cases here, submit one job
+  per filter pass and detector run to a shared work queue; af_worker.py
+  processes on any node lease and run them, with leases and retries, and
+  the results are collected into the same table
+
+Manifest (JSON or CSV, paths relative to the manifest):
+    [{"host": "ws01", "mft": "ws01/mft.jsonld", "usn": "ws01/usn.jsonld",
+      "security": "ws01/security.jsonld", "lnk": "ws01/lnk.jsonld"}, ...]
+
+    host,mft,usn,history,security,system,lnk,office_xml
+    ws01,ws01/mft.jsonld,ws01/usn.jsonld,,ws01/security.jsonld,,,
+
+Usage:
+    python3 af_batch.py cases.json --output-dir /cases/out --workers 8
+    python3 af_batch.py cases.csv --output-dir /cases/out --memory-budget 16000 --first-hit
+
+    # Distributed: submit and wait; start workers on every node meanwhile
+    python3 af_batch.py cases.json --output-dir /shared/out --queue /shared/queue.db
+    python3 af_worker.py --queue /shared/queue.db          # on each node
+
+Distributed output (per rule, per job step):
+    <output-dir>/<host>/<rule>/<step>/              filter pass output
+    <output-dir>/<host>/<rule>/<step>.log           job output (all attempts)
+    <output-dir>/<host>/<rule>/<step>.metrics.json  job metrics
+
+Output:
+    <output-dir>/<host>/af_detect.log     full detector output
+    <output-dir>/<host>/metrics.json      per-stage metrics (see --metrics-json)
+    <output-dir>/batch_results.csv        one row per host
+
+Exit codes: 0 = all clean, 1 = a case failed, 2 = at least one host positive
+"""
+
+import argparse
+import csv
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from af_common.registry import REPO_ROOT, RULES, SOURCES, RuleSpec
+
+AF_DETECT = Path(__file__).resolve().parent / 'af_detect.py'
+
+# Interpreter + rdflib + working set of a case with small (prefiltered) inputs
+BASE_MEMORY_MB = 200.0
+
+
+class Case(NamedTuple):
+    host: str
+    sources: Dict[str, Path]
+
+
+class JobSpec(NamedTuple):
+    """One queued job: a filter pass or a detector run of one rule for one host."""
+    rule: str
+    step: str
+    command: List[str]
+    depends_on: Tuple[str, ...] = ()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Run AF detection for many hosts on a bounded, memory-aware worker pool"
+    )
+    parser.add_argument(
+        'manifest',
+        help="Case manifest (.json list of objects or .csv with a host column)"
+    )
+    parser.add_argument(
+        '--output-dir',
+        required=True,
+        help="Directory for per-host logs/metrics and batch_results.csv"
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=4,
+        help="Maximum cases running at once (default: 4)"
+    )
+    parser.add_argument(
+        '--memory-budget',
+        type=float,
+        help="Memory budget in MB for running cases (default: 75%% of available memory)"
+    )
+    parser.add_argument(
+        '--memory-factor',
+        type=float,
+        default=0.25,
+        help="Estimated MB of peak memory per MB of case input, on top of "
+             f"{BASE_MEMORY_MB:.0f} MB (default: 0.25)"
+    )
+    parser.add_argument(
+        '--timeout',
+        type=float,
+        help="Seconds before a case is killed and marked as timed out"
+    )
+    parser.add_argument(
+        '--rules',
+        help="Comma-separated rule IDs passed to af_detect.py (default: all applicable)"
+    )
+    parser.add_argument(
+        '--first-hit',
+        action='store_true',
+        help="Stop each case at its first positive rule (triage)"
+    )
+    parser.add_argument(
+        '--queue',
+        metavar='PATH',
+        help="Submit per-rule filter/detect jobs to this shared work queue (SQLite) "
+             "for af_worker.py processes instead of running cases locally"
+    )
+    parser.add_argument(
+        '--batch-id',
+        help="Batch name in the queue (default: name of --output-dir)"
+    )
+    parser.add_argument(
+        '--max-attempts',
+        type=int,
+        default=3,
+        help="Attempts per queued job that fails transiently before it is marked failed (default: 3)"
+    )
+    parser.add_argument(
+        '--no-wait',
+        action='store_true',
+        help="With --queue: submit and exit; rerun the same command later to collect"
+    )
+
+    return parser.parse_args()
+
+
+def load_manifest(path: Path) -> List[Case]:
+    """
+    Read cases from a JSON or CSV manifest.
+
+    Relative evidence paths are resolved against the manifest's directory;
+    empty values are ignored. Raises ValueError on unknown columns or
+    duplicate hosts.
+    """
+    if path.suffix.lower() == '.json':
+        data = json.loads(path.read_text())
+        rows = data['cases'] if isinstance(data, dict) else data
+    else:
+        with open(path, newline='') as f:
+            rows = list(csv.DictReader(f))
+
+    cases = []
+    seen = set()
+    for number, row in enumerate(rows, 1):
+        row = {key.strip().replace('-', '_'): value for key, value in row.items() if key}
+        host = str(row.pop('host', '') or '').strip()
+        if not host:
+            raise ValueError(f"{path.name}: case #{number} has no host")
+        if host in seen:
+            raise ValueError(f"{path.name}: duplicate host {host}")
+        seen.add(host)
+
+        unknown = set(row) - set(SOURCES)
+        if unknown:
+            raise ValueError(f"{path.name}: {host}: unknown source(s): {', '.join(sorted(unknown))}")
+
+        sources = {}
+        for source in SOURCES:
+            value = (row.get(source) or '').strip()
+            if value:
+                evidence = Path(value)
+                sources[source] = evidence if evidence.is_absolute() else path.parent / evidence
+        cases.append(Case(host, sources))
+
+    return cases
+
+
+def available_memory_mb() -> Optional[float]:
+    """MemAvailable from /proc/meminfo, or None where unavailable."""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def estimate_memory_mb(case: Case, factor: float) -> float:
+    """Estimated peak memory of a case from the size of its inputs."""
+    size = sum(p.stat().st_size for p in case.sources.values() if p.exists())
+    return BASE_MEMORY_MB + factor * size / (1024**2)
+
+
+def case_command(case: Case, case_dir: Path, args) -> List[str]:
+    """af_detect.py invocation for one case."""
+    command = [sys.executable, str(AF_DETECT)]
+    for source, path in case.sources.items():
+        command += [f"--{source.replace('_', '-')}", str(path)]
+    command += [
+        '--prefilter-dir', str(case_dir / 'prefiltered'),
+        '--metrics-json', str(case_dir / 'metrics.json'),
+    ]
+    if args.rules:
+        command += ['--rules', args.rules]
+    if args.first_hit:
+        command.append('--first-hit')
+    return command
+
+
+def case_result(case: Case, case_dir: Path, exit_code: Optional[int],
+                elapsed: float, status: Optional[str] = None) -> Dict:
+    """Summarise a finished case from its exit code and metrics file."""
+    if status is None:
+        status = {0: 'clean', 2: 'ALERT', 1: 'error'}.get(exit_code, 'crashed')
+
+    rules = {}
+    peak_rss = None
+    metrics_file = case_dir / 'metrics.json'
+    # af_detect.py exits 1 when one rule failed, after running the others
+    if status in ('clean', 'ALERT', 'error') and metrics_file.exists():
+        metrics = json.loads(metrics_file.read_text())
+        peak_rss = metrics.get('peak_rss_bytes')
+        for stage in metrics['stages']:
+            if stage['name'].startswith('rule:'):
+                rules[stage['name'][len('rule:'):]] = \
+                    {0: 'clean', 2: 'ALERT'}.get(stage.get('exit_code'), 'error')
+
+    return {
+        'host': case.host,
+        'status': status,
+        'exit_code': exit_code,
+        'rules': rules,
+        'seconds': elapsed,
+        'peak_rss_mb': peak_rss / (1024**2) if peak_rss else None,
+        'log': str(case_dir / 'af_detect.log'),
+    }
+
+
+def run_batch(cases: List[Case], output_dir: Path, args, budget_mb: Optional[float]) -> List[Dict]:
+    """Run every case, at most args.workers at once and within budget_mb."""
+    pending = [(case, estimate_memory_mb(case, args.memory_factor)) for case in cases]
+    running = {}  # Popen -> (case, case_dir, start, estimate, log file)
+    results = []
+    failed = 0
+    total = len(cases)
+
+    def start(case: Case, estimate: float):
+        case_dir = output_dir / case.host
+        case_dir.mkdir(parents=True, exist_ok=True)
+        # A failed run writes no metrics; never read those of an earlier run
+        (case_dir / 'metrics.json').unlink(missing_ok=True)
+        log = open(case_dir / 'af_detect.log', 'w')
+        process = subprocess.Popen(case_command(case, case_dir, args),
+                                   stdout=log, stderr=subprocess.STDOUT)
+        running[process] = (case, case_dir, time.monotonic(), estimate, log)
+
+    try:
+        while pending or running:
+            # Admit the first pending cases that fit the worker and memory limits
+            in_use = sum(entry[3] for entry in running.values())
+            for item in list(pending):
+                if len(running) >= args.workers:
+                    break
+                case, estimate = item
+                if running and budget_mb is not None and in_use + estimate > budget_mb:
+                    continue
+                pending.remove(item)
+                start(case, estimate)
+                in_use += estimate
+
+            time.sleep(0.1)
+
+            for process, (case, case_dir, started, _, log) in list(running.items()):
+                elapsed = time.monotonic() - started
+                status = None
+                if process.poll() is None:
+                    if args.timeout is None or elapsed < args.timeout:
+                        continue
+                    process.kill()
+                    process.wait()
+                    status = 'timeout'
+
+                log.close()
+                del running[process]
+                result = case_result(case, case_dir, process.returncode, elapsed, status)
+                results.append(result)
+                failed += result['status'] not in ('clean', 'ALERT')
+
+                positives = ', '.join(r for r, v in result['rules'].items() if v == 'ALERT')
+                print(f"[{len(results):>{len(str(total))}}/{total}] {case.host:<20} "
+                      f"{result['status']:<8} {elapsed:7.1f}s  {positives}"
+                      f"  (running {len(running)}, queued {len(pending)}, failed {failed})")
+    except KeyboardInterrupt:
+        print("\nInterrupted: stopping running cases", file=sys.stderr)
+        for process, (case, case_dir, started, _, log) in running.items():
+            process.kill()
+            process.wait()
+            log.close()
+            results.append(case_result(case, case_dir, None,
+                                       time.monotonic() - started, 'interrupted'))
+        raise
+
+    return results
+
+
+def _script(spec: RuleSpec, name: str) -> str:
+    # Relative to the repository root so workers can use their own checkout
+    return str((spec.directory / name).relative_to(REPO_ROOT))
+
+
+def plan_rule_jobs(spec: RuleSpec, case: Case, rule_dir: Path, args) -> List[JobSpec]:
+    """
+    Split one rule for one host into filter and detector jobs.
+
+    Every stream filter pass that can run on its own is its own job (AF-007
+    runs its USN, Security and System passes in parallel); the detector job
+    depends on them. Rules without a known split (plugins) run as a single
+    af_detect.py job.
+    """
+    src = {source: str(path.resolve()) for source, path in case.sources.items()}
+    first_hit = ['--first-hit'] if args.first_hit else []
+
+    def job(step, script, *arguments, depends_on=()):
+        command = [_script(spec, script), *map(str, arguments),
+                   '--metrics-json', str(rule_dir / f'{step}.metrics.json')]
+        return JobSpec(spec.rule_id, step, command, tuple(depends_on))
+
+    if spec.rule_id == 'AF-002':
+        from af_common.history_db import is_history_db
+
+        out = rule_dir / 'filter'
+        return [
+            job('filter', spec.stream_filter, '--mft', src['mft'], '--usn', src['usn'],
+                '--history', src['history'], '--output-dir', out),
+            job('detect', spec.detector, out / 'mft_indexeddb_filtered.jsonld',
+                # A History SQLite database is read in place, not copied
+                src['history'] if is_history_db(src['history']) else out / 'history_all.jsonld',
+                out / 'usn_history_filtered.jsonld', *first_hit, depends_on=['filter']),
+        ]
+
+    if spec.rule_id == 'AF-004':
+        out = rule_dir / 'filter'
+        return [
+            job('filter', spec.stream_filter, '--mft', src['mft'], '--usn', src['usn'],
+                '--output-dir', out),
+            job('detect', spec.detector, out / 'mft_vss_filtered.jsonld',
+                out / 'usn_vss_filtered.jsonld', *first_hit, depends_on=['filter']),
+        ]
+
+    if spec.rule_id == 'AF-007':
+        passes = {'usn': 'usn_security_filtered.jsonld',
+                  'security': 'security_1102_filtered.jsonld',
+                  'system': 'system_events.jsonld'}
+        jobs, detect_args = [], []
+        for source, output in passes.items():
+            if source not in src:
+                continue
+            step = f'filter-{source}'
+            jobs.append(job(step, spec.stream_filter, f'--{source}', src[source],
+                            '--output-dir', rule_dir / step))
+            detect_args += [f'--{source}', rule_dir / step / output]
+        jobs.append(job('detect', spec.detector, *detect_args, *first_hit,
+                        depends_on=[j.step for j in jobs]))
+        return jobs
+
+    if spec.rule_id == 'AF-TIMESTOMPING':
+        out = rule_dir / 'filter'
+        return [
+            job('filter', spec.stream_filter, '--mft', src['mft'], '--lnk', src['lnk'],
+                '--output-dir', out),
+            job('detect', spec.detector, out, *first_hit, depends_on=['filter']),
+        ]
+
+    if spec.rule_id == 'AF-TIMESTOMPING-XML':
+        return [job('detect', spec.detector, src['office_xml'], *first_hit)]
+
+    command = [str(AF_DETECT.relative_to(REPO_ROOT)), '--rules', spec.rule_id]
+    for source, path in src.items():
+        command += [f"--{source.replace('_', '-')}", path]
+    command += ['--prefilter-dir', str(rule_dir / 'prefiltered'),
+                '--metrics-json', str(rule_dir / 'detect.metrics.json')] + first_hit
+    return [JobSpec(spec.rule_id, 'detect', command)]
+
+
+def case_rules(case: Case, args) -> List[RuleSpec]:
+    """Rules to run for a case: --rules, or every rule whose sources are present."""
+    requested = [r.strip() for r in args.rules.split(',')] if args.rules else list(RULES)
+    return [RULES[rule_id] for rule_id in requested
+            if rule_id in RULES and all(s in case.sources for s in RULES[rule_id].sources)]
+
+
+def submit_batch(queue, batch: str, cases: List[Case], output_dir: Path, args) -> int:
+    """Queue every case's jobs; returns the number of jobs in the batch."""
+    submitted = 0
+    for case in cases:
+        for spec in case_rules(case, args):
+            rule_dir = (output_dir / case.host / spec.rule_id).resolve()
+            for job in plan_rule_jobs(spec, case, rule_dir, args):
+                queue.submit(batch, case.host, spec.rule_id, job.step, job.command,
+                             depends_on=[queue.job_id(batch, case.host, spec.rule_id, dep)
+                                         for dep in job.depends_on],
+                             log=str(rule_dir / f'{job.step}.log'),
+                             max_attempts=args.max_attempts)
+                submitted += 1
+    return submitted
+
+
+def wait_for_batch(queue, batch: str, poll: float = 2.0):
+    """Print progress until no job of the batch is queued or running."""
+    last = None
+    while True:
+        counts = queue.counts(batch)
+        if counts != last:
+            print(f"  {time.strftime('%H:%M:%S')}  " +
+                  ', '.join(f"{status} {count}" for status, count in counts.items()))
+            last = counts
+        if not counts['queued'] and not counts['leased']:
+            return
+        time.sleep(poll)
+
+
+def collect_results(queue, batch: str, cases: List[Case], output_dir: Path) -> List[Dict]:
+    """One result per host from the exit codes of its detector jobs."""
+    jobs_by_host: Dict[str, list] = {}
+    for job in queue.jobs(batch):
+        jobs_by_host.setdefault(job.host, []).append(job)
+
+    results = []
+    for case in cases:
+        jobs = jobs_by_host.get(case.host, [])
+        rules = {}
+        peak_rss = None
+        for job in jobs:
+            if job.step != 'detect':
+                continue
+            if job.status == 'done':
+                rules[job.rule] = 'ALERT' if job.exit_code == 2 else 'clean'
+                metrics_file = output_dir / case.host / job.rule / 'detect.metrics.json'
+                if metrics_file.exists():
+                    rss = json.loads(metrics_file.read_text()).get('peak_rss_bytes')
+                    peak_rss = max(peak_rss or 0, rss or 0) or None
+            else:
+                rules[job.rule] = job.status
+
+        if 'ALERT' in rules.values():
+            status, exit_code = 'ALERT', 2
+        elif all(value == 'clean' for value in rules.values()):
+            status, exit_code = 'clean', 0
+        else:
+            status, exit_code = 'error', 1
+
+        results.append({
+            'host': case.host,
+            'status': status,
+            'exit_code': exit_code,
+            'rules': rules,
+            'seconds': sum(job.run_seconds for job in jobs),
+            'peak_rss_mb': peak_rss / (1024**2) if peak_rss else None,
+            'log': str(output_dir / case.host),
+        })
+    return results
+
+
+def batch_elapsed(queue, batch: str) -> float:
+    """
+    Wall-clock time of a queued batch, from its first submission to its
+    last finished job, whenever (and by whichever run) it is collected.
+    """
+    jobs = queue.jobs(batch)
+    finished = [job.finished for job in jobs if job.finished]
+    if not finished:
+        return 0.0
+    return max(finished) - min(job.submitted for job in jobs)
+
+
+def write_results(results: List[Dict], path: Path) -> List[str]:
+    """Write one CSV row per host; returns the rule columns used."""
+    seen = {rule for result in results for rule in result['rules']}
+    rule_ids = [rule for rule in RULES if rule in seen] + sorted(seen - set(RULES))
+
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['host', 'status', 'exit_code'] + rule_ids +
+                        ['seconds', 'peak_rss_mb', 'log'])
+        for result in sorted(results, key=lambda r: r['host']):
+            writer.writerow(
+                [result['host'], result['status'], result['exit_code']] +
+                [result['rules'].get(rule, '') for rule in rule_ids] +
+                [f"{result['seconds']:.2f}",
+                 f"{result['peak_rss_mb']:.1f}" if result['peak_rss_mb'] else '',
+                 result['log']])
+
+    return rule_ids
+
+
+def main():
+    args = parse_args()
+
+    manifest = Path(args.manifest)
+    if not manifest.exists():
+        print(f"ERROR: Manifest not found: {manifest}", file=sys.stderr)
+        return 1
+
+    try:
+        cases = load_manifest(manifest)
+    except (ValueError, KeyError, json.JSONDecodeError) as e:
+        print(f"ERROR: Invalid manifest: {e}", file=sys.stderr)
+        return 1
+
+    if not cases:
+        print("ERROR: Manifest has no cases", file=sys.stderr)
+        return 1
+
+    budget_mb = args.memory_budget
+    if budget_mb is None:
+        available = available_memory_mb()
+        budget_mb = 0.75 * available if available else None
+
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    print("=" * 70)
+    print("AF Batch Detection")
+    print("=" * 70)
+    print()
+    print(f"Cases: {len(cases)}")
+    if args.queue:
+        batch = args.batch_id or output_dir.resolve().name
+        print(f"Queue: {args.queue} (batch {batch})")
+    else:
+        print(f"Workers: {args.workers}")
+        print(f"Memory budget: {f'{budget_mb:,.0f} MB' if budget_mb else 'unlimited'}")
+    print()
+
+    start = time.perf_counter()
+    if args.queue:
+        from af_common.workqueue import WorkQueue
+
+        with WorkQueue(Path(args.queue)) as queue:
+            submitted = submit_batch(queue, batch, cases, output_dir, args)
+            print(f"Submitted {submitted} job(s); already-queued jobs are kept as they are")
+            if args.no_wait:
+                print(f"Start workers with: python3 af_worker.py --queue {args.queue}")
+                print("Rerun this command to wait for and collect the results")
+                return 0
+            try:
+                wait_for_batch(queue, batch)
+            except KeyboardInterrupt:
+                print("\nStopped waiting; queued jobs keep running on the workers", file=sys.stderr)
+                return 1
+            results = collect_results(queue, batch, cases, output_dir)
+            elapsed = batch_elapsed(queue, batch)
+    else:
+        try:
+            results = run_batch(cases, output_dir, args, budget_mb)
+        except KeyboardInterrupt:
+            return 1
+        elapsed = time.perf_counter() - start
+
+    results_file = output_dir / 'batch_results.csv'
+    rule_ids = write_results(results, results_file)
+
+    counts = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+
+    print()
+    print("=" * 70)
+    print("Batch Summary")
+    print("=" * 70)
+    print()
+    print(f"{'Host':<20}{'Status':<10}" + ''.join(f"{rule:<21}" for rule in rule_ids) + f"{'Time':>8}")
+    for result in sorted(results, key=lambda r: r['host']):
+        print(f"{result['host']:<20}{result['status']:<10}" +
+              ''.join(f"{result['rules'].get(rule, '-'):<21}" for rule in rule_ids) +
+              f"{result['seconds']:>7.1f}s")
+    print()
+    print("Totals: " + ', '.join(f"{status} {count}" for status, count in sorted(counts.items())))
+    print(f"Elapsed: {elapsed:.1f}s")
+    print(f"Results: {results_file}")
+    print("=" * 70)
+
+    if counts.get('ALERT'):
+        return 2
+    return 1 if len(results) != counts.get('clean', 0) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
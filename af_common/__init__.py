@@ -0,0 +1,7 @@
+"""
+Shared helpers for the AF-* stream filters and detectors.
+
+Each AF-* directory stays a self-contained set of scripts; this package
+only holds the pieces they would otherwise copy between each other.
+Scripts add the repository root to sys.path before importing from here.
+"""
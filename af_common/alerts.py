@@ -0,0 +1,131 @@
+"""
+Machine-readable detector output: one JSON object per line (NDJSON).
+
+With --output ndjson, a detect_*.py script writes its findings to stdout
+as they are reported, one line each, and ends with a summary line. The
+human report, banners and progress lines move to stderr, so stdout
+carries nothing but JSON:
+
+    {"type": "finding", "rule": "AF-004", "host": "ws-17", "case_id": "IR-2291",
+     "index": 1, "detected_at": "2026-...Z",
+     "evidence": {"vss_infrastructure": "tracking.log", ...},
+     "timestamps": {}}
+    ...
+    {"type": "summary", "rule": "AF-004", "host": "ws-17", "case_id": "IR-2291",
+     "positive": true, "exit_code": 2, "findings": 3, "cached": false,
+     "counts": {"mft": 8112, "usn": 402}, "wall_seconds": 1.84,
+     "stages": [{"name": "mft", "wall_seconds": 0.91, "seconds": {...},
+                 "records": 8112}, ...]}
+
+detect_timestomp_optimized.py writes each finding as rdflib yields its row
+(run_query(on_row=...)); its rule has no ORDER BY. The other detectors write
+their findings once the query has returned every row: the AF-002, AF-004
+and XML timestomping rules end in ORDER BY, which makes rdflib evaluate the
+whole query before the first row, AF-007 pairs each truncation with the
+events around it, and the native engines return a list. There, --first-hit
+is what shortens the wait. Each line is flushed as it is written. The exit
+code is unchanged (0 clean, 2 positive). Input errors exit 1 with a message
+on stderr and no summary line.
+
+Scripts expose this through add_output_arguments():
+    --output {text,ndjson}   report format on stdout (default: text)
+    --host NAME              host in every record (default: this machine's name)
+    --case-id ID             case or ticket id in every record
+"""
+
+import json
+import sys
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, TextIO
+
+OUTPUT_FORMATS = ('text', 'ndjson')
+
+
+class AlertStream:
+    """Writes a detector's findings and its summary as NDJSON records."""
+
+    def __init__(self, rule: str, stream: TextIO, host: str, case_id: Optional[str] = None):
+        self.rule = rule
+        self.stream = stream
+        self.host = host
+        self.case_id = case_id
+        self.findings = 0
+
+    def _write(self, record: Dict[str, Any]):
+        self.stream.write(json.dumps(record, default=str, ensure_ascii=False) + '\n')
+        self.stream.flush()
+
+    def _header(self, record_type: str) -> Dict[str, Any]:
+        return {'type': record_type, 'rule': self.rule, 'host': self.host,
+                'case_id': self.case_id}
+
+    def finding(self, evidence: Dict[str, Any], timestamps: Optional[Dict[str, Any]] = None):
+        """One finding: the evidence fields of a result row and its timestamps."""
+        self.findings += 1
+        self._write({
+            **self._header('finding'),
+            'index': self.findings,
+            'detected_at': datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z'),
+            'evidence': evidence,
+            'timestamps': timestamps or {},
+        })
+
+    def summary(self, exit_code: int, counts: Dict[str, int], run_metrics,
+                cached: bool = False):
+        """The last record: outcome, input counts and per-stage timings."""
+        metrics = run_metrics.to_dict()
+        self._write({
+            **self._header('summary'),
+            'positive': exit_code == 2,
+            'exit_code': exit_code,
+            'findings': self.findings,
+            'cached': cached,
+            'counts': counts,
+            'wall_seconds': metrics['wall_seconds'],
+            'peak_rss_bytes': metrics['peak_rss_bytes'],
+            'stages': [{'name': stage['name'], 'wall_seconds': stage['wall_seconds'],
+                        'seconds': stage['seconds'], 'records': stage['records']}
+                       for stage in metrics['stages']],
+        })
+
+
+def add_output_arguments(parser):
+    """Add --output, --host and --case-id to an argparse parser."""
+    group = parser.add_argument_group('machine-readable output')
+    group.add_argument(
+        '--output',
+        choices=OUTPUT_FORMATS,
+        default='text',
+        help="text: the human report (default); ndjson: one JSON object per "
+             "finding on stdout, then a summary record (the report goes to stderr); "
+             "findings are written once the query has finished, except for "
+             "rules without ORDER BY"
+    )
+    group.add_argument(
+        '--host',
+        metavar='NAME',
+        help="Host name in every NDJSON record (default: this machine's host name)"
+    )
+    group.add_argument(
+        '--case-id',
+        metavar='ID',
+        help="Case or ticket id in every NDJSON record"
+    )
+
+
+def open_alerts(args, rule: str) -> Optional[AlertStream]:
+    """
+    The AlertStream for --output ndjson, None for text.
+
+    Takes over stdout for the records: everything else the process prints
+    from here on goes to stderr.
+    """
+    if args.output != 'ndjson':
+        return None
+    host = args.host
+    if not host:
+        import socket
+        host = socket.gethostname()
+    alerts = AlertStream(rule, sys.stdout, host, args.case_id)
+    sys.stdout = sys.stderr
+    return alerts
@@ -0,0 +1,105 @@
+"""
+Checkpoint state for resumable filter passes.
+
+One small JSON file in the filter's --output-dir records, per output file,
+how far the input has been consumed (byte offset just past the last entry
+read), how many entries were scanned and matched, and how many bytes of
+the output are known to be valid. Resuming truncates the output back to
+that position and continues reading the input from the recorded offset,
+so the finished output is byte-identical to an uninterrupted run.
+"""
+
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+CHECKPOINT_FILENAME = 'filter_checkpoint.json'
+CHECKPOINT_VERSION = 1
+
+
+class CheckpointError(RuntimeError):
+    """Raised when a checkpoint cannot be used to resume a pass."""
+
+
+def _input_fingerprint(path: Path) -> Dict[str, Any]:
+    stat = path.stat()
+    return {
+        'path': str(path.resolve()),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+    }
+
+
+class CheckpointStore:
+    """
+    Per-output-directory checkpoint file shared by all passes of a filter run.
+
+    With resume=False any existing state is discarded and every pass starts
+    from scratch; with resume=True passes pick up where the state file says.
+    """
+
+    def __init__(self, output_dir: Path, resume: bool = False,
+                 interval: float = 30.0):
+        self.path = Path(output_dir) / CHECKPOINT_FILENAME
+        self.resume = resume
+        self.interval = interval
+        self._passes: Dict[str, Dict[str, Any]] = {}
+
+        if resume and self.path.exists():
+            with open(self.path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            if state.get('version') != CHECKPOINT_VERSION:
+                raise CheckpointError(
+                    f"Unsupported checkpoint version in {self.path}")
+            self._passes = state.get('passes', {})
+
+    def lookup(self, input_file: Path, output_file: Path) -> Optional[Dict[str, Any]]:
+        """
+        Return the saved state for this pass, or None to start from scratch.
+
+        Raises CheckpointError if the state exists but the input changed or
+        the partial output is missing/shorter than recorded.
+        """
+        if not self.resume:
+            return None
+        state = self._passes.get(Path(output_file).name)
+        if state is None:
+            return None
+
+        if state['input'] != _input_fingerprint(Path(input_file)):
+            raise CheckpointError(
+                f"Input changed since checkpoint was written: {input_file}")
+
+        output_file = Path(output_file)
+        if not output_file.exists() or output_file.stat().st_size < state['output_position']:
+            raise CheckpointError(
+                f"Partial output missing or truncated: {output_file}")
+
+        return state
+
+    def save(self, input_file: Path, output_file: Path, *, input_offset: int,
+             total: int, matched: int, output_position: int,
+             complete: bool = False, **extra: Any):
+        """Record progress for one pass and atomically rewrite the state file."""
+        self._passes[Path(output_file).name] = {
+            'input': _input_fingerprint(Path(input_file)),
+            'input_offset': input_offset,
+            'total': total,
+            'matched': matched,
+            'output_position': output_position,
+            'complete': complete,
+            **extra,
+        }
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': CHECKPOINT_VERSION, 'passes': self._passes}, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        """Remove the state file once the whole filter run has finished."""
+        self._passes = {}
+        if self.path.exists():
+            self.path.unlink()
@@ -0,0 +1,495 @@
+"""
+Columnar cache of the fields the rules read, as memory-mapped NumPy columns.
+
+Of the hundreds of properties in an export, the rules only ever touch a few
+dozen: entryNumber, parentPath, fileName, isDirectory, the $SI/$FN times,
+updateReasons, updateTimestamp, eventID, channel, URL. The first pass over
+an input extracts those (FIELDS) into one table per input file; later runs
+of any native evaluator load the table with np.load(mmap_mode='r') in
+milliseconds instead of parsing the JSON-LD again.
+
+Each row is one @graph entry with facets. A field holds the value a rule
+sees through af_common.native.Terms, so evaluating on the columns gives
+the rows the JSON-LD pass gives:
+- 'string': a string literal (plain or xsd:string), as CONTAINS, REGEX and
+  = "text" accept it
+- 'plain': a plain literal only, as a constant in a triple pattern matches
+- 'literal': the lexical form of any literal (xsd:dateTime normalised)
+- 'time': like 'literal', plus <field>.ns: ns since the epoch (UTC, naive
+  taken as UTC) of the normalised xsd:dateTime values, TIME_MISSING for
+  anything else
+- 'int': int64, -1 for no value
+The field's facet type is part of its definition (fileName is FileFacet's
+observable:fileName, parentPath MftFacet's). String fields are dictionary
+encoded: int32 codes per row (-1 = no value) and the distinct values once,
+as a UTF-8 blob with offsets, so a predicate is evaluated once per
+distinct value and the rows are selected with np.isin(). node (the
+expanded @id) and facets (the facet @ids) are per-row strings; they
+identify a row when an evaluator deduplicates as rdflib's triple set does.
+
+A table is one column per row, so an input it cannot represent is not
+cached and the evaluators read the JSON-LD as before (ColumnsUnsupported):
+an entry with two facets of one field's facet type, two values for one
+field, a language-tagged value or a facet referenced by @id.
+
+Tables are kept under <cache dir>/columns/<SHA-256 of the input>, next to
+the result cache, and are built by the native evaluators on first use
+(--no-cache disables both). An input found unsupported is remembered in
+<SHA-256>.unsupported-<COLUMNS_FORMAT>, so it is tried again once the
+format changes. Building needs memory for the distinct values
+of the dictionary fields; row data is spilled to disk in chunks.
+NumPy is optional: without it the evaluators read the JSON-LD.
+"""
+
+import json
+import os
+import re
+import shutil
+import time
+from array import array
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from af_common.jsonld_stream import JsonLdReader
+from af_common.metrics import StageMetrics
+from af_common.native import HAS_FACET, Terms
+from af_common.timeline import parse_time_ns
+
+# numpy is imported where it is used: it costs ~60 ms, and is optional
+
+# Bump when FIELDS or the layout change: older tables are rebuilt
+COLUMNS_FORMAT = 1
+
+OBSERVABLE = 'https://ontology.unifiedcyberontology.org/uco/observable/'
+DFC_EXT = 'https://www.w3.org/dfc-ext/'
+
+FILE_FACET = OBSERVABLE + 'FileFacet'
+URL_FACET = OBSERVABLE + 'URLFacet'
+EVENT_RECORD_FACET = OBSERVABLE + 'EventRecordFacet'
+MFT_FACET = DFC_EXT + 'MftFacet'
+USN_FACET = DFC_EXT + 'UsnFacet'
+EVENT_LOG_FACET = DFC_EXT + 'EventLogFacet'
+
+TIME_MISSING = -(1 << 63)
+_CHUNK_ROWS = 1 << 20
+
+
+class Field(NamedTuple):
+    name: str
+    facet_type: Optional[str]   # None: any facet
+    property: str
+    kind: str                   # 'string', 'plain', 'literal', 'time' or 'int'
+
+
+FIELDS = (
+    Field('entryNumber', None, DFC_EXT + 'entryNumber', 'int'),
+    Field('sequenceNumber', None, DFC_EXT + 'sequenceNumber', 'int'),
+    Field('parentEntryNumber', None, DFC_EXT + 'parentEntryNumber', 'int'),
+    Field('parentSequenceNumber', None, DFC_EXT + 'parentSequenceNumber', 'int'),
+    Field('fileName', FILE_FACET, OBSERVABLE + 'fileName', 'string'),
+    Field('isDirectory', FILE_FACET, OBSERVABLE + 'isDirectory', 'string'),
+    Field('parentPath', MFT_FACET, DFC_EXT + 'parentPath', 'string'),
+) + tuple(
+    Field(f'{name}{attribute}', MFT_FACET, f'{DFC_EXT}{name}{attribute}', 'time')
+    for attribute in ('0x10', '0x30')
+    for name in ('created', 'lastModified', 'lastAccess', 'lastRecordChange')
+) + (
+    Field('updateReasons', USN_FACET, DFC_EXT + 'updateReasons', 'string'),
+    Field('updateTimestamp', USN_FACET, DFC_EXT + 'updateTimestamp', 'time'),
+    Field('eventID', EVENT_RECORD_FACET, OBSERVABLE + 'eventID', 'plain'),
+    Field('startTime', EVENT_RECORD_FACET, OBSERVABLE + 'startTime', 'time'),
+    Field('eventRecordText', EVENT_RECORD_FACET, OBSERVABLE + 'eventRecordText', 'literal'),
+    Field('channel', EVENT_LOG_FACET, DFC_EXT + 'channel', 'plain'),
+    Field('url', URL_FACET, OBSERVABLE + 'fullValue', 'string'),
+)
+# Row identity and entry type set (sorted expanded @type IRIs, '|'-joined)
+ROW_FIELDS = ('node', 'facets')
+TYPES_FIELD = 'types'
+
+
+class ColumnsUnsupported(ValueError):
+    """The input has a shape a one-value-per-field table cannot represent."""
+
+
+def numpy_available() -> bool:
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+# -- writing -------------------------------------------------------------------
+
+class _Spill:
+    """An array column written to disk in chunks, turned into .npy at the end."""
+
+    def __init__(self, directory: Path, name: str, typecode: str):
+        self.path = directory / f'{name}.npy'
+        self._raw = directory / f'{name}.raw'
+        self._file = open(self._raw, 'wb')
+        self.buffer = array(typecode)
+        self.count = 0
+
+    def flush(self):
+        self.buffer.tofile(self._file)
+        self.count += len(self.buffer)
+        del self.buffer[:]
+
+    def finish(self, dtype):
+        import numpy as np
+
+        self.flush()
+        self._file.close()
+        out = np.lib.format.open_memmap(self.path, mode='w+', dtype=dtype, shape=(self.count,))
+        step = _CHUNK_ROWS
+        with open(self._raw, 'rb') as f:
+            for start in range(0, self.count, step):
+                chunk = np.fromfile(f, dtype=dtype, count=min(step, self.count - start))
+                out[start:start + len(chunk)] = chunk
+        out.flush()
+        del out
+        self._raw.unlink()
+
+
+class _ColumnWriter:
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.rows = 0
+        self._codes: Dict[str, _Spill] = {}
+        self._values: Dict[str, Dict[str, int]] = {}
+        self._numbers: Dict[str, _Spill] = {}
+        self._row_offsets: Dict[str, _Spill] = {}
+        self._row_blobs: Dict[str, _Spill] = {}
+        self._row_sizes: Dict[str, int] = {}
+
+        for name in [f.name for f in FIELDS if f.kind != 'int'] + [TYPES_FIELD]:
+            self._codes[name] = _Spill(directory, f'{name}.codes', 'i')
+            self._values[name] = {}
+        for field in FIELDS:
+            if field.kind == 'int':
+                self._numbers[field.name] = _Spill(directory, field.name, 'q')
+            elif field.kind == 'time':
+                self._numbers[field.name + '.ns'] = _Spill(directory, f'{field.name}.ns', 'q')
+        for name in ROW_FIELDS:
+            self._row_offsets[name] = _Spill(directory, f'{name}.offsets', 'q')
+            self._row_offsets[name].buffer.append(0)
+            self._row_blobs[name] = _Spill(directory, f'{name}.blob', 'B')
+            self._row_sizes[name] = 0
+
+    def add(self, strings: Dict[str, str], numbers: Dict[str, int], row_strings: Dict[str, str]):
+        for name, spill in self._codes.items():
+            value = strings.get(name)
+            if value is None:
+                spill.buffer.append(-1)
+            else:
+                codes = self._values[name]
+                code = codes.get(value)
+                if code is None:
+                    code = codes[value] = len(codes)
+                spill.buffer.append(code)
+        for name, spill in self._numbers.items():
+            spill.buffer.append(numbers.get(name, TIME_MISSING if name.endswith('.ns') else -1))
+        for name, text in row_strings.items():
+            data = text.encode('utf-8')
+            self._row_sizes[name] += len(data)
+            self._row_blobs[name].buffer.frombytes(data)
+            self._row_offsets[name].buffer.append(self._row_sizes[name])
+        self.rows += 1
+        if self.rows % _CHUNK_ROWS == 0:
+            for spill in self._spills():
+                spill.flush()
+
+    def _spills(self):
+        return [*self._codes.values(), *self._numbers.values(),
+                *self._row_offsets.values(), *self._row_blobs.values()]
+
+    def finish(self):
+        import numpy as np
+
+        for spill in self._codes.values():
+            spill.finish(np.int32)
+        for spill in self._numbers.values():
+            spill.finish(np.int64)
+        for spill in self._row_offsets.values():
+            spill.finish(np.int64)
+        for spill in self._row_blobs.values():
+            spill.finish(np.uint8)
+        for name, codes in self._values.items():
+            data = [value.encode('utf-8') for value in codes]
+            offsets = np.zeros(len(data) + 1, dtype=np.int64)
+            np.cumsum([len(d) for d in data], out=offsets[1:])
+            np.save(self.directory / f'{name}.offsets.npy', offsets)
+            np.save(self.directory / f'{name}.blob.npy',
+                    np.frombuffer(b''.join(data), dtype=np.uint8))
+
+    def abandon(self):
+        for spill in self._spills():
+            spill._file.close()
+
+
+def _field_value(terms: Terms, field: Field, values: List[Any]):
+    """The single value a field takes from a facet's values, or None."""
+    found = []
+    for value in values:
+        if isinstance(value, dict) and '@language' in value:
+            raise ColumnsUnsupported(f"language-tagged {field.name}")
+    if field.kind == 'string':
+        found = list(terms.strings(values))
+    elif field.kind == 'plain':
+        found = [v if isinstance(v, str) else v['@value'] for v in values
+                 if isinstance(v, str) or (isinstance(v, dict) and set(v) == {'@value'}
+                                           and isinstance(v['@value'], str))]
+    else:
+        found = list(terms.literals(values))
+    if len(found) > 1:
+        raise ColumnsUnsupported(f"{len(found)} values for {field.name}")
+    return found[0] if found else None
+
+
+def extract(path: Path, directory: Path, metrics: Optional[StageMetrics] = None) -> int:
+    """
+    Write the column table of a JSON-LD input to directory (replaced
+    atomically). Returns the number of rows.
+
+    Raises:
+        ColumnsUnsupported: the input cannot be represented (nothing is written)
+    """
+    start = time.perf_counter()
+    directory = Path(directory)
+    tmp = directory.with_name(f'.{directory.name}.{os.getpid()}.tmp')
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    writer = _ColumnWriter(tmp)
+    by_property: Dict[str, List[Field]] = {}
+    for field in FIELDS:
+        by_property.setdefault(field.property, []).append(field)
+    facet_types = {field.facet_type for field in FIELDS if field.facet_type}
+    records = 0
+
+    try:
+        with JsonLdReader(path) as reader:
+            terms = Terms(reader.context)
+            for entry, _ in reader:
+                records += 1
+                facets = terms.get(entry, HAS_FACET)
+                if not facets:
+                    continue
+                strings: Dict[str, str] = {}
+                numbers: Dict[str, int] = {}
+                seen_types = set()
+                facet_ids = []
+                for facet in facets:
+                    if not isinstance(facet, dict) or set(facet) == {'@id'}:
+                        raise ColumnsUnsupported("facet referenced by @id")
+                    types = terms.types(facet)
+                    for facet_type in types & facet_types:
+                        if facet_type in seen_types:
+                            raise ColumnsUnsupported(f"two {facet_type.rsplit('/', 1)[-1]}s on one entry")
+                        seen_types.add(facet_type)
+                    facet_ids.append(terms.expand(facet['@id']) if '@id' in facet else None)
+                    for key, values in facet.items():
+                        fields = by_property.get(terms.expand(key))
+                        if not fields:
+                            continue
+                        values = values if isinstance(values, list) else [values]
+                        for field in fields:
+                            if field.facet_type and field.facet_type not in types:
+                                continue
+                            value = _field_value(terms, field, values)
+                            if value is None:
+                                continue
+                            if field.name in strings or field.name in numbers:
+                                raise ColumnsUnsupported(f"two values for {field.name}")
+                            if field.kind == 'int':
+                                try:
+                                    numbers[field.name] = int(value[0])
+                                except ValueError:
+                                    pass
+                            elif field.kind in ('literal', 'time'):
+                                strings[field.name] = value[0]
+                                if field.kind == 'time' and value[1] is not None:
+                                    numbers[field.name + '.ns'] = parse_time_ns(value[0])
+                            else:
+                                strings[field.name] = value
+                strings[TYPES_FIELD] = '|'.join(sorted(terms.types(entry)))
+                writer.add(strings, numbers, {
+                    'node': terms.expand(entry['@id']) if '@id' in entry else '',
+                    # A blank facet makes the row unique: no facets key
+                    'facets': '' if None in facet_ids else '\n'.join(facet_ids),
+                })
+        writer.finish()
+        meta = {'format': COLUMNS_FORMAT, 'source': str(Path(path).resolve()),
+                'rows': writer.rows, 'entries': records,
+                'fields': [f.name for f in FIELDS]}
+        (tmp / 'meta.json').write_text(json.dumps(meta))
+    except BaseException:
+        writer.abandon()
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp, directory)
+    if metrics is not None:
+        metrics.records += records
+        metrics.bytes += Path(path).stat().st_size
+        metrics.add('scan', time.perf_counter() - start)
+    return writer.rows
+
+
+# -- reading -------------------------------------------------------------------
+
+class ColumnTable:
+    """
+    A column table, memory-mapped. codes()/ints()/ns() are NumPy arrays
+    over the rows; values() is a dictionary field's distinct values, by code.
+    """
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        meta = json.loads((self.directory / 'meta.json').read_text())
+        if meta.get('format') != COLUMNS_FORMAT:
+            raise ValueError(f"column table format {meta.get('format')}")
+        self.rows: int = meta['rows']
+        self.entries: int = meta['entries']
+        self._arrays: Dict[str, Any] = {}
+        self._values: Dict[str, List[str]] = {}
+
+    def _load(self, name: str):
+        array_ = self._arrays.get(name)
+        if array_ is None:
+            import numpy as np
+
+            array_ = self._arrays[name] = np.load(self.directory / f'{name}.npy', mmap_mode='r')
+        return array_
+
+    def codes(self, field: str):
+        """int32 value codes per row (-1 = no value)."""
+        return self._load(f'{field}.codes')
+
+    def ints(self, field: str):
+        """int64 per row (-1 = no value)."""
+        return self._load(field)
+
+    def ns(self, field: str):
+        """int64 ns since the epoch per row, for time fields (TIME_MISSING = no value)."""
+        return self._load(f'{field}.ns')
+
+    def values(self, field: str) -> List[str]:
+        """Distinct values of a dictionary field; values(f)[code]."""
+        values = self._values.get(field)
+        if values is None:
+            blob = self._load(f'{field}.blob').tobytes()
+            offsets = self._load(f'{field}.offsets').tolist()
+            values = self._values[field] = [blob[a:b].decode('utf-8')
+                                            for a, b in zip(offsets, offsets[1:])]
+        return values
+
+    def value(self, field: str, row: int) -> Optional[str]:
+        """A field's value on one row (dictionary and per-row fields)."""
+        if field in ROW_FIELDS:
+            offsets = self._load(f'{field}.offsets')
+            start, end = int(offsets[row]), int(offsets[row + 1])
+            return bytes(self._load(f'{field}.blob')[start:end]).decode('utf-8')
+        code = int(self.codes(field)[row])
+        return None if code < 0 else self.values(field)[code]
+
+    def codes_where(self, field: str, predicate: Callable[[str], bool]):
+        """Codes of the distinct values the predicate accepts (once per value)."""
+        import numpy as np
+
+        return np.array([code for code, value in enumerate(self.values(field))
+                         if predicate(value)], dtype=np.int32)
+
+    def codes_containing(self, field: str, text: str):
+        """
+        Codes of the distinct values containing text, found by scanning the
+        UTF-8 blob once (no per-value decoding).
+        """
+        import numpy as np
+
+        blob = self._load(f'{field}.blob').tobytes()
+        offsets = self._load(f'{field}.offsets')
+        needle = text.encode('utf-8')
+        if not needle:
+            return np.arange(len(offsets) - 1, dtype=np.int32)
+        starts = np.array([m.start() for m in re.finditer(re.escape(needle), blob)],
+                          dtype=np.int64)
+        if not len(starts):
+            return np.zeros(0, dtype=np.int32)
+        codes = np.searchsorted(offsets, starts, side='right') - 1
+        # A match must end inside the value it starts in
+        codes = codes[starts + len(needle) <= offsets[codes + 1]]
+        return np.unique(codes).astype(np.int32)
+
+    def mask(self, field: str, codes):
+        """Boolean per row: the field's value code is one of codes."""
+        import numpy as np
+
+        return np.isin(self.codes(field), codes)
+
+    def type_mask(self, iri: str):
+        """Boolean per row: the entry has @type iri."""
+        return self.mask(TYPES_FIELD, self.codes_where(TYPES_FIELD,
+                                                       lambda types: iri in types.split('|')))
+
+
+class ColumnCache:
+    """Column tables per input under directory, keyed by the input's digest."""
+
+    def __init__(self, directory: Path, file_digest: Callable[[Path], str]):
+        self.directory = Path(directory)
+        self._file_digest = file_digest
+
+    def table(self, path: Path, metrics: Optional[StageMetrics] = None) -> Optional[ColumnTable]:
+        """
+        The input's table: loaded if cached, else extracted now. None when
+        NumPy is missing or the input cannot be represented (the caller
+        reads the JSON-LD). metrics.extra['columns'] records which.
+        """
+        def note(state: str):
+            if metrics is not None:
+                metrics.extra['columns'] = state
+
+        if not numpy_available():
+            note('no numpy')
+            return None
+        directory = self.directory / self._file_digest(path)
+        # Remembered, so an unsupported input is not extracted on every run;
+        # per format, since a new FIELDS or layout may represent it
+        unsupported = directory.with_name(f'{directory.name}.unsupported-{COLUMNS_FORMAT}')
+        start = time.perf_counter()
+        try:
+            table = ColumnTable(directory)
+        except (OSError, ValueError, KeyError):
+            try:
+                note(f'unsupported: {unsupported.read_text()}')
+                return None
+            except OSError:
+                pass
+            try:
+                extract(path, directory, metrics)
+            except ColumnsUnsupported as e:
+                note(f'unsupported: {e}')
+                try:
+                    unsupported.write_text(str(e))
+                except OSError:
+                    pass
+                return None
+            except OSError as e:
+                note(f'not written: {e}')
+                return None
+            note('built')
+            return ColumnTable(directory)
+        note('loaded')
+        if metrics is not None:
+            metrics.records += table.entries
+            metrics.add('read', time.perf_counter() - start)
+        return table
+
+
+def open_columns(cache) -> Optional[ColumnCache]:
+    """The column cache next to a ResultCache (None when caching is off)."""
+    if cache is None:
+        return None
+    return ColumnCache(cache.directory / 'columns', cache.file_digest)
@@ -0,0 +1,122 @@
+"""
+Facet access for the filter predicates.
+
+The predicates look at an entry's facets by type: the MftFacet for the
+parent path, the FileFacet for the file name, the UsnFacet for the update
+reasons. Written inline, every predicate wrapped a single facet in a new
+list, built str() of each facet's @type (a list, ['dfc-ext:MftFacet',
+'core:Facet'], in most MFT exports) and tested one type name after
+another on that string.
+
+Type names are instead registered once on FACET_TYPES, and each gets a
+bit. A facet's @type is then classified once into the bitset of the
+registered names it contains, memoised per @type value, so the
+predicates dispatch on bits in a single pass. The decoder builds a new
+list for every list-valued @type, so a two-member list (the shape of most
+MFT exports) is looked up member by member in a nested memo rather than
+keyed as a new tuple per facet; longer lists are keyed as a tuple:
+
+    MFT_FACET = FACET_TYPES.register('MftFacet')
+    FILE_FACET = FACET_TYPES.register('FileFacet')
+    ...
+    for facet in facet_list(entry.get('core:hasFacet')):
+        kinds = facet_kinds(facet)
+        if kinds & MFT_FACET:
+            ...
+        if kinds & FILE_FACET:
+            ...
+
+A name matches as a substring of any of the @type members, as the
+former `'MftFacet' in str(facet_type)` tests did (without matching across
+members). Non-dict facets get no bits.
+"""
+
+from typing import Any, Dict, Sequence
+
+# Memoised @type values before the memo is dropped (bounds memory on odd inputs)
+_CACHE_LIMIT = 1 << 12
+
+
+class FacetTypes:
+    """Facet type names, each with a fixed bit, and a memo of @type bitsets."""
+
+    def __init__(self, cache_limit: int = _CACHE_LIMIT):
+        self.cache_limit = cache_limit
+        self._bits: Dict[str, int] = {}
+        self._memo: Dict[Any, int] = {}
+        # Two-member lists: first member -> second member -> bits
+        self._pairs: Dict[Any, Dict[Any, int]] = {}
+        self._pair_count = 0
+
+    def register(self, *names: str) -> int:
+        """Add type names (if new) and return the mask of their bits."""
+        mask = 0
+        for name in names:
+            bit = self._bits.get(name)
+            if bit is None:
+                bit = self._bits[name] = 1 << len(self._bits)
+                self._clear()
+            mask |= bit
+        return mask
+
+    def _clear(self):
+        self._memo.clear()
+        self._pairs.clear()
+        self._pair_count = 0
+
+    def _remember_pair(self, first: Any, second: Any) -> int:
+        kinds = self._classify((first, second))
+        if self._pair_count >= self.cache_limit:
+            self._pairs.clear()
+            self._pair_count = 0
+        self._pairs.setdefault(first, {})[second] = kinds
+        self._pair_count += 1
+        return kinds
+
+    def _classify(self, types: Any) -> int:
+        members = types if isinstance(types, tuple) else (types,)
+        kinds = 0
+        for member in members:
+            if isinstance(member, str):
+                for name, bit in self._bits.items():
+                    if name in member:
+                        kinds |= bit
+        return kinds
+
+    def kinds(self, facet: Any) -> int:
+        """Bitset of the registered names in a facet's @type."""
+        if not isinstance(facet, dict):
+            return 0
+        types = facet.get('@type')
+        try:
+            if isinstance(types, list):
+                if len(types) == 2:
+                    by_second = self._pairs.get(types[0])
+                    if by_second is not None:
+                        kinds = by_second.get(types[1])
+                        if kinds is not None:
+                            return kinds
+                    return self._remember_pair(types[0], types[1])
+                types = tuple(types)
+            kinds = self._memo.get(types)
+        except TypeError:
+            # An unhashable @type (a dict, or lists nested in the list)
+            return 0
+        if kinds is None:
+            kinds = self._classify(types)
+            if len(self._memo) >= self.cache_limit:
+                self._memo.clear()
+            self._memo[types] = kinds
+        return kinds
+
+
+# The facet type names of every rule's filter predicates
+FACET_TYPES = FacetTypes()
+facet_kinds = FACET_TYPES.kinds
+
+
+def facet_list(facets: Any) -> Sequence[Any]:
+    """facets as a sequence (a single facet or None too), without copying a list."""
+    if isinstance(facets, list):
+        return facets
+    return () if facets is None else (facets,)
@@ -0,0 +1,432 @@
+"""
+Incremental JSON-LD reader and writer used by the stream filters.
+
+The reader walks a document shaped like {"@context": ..., "@graph": [...]}
+(or a bare top-level array) one @graph entry at a time, so memory stays
+bounded by the largest single entry instead of the whole file. Every entry
+is yielded together with the byte offset just past it, which is what the
+checkpoint layer records to resume a pass.
+
+entry_boundary() finds such an offset from any byte position without
+reading the entries before it, so a pass can start mid-file (sampling).
+It relies on the indented layout: the separator between two top-level
+entries repeats the line break and indentation before the first one,
+which no nested value or string can contain.
+
+JSON-LD does not fix the order of the top-level keys. When @context follows
+@graph, the reader finds it before yielding any entry: it first skips over
+the graph once, decoding but not keeping the entries, then reads the
+members after it. Only files whose tail shows members after the graph pay
+for that prepass.
+
+With canonical_keys=True, keys are rewritten to the prefixes the filter
+predicates look up ("uco-core:hasFacet" -> "core:hasFacet") as entries
+are decoded, from a table built once from @context (af_common/prefixes.py).
+
+The writer produces exactly what json.dump(data, f, indent=2) would have
+written for the same entries, so filtered outputs are unchanged.
+"""
+
+import codecs
+import json
+import re
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from af_common.prefixes import KeyRewriter
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+# What precedes an entry after a resume point: the separator, or the '['
+_ENTRY_PREFIX = re.compile(r'[ \t\n\r,\[]*')
+_DECODER = json.JSONDecoder()
+
+# Initial read size; doubled while a single entry does not fit the buffer
+DEFAULT_CHUNK_SIZE = 1 << 20
+# Read size when scanning for an entry boundary, and of the tail checked
+# for members after @graph
+_SPLIT_BLOCK = 1 << 16
+
+
+class JsonLdFormatError(ValueError):
+    """Raised when the input is not a JSON-LD document the reader supports."""
+
+
+class JsonLdReader:
+    """
+    Stream @graph entries out of a JSON-LD file.
+
+    Attributes (available after construction):
+        header:  top-level keys that precede @graph (usually just @context),
+            plus a @context that follows it
+        trailer: top-level keys after @graph (read by the end of iteration)
+        context: header['@context'] or None; with canonical_keys, the
+            context the rewritten entries expand under
+        source_context: the @context as written in the file
+        graph_offset: byte offset where the first @graph entry may start
+        read_seconds: time spent in file reads so far (the rest of the
+            iteration time is decoding)
+
+    Iterating yields (entry, end_offset) tuples. Passing a previously
+    yielded end_offset as start_offset resumes right after that entry.
+    """
+
+    def __init__(self, path: Path, start_offset: Optional[int] = None,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE, canonical_keys: bool = False):
+        self.path = Path(path)
+        self.chunk_size = chunk_size
+        self.header: Dict[str, Any] = {}
+        self.trailer: Dict[str, Any] = {}
+        self.size = self.path.stat().st_size
+        self.read_seconds = 0.0
+
+        self._file = open(self.path, 'rb')
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._buf = ''
+        self._ascii = True
+        self._pos = 0
+        self._start = 0       # self._buf index where the last value began
+        self._offset = 0      # byte offset of self._buf[self._pos]
+        self._eof = False
+        self._top_level_list = False
+        self._has_graph = False
+        self._separator: Optional[bytes] = None
+        self._raw = None      # separate handle for entry_at()
+
+        self._read_header()
+        self.graph_offset = self._offset
+        if '@context' not in self.header and self._may_have_trailer():
+            self._read_trailer()
+            if '@context' in self.trailer:
+                self.header['@context'] = self.trailer['@context']
+
+        self.source_context = self.context
+        self._rewriter = KeyRewriter.from_context(self.source_context) if canonical_keys else None
+        if self._rewriter:
+            self.header['@context'] = self._rewriter.context(self.source_context)
+
+        self._after_entry = False
+        if start_offset is not None and start_offset > self.graph_offset:
+            self._seek(start_offset)
+            self._after_entry = True
+
+    @property
+    def context(self) -> Optional[Any]:
+        return self.header.get('@context')
+
+    @property
+    def offset(self) -> int:
+        """Byte offset of the next unread character."""
+        return self._offset
+
+    def close(self):
+        self._file.close()
+        if self._raw:
+            self._raw.close()
+
+    def entry_boundary(self, offset: int) -> Optional[int]:
+        """
+        The first resume point at or after byte offset: graph_offset, or an
+        offset just past a @graph entry, as iteration yields. None if no
+        entry starts after offset.
+        """
+        if not self._has_graph:
+            raise JsonLdFormatError(f"{self.path.name}: no @graph array to split")
+        if offset <= self.graph_offset:
+            return self.graph_offset
+        separator = self._entry_separator()
+        if separator is None:
+            return None
+        keep = len(separator) - 1
+        with open(self.path, 'rb') as raw:
+            raw.seek(offset)
+            data = b''
+            base = offset     # byte offset of data[0]
+            while True:
+                block = raw.read(_SPLIT_BLOCK)
+                if not block:
+                    return None
+                data += block
+                found = data.find(separator)
+                if found >= 0:
+                    return base + found
+                base += len(data) - keep
+                data = data[-keep:]
+
+    def seek_entry(self, offset: int):
+        """Continue iteration at a resume point from entry_boundary()."""
+        if offset <= self.graph_offset:
+            self._seek(self.graph_offset)
+            self._after_entry = False
+        else:
+            self._seek(offset)
+            self._after_entry = True
+
+    def entry_at(self, start: int, end: int) -> Dict[str, Any]:
+        """
+        The entry iteration yielded with end_offset end, when the entry
+        before it was yielded with start (graph_offset for the first one).
+        Reads just those bytes, without moving the iteration.
+        """
+        if self._raw is None:
+            self._raw = open(self.path, 'rb')
+        self._raw.seek(start)
+        text = self._raw.read(end - start).decode('utf-8')
+        entry, _ = _DECODER.raw_decode(text, _ENTRY_PREFIX.match(text).end())
+        return self._rewriter.rewrite(entry) if self._rewriter else entry
+
+    def read_ahead(self, pipeline) -> None:
+        """Read the rest of the file through a pipeline's read-ahead thread."""
+        self._file = pipeline.read_ahead(self._file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # -- buffer management -------------------------------------------------
+
+    def _fill(self, size: int) -> bool:
+        """Append up to `size` bytes to the buffer. Returns False at EOF."""
+        if self._eof:
+            return False
+        start = time.perf_counter()
+        raw = self._file.read(size)
+        self.read_seconds += time.perf_counter() - start
+        text = self._decoder.decode(raw, final=not raw)
+        if not raw:
+            self._eof = True
+        if self._pos:
+            self._buf = self._buf[self._pos:]
+            self._pos = 0
+        self._buf += text
+        self._ascii = self._buf.isascii()
+        return bool(raw)
+
+    def _consume(self, end: int):
+        """Advance past self._buf[self._pos:end], keeping the byte offset."""
+        if self._ascii:
+            self._offset += end - self._pos
+        else:
+            self._offset += len(self._buf[self._pos:end].encode('utf-8'))
+        self._pos = end
+
+    def _seek(self, byte_offset: int):
+        self._file.seek(byte_offset)
+        self._decoder.reset()
+        self._buf = ''
+        self._pos = 0
+        self._offset = byte_offset
+        self._eof = False
+
+    def _entry_separator(self) -> Optional[bytes]:
+        """The bytes between two @graph entries (None if there are none)."""
+        if self._separator is None:
+            with open(self.path, 'rb') as raw:
+                raw.seek(self.graph_offset)
+                head = raw.read(_SPLIT_BLOCK)
+            indent = re.match(rb'[ \t\r\n]*', head).group()
+            first = head[len(indent):len(indent) + 1]
+            if first != b'{':
+                return None
+            if b'\n' not in indent:
+                raise JsonLdFormatError(
+                    f"{self.path.name}: @graph entries are not one per line, so "
+                    f"entry boundaries cannot be found from a byte offset")
+            self._separator = b',' + indent + b'{'
+        return self._separator
+
+    def _peek(self) -> str:
+        """Skip whitespace and return the next character ('' at EOF)."""
+        while True:
+            end = _WHITESPACE.match(self._buf, self._pos).end()
+            self._consume(end)
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill(self.chunk_size):
+                return ''
+
+    def _expect(self, char: str):
+        found = self._peek()
+        if found != char:
+            raise JsonLdFormatError(
+                f"{self.path.name}: expected {char!r} at byte {self._offset}, "
+                f"found {found!r}")
+        self._consume(self._pos + 1)
+
+    def _value(self) -> Any:
+        """Decode the next complete JSON value from the buffer."""
+        self._peek()
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self._buf, self._pos)
+                # A value ending exactly at the buffer edge might be a
+                # truncated number; only trust it once more data is seen.
+                if end < len(self._buf) or self._eof:
+                    self._start = self._pos
+                    self._consume(end)
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            self._fill(size)
+            size *= 2
+
+    # -- document structure ------------------------------------------------
+
+    def _may_have_trailer(self) -> bool:
+        """
+        Whether members may follow the @graph array: the file does not end
+        with the array's ']' and the closing brace, or its tail names a
+        @context.
+        """
+        if not self._has_graph or self._top_level_list:
+            return False
+        with open(self.path, 'rb') as raw:
+            raw.seek(max(self.graph_offset, self.size - _SPLIT_BLOCK))
+            tail = raw.read()
+        return (re.search(rb'\]\s*\}\s*$', tail) is None
+                or b'"@context"' in tail)
+
+    def _read_trailer(self):
+        """Read the members after @graph into trailer, then return to the first entry."""
+        after_entry = False
+        while True:
+            char = self._peek()
+            if char == ']':
+                self._consume(self._pos + 1)
+                break
+            if char == '':
+                raise JsonLdFormatError(f"{self.path.name}: unterminated @graph array")
+            if after_entry:
+                self._expect(',')
+            self._value()
+            after_entry = True
+        self._read_members(self.trailer)
+        self._seek(self.graph_offset)
+
+    def _read_header(self):
+        first = self._peek()
+        if first == '[':
+            self._consume(self._pos + 1)
+            self._top_level_list = True
+            self._has_graph = True
+            return
+        self._expect('{')
+        self._read_members(self.header)
+
+    def _read_members(self, target: Dict[str, Any]):
+        """Read object members into target until @graph or the closing brace."""
+        while True:
+            char = self._peek()
+            if char == '}':
+                self._consume(self._pos + 1)
+                return
+            if char == ',':
+                self._consume(self._pos + 1)
+                continue
+            key = self._value()
+            self._expect(':')
+            if key == '@graph' and self._peek() == '[':
+                self._consume(self._pos + 1)
+                self._has_graph = True
+                return
+            target[key] = self._value()
+
+    def __iter__(self) -> Iterator[Tuple[Dict[str, Any], int]]:
+        rewrite = self._rewriter.rewrite if self._rewriter else None
+        markers = self._rewriter.markers if self._rewriter else None
+        if not self._has_graph:
+            # Single node document: the whole object is the only entry
+            if self.header and not self._after_entry:
+                yield (rewrite(self.header) if rewrite else self.header), self._offset
+            return
+
+        while True:
+            char = self._peek()
+            if char == ']':
+                self._consume(self._pos + 1)
+                break
+            if char == '':
+                raise JsonLdFormatError(f"{self.path.name}: unterminated @graph array")
+            if self._after_entry:
+                self._expect(',')
+            entry = self._value()
+            if rewrite and (markers is None or any(
+                    self._buf.find(marker, self._start, self._pos) >= 0 for marker in markers)):
+                entry = rewrite(entry)
+            self._after_entry = True
+            yield entry, self._offset
+
+        if not self._top_level_list:
+            self._read_members(self.trailer)
+            if '@context' in self.trailer and '@context' not in self.header:
+                raise JsonLdFormatError(
+                    f"{self.path.name}: @context after @graph was not found before the "
+                    f"entries were read")
+
+
+class JsonLdWriter:
+    """
+    Write @graph entries incrementally in json.dump(..., indent=2) layout.
+
+    header=None writes a bare top-level array (the legacy layout some filters
+    use when the input had no @context); otherwise the header keys are written
+    first, followed by "@graph".
+
+    To continue a partially written file, pass resume_position (the byte
+    length known to be valid) and the number of entries it already holds.
+    """
+
+    def __init__(self, path: Path, header: Optional[Dict[str, Any]],
+                 resume_position: Optional[int] = None, written: int = 0):
+        self.path = Path(path)
+        self.written = written
+
+        if header is None:
+            prefix = '['
+            self._pad = '  '
+            self._empty_close = ']'
+            self._close = '\n]'
+        else:
+            document = json.dumps({**header, '@graph': []}, indent=2)
+            prefix = document[:-len(']\n}')]
+            self._pad = '    '
+            self._empty_close = ']\n}'
+            self._close = '\n  ]\n}'
+
+        if resume_position is None:
+            self._file = open(self.path, 'wb')
+            self.position = 0
+            self._write(prefix)
+        else:
+            self._file = open(self.path, 'r+b')
+            self._file.truncate(resume_position)
+            self._file.seek(resume_position)
+            self.position = resume_position
+
+    def _write(self, text: str):
+        data = text.encode('utf-8')
+        self._file.write(data)
+        self.position += len(data)
+
+    def write(self, entry: Dict[str, Any]):
+        text = json.dumps(entry, indent=2).replace('\n', '\n' + self._pad)
+        self._write(('\n' if self.written == 0 else ',\n') + self._pad + text)
+        self.written += 1
+
+    def flush(self, durable: bool = False):
+        self._file.flush()
+        if durable:
+            import os
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        self._write(self._close if self.written else self._empty_close)
+        self._file.close()
+
+    def abandon(self):
+        """Close without writing the trailer (leaves a resumable partial file)."""
+        self._file.close()
@@ -0,0 +1,248 @@
+"""
+Run metrics for the stream filters, detectors and af_detect.py.
+
+A RunMetrics collects one StageMetrics per pipeline stage (a filter pass, a
+graph load, a query). Each stage records time per operation (read, decode,
+predicate, write, parse, merge, query), records, matches and bytes, from which
+records/s, bytes/s and the match ratio are derived. The run adds wall time
+and peak RSS and can be written as JSON and/or as a Prometheus textfile
+(node_exporter textfile collector format).
+
+Scripts expose this through add_metrics_arguments():
+    --metrics-json PATH   write the run metrics as JSON
+    --metrics-prom PATH   write them as a Prometheus textfile
+    --profile             cProfile + tracemalloc the hot loop, print top offenders
+"""
+
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+# Operations a stage may time, in reporting order
+OPERATIONS = ('read', 'decode', 'predicate', 'write', 'parse', 'merge', 'query')
+
+
+def peak_rss_bytes() -> Optional[int]:
+    """Peak resident set size of this process, or None where unsupported."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS reports bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class StageMetrics:
+    """Timings and counters for one stage of a run."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.seconds: Dict[str, float] = {}
+        self.records = 0
+        self.matched: Optional[int] = None
+        self.bytes = 0
+        self.wall_seconds = 0.0
+        self.extra: Dict[str, Any] = {}
+
+    def add(self, operation: str, seconds: float):
+        self.seconds[operation] = self.seconds.get(operation, 0.0) + seconds
+
+    @contextmanager
+    def timed(self, operation: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(operation, time.perf_counter() - start)
+
+    def to_dict(self) -> Dict[str, Any]:
+        wall = self.wall_seconds
+        result = {
+            'name': self.name,
+            'wall_seconds': round(wall, 6),
+            'seconds': {op: round(self.seconds[op], 6)
+                        for op in sorted(self.seconds, key=_operation_order)},
+            'records': self.records,
+            'bytes': self.bytes,
+            'records_per_second': round(self.records / wall, 1) if wall else None,
+            'bytes_per_second': round(self.bytes / wall, 1) if wall else None,
+        }
+        if self.matched is not None:
+            result['matched'] = self.matched
+            result['match_ratio'] = round(self.matched / self.records, 6) if self.records else 0.0
+        result.update(self.extra)
+        return result
+
+
+def _operation_order(operation: str):
+    return (OPERATIONS.index(operation) if operation in OPERATIONS else len(OPERATIONS), operation)
+
+
+class RunMetrics:
+    """All stages of one script invocation."""
+
+    def __init__(self, tool: str):
+        self.tool = tool
+        self.stages: List[StageMetrics] = []
+        self.started = datetime.now(timezone.utc)
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[StageMetrics]:
+        """Time a stage's wall clock; fill in its counters inside the block."""
+        stage = StageMetrics(name)
+        self.stages.append(stage)
+        start = time.perf_counter()
+        try:
+            yield stage
+        finally:
+            stage.wall_seconds += time.perf_counter() - start
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'tool': self.tool,
+            'started': self.started.isoformat(),
+            'wall_seconds': round(time.perf_counter() - self._start, 6),
+            'peak_rss_bytes': peak_rss_bytes(),
+            'stages': [stage.to_dict() for stage in self.stages],
+        }
+
+    def write_json(self, path: Path):
+        _write_atomic(Path(path), json.dumps(self.to_dict(), indent=2) + '\n')
+
+    def write_prometheus(self, path: Path):
+        """Write a textfile for the node_exporter textfile collector."""
+        data = self.to_dict()
+        lines = []
+
+        def metric(name, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                if value is None:
+                    continue
+                label_text = ','.join(f'{k}="{_label(v)}"' for k, v in
+                                      (('tool', data['tool']),) + labels)
+                lines.append(f"{name}{{{label_text}}} {value}")
+
+        stages = data['stages']
+        metric('af_run_wall_seconds', "Wall time of the run",
+               [((), data['wall_seconds'])])
+        metric('af_run_peak_rss_bytes', "Peak resident set size of the run",
+               [((), data['peak_rss_bytes'])])
+        metric('af_stage_wall_seconds', "Wall time per stage",
+               [((('stage', s['name']),), s['wall_seconds']) for s in stages])
+        metric('af_stage_operation_seconds', "Time per stage and operation",
+               [((('stage', s['name']), ('operation', op)), sec)
+                for s in stages for op, sec in s['seconds'].items()])
+        metric('af_stage_records', "Records processed per stage",
+               [((('stage', s['name']),), s['records']) for s in stages])
+        metric('af_stage_bytes', "Input bytes processed per stage",
+               [((('stage', s['name']),), s['bytes']) for s in stages])
+        metric('af_stage_records_per_second', "Record throughput per stage",
+               [((('stage', s['name']),), s['records_per_second']) for s in stages])
+        metric('af_stage_bytes_per_second', "Byte throughput per stage",
+               [((('stage', s['name']),), s['bytes_per_second']) for s in stages])
+        metric('af_stage_match_ratio', "Fraction of records kept per filter stage",
+               [((('stage', s['name']),), s.get('match_ratio')) for s in stages])
+
+        queues = [(s['name'], name, q) for s in stages
+                  for name, q in s.get('queues', {}).items()]
+        metric('af_stage_queue_depth', "Capacity of each pipeline queue",
+               [((('stage', stage), ('queue', name)), q['depth']) for stage, name, q in queues])
+        metric('af_stage_queue_mean_occupancy', "Mean items queued per pipeline queue",
+               [((('stage', stage), ('queue', name)), q['mean_occupancy'])
+                for stage, name, q in queues])
+        metric('af_stage_queue_wait_seconds', "Time a pipeline queue's producer waited "
+               "on a full queue, or its consumer on an empty one",
+               [((('stage', stage), ('queue', name), ('side', side)), q[f'{wait}_wait_seconds'])
+                for stage, name, q in queues
+                for side, wait in (('producer', 'full'), ('consumer', 'empty'))])
+
+        _write_atomic(Path(path), '\n'.join(lines) + '\n')
+
+    def emit(self, json_path: Optional[str], prom_path: Optional[str]):
+        """Write whichever outputs were requested on the command line."""
+        if json_path:
+            self.write_json(Path(json_path))
+            print(f"Metrics written to: {json_path}")
+        if prom_path:
+            self.write_prometheus(Path(prom_path))
+            print(f"Prometheus metrics written to: {prom_path}")
+
+
+def _label(value: Any) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _write_atomic(path: Path, text: str):
+    # Scrapers must never see a half-written file
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + '.tmp')
+    tmp.write_text(text)
+    os.replace(tmp, path)
+
+
+@contextmanager
+def profiled(enabled: bool, top: int = 15) -> Iterator[None]:
+    """
+    Run the block under cProfile and tracemalloc when enabled, then print
+    the functions with the highest cumulative time and the largest
+    allocation sites.
+    """
+    if not enabled:
+        yield
+        return
+
+    import cProfile
+    import pstats
+    import tracemalloc
+
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        _, traced_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        print(f"\n{'='*60}")
+        print(f"Profile: top {top} functions by cumulative time")
+        print(f"{'='*60}")
+        pstats.Stats(profiler, stream=sys.stdout).sort_stats('cumulative').print_stats(top)
+
+        print(f"{'='*60}")
+        print(f"Profile: top {top} allocation sites "
+              f"(traced peak {traced_peak / (1024**2):.1f} MB)")
+        print(f"{'='*60}")
+        for stat in snapshot.statistics('lineno')[:top]:
+            print(f"  {stat}")
+        print()
+
+
+def add_metrics_arguments(parser):
+    """Add --metrics-json, --metrics-prom and --profile to an argparse parser."""
+    parser.add_argument(
+        '--metrics-json',
+        metavar='PATH',
+        help="Write per-stage timings, throughput and peak RSS as JSON"
+    )
+    parser.add_argument(
+        '--metrics-prom',
+        metavar='PATH',
+        help="Write the same metrics as a Prometheus textfile"
+    )
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        help="Profile the hot loop with cProfile/tracemalloc and print top offenders"
+    )
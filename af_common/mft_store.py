@@ -0,0 +1,515 @@
+"""
+MFT records sorted by entry number, for key lookups without a rescan.
+
+The LNK -> MFT join of AF-TIMESTOMPING (targetMftEntryNumber ->
+entryNumber) and parent path reconstruction (USN parentEntryNumber ->
+MFT) are lookups by MFT entry number. Served from the JSON-LD export,
+each one is a full rescan of the MFT, or a join in rdflib.
+
+build_store() streams an MFT export once (JsonLdReader, canonical keys)
+and writes one record per MftFacet of every observable:File entry:
+
+    (entryNumber, sequenceNumber, parentEntryNumber, parentSequenceNumber,
+     fileName, parentPath, byte range of the entry in the export)
+
+Records are sorted by (entryNumber, sequenceNumber) with bounded memory,
+as the timeline is: sorted runs of run_size records are spilled to disk
+and k-way merged. Ties keep input order, so a build is deterministic.
+
+File layout (little endian):
+    MAGIC, u32 header length, JSON header (source file, its @context)
+    records: <q entry, q sequence, q parent entry, q parent sequence,
+             Q start, I length, H H lengths of fileName, parentPath>
+             + their UTF-8 bytes, in entry number order
+    fences:  <q entry, Q offset> of every FENCE_STRIDE-th record
+    footer:  <Q records, Q fence offset, Q fences> + MAGIC
+
+Numbers an entry does not have are -1. The fences split the records
+into blocks of FENCE_STRIDE and are held in memory (16 bytes per block),
+so MftStore.lookup() bisects them and reads a single block:
+
+    with MftStore('mft.afms') as store:
+        for record in store.lookup(1234):
+            print(record.sequence_number, record.path)
+
+MftStore.probe() takes many entry numbers and returns their records in
+one merge join: the numbers are sorted, consecutive ones are read from
+the same block, and blocks with none of them are skipped by the fences.
+MftStore.entries() then reads just those entries back from the export.
+
+The header records the export's size and mtime; MftStore.check_source()
+refuses a store built from another version of the file. Entry numbers
+that are not plain decimal integers are not indexed; the header counts
+them (unindexed), so a caller that needs every entry can fall back to a
+scan.
+"""
+
+import heapq
+import json
+import os
+import struct
+import tempfile
+import time
+from bisect import bisect_left
+from operator import itemgetter
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from af_common.facets import FACET_TYPES, facet_kinds, facet_list
+from af_common.jsonld_stream import JsonLdReader
+from af_common.metrics import StageMetrics
+
+MAGIC = b'AFMS\x01\r\n\x00'
+FORMAT = 1
+
+DEFAULT_RUN_SIZE = 500_000
+MAX_FAN_IN = 64
+FENCE_STRIDE = 128
+
+_RECORD = struct.Struct('<qqqqQIHH')
+_FENCE = struct.Struct('<qQ')
+_FOOTER = struct.Struct('<QQQ8s')
+_LENGTH = struct.Struct('<I')
+_MAX_FIELD = 0xFFFF
+_BUFFER = 1 << 16
+
+MFT_FACET = FACET_TYPES.register('MftFacet')
+FILE_FACET = FACET_TYPES.register('FileFacet')
+
+
+class MftRecord(NamedTuple):
+    entry_number: int
+    sequence_number: int
+    parent_entry_number: int
+    parent_sequence_number: int
+    file_name: str
+    parent_path: str
+    start: int      # the entry is export bytes start..end (JsonLdReader.entry_at)
+    end: int
+
+    @property
+    def path(self) -> str:
+        """parentPath and fileName joined (the fileName alone without a parent path)."""
+        if not self.parent_path:
+            return self.file_name
+        return self.parent_path.rstrip('\\') + '\\' + self.file_name
+
+
+def _number(value: Any) -> Optional[int]:
+    """A plain decimal integer literal as an int, else None."""
+    if isinstance(value, dict):
+        value = value.get('@value')
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and value.isdigit() and str(int(value)) == value:
+        return int(value)
+    return None
+
+
+def _field(facet: Dict[str, Any], key: str) -> int:
+    number = _number(facet.get(key))
+    return -1 if number is None else number
+
+
+def _text(value: Any) -> str:
+    if isinstance(value, dict):
+        value = value.get('@value', '')
+    return value if isinstance(value, str) else ''
+
+
+def mft_records(entry: Dict[str, Any], start: int, end: int
+                ) -> Tuple[List[MftRecord], int]:
+    """
+    The records of one MFT export entry (one per MftFacet with an entry
+    number), and the number of MftFacets whose entry number is not a
+    plain integer.
+    """
+    if entry.get('@type') != 'observable:File':
+        return [], 0
+    records = []
+    unindexed = 0
+    file_name = ''
+    facets = facet_list(entry.get('core:hasFacet'))
+    for facet in facets:
+        if facet_kinds(facet) & FILE_FACET:
+            file_name = _text(facet.get('observable:fileName')) or file_name
+    for facet in facets:
+        if not facet_kinds(facet) & MFT_FACET:
+            continue
+        value = facet.get('dfc-ext:entryNumber')
+        number = _number(value)
+        if number is None:
+            unindexed += value is not None
+            continue
+        records.append(MftRecord(
+            number,
+            _field(facet, 'dfc-ext:sequenceNumber'),
+            _field(facet, 'dfc-ext:parentEntryNumber'),
+            _field(facet, 'dfc-ext:parentSequenceNumber'),
+            file_name or _text(facet.get('dfc-ext:fileName')),
+            _text(facet.get('dfc-ext:parentPath')),
+            start, end,
+        ))
+    return records, unindexed
+
+
+# -- build -------------------------------------------------------------------
+
+def _encode(record: MftRecord) -> bytes:
+    name = record.file_name.encode('utf-8')[:_MAX_FIELD]
+    parent = record.parent_path.encode('utf-8')[:_MAX_FIELD]
+    return _RECORD.pack(*record[:4], record.start, record.end - record.start,
+                        len(name), len(parent)) + name + parent
+
+
+def _decode(raw: bytes) -> MftRecord:
+    entry, sequence, parent, parent_sequence, start, length, a, b = _RECORD.unpack_from(raw)
+    body = raw[_RECORD.size:]
+    return MftRecord(entry, sequence, parent, parent_sequence,
+                     body[:a].decode('utf-8', 'replace'),
+                     body[a:a + b].decode('utf-8', 'replace'),
+                     start, start + length)
+
+
+def _read_records(f, end: Optional[int] = None) -> Iterator[Tuple[Tuple[int, int], bytes]]:
+    """((entry, sequence), raw record) from the current position up to byte offset end."""
+    read = f.read
+    position = f.tell()
+    while end is None or position < end:
+        head = read(_RECORD.size)
+        if len(head) < _RECORD.size:
+            return
+        entry, sequence, _, _, _, _, a, b = _RECORD.unpack(head)
+        body = read(a + b)
+        position += _RECORD.size + len(body)
+        yield (entry, sequence), head + body
+
+
+def _merge(runs: List[Path], output, on_record=None) -> int:
+    """k-way merge sorted run files into output (stable: earlier runs first)."""
+    files = [open(run, 'rb', buffering=1 << 20) for run in runs]
+    try:
+        count = 0
+        for key, record in heapq.merge(*map(_read_records, files), key=itemgetter(0)):
+            if on_record:
+                on_record(key, record)
+            output.write(record)
+            count += 1
+        return count
+    finally:
+        for f in files:
+            f.close()
+
+
+class _StoreWriter:
+    def __init__(self, path: Path, header: Dict[str, Any]):
+        self.path = Path(path)
+        self._tmp = self.path.with_name(f'.{self.path.name}.{os.getpid()}.tmp')
+        self._file = open(self._tmp, 'wb', buffering=1 << 20)
+        data = json.dumps({'format': FORMAT, **header}).encode()
+        self._file.write(MAGIC + _LENGTH.pack(len(data)) + data)
+        self._offset = len(MAGIC) + _LENGTH.size + len(data)
+        self.count = 0
+        self._fences: List[bytes] = []
+
+    def add(self, key: Tuple[int, int], record: bytes):
+        if self.count % FENCE_STRIDE == 0:
+            self._fences.append(_FENCE.pack(key[0], self._offset))
+        self._offset += len(record)
+        self.count += 1
+
+    def write(self, record: bytes):
+        self._file.write(record)
+
+    def close(self):
+        fence_offset = self._offset
+        self._file.write(b''.join(self._fences))
+        self._file.write(_FOOTER.pack(self.count, fence_offset, len(self._fences), MAGIC))
+        self._file.close()
+        os.replace(self._tmp, self.path)
+
+    def abandon(self):
+        self._file.close()
+        self._tmp.unlink(missing_ok=True)
+
+
+def build_store(mft_file: Path, output: Path, run_size: int = DEFAULT_RUN_SIZE,
+                tmp_dir: Optional[Path] = None,
+                metrics: Optional[StageMetrics] = None) -> int:
+    """
+    Build an MFT store from an MFT JSON-LD export.
+
+    Args:
+        run_size: records held in memory before a sorted run is spilled
+        tmp_dir: where runs are spilled (default: next to output)
+        metrics: gets read/decode/sort/write times, entries scanned and
+            records written (matched)
+
+    Returns:
+        Number of records in the store
+    """
+    mft_file = Path(mft_file)
+    st = mft_file.stat()
+    entries = unindexed = 0
+
+    with tempfile.TemporaryDirectory(prefix='afms-', dir=tmp_dir or Path(output).parent) as tmp:
+        runs: List[Path] = []
+        buffer: List[Tuple[Tuple[int, int], bytes]] = []
+        sort_seconds = 0.0
+
+        def spill():
+            nonlocal sort_seconds
+            start = time.perf_counter()
+            buffer.sort(key=itemgetter(0))
+            run = Path(tmp) / f'run-{len(runs):06d}'
+            with open(run, 'wb', buffering=1 << 20) as f:
+                f.write(b''.join(record for _, record in buffer))
+            runs.append(run)
+            buffer.clear()
+            sort_seconds += time.perf_counter() - start
+
+        start = time.perf_counter()
+        with JsonLdReader(mft_file, canonical_keys=True) as reader:
+            context = reader.context
+            previous = reader.graph_offset
+            for entry, offset in reader:
+                entries += 1
+                records, skipped = mft_records(entry, previous, offset)
+                unindexed += skipped
+                for record in records:
+                    buffer.append(((record.entry_number, record.sequence_number),
+                                   _encode(record)))
+                previous = offset
+                if len(buffer) >= run_size:
+                    spill()
+            read_seconds = reader.read_seconds
+            scanned = reader.offset
+        scan_seconds = time.perf_counter() - start - sort_seconds
+
+        header = {
+            'source': str(mft_file.resolve()),
+            'source_size': st.st_size,
+            'source_mtime_ns': st.st_mtime_ns,
+            'context': context,
+            'entries': entries,
+            'unindexed': unindexed,
+        }
+        writer = _StoreWriter(output, header)
+        merge_start = time.perf_counter()
+        try:
+            if not runs:
+                # Everything fitted in memory: no run files needed
+                buffer.sort(key=itemgetter(0))
+                for key, record in buffer:
+                    writer.add(key, record)
+                    writer.write(record)
+            else:
+                if buffer:
+                    spill()
+                # Bounded fan-in: merge consecutive groups until one pass is left
+                level = 0
+                while len(runs) > MAX_FAN_IN:
+                    merged = []
+                    for i in range(0, len(runs), MAX_FAN_IN):
+                        group = runs[i:i + MAX_FAN_IN]
+                        target = Path(tmp) / f'merge-{level}-{i:06d}'
+                        with open(target, 'wb', buffering=1 << 20) as f:
+                            _merge(group, f)
+                        for run in group:
+                            run.unlink()
+                        merged.append(target)
+                    runs, level = merged, level + 1
+                _merge(runs, writer, on_record=writer.add)
+        except BaseException:
+            writer.abandon()
+            raise
+        writer.close()
+        merge_seconds = time.perf_counter() - merge_start
+
+    if metrics is not None:
+        metrics.add('read', read_seconds)
+        metrics.add('decode', max(scan_seconds - read_seconds, 0.0))
+        metrics.add('sort', sort_seconds)
+        metrics.add('write', merge_seconds)
+        metrics.records += entries
+        metrics.matched = (metrics.matched or 0) + writer.count
+        metrics.bytes += scanned
+        metrics.extra['spilled_runs'] = len(runs)
+        metrics.extra['unindexed'] = unindexed
+    return writer.count
+
+
+# -- lookup ------------------------------------------------------------------
+
+class MftStore:
+    """
+    Read access to an MFT store.
+
+    Attributes:
+        count: number of records; source_entries: entries in the export
+        unindexed: MftFacets whose entry number was not indexed
+        source: path of the export; context: its @context (canonical keys)
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._file = open(self.path, 'rb', buffering=_BUFFER)
+        self._source_reader: Optional[JsonLdReader] = None
+        try:
+            self._open()
+        except BaseException:
+            self._file.close()
+            raise
+
+    def _open(self):
+        f = self._file
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{self.path.name}: not an MFT store")
+        (length,) = _LENGTH.unpack(f.read(_LENGTH.size))
+        header = json.loads(f.read(length))
+        if header.get('format') != FORMAT:
+            raise ValueError(f"{self.path.name}: unsupported MFT store format {header.get('format')}")
+        self.source = Path(header['source'])
+        self.source_size: int = header['source_size']
+        self.source_mtime_ns: int = header['source_mtime_ns']
+        self.context = header['context']
+        self.source_entries: int = header['entries']
+        self.unindexed: int = header['unindexed']
+
+        f.seek(-_FOOTER.size, 2)
+        self.count, fence_offset, fences, magic = _FOOTER.unpack(f.read(_FOOTER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{self.path.name}: truncated MFT store")
+        self._end_offset = fence_offset
+        f.seek(fence_offset)
+        fence = list(_FENCE.iter_unpack(f.read(fences * _FENCE.size)))
+        self._fence_keys = [entry for entry, _ in fence]
+        self._fence_offsets = [offset for _, offset in fence]
+
+    def close(self):
+        self._file.close()
+        if self._source_reader:
+            self._source_reader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def check_source(self, mft_file: Path):
+        """Raise ValueError unless the store was built from this version of mft_file."""
+        st = Path(mft_file).stat()
+        if (st.st_size, st.st_mtime_ns) != (self.source_size, self.source_mtime_ns):
+            raise ValueError(f"{self.path.name} was not built from this version of "
+                             f"{Path(mft_file).name}; rebuild it")
+
+    def _scan(self, block: int) -> Iterator[Tuple[Tuple[int, int], bytes]]:
+        self._file.seek(self._fence_offsets[block])
+        return _read_records(self._file, self._end_offset)
+
+    def _first_block(self, entry_number: int, low: int = 0) -> int:
+        # The block before the first fence >= entry_number may still end
+        # with records of entry_number, so the scan starts there
+        return max(bisect_left(self._fence_keys, entry_number, low) - 1, 0)
+
+    def __iter__(self) -> Iterator[MftRecord]:
+        if self._fence_offsets:
+            for _, raw in self._scan(0):
+                yield _decode(raw)
+
+    def lookup(self, entry_number: int, sequence_number: Optional[int] = None
+               ) -> List[MftRecord]:
+        """Records of one entry number (and sequence number, if given)."""
+        if not self._fence_offsets:
+            return []
+        found = []
+        for (entry, sequence), raw in self._scan(self._first_block(entry_number)):
+            if entry < entry_number:
+                continue
+            if entry > entry_number:
+                break
+            if sequence_number is None or sequence == sequence_number:
+                found.append(_decode(raw))
+        return found
+
+    def probe(self, entry_numbers: Iterable[int]) -> Iterator[MftRecord]:
+        """
+        Records of many entry numbers, in entry number order, by one merge
+        join of the sorted numbers against the records.
+        """
+        if not self._fence_offsets:
+            return
+        block = -1          # block the scan was (re)started at
+        position = 0        # records read since then
+        scan: Iterator = iter(())
+        current = None
+        for number in sorted(set(entry_numbers)):
+            target = self._first_block(number, max(block, 0))
+            if target > block + position // FENCE_STRIDE:
+                # None of the blocks in between can hold a wanted number
+                block, position = target, 0
+                scan = self._scan(block)
+                current = next(scan, None)
+            while current is not None and current[0][0] < number:
+                current = next(scan, None)
+                position += 1
+            while current is not None and current[0][0] == number:
+                yield _decode(current[1])
+                current = next(scan, None)
+                position += 1
+            if current is None:
+                return
+
+    def entries(self, records: Iterable[MftRecord], mft_file: Optional[Path] = None
+                ) -> Iterator[Tuple[MftRecord, Dict[str, Any]]]:
+        """
+        (record, export entry) for records, in export order; an entry with
+        several of the records is read and yielded once. Keys are
+        canonical, as JsonLdReader(canonical_keys=True) yields them.
+        """
+        if self._source_reader is None:
+            source = Path(mft_file) if mft_file else self.source
+            self.check_source(source)
+            self._source_reader = JsonLdReader(source, canonical_keys=True)
+        reader = self._source_reader
+        last = None
+        for record in sorted(records, key=lambda r: r.start):
+            if record.start != last:
+                last = record.start
+                yield record, reader.entry_at(record.start, record.end)
+
+
+def open_store(store_path: Path, mft_file: Optional[Path] = None,
+               metrics: Optional[StageMetrics] = None) -> MftStore:
+    """
+    The MFT store at store_path. Given mft_file, it is built first if it
+    is missing or was built from another version of that file.
+    """
+    store_path = Path(store_path)
+    if mft_file is None:
+        if not store_path.exists():
+            raise ValueError(f"MFT store not found: {store_path} (af_mftstore.py build)")
+        store = MftStore(store_path)
+        print(f"  ✓ MFT store: {store_path.name} ({len(store):,} records)")
+        return store
+
+    if store_path.exists():
+        store = MftStore(store_path)
+        try:
+            store.check_source(mft_file)
+            print(f"  ✓ MFT store: {store_path.name} ({len(store):,} records)")
+            return store
+        except ValueError:
+            store.close()
+            print(f"  MFT store {store_path.name} is out of date: rebuilding")
+
+    print(f"  Building MFT store {store_path.name}...")
+    count = build_store(mft_file, store_path, metrics=metrics)
+    print(f"  ✓ MFT store: {store_path.name} ({count:,} records)")
+    return MftStore(store_path)
@@ -0,0 +1,122 @@
+"""
+Shared multi-pattern matcher for the filter predicates.
+
+Every filter module registers the literals its predicates look for
+('tracking.log', 'IndexedDB', 'Security', 'DataTruncation', ...) on the
+one FIELD_PATTERNS set and gets back a bitmask. A field value is then
+scanned once for all registered literals of all rules. scan() returns the
+bitset of the literals it contains, and a predicate tests its masks
+against it:
+
+    VSS_FILES = FIELD_PATTERNS.register('tracking.log', '{')
+    ...
+    if FIELD_PATTERNS.scan(filename) & VSS_FILES:
+
+The automaton is built on the first scan after a registration, so it is
+built once when all rule modules are imported before the pass starts. It
+is a single compiled alternation of the literals, longest first. A match
+of a literal implies every literal it contains (closure masks), so the
+non-overlapping leftmost scan reports exactly the literals that occur.
+When a suffix of one literal is a prefix of another, an overlapping scan
+is used instead.
+
+Bitsets are memoised per value. Paths, update reasons and channel names
+repeat heavily, and several rules in a single-pass prefilter look at the
+same strings, so most scans are one dict lookup.
+"""
+
+import re
+from typing import Any, Dict, Iterable, List, Optional
+
+# Memoised values before the cache is dropped (bounds memory on huge inputs)
+_CACHE_LIMIT = 1 << 16
+
+
+class PatternSet:
+    """
+    A growing set of literals, each with a fixed bit, matched in one scan.
+
+    Bits never change once assigned, so masks taken before a later
+    registration stay valid. cache_limit=0 disables the memo.
+    """
+
+    def __init__(self, patterns: Iterable[str] = (), cache_limit: int = _CACHE_LIMIT):
+        self.cache_limit = cache_limit
+        self._bits: Dict[str, int] = {}
+        self._closure: Dict[str, int] = {}
+        self._findall = None
+        self._cache: Dict[str, int] = {}
+        self.register(*patterns)
+
+    @property
+    def patterns(self) -> List[str]:
+        return list(self._bits)
+
+    def register(self, *patterns: str) -> int:
+        """Add literals (if new) and return the mask of their bits."""
+        mask = 0
+        for pattern in patterns:
+            if not pattern:
+                raise ValueError("empty pattern")
+            bit = self._bits.get(pattern)
+            if bit is None:
+                bit = self._bits[pattern] = 1 << len(self._bits)
+                self._findall = None
+            mask |= bit
+        return mask
+
+    def mask(self, *patterns: str) -> int:
+        """Mask of already registered literals (KeyError for unknown ones)."""
+        mask = 0
+        for pattern in patterns:
+            mask |= self._bits[pattern]
+        return mask
+
+    def _build(self):
+        patterns = sorted(self._bits, key=len, reverse=True)
+        self._closure = {p: sum(bit for q, bit in self._bits.items() if q in p)
+                         for p in patterns}
+        alternation = '|'.join(map(re.escape, patterns))
+        overlapping = any(p[i:] == q[:len(p) - i]
+                          for p in patterns for q in patterns
+                          for i in range(1, len(p)) if len(p) - i < len(q))
+        if overlapping:
+            alternation = f'(?=({alternation}))'
+        self._findall = re.compile(alternation).findall
+        self._cache = {}
+
+    def scan(self, value: Any) -> int:
+        """
+        Bitset of the registered literals occurring in value (non-string
+        values are matched on str(value)).
+        """
+        if not isinstance(value, str):
+            value = str(value)
+        hits = self._cache.get(value)
+        if hits is None:
+            if self._findall is None:
+                self._build()
+            hits = 0
+            closure = self._closure
+            for found in self._findall(value):
+                hits |= closure[found]
+            if len(self._cache) >= self.cache_limit:
+                self._cache.clear()
+                if not self.cache_limit:
+                    return hits
+            self._cache[value] = hits
+        return hits
+
+    def naive_scan(self, value: Any, patterns: Optional[Iterable[str]] = None) -> int:
+        """Per-literal reference scan (one `in` test per literal), for checks."""
+        if not isinstance(value, str):
+            value = str(value)
+        hits = 0
+        for pattern in self._bits if patterns is None else patterns:
+            if pattern in value:
+                hits |= self._bits[pattern]
+        return hits
+
+
+# The literals of every rule's filter predicates
+FIELD_PATTERNS = PatternSet()
@@ -0,0 +1,177 @@
+"""
+JSON-LD access helpers for the native (rdflib-free) rule evaluators.
+
+A native evaluator streams a rule's JSON-LD inputs with JsonLdReader and
+evaluates the rule's graph pattern in plain Python. To return exactly what
+the SPARQL rule returns it has to see the entries the way rdflib does:
+
+- compact IRIs in keys and @type values are expanded through the
+  document's @context, so "core:hasFacet" and "uco-core:hasFacet" are the
+  same property when both prefixes map to the same namespace
+- only string literals (plain, xsd:string or language-tagged) take part in
+  CONTAINS/REGEX; on any other literal those functions raise a SPARQL type
+  error, which makes the FILTER false
+- = "text" only holds for plain or xsd:string literals with that text
+  (a "true"^^xsd:boolean is not equal to "true"); a constant in a triple
+  pattern (observable:eventID "1102") is stricter still and only matches
+  the plain literal
+- xsd:dateTime values are read back normalised, as rdflib does
+  (datetime.fromisoformat(), then isoformat())
+- the graph is a set of triples: an entry exported twice (same @id) is one
+  subject, so an evaluator without DISTINCT still counts a solution once
+  per distinct binding (see Terms.node_key)
+
+Contexts are expected to define prefixes (term -> IRI string), which is
+what every exporter feeding these rules writes.
+"""
+
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from af_common.jsonld_stream import JsonLdReader
+from af_common.metrics import StageMetrics
+
+XSD = 'http://www.w3.org/2001/XMLSchema#'
+XSD_STRING = XSD + 'string'
+XSD_DATETIME = XSD + 'dateTime'
+HAS_FACET = 'https://ontology.unifiedcyberontology.org/uco/core/hasFacet'
+
+
+class Terms:
+    """Compact IRI expansion for one document's @context."""
+
+    def __init__(self, context: Optional[Any]):
+        self.prefixes: Dict[str, str] = {}
+        for item in context if isinstance(context, list) else [context]:
+            if isinstance(item, dict):
+                self.prefixes.update((term, iri) for term, iri in item.items()
+                                     if isinstance(iri, str) and not term.startswith('@'))
+        self._cache: Dict[str, str] = {}
+
+    def expand(self, term: str) -> str:
+        """Expand prefix:local (or a bare term) to a full IRI."""
+        iri = self._cache.get(term)
+        if iri is None:
+            prefix, colon, local = term.partition(':')
+            if colon and prefix in self.prefixes and not local.startswith('//'):
+                iri = self.prefixes[prefix] + local
+            else:
+                iri = self.prefixes.get(term, term)
+            self._cache[term] = iri
+        return iri
+
+    def get(self, node: Dict[str, Any], iri: str) -> List[Any]:
+        """All values of property iri on node, whatever prefix the key uses."""
+        found = []
+        for key, value in node.items():
+            if self.expand(key) == iri:
+                found.extend(value if isinstance(value, list) else [value])
+        return found
+
+    def types(self, node: Dict[str, Any]) -> Set[str]:
+        """Expanded @type IRIs of a node."""
+        value = node.get('@type', [])
+        return {self.expand(t) for t in (value if isinstance(value, list) else [value])
+                if isinstance(t, str)}
+
+    def strings(self, values: List[Any]) -> Iterator[str]:
+        """Lexical forms of the string literals among values."""
+        for value in values:
+            if isinstance(value, str):
+                yield value
+            elif isinstance(value, dict) and isinstance(value.get('@value'), str):
+                datatype = value.get('@type')
+                if datatype is None or self.expand(datatype) == XSD_STRING:
+                    yield value['@value']
+
+    def equals(self, values: List[Any], text: str) -> bool:
+        """SPARQL ?x = "text" for any of values (no language tag, string datatype)."""
+        return any(value == text for value in self.strings(
+            [v for v in values if not (isinstance(v, dict) and '@language' in v)]))
+
+    def matches(self, values: List[Any], text: str) -> bool:
+        """Whether values include the plain literal "text" (triple pattern constant)."""
+        return any(v == text or (isinstance(v, dict) and v.get('@value') == text
+                                 and set(v) == {'@value'})
+                   for v in values)
+
+    def node_key(self, node: Dict[str, Any]) -> Any:
+        """
+        Identity of a node in the RDF graph: its expanded @id, so repeated
+        occurrences of a node are one subject, as in rdflib's triple set.
+        Nodes without @id are blank nodes, distinct per occurrence.
+        """
+        if '@id' in node:
+            return self.expand(node['@id'])
+        return object()
+
+    def literals(self, values: List[Any]) -> Iterator[Tuple[str, Optional[datetime]]]:
+        """
+        (lexical form, datetime or None) of the literals among values.
+
+        xsd:dateTime values come back in rdflib's normalised form; node
+        references (IRIs, blank nodes) are skipped.
+        """
+        for value in values:
+            if isinstance(value, dict):
+                if '@value' not in value:
+                    continue
+                text, datatype = value['@value'], value.get('@type')
+            else:
+                text, datatype = value, None
+            if isinstance(text, bool):
+                text = 'true' if text else 'false'
+            text = str(text)
+            if datatype is not None and self.expand(datatype) == XSD_DATETIME:
+                try:
+                    parsed = datetime.fromisoformat(text)
+                except ValueError:
+                    yield text, None  # ill-typed: rdflib keeps the lexical form
+                else:
+                    yield parsed.isoformat(), parsed
+            else:
+                yield text, None
+
+
+def typed_entries(path: Path, types: Set[str], metrics: Optional[StageMetrics] = None
+                  ) -> Iterator[Tuple[Terms, Dict[str, Any], List[Dict[str, Any]]]]:
+    """
+    Yield (terms, entry, facets) for every @graph entry with one of types.
+
+    Facets embedded in core:hasFacet are used directly; facets referenced by
+    @id are resolved against the file's top-level nodes once the pass ends.
+    The pass's records, bytes and time go to metrics as operation 'scan'.
+    """
+    start = time.perf_counter()
+    records = 0
+    pending = []
+    nodes: Dict[str, dict] = {}
+
+    with JsonLdReader(path) as reader:
+        terms = Terms(reader.context)
+        for entry, _ in reader:
+            records += 1
+            facets = [f for f in terms.get(entry, HAS_FACET) if isinstance(f, dict)]
+            if not facets:
+                # Only facet-less nodes can be referenced facets; keeping just
+                # these keeps memory bounded on exports with embedded facets
+                if '@id' in entry:
+                    nodes.setdefault(entry['@id'], entry)
+                continue
+            if not types & terms.types(entry):
+                continue
+            if any(set(f) == {'@id'} for f in facets):
+                pending.append((entry, facets))
+            else:
+                yield terms, entry, facets
+
+    for entry, facets in pending:
+        yield terms, entry, [nodes.get(f['@id'], f) if set(f) == {'@id'} else f
+                             for f in facets]
+
+    if metrics is not None:
+        metrics.records += records
+        metrics.bytes += Path(path).stat().st_size
+        metrics.add('scan', time.perf_counter() - start)
@@ -0,0 +1,128 @@
+"""
+Full paths of USN records, resolved through an MFT store.
+
+USN exports leave dfc-ext:parentPath empty: a record only names its
+parent directory by (parentEntryNumber, parentSequenceNumber). The USN
+predicates of AF-002 and AF-007 therefore match on the bare fileName
+("History", "Security.evtx"), which also keeps History.lnk, other
+programs' *History.db files and every *Security*.evtx channel log.
+
+ParentPaths resolves a parent reference to the directory's full path
+with MftStore.lookup() (af_common/mft_store.py): the directory's own MFT
+record holds its parentPath and fileName. Results are kept in an LRU
+cache, since the records a predicate looks at come in bursts from a few
+directories (a browser profile, winevt\\Logs):
+
+    paths = ParentPaths(open_store('mft_case.afms'))
+    ...
+    path = paths.file_path(usn_facet, file_name)
+    if path is None:
+        ...          # unresolved: fall back to the fileName match
+    elif HISTORY_PATH.search(path):
+        ...
+
+A reference resolves only to an MFT record with the same sequence
+number, so a directory whose entry was reused is not mistaken for the
+one the USN record names. Unresolved references return None; the
+predicates then keep their fileName-only match rather than drop the
+record.
+
+Scripts expose this through add_parent_path_arguments():
+    --mft-store FILE   MFT store to resolve USN parent paths through
+"""
+
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from af_common.metrics import StageMetrics
+
+# Parent directories whose paths are kept (an entry is ~200 bytes)
+DEFAULT_CACHE_SIZE = 1 << 16
+
+
+def _number(value: Any) -> Optional[int]:
+    """A plain decimal integer (or its string) as an int, else None."""
+    if isinstance(value, dict):
+        value = value.get('@value')
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.isascii() and value.isdigit():
+        return int(value)
+    return None
+
+
+class ParentPaths:
+    """Full paths of parent directory references, LRU-cached."""
+
+    def __init__(self, store, cache_size: int = DEFAULT_CACHE_SIZE):
+        self.store = store
+        self.resolved = 0
+        self.unresolved = 0
+        self.resolve = lru_cache(maxsize=cache_size)(self._resolve)
+
+    def _resolve(self, entry_number: int, sequence_number: Optional[int]) -> Optional[str]:
+        """Full path of the directory with this MFT reference; None if not in the store."""
+        for record in self.store.lookup(entry_number, sequence_number):
+            return record.path
+        return None
+
+    def parent_path(self, facet: Dict[str, Any]) -> Optional[str]:
+        """
+        Full path of the directory a USN record's file is in: its
+        parentPath if the export filled it, else resolved from its parent
+        reference. None if it cannot be resolved.
+        """
+        parent_path = facet.get('dfc-ext:parentPath')
+        if isinstance(parent_path, str) and parent_path:
+            return parent_path
+        entry_number = _number(facet.get('dfc-ext:parentEntryNumber'))
+        path = None
+        if entry_number is not None:
+            path = self.resolve(entry_number,
+                                _number(facet.get('dfc-ext:parentSequenceNumber')))
+        if path is None:
+            self.unresolved += 1
+        else:
+            self.resolved += 1
+        return path
+
+    def file_path(self, facet: Dict[str, Any], file_name: str) -> Optional[str]:
+        """Full path of a USN record's file (parent_path() and file_name joined)."""
+        parent_path = self.parent_path(facet)
+        if parent_path is None:
+            return None
+        return parent_path.rstrip('\\') + '\\' + file_name
+
+    def stats(self) -> Dict[str, int]:
+        info = self.resolve.cache_info()
+        return {'resolved': self.resolved, 'unresolved': self.unresolved,
+                'cache_hits': info.hits, 'cache_misses': info.misses,
+                'cached': info.currsize}
+
+    def close(self):
+        self.store.close()
+
+
+def add_parent_path_arguments(parser, builds_from_mft: bool = False):
+    """Add --mft-store to an argparse parser."""
+    parser.add_argument(
+        '--mft-store',
+        type=Path,
+        metavar='FILE',
+        help="MFT store (af_mftstore.py) to resolve the parent paths of USN records through, "
+             "so USN entries are matched on their full path"
+             + ("; built from --mft if missing or out of date" if builds_from_mft else "")
+    )
+
+
+def open_parent_paths(store_path: Optional[Path], mft_file: Optional[Path] = None,
+                      metrics: Optional[StageMetrics] = None) -> Optional[ParentPaths]:
+    """
+    ParentPaths over the MFT store at store_path (None without one). Given
+    mft_file, the store is built from it if missing or out of date.
+    """
+    if store_path is None:
+        return None
+    from af_common.mft_store import open_store
+    return ParentPaths(open_store(store_path, mft_file, metrics))
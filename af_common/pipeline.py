@@ -0,0 +1,315 @@
+"""
+Pipelined input for the stream filters: read-ahead, decode and predicate
+stages running concurrently, connected by bounded queues.
+
+On network-attached evidence storage, a single-threaded filter pass
+alternates between blocking on a read and decoding JSON, so neither the
+link nor the CPU is kept busy. filter_jsonld() therefore runs its pass as
+
+    read-ahead thread   reads block_size blocks, up to read_ahead queued
+        -> decode thread    JsonLdReader turns blocks into entries
+        -> predicate thread applies the filter predicate
+        -> caller           writes kept entries, checkpoints
+
+Entries travel between threads in batches of batch_size, so queue
+overhead stays far below the cost of decoding an entry. The batches keep
+the input order, so the output is byte-identical to an inline pass.
+Reads release the GIL and overlap with decoding. Decode and predicate
+share the interpreter, so they overlap only with I/O and with each
+other's waits. A depth of 0 runs that stage inline in the thread that
+consumes it.
+
+Every queue reports its depth, items passed, mean occupancy and the
+time its producer waited on a full queue or its consumer on an empty
+one. A read queue that is mostly empty while the decoder waits means the
+pass is I/O bound; a full one means it is CPU bound.
+
+Scripts expose the depths through add_pipeline_arguments():
+    --read-ahead N        blocks read ahead of the decoder (0: read inline)
+    --block-size BYTES    read-ahead block size
+    --decode-queue N      entry batches queued after decoding (0: decode inline)
+    --predicate-queue N   entry batches queued after the predicate (0: inline)
+"""
+
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple
+
+# How often a blocked producer checks whether the consumer has gone away
+_POLL_SECONDS = 0.1
+_END = object()
+
+
+class PipelineClosed(Exception):
+    """Raised in a stage thread whose queue was closed by the consumer."""
+
+
+class PipelineConfig(NamedTuple):
+    """Queue depths of a pipelined pass; 0 runs a stage inline."""
+    read_ahead: int = 4
+    block_size: int = 1 << 20
+    decode_queue: int = 8
+    predicate_queue: int = 8
+    batch_size: int = 256
+
+
+# Used by filter_jsonld() when no config is passed; set from the command
+# line with configure()
+DEFAULT = PipelineConfig()
+INLINE = PipelineConfig(read_ahead=0, decode_queue=0, predicate_queue=0)
+_default = DEFAULT
+
+
+def default_config() -> PipelineConfig:
+    return _default
+
+
+def configure(config: PipelineConfig):
+    """Set the pipeline used by every later filter pass of this process."""
+    global _default
+    _default = config
+
+
+class _Failure:
+    """An exception raised in a stage thread, re-raised in its consumer."""
+    __slots__ = ('error',)
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class BoundedQueue:
+    """A queue.Queue that accounts for its occupancy and both sides' waits."""
+
+    def __init__(self, name: str, depth: int):
+        self.name = name
+        self.depth = depth
+        self.items = 0
+        self.full_wait_seconds = 0.0
+        self.empty_wait_seconds = 0.0
+        self._occupancy = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=depth)
+        self._closed = False
+
+    def put(self, item) -> bool:
+        """Queue item; False if the consumer has closed the queue meanwhile."""
+        if self._closed:
+            return False
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            pass
+        start = time.perf_counter()
+        try:
+            while not self._closed:
+                try:
+                    self._queue.put(item, timeout=_POLL_SECONDS)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        finally:
+            self.full_wait_seconds += time.perf_counter() - start
+
+    def get(self):
+        self._occupancy += self._queue.qsize()
+        self.items += 1
+        try:
+            return self._queue.get_nowait()
+        except queue.Empty:
+            pass
+        start = time.perf_counter()
+        try:
+            while not self._closed:
+                try:
+                    return self._queue.get(timeout=_POLL_SECONDS)
+                except queue.Empty:
+                    continue
+            raise PipelineClosed(self.name)
+        finally:
+            self.empty_wait_seconds += time.perf_counter() - start
+
+    def close(self):
+        """Stop both sides: pending and later puts are dropped, gets raise."""
+        self._closed = True
+        try:
+            while True:
+                self._queue.get_nowait()
+        except queue.Empty:
+            pass
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'depth': self.depth,
+            'items': self.items,
+            'mean_occupancy': round(self._occupancy / self.items, 3) if self.items else 0.0,
+            'full_wait_seconds': round(self.full_wait_seconds, 6),
+            'empty_wait_seconds': round(self.empty_wait_seconds, 6),
+        }
+
+
+class Pipeline:
+    """
+    The threads and queues of one pass.
+
+    Use as a context manager: leaving the block (normally, on an error or
+    on Ctrl-C) stops every stage thread.
+    """
+
+    def __init__(self, config: PipelineConfig):
+        self.config = config
+        self.queues: List[BoundedQueue] = []
+        self._threads: List[threading.Thread] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for bounded in self.queues:
+            bounded.close()
+        for thread in self._threads:
+            thread.join()
+
+    def _start(self, name: str, target: Callable[[], None]):
+        thread = threading.Thread(target=target, name=f"af-pipeline-{name}", daemon=True)
+        self._threads.append(thread)
+        thread.start()
+
+    def read_ahead(self, file) -> 'ReadAhead':
+        """Wrap an open binary file so blocks are read in a background thread."""
+        bounded = BoundedQueue('read', self.config.read_ahead)
+        self.queues.append(bounded)
+        reader = ReadAhead(file, bounded, self.config.block_size)
+        self._start('read', reader.run)
+        return reader
+
+    def stage(self, name: str, items: Iterable, depth: int) -> Iterator:
+        """
+        Iterate items in a thread of its own, handing them on in batches
+        through a queue of depth batches. depth=0 returns items unchanged.
+        """
+        if not depth:
+            return iter(items)
+        bounded = BoundedQueue(name, depth)
+        self.queues.append(bounded)
+        batch_size = self.config.batch_size
+
+        def produce():
+            batch = []
+            try:
+                for item in items:
+                    batch.append(item)
+                    if len(batch) >= batch_size:
+                        if not bounded.put(batch):
+                            return
+                        batch = []
+                if batch and not bounded.put(batch):
+                    return
+                bounded.put(_END)
+            except BaseException as error:
+                bounded.put(_Failure(error))
+
+        def consume():
+            while True:
+                batch = bounded.get()
+                if batch is _END:
+                    return
+                if isinstance(batch, _Failure):
+                    raise batch.error
+                yield from batch
+
+        self._start(name, produce)
+        return consume()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {bounded.name: bounded.to_dict() for bounded in self.queues}
+
+
+class ReadAhead:
+    """
+    File-like reader fed by a background thread.
+
+    read() returns the next block, whatever size is asked for, and b''
+    once the file is exhausted. It does not support seeking.
+    """
+
+    def __init__(self, file, bounded: BoundedQueue, block_size: int):
+        self._file = file
+        self._queue = bounded
+        self._block_size = block_size
+        self._eof = False
+
+    def run(self):
+        try:
+            while True:
+                block = self._file.read(self._block_size)
+                if not self._queue.put(block) or not block:
+                    return
+        except BaseException as error:
+            self._queue.put(_Failure(error))
+
+    def read(self, size: int = -1) -> bytes:
+        if self._eof:
+            return b''
+        block = self._queue.get()
+        if isinstance(block, _Failure):
+            raise block.error
+        if not block:
+            self._eof = True
+        return block
+
+    def close(self):
+        self._queue.close()
+        self._file.close()
+
+
+def add_pipeline_arguments(parser):
+    """Add the pipeline depth knobs to an argparse parser."""
+    group = parser.add_argument_group('pipelined input')
+    group.add_argument(
+        '--read-ahead',
+        type=int,
+        default=DEFAULT.read_ahead,
+        metavar='N',
+        help=f"Blocks read ahead of the decoder in a background thread; "
+             f"0 reads inline (default: {DEFAULT.read_ahead})"
+    )
+    group.add_argument(
+        '--block-size',
+        type=int,
+        default=DEFAULT.block_size,
+        metavar='BYTES',
+        help=f"Read-ahead block size (default: {DEFAULT.block_size:,})"
+    )
+    group.add_argument(
+        '--decode-queue',
+        type=int,
+        default=DEFAULT.decode_queue,
+        metavar='N',
+        help=f"Entry batches queued between the decode and predicate threads; "
+             f"0 decodes inline (default: {DEFAULT.decode_queue})"
+    )
+    group.add_argument(
+        '--predicate-queue',
+        type=int,
+        default=DEFAULT.predicate_queue,
+        metavar='N',
+        help=f"Entry batches queued between the predicate thread and the writer; "
+             f"0 runs the predicate inline (default: {DEFAULT.predicate_queue})"
+    )
+
+
+def pipeline_config(args) -> PipelineConfig:
+    """The PipelineConfig given on the command line (ValueError if out of range)."""
+    if min(args.read_ahead, args.decode_queue, args.predicate_queue) < 0:
+        raise ValueError("--read-ahead, --decode-queue and --predicate-queue must be >= 0")
+    if args.block_size < 1:
+        raise ValueError("--block-size must be positive")
+    return DEFAULT._replace(read_ahead=args.read_ahead, block_size=args.block_size,
+                            decode_queue=args.decode_queue,
+                            predicate_queue=args.predicate_queue)
@@ -0,0 +1,58 @@
+"""
+SPARQL execution shared by the detect_*.py scripts and af_detect.py.
+
+run_query() returns every row by default. In first-hit mode (fleet triage,
+where only "does this host trip the rule?" matters) it drops the trailing
+ORDER BY, pulls rows lazily from rdflib and stops as soon as the rows seen
+so far confirm a positive, instead of enumerating every contradiction.
+"""
+
+import re
+from typing import Callable, List, Optional
+
+_ORDER_BY = re.compile(r'\bORDER\s+BY\b(?:(?!\bLIMIT\b|\bOFFSET\b)[^{}])*', re.IGNORECASE)
+
+
+def without_order_by(query: str) -> str:
+    """
+    Remove the top-level ORDER BY (after the last closing brace).
+
+    Sorting forces rdflib to evaluate the whole query before yielding the
+    first row; ordering is irrelevant when only the first positive matters.
+    """
+    head, brace, tail = query.rpartition('}')
+    if not brace:
+        return query
+    return head + brace + _ORDER_BY.sub('', tail)
+
+
+def run_query(target, query: str, first_hit: bool = False,
+              is_positive: Optional[Callable[[list], bool]] = None,
+              on_row: Optional[Callable] = None) -> List:
+    """
+    Run a SPARQL SELECT against an rdflib Graph/Dataset.
+
+    Args:
+        target: Graph or Dataset to query
+        query: SPARQL query text
+        first_hit: Stop at the first confirmed positive
+        is_positive: Decides whether the rows collected so far confirm a
+            positive (default: any row does)
+        on_row: Called with each row as rdflib yields it (at once for a
+            query without ORDER BY, after the sort for one with it)
+
+    Returns:
+        List of result rows (at most those needed to confirm in first-hit mode)
+    """
+    if not first_hit and on_row is None:
+        return list(target.query(query))
+
+    is_positive = is_positive or bool
+    rows = []
+    for row in target.query(without_order_by(query) if first_hit else query):
+        rows.append(row)
+        if on_row is not None:
+            on_row(row)
+        if first_hit and is_positive(rows):
+            break
+    return rows
@@ -0,0 +1,142 @@
+"""
+Rule registry for the unified detection CLI (af_detect.py).
+
+Every AF rule stays in its own directory with its own detect_*.py and
+stream_filter_*.py scripts. A RuleSpec tells the CLI where those live,
+which evidence sources the rule needs and how its SPARQL expects them:
+
+- named_graphs=True: the query uses GRAPH <urn:graph:SOURCE> clauses and
+  runs directly against the shared Dataset
+- named_graphs=False: the query reads the default graph, so it runs
+  against a view holding only the rule's own sources
+
+Detector modules must provide report(results, triple_counts) -> exit code,
+and may provide is_positive(rows) when a single row does not by itself
+confirm a detection (used by --first-hit).
+Filter modules may provide source_predicates(sources) -> {source: predicate}
+so the CLI can prefilter each source once for all selected rules.
+
+Extra rules can be added from a plugin file that calls register().
+"""
+
+import importlib.util
+from pathlib import Path
+from types import ModuleType
+from typing import Dict, NamedTuple, Optional, Tuple
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# Evidence sources the CLI knows how to load, in load order
+SOURCES = ('mft', 'usn', 'history', 'security', 'system', 'lnk', 'office_xml')
+
+
+class RuleSpec(NamedTuple):
+    rule_id: str
+    directory: Path
+    detector: str
+    rule_file: str
+    sources: Tuple[str, ...]
+    named_graphs: bool
+    optional_sources: Tuple[str, ...] = ()
+    stream_filter: Optional[str] = None
+    description: str = ''
+
+    @property
+    def rule_path(self) -> Path:
+        return self.directory / self.rule_file
+
+    @property
+    def detector_path(self) -> Path:
+        return self.directory / self.detector
+
+    @property
+    def filter_path(self) -> Optional[Path]:
+        return self.directory / self.stream_filter if self.stream_filter else None
+
+
+RULES: Dict[str, RuleSpec] = {}
+_MODULES: Dict[Path, ModuleType] = {}
+
+
+def register(spec: RuleSpec) -> RuleSpec:
+    """Add a rule to the registry (later registrations replace earlier ones)."""
+    unknown = set(spec.sources + spec.optional_sources) - set(SOURCES)
+    if unknown:
+        raise ValueError(f"{spec.rule_id}: unknown evidence source(s): {', '.join(sorted(unknown))}")
+    RULES[spec.rule_id] = spec
+    return spec
+
+
+def load_script(path: Path) -> ModuleType:
+    """Import a script by path (AF-* directory names are not importable)."""
+    path = Path(path).resolve()
+    if path not in _MODULES:
+        name = 'af_plugin_' + '_'.join(path.relative_to(REPO_ROOT).with_suffix('').parts) \
+            if path.is_relative_to(REPO_ROOT) else 'af_plugin_' + path.stem
+        name = name.replace('-', '_')
+        module_spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(module_spec)
+        module_spec.loader.exec_module(module)
+        _MODULES[path] = module
+    return _MODULES[path]
+
+
+def load_plugin(path: Path):
+    """Execute a plugin file; it is expected to call register()."""
+    load_script(path)
+
+
+register(RuleSpec(
+    rule_id='AF-002',
+    directory=REPO_ROOT / 'AF-002',
+    detector='detect_af002.py',
+    rule_file='RULE.rq',
+    sources=('mft', 'history', 'usn'),
+    named_graphs=True,
+    stream_filter='stream_filter_af002.py',
+    description="Selective browser history deletion",
+))
+
+register(RuleSpec(
+    rule_id='AF-004',
+    directory=REPO_ROOT / 'AF-004',
+    detector='detect_af004_optimized.py',
+    rule_file='RULE_SIMPLE.rq',
+    sources=('mft', 'usn'),
+    named_graphs=True,
+    stream_filter='stream_filter_vss.py',
+    description="Volume Shadow Copy purge",
+))
+
+register(RuleSpec(
+    rule_id='AF-007',
+    directory=REPO_ROOT / 'AF-007',
+    detector='detect_af007_optimized.py',
+    rule_file='RULE.rq',
+    sources=('usn', 'security'),
+    optional_sources=('system',),
+    named_graphs=False,
+    stream_filter='stream_filter_evtx.py',
+    description="Security event log clearing",
+))
+
+register(RuleSpec(
+    rule_id='AF-TIMESTOMPING',
+    directory=REPO_ROOT / 'AF-TIMESTOMPING',
+    detector='detect_timestomp_optimized.py',
+    rule_file='rule_optimized.rq',
+    sources=('mft', 'lnk'),
+    named_graphs=False,
+    stream_filter='stream_filter_timestomp.py',
+    description="Timestamp manipulation (LNK vs MFT)",
+))
+
+register(RuleSpec(
+    rule_id='AF-TIMESTOMPING-XML',
+    directory=REPO_ROOT / 'AF-TIMESTOMPING' / 'AF-timestomping-xml',
+    detector='detect_xml_timestomp.py',
+    rule_file='rule_xml_timestomp.rq',
+    sources=('office_xml',),
+    named_graphs=False,
+    description="Timestamp manipulation (Office XML vs MFT)",
+))
@@ -0,0 +1,239 @@
+"""
+Detection result cache for the detect_*.py scripts.
+
+Rerunning a detector on unchanged evidence (to regenerate a report, say)
+should not load and query the graphs again. A cached result is keyed by:
+- the rule text (RULE.rq, RULE_SIMPLE.rq, rule_optimized.rq, ...)
+- the SHA-256 of every input file
+- the engine: its name and version (rdflib for sparql), a digest of the
+  code that produces the rows (the detector or native evaluator, and the
+  shared modules of its engine, ENGINE_SOURCES), and the options that
+  change them (--first-hit, input format)
+Changing any of these gives a new key, so stale results are never served
+and nothing has to be invalidated by hand.
+
+A hit holds the result rows (values as their string form, which is all the
+report() functions print or parse) and the counts report() shows, so the
+alert report and exit code come back without importing rdflib.
+
+Hashing a multi-GB input costs a full read, so input digests are
+remembered by (path, size, mtime, inode) in digests.json and only
+recomputed when the file changes.
+
+Scripts expose this through add_cache_arguments():
+    --cache-dir PATH   where results are kept (default: $AF_CACHE_DIR,
+                       else $XDG_CACHE_HOME/af-detect, else ~/.cache/af-detect)
+    --no-cache         neither read nor write cached results
+"""
+
+import json
+import os
+import sys
+from collections import namedtuple
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+
+from af_common.metrics import RunMetrics
+
+# hashlib (OpenSSL) is imported where it is used: at module level it would
+# cost every detector's --help path several milliseconds
+
+# Bump when the stored layout or the meaning of a key changes
+CACHE_FORMAT = 1
+
+_HASH_CHUNK = 1 << 20
+
+_COMMON = Path(__file__).resolve().parent
+# Shared code that shapes every row an engine produces, hashed into its
+# engine_id() besides the sources a detector names
+ENGINE_SOURCES = {
+    'sparql': (_COMMON / 'graph_load.py', _COMMON / 'query.py'),
+    # The JSON-LD reader (with key canonicalisation), the column tables
+    # and their time parsing, and the spilling DISTINCT
+    'native': (_COMMON / 'native.py', _COMMON / 'jsonld_stream.py', _COMMON / 'prefixes.py',
+               _COMMON / 'columns.py', _COMMON / 'timeline.py', _COMMON / 'spill.py'),
+}
+
+
+def default_cache_dir() -> Path:
+    if os.environ.get('AF_CACHE_DIR'):
+        return Path(os.environ['AF_CACHE_DIR'])
+    base = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+    return Path(base) / 'af-detect'
+
+
+def add_cache_arguments(parser):
+    """Add --cache-dir and --no-cache to an argparse parser."""
+    parser.add_argument(
+        '--cache-dir',
+        type=Path,
+        metavar='PATH',
+        help="Directory for cached detection results (default: $AF_CACHE_DIR, "
+             "else $XDG_CACHE_HOME/af-detect, else ~/.cache/af-detect)"
+    )
+    parser.add_argument(
+        '--no-cache',
+        action='store_true',
+        help="Always run the detection; do not read or write cached results"
+    )
+
+
+def rdflib_version() -> str:
+    """Installed rdflib version, read from package metadata (rdflib is not imported)."""
+    from importlib.metadata import PackageNotFoundError, version
+    try:
+        return version('rdflib')
+    except PackageNotFoundError:
+        return 'unknown'
+
+
+def engine_id(engine: str, *sources: Path) -> str:
+    """
+    Engine part of a key: the engine name, the rdflib version for 'sparql',
+    and a digest of the source files that produce the rows (the detector,
+    a native evaluator) and of the engine's ENGINE_SOURCES, so a code
+    change invalidates its cached results.
+    """
+    import hashlib
+
+    digest = hashlib.sha256()
+    for path in sources + ENGINE_SOURCES.get(engine, ()):
+        digest.update(Path(path).read_bytes())
+    version = f"rdflib-{rdflib_version()}/" if engine == 'sparql' else ''
+    return f"{engine}/{version}{digest.hexdigest()[:16]}"
+
+
+class CachedResult(NamedTuple):
+    rows: List[Any]
+    counts: Dict[str, int]
+    created: str
+
+
+class ResultCache:
+    """Result rows per key, one JSON file each, under directory/results."""
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self._digest_file = self.directory / 'digests.json'
+        self._digests: Optional[Dict[str, list]] = None
+        self.hashed_bytes = 0
+
+    # -- input digests -----------------------------------------------------
+
+    def _load_digests(self) -> Dict[str, list]:
+        if self._digests is None:
+            try:
+                self._digests = json.loads(self._digest_file.read_text())
+            except (OSError, ValueError):
+                self._digests = {}
+        return self._digests
+
+    def file_digest(self, path: Path) -> str:
+        """SHA-256 of a file, reusing the remembered one while it is unchanged."""
+        path = Path(path).resolve()
+        st = path.stat()
+        stamp = [st.st_size, st.st_mtime_ns, st.st_ino]
+        digests = self._load_digests()
+        known = digests.get(str(path))
+        if known and known[:3] == stamp:
+            return known[3]
+
+        import hashlib
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            while chunk := f.read(_HASH_CHUNK):
+                digest.update(chunk)
+        self.hashed_bytes += st.st_size
+        digests[str(path)] = stamp + [digest.hexdigest()]
+        self._write_json(self._digest_file, digests)
+        return digests[str(path)][3]
+
+    # -- results -----------------------------------------------------------
+
+    def key(self, rule: str, inputs: Sequence[Path], engine: str,
+            options: Optional[Dict[str, Any]] = None) -> str:
+        """Cache key of a detection: rule text, input contents, engine and options."""
+        import hashlib
+
+        material = {
+            'format': CACHE_FORMAT,
+            'rule': hashlib.sha256(rule.encode('utf-8')).hexdigest(),
+            'inputs': [self.file_digest(p) for p in inputs],
+            'engine': engine,
+            'options': options or {},
+        }
+        return hashlib.sha256(json.dumps(material, sort_keys=True).encode()).hexdigest()
+
+    def _result_file(self, key: str) -> Path:
+        return self.directory / 'results' / f'{key}.json'
+
+    def load(self, key: str) -> Optional[CachedResult]:
+        try:
+            data = json.loads(self._result_file(key).read_text())
+            row_type = namedtuple('CachedRow', data['fields'])
+            rows = [row_type(*values) for values in data['rows']]
+            return CachedResult(rows, data['counts'], data['created'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None  # missing or damaged: recompute
+
+    def store(self, key: str, results: Sequence[Any], counts: Dict[str, int]):
+        """
+        Save result rows: rdflib ResultRows or NamedTuples, values kept as
+        str(value) (None for unbound variables).
+        """
+        fields: List[str] = []
+        if results:
+            first = results[0]
+            fields = list(getattr(first, '_fields', None)
+                          or sorted(first.labels, key=first.labels.get))
+        data = {
+            'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'fields': fields,
+            'rows': [[None if v is None else str(v) for v in row] for row in results],
+            'counts': counts,
+        }
+        self._write_json(self._result_file(key), data)
+
+    @staticmethod
+    def _write_json(path: Path, data):
+        # A read-only or full cache directory only costs the speedup
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+            tmp.write_text(json.dumps(data))
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"WARNING: result cache not updated: {e}", file=sys.stderr)
+
+
+def open_cache(args) -> Optional[ResultCache]:
+    """The ResultCache selected by the parsed arguments, or None with --no-cache."""
+    if args.no_cache:
+        return None
+    return ResultCache(args.cache_dir or default_cache_dir())
+
+
+def lookup(cache: Optional[ResultCache], run_metrics: RunMetrics, rule: str,
+           inputs: Sequence[Path], engine: str,
+           options: Optional[Dict[str, Any]] = None):
+    """
+    Compute the key and look it up, as a 'cache' metrics stage.
+
+    Returns:
+        (key, CachedResult or None); (None, None) when caching is off
+    """
+    if cache is None:
+        return None, None
+    with run_metrics.stage('cache') as stage:
+        with stage.timed('read'):
+            key = cache.key(rule, inputs, engine, options)
+            hit = cache.load(key)
+        stage.bytes = cache.hashed_bytes
+        stage.records = len(hit.rows) if hit else 0
+        stage.extra['cache_hit'] = hit is not None
+    if hit:
+        print(f"Cached result from {hit.created} (rule, inputs and engine unchanged; "
+              f"--no-cache to rerun)")
+    return key, hit
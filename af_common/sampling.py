@@ -0,0 +1,272 @@
+"""
+Approximate triage for the stream filters: run a filter's predicates on
+a spread sample of byte ranges and estimate how many entries it would
+keep, instead of reading the whole export.
+
+The @graph bytes of an input are cut into N equal strata, and one range
+of --sample-span bytes is placed at a random offset inside each stratum
+(seeded, so a rerun reads the same ranges). JsonLdReader.entry_boundary()
+snaps each range to the next entry, and the entries that start inside
+the range are decoded and tested. An entry belongs to the range its
+preceding boundary falls in, so every entry of the file has the same
+chance, span / stratum width, of being read.
+
+Totals are the per-range counts scaled to the whole graph:
+
+    estimate = (graph bytes / span) * mean(count per range)
+
+The confidence bounds use the normal approximation over the N ranges,
+with the finite population correction. The lower bound is never below
+the number of matches actually seen. When no range matched, the upper
+bound is the Poisson bound, -ln(1 - confidence) / sampled fraction
+(about 3 / fraction at 95%), so a clean sample still bounds the count.
+If the ranges would cover the whole graph, the input is scanned in full
+and the counts are exact.
+
+Scripts expose this through add_sampling_arguments():
+    --sample N            estimate from N ranges per input, write nothing
+    --sample-span BYTES   bytes per range
+    --sample-seed N       seed for the range offsets
+    --confidence LEVEL    confidence level of the bounds
+"""
+
+import math
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from af_common.jsonld_stream import JsonLdFormatError, JsonLdReader
+from af_common.metrics import RunMetrics, StageMetrics
+
+DEFAULT_SPAN = 1 << 18
+
+
+class SampleConfig(NamedTuple):
+    ranges: int
+    span: int = DEFAULT_SPAN
+    seed: int = 0
+    confidence: float = 0.95
+
+
+class Estimate(NamedTuple):
+    value: float
+    low: float
+    high: float
+
+
+class SampleResult(NamedTuple):
+    """What one input's sample saw, and the totals estimated from it."""
+    ranges: int
+    span: int
+    graph_bytes: int
+    entries: int
+    matched: int
+    exact: bool
+    total: Estimate
+    matches: Estimate
+
+    @property
+    def fraction(self) -> float:
+        """Share of the graph's bytes the ranges covered."""
+        if self.exact or not self.graph_bytes:
+            return 1.0
+        return min(self.ranges * self.span / self.graph_bytes, 1.0)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'ranges': self.ranges,
+            'span_bytes': self.span,
+            'sampled_fraction': round(self.fraction, 6),
+            'exact': self.exact,
+            'sampled_entries': self.entries,
+            'sampled_matches': self.matched,
+            'estimated_entries': self.total._asdict(),
+            'estimated_matches': self.matches._asdict(),
+        }
+
+
+def _estimate(counts: List[int], scale: float, fraction: float, z: float,
+              confidence: float) -> Estimate:
+    """Scaled total of per-range counts, with its confidence bounds."""
+    ranges = len(counts)
+    seen = sum(counts)
+    mean = seen / ranges
+    value = scale * mean
+    variance = sum((c - mean) ** 2 for c in counts) / (ranges - 1) if ranges > 1 else 0.0
+    half = z * scale * math.sqrt(max(1.0 - fraction, 0.0) * variance / ranges)
+    high = value + half
+    if not seen:
+        high = max(high, -math.log(1.0 - confidence) / fraction)
+    return Estimate(round(value, 1), round(max(seen, value - half), 1), round(high, 1))
+
+
+def sample_jsonld(
+    input_file: Path,
+    predicate: Callable[[Dict[str, Any]], bool],
+    config: SampleConfig,
+    metrics: Optional[StageMetrics] = None,
+) -> SampleResult:
+    """Estimate the entries of input_file and how many predicate keeps."""
+    import random
+    from statistics import NormalDist
+
+    clock = time.perf_counter
+    predicate_seconds = decode_seconds = 0.0
+    entry_counts: List[int] = []
+    match_counts: List[int] = []
+
+    with JsonLdReader(input_file, chunk_size=min(config.span, 1 << 20),
+                      canonical_keys=True) as reader:
+        graph_start = reader.graph_offset
+        graph_bytes = max(reader.size - graph_start, 1)
+        stride = graph_bytes / config.ranges
+        exact = config.span >= stride
+        if exact:
+            span, starts = graph_bytes, [graph_start]
+        else:
+            span = config.span
+            rng = random.Random(config.seed)
+            starts = [graph_start + int(i * stride + rng.random() * (stride - span))
+                      for i in range(config.ranges)]
+
+        for start in starts:
+            end = start + span
+            entries = matched = 0
+            t0 = clock()
+            boundary = reader.entry_boundary(start)
+            if boundary is not None and boundary < end:
+                reader.seek_entry(boundary)
+                for entry, offset in reader:
+                    t1 = clock()
+                    decode_seconds += t1 - t0
+                    entries += 1
+                    if predicate(entry):
+                        matched += 1
+                    t0 = clock()
+                    predicate_seconds += t0 - t1
+                    if offset >= end:
+                        break
+            decode_seconds += clock() - t0
+            entry_counts.append(entries)
+            match_counts.append(matched)
+        read_seconds = reader.read_seconds
+
+    ranges = len(starts)
+    fraction = 1.0 if exact else ranges * span / graph_bytes
+    scale = graph_bytes / span
+    z = NormalDist().inv_cdf(0.5 + config.confidence / 2)
+    result = SampleResult(
+        ranges=ranges,
+        span=span,
+        graph_bytes=graph_bytes,
+        entries=sum(entry_counts),
+        matched=sum(match_counts),
+        exact=exact,
+        total=_estimate(entry_counts, scale, fraction, z, config.confidence),
+        matches=_estimate(match_counts, scale, fraction, z, config.confidence),
+    )
+
+    if metrics:
+        metrics.add('read', read_seconds)
+        metrics.add('decode', max(decode_seconds - read_seconds, 0.0))
+        metrics.add('predicate', predicate_seconds)
+        metrics.records += result.entries
+        metrics.matched = (metrics.matched or 0) + result.matched
+        metrics.bytes += int(fraction * graph_bytes)
+        metrics.extra['sample'] = result.to_dict()
+    return result
+
+
+def _bounds(estimate: Estimate) -> str:
+    return f"{estimate.value:,.0f} ({estimate.low:,.0f} – {estimate.high:,.0f})"
+
+
+def sample_sources(predicates: Dict[str, Callable[[Dict[str, Any]], bool]],
+                   sources: Dict[str, Path], config: SampleConfig,
+                   run_metrics: RunMetrics) -> Optional[Dict[str, SampleResult]]:
+    """
+    Sample every source that has a predicate, printing each estimate.
+    Returns None, after printing the error, if an input cannot be split.
+    """
+    results = {}
+    for source, input_file in sources.items():
+        if source not in predicates or input_file is None:
+            continue
+        print(f"\n{'='*60}")
+        print(f"Sampling {source.upper()}: {input_file.name}")
+        print(f"  Input size: {input_file.stat().st_size / (1024**2):.1f} MB")
+        print(f"{'='*60}")
+        try:
+            with run_metrics.stage(f"sample:{source}") as stage:
+                result = sample_jsonld(input_file, predicates[source], config, stage)
+        except JsonLdFormatError as e:
+            print(f"ERROR: {e}", file=sys.stderr)
+            return None
+        results[source] = result
+
+        if result.exact:
+            print(f"  Ranges cover the whole input: scanned in full (exact counts)")
+        else:
+            print(f"  Sampled {result.ranges} ranges of {result.span:,} bytes "
+                  f"({100 * result.fraction:.1f}% of input, seed {config.seed})")
+        print(f"  Entries read: {result.entries:,} ({result.matched:,} matched)")
+        level = f"{100 * config.confidence:g}%"
+        print(f"  Estimated entries: {_bounds(result.total)}  [{level} bounds]")
+        print(f"  Estimated matches: {_bounds(result.matches)}  [{level} bounds]")
+
+    print(f"\n{'='*60}")
+    print("SAMPLING COMPLETE (estimates only, no files written)")
+    print(f"{'='*60}")
+    for source, result in results.items():
+        print(f"{source.upper()}: ~{_bounds(result.matches)} matching "
+              f"of ~{result.total.value:,.0f} entries")
+    print(f"\nRun without --sample for the exact filtered files.")
+    return results
+
+
+def add_sampling_arguments(parser):
+    """Add --sample, --sample-span, --sample-seed and --confidence to a parser."""
+    group = parser.add_argument_group('sampling (approximate triage)')
+    group.add_argument(
+        '--sample',
+        type=int,
+        default=0,
+        metavar='N',
+        help="Estimate match counts from N byte ranges spread over each input "
+             "instead of filtering it; writes no output files (default: 0, full pass)"
+    )
+    group.add_argument(
+        '--sample-span',
+        type=int,
+        default=DEFAULT_SPAN,
+        metavar='BYTES',
+        help=f"Bytes per sampled range (default: {DEFAULT_SPAN:,})"
+    )
+    group.add_argument(
+        '--sample-seed',
+        type=int,
+        default=0,
+        metavar='N',
+        help="Seed for the range offsets; the same seed reads the same ranges (default: 0)"
+    )
+    group.add_argument(
+        '--confidence',
+        type=float,
+        default=0.95,
+        metavar='LEVEL',
+        help="Confidence level of the estimate bounds (default: 0.95)"
+    )
+
+
+def sampling_config(args) -> Optional[SampleConfig]:
+    """The SampleConfig given on the command line, None without --sample."""
+    if args.sample < 0:
+        raise ValueError("--sample must be >= 0")
+    if not args.sample:
+        return None
+    if args.sample_span < 1:
+        raise ValueError("--sample-span must be positive")
+    if not 0 < args.confidence < 1:
+        raise ValueError("--confidence must be between 0 and 1")
+    return SampleConfig(args.sample, args.sample_span, args.sample_seed, args.confidence)
@@ -0,0 +1,466 @@
+"""
+Memory budget for the filters and native join engines, with spill to disk.
+
+Without a budget, the structures that grow with the evidence are plain
+in-memory sets and dicts: the LNK references that AF-TIMESTOMPING's MFT
+pass probes, and the distinct bindings of the native AF-004 and AF-007
+engines. With --memory-limit, each of them charges its estimated size to
+a MemoryBudget shared by the run, and once the budget is exhausted moves
+to temporary run files partitioned by key hash, as in a grace hash join:
+
+    SpillingSet         build side of a semi-join; semi_join_positions()
+                        partitions the probe side by the same hash and
+                        joins one partition pair at a time
+    SpillingDistinct    DISTINCT records in first-seen order; each
+                        partition is deduplicated on its own, then the
+                        partitions are merged back by first-seen position
+
+A partition that still would not fit is split again with another hash,
+up to MAX_DEPTH times. Joins and merges keep the input order, so results
+and output files are identical to the in-memory path. The cost is one
+write and one read of the spilled data, plus pickling.
+
+Sizes are estimates of the Python objects held (sys.getsizeof over the
+record, plus a hash-table slot), not RSS: the budget bounds what grows
+with the input, not the interpreter, the decoder's buffers or the result
+rows a detector reports.
+
+Scripts expose this through add_memory_arguments():
+    --memory-limit SIZE   budget for accumulated matches and join build
+                          sides, e.g. 512M or 2G (default: unlimited)
+    --spill-dir DIR       directory for the run files (default: system temp)
+"""
+
+import os
+import re
+import sys
+from pathlib import Path
+from typing import Any, Dict, Hashable, Iterable, Iterator, List, Optional, Tuple
+
+# Run files per spill, and per split of a partition that is still too large
+PARTITIONS = 64
+# Splits of one partition before it is loaded whatever its size
+MAX_DEPTH = 2
+# Records pickled together in a run file, and in the runs merged at the
+# end (the merge holds one batch of every run)
+_BATCH = 1024
+_MERGE_BATCH = 64
+# Hash-table slot and entry overhead charged per record
+_SLOT_BYTES = 72
+# In-memory bytes per byte of a loaded run (small tuples of strings)
+_LOAD_FACTOR = 4
+
+_UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+_SIZE = re.compile(r'\s*(\d+(?:\.\d+)?)\s*([KMGT]?)(?:I?B)?\s*', re.IGNORECASE)
+
+
+def parse_size(text: str) -> int:
+    """Bytes in a size such as 1048576, 64K, 512M or 1.5G (binary units)."""
+    match = _SIZE.fullmatch(text)
+    if not match:
+        raise ValueError(f"invalid size {text!r} (expected e.g. 512M or 2G)")
+    size = int(float(match.group(1)) * _UNITS[match.group(2).upper()])
+    if size < 1:
+        raise ValueError(f"size must be positive: {text!r}")
+    return size
+
+
+def estimate_size(value: Any) -> int:
+    """Rough bytes held by value: sys.getsizeof, recursing into containers."""
+    size = sys.getsizeof(value)
+    if isinstance(value, (tuple, list, set, frozenset)):
+        size += sum(estimate_size(item) for item in value)
+    elif isinstance(value, dict):
+        size += sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    return size
+
+
+class MemoryBudget:
+    """Bytes that the spilling structures of one run may hold between them."""
+
+    def __init__(self, limit: int, directory: Optional[Path] = None):
+        self.limit = limit
+        self.directory = Path(directory) if directory else None
+        self.used = 0
+        self.peak = 0
+        self.spills = 0
+        self.spilled_bytes = 0
+
+    def reserve(self, size: int) -> bool:
+        """Charge size bytes; False (nothing charged) if that exceeds the limit."""
+        if self.used + size > self.limit:
+            return False
+        self.used += size
+        self.peak = max(self.peak, self.used)
+        return True
+
+    def release(self, size: int):
+        self.used -= size
+
+    def mkdtemp(self) -> Path:
+        """A directory for run files, removed when the process exits."""
+        import atexit
+        import shutil
+        import tempfile
+
+        if self.directory:
+            self.directory.mkdir(parents=True, exist_ok=True)
+        path = Path(tempfile.mkdtemp(prefix='af_spill_', dir=self.directory))
+        atexit.register(shutil.rmtree, path, True)
+        return path
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'limit_bytes': self.limit,
+            'peak_bytes': self.peak,
+            'spills': self.spills,
+            'spilled_bytes': self.spilled_bytes,
+        }
+
+
+class _RunWriter:
+    """A run file of pickled record batches."""
+
+    def __init__(self, path: Path, batch: int = _BATCH):
+        import pickle
+        self._dump = pickle.dump
+        self._protocol = pickle.HIGHEST_PROTOCOL
+        self.path = path
+        self._file = open(path, 'wb')
+        self._batch: List[Any] = []
+        self._batch_size = batch
+
+    def write(self, record: Any):
+        self._batch.append(record)
+        if len(self._batch) >= self._batch_size:
+            self._dump(self._batch, self._file, self._protocol)
+            self._batch = []
+
+    def close(self) -> int:
+        """Close the run; returns its size in bytes."""
+        if self._batch:
+            self._dump(self._batch, self._file, self._protocol)
+            self._batch = []
+        size = self._file.tell()
+        self._file.close()
+        return size
+
+
+def _read_run(path: Path, remove: bool = False) -> Iterator[Any]:
+    """The records of a run file in write order, optionally deleting it after."""
+    import pickle
+
+    with open(path, 'rb') as file:
+        while True:
+            try:
+                batch = pickle.load(file)
+            except EOFError:
+                break
+            yield from batch
+    if remove:
+        path.unlink()
+
+
+class _Partitions:
+    """Run files of records routed by a hash of their key, one hash per depth."""
+
+    def __init__(self, directory: Path, prefix: str, depth: int, count: int = PARTITIONS):
+        self.directory = directory
+        self.prefix = prefix
+        self.depth = depth
+        self.count = count
+        self._writers: List[Optional[_RunWriter]] = [None] * count
+
+    def write(self, key: Hashable, record: Any):
+        index = hash((self.depth, key)) % self.count
+        writer = self._writers[index]
+        if writer is None:
+            writer = self._writers[index] = _RunWriter(
+                self.directory / f"{self.prefix}-{index}.run")
+        writer.write(record)
+
+    def close(self) -> Tuple[List[Optional[Path]], int]:
+        """(run path per partition, None where empty; bytes written)."""
+        size = 0
+        for writer in self._writers:
+            if writer is not None:
+                size += writer.close()
+        return [writer.path if writer else None for writer in self._writers], size
+
+
+def _too_large(run: Path, budget: MemoryBudget, depth: int) -> bool:
+    return depth < MAX_DEPTH and os.path.getsize(run) * _LOAD_FACTOR > budget.limit
+
+
+def _split_count(run: Path, budget: MemoryBudget) -> int:
+    """Parts to split an oversized run into so that each one fits the budget."""
+    return min(PARTITIONS, os.path.getsize(run) * _LOAD_FACTOR // budget.limit + 2)
+
+
+class SpillingSet:
+    """
+    A set of keys that moves to partitioned run files when over budget.
+
+    Membership tests work until it spills; a spilled set is probed through
+    semi_join_positions(). len() is exact until then and afterwards counts
+    each key once per spill it was added after (an upper bound).
+    """
+
+    def __init__(self, budget: MemoryBudget, name: str = 'set'):
+        self.budget = budget
+        self.name = name
+        self._keys: set = set()
+        self._charged = 0
+        self._written = 0
+        self._directory: Optional[Path] = None
+        self._partitions: Optional[_Partitions] = None
+        self._runs: Optional[List[Optional[Path]]] = None
+
+    @property
+    def spilled(self) -> bool:
+        return self._partitions is not None
+
+    def add(self, key: Hashable):
+        if self._partitions is not None:
+            self._partitions.write(key, key)
+            self._written += 1
+            return
+        if key in self._keys:
+            return
+        size = estimate_size(key) + _SLOT_BYTES
+        if not self.budget.reserve(size):
+            self._spill()
+            self.add(key)
+            return
+        self._keys.add(key)
+        self._charged += size
+
+    def _spill(self):
+        self._directory = self.budget.mkdtemp()
+        self._partitions = _Partitions(self._directory, f"{self.name}-build", 0)
+        for key in self._keys:
+            self._partitions.write(key, key)
+        self._written = len(self._keys)
+        self._keys = set()
+        self.budget.release(self._charged)
+        self._charged = 0
+        self.budget.spills += 1
+
+    def __contains__(self, key: Hashable) -> bool:
+        if self._partitions is not None:
+            raise RuntimeError(f"{self.name} has spilled to disk; join with semi_join_positions()")
+        return key in self._keys
+
+    def __len__(self) -> int:
+        return self._written if self._partitions is not None else len(self._keys)
+
+    def runs(self) -> List[Optional[Path]]:
+        """The build-side run per partition (None where empty); no more adds."""
+        if self._runs is None:
+            self._runs, size = self._partitions.close()
+            self.budget.spilled_bytes += size
+        return self._runs
+
+
+def semi_join_positions(build: SpillingSet,
+                        probe: Iterable[Tuple[int, Iterable[Hashable]]]) -> Iterator[int]:
+    """
+    Ascending positions of the probe records with a key in build.
+
+    probe yields (position, keys) by ascending position. Until build has
+    spilled this is a set test per record. A spilled build side is joined
+    as a grace hash join: the probe keys are partitioned by the same hash,
+    each partition pair is joined with only its build keys in memory, and
+    the matching positions of all partitions are merged back into order.
+    The probe side is consumed before this returns.
+    """
+    if not build.spilled:
+        return iter([position for position, keys in probe
+                     if any(key in build for key in keys)])
+
+    import heapq
+
+    budget = build.budget
+    probes = _Partitions(build._directory, f"{build.name}-probe", 0)
+    for position, keys in probe:
+        for key in keys:
+            probes.write(key, (key, position))
+    probe_runs, size = probes.close()
+    budget.spilled_bytes += size
+
+    matches: List[Path] = []
+    for build_run, probe_run in zip(build.runs(), probe_runs):
+        matches.extend(_join_partition(build_run, probe_run, 0, budget))
+
+    def merged() -> Iterator[int]:
+        last = None
+        for position in heapq.merge(*(_read_run(run, remove=True) for run in matches)):
+            # A record that matched on several keys appears once per key
+            if position != last:
+                last = position
+                yield position
+
+    return merged()
+
+
+def _join_partition(build_run: Optional[Path], probe_run: Optional[Path],
+                    depth: int, budget: MemoryBudget) -> List[Path]:
+    """Runs of the matching probe positions of one partition pair, each ascending."""
+    if build_run is None or probe_run is None:
+        for run in (build_run, probe_run):
+            if run is not None:
+                run.unlink()
+        return []
+
+    if _too_large(build_run, budget, depth):
+        # Split both sides again with the next depth's hash
+        count = _split_count(build_run, budget)
+        runs = []
+        for run in (build_run, probe_run):
+            split = _Partitions(run.parent, run.stem, depth + 1, count)
+            for record in _read_run(run, remove=True):
+                split.write(record if run is build_run else record[0], record)
+            paths, size = split.close()
+            budget.spilled_bytes += size
+            runs.append(paths)
+        matches = []
+        for sub_build, sub_probe in zip(*runs):
+            matches.extend(_join_partition(sub_build, sub_probe, depth + 1, budget))
+        return matches
+
+    keys = set(_read_run(build_run, remove=True))
+    out = _RunWriter(probe_run.with_suffix('.match'), _MERGE_BATCH)
+    for key, position in _read_run(probe_run, remove=True):
+        if key in keys:
+            out.write(position)
+    out.close()
+    return [out.path]
+
+
+class SpillingDistinct:
+    """
+    DISTINCT records in first-seen order, spilling past the budget.
+
+    add(key, value) keeps the first value added per key; iterating yields
+    the kept values in the order their keys were first added. Once over
+    budget, the records held are written to partitioned runs (with their
+    first-seen position) and memory is reused for the next ones. A budget
+    of None never spills. len() is exact until the first spill and an upper
+    bound after it.
+    """
+
+    def __init__(self, budget: Optional[MemoryBudget], name: str = 'distinct'):
+        self.budget = budget
+        self.name = name
+        self._records: Dict[Hashable, Tuple[int, Any]] = {}
+        self._position = 0
+        self._charged = 0
+        self._written = 0
+        self._partitions: Optional[_Partitions] = None
+
+    @property
+    def spilled(self) -> bool:
+        return self._partitions is not None
+
+    def add(self, key: Hashable, value: Any):
+        position = self._position
+        self._position += 1
+        if key in self._records:
+            return
+        if self.budget is not None:
+            size = estimate_size(key) + estimate_size(value) + _SLOT_BYTES
+            if not self.budget.reserve(size):
+                self._flush()
+                if not self.budget.reserve(size):
+                    # Other structures hold the budget: straight to disk
+                    self._partitions.write(key, (position, key, value))
+                    self._written += 1
+                    return
+            self._charged += size
+        self._records[key] = (position, value)
+
+    def _flush(self):
+        """Write the records held to the partition runs and release their budget."""
+        if self._partitions is None:
+            self._partitions = _Partitions(self.budget.mkdtemp(), self.name, 0)
+            self.budget.spills += 1
+        for key, (position, value) in self._records.items():
+            self._partitions.write(key, (position, key, value))
+        self._written += len(self._records)
+        self._records = {}
+        self.budget.release(self._charged)
+        self._charged = 0
+
+    def __len__(self) -> int:
+        return self._written + len(self._records)
+
+    def __iter__(self) -> Iterator[Any]:
+        if self._partitions is None:
+            return (value for _, value in self._records.values())
+
+        import heapq
+        from operator import itemgetter
+
+        self._flush()
+        runs, size = self._partitions.close()
+        self.budget.spilled_bytes += size
+        distinct: List[Path] = []
+        for run in runs:
+            if run is not None:
+                distinct.extend(_distinct_partition(run, 0, self.budget))
+        # Positions are unique across partitions, since each key has one
+        return (value for _, value in
+                heapq.merge(*(_read_run(run, remove=True) for run in distinct),
+                            key=itemgetter(0)))
+
+
+def _distinct_partition(run: Path, depth: int, budget: MemoryBudget) -> List[Path]:
+    """Runs of (position, value) of the first record per key, each ascending."""
+    if _too_large(run, budget, depth):
+        split = _Partitions(run.parent, run.stem, depth + 1, _split_count(run, budget))
+        for record in _read_run(run, remove=True):
+            split.write(record[1], record)
+        paths, size = split.close()
+        budget.spilled_bytes += size
+        return [out for path in paths if path is not None
+                for out in _distinct_partition(path, depth + 1, budget)]
+
+    from operator import itemgetter
+
+    first: Dict[Hashable, Tuple[int, Any]] = {}
+    for position, key, value in _read_run(run, remove=True):
+        kept = first.get(key)
+        if kept is None or position < kept[0]:
+            first[key] = (position, value)
+    out = _RunWriter(run.with_suffix('.distinct'), _MERGE_BATCH)
+    for record in sorted(first.values(), key=itemgetter(0)):
+        out.write(record)
+    out.close()
+    return [out.path]
+
+
+def add_memory_arguments(parser):
+    """Add --memory-limit and --spill-dir to an argparse parser."""
+    group = parser.add_argument_group('memory budget')
+    group.add_argument(
+        '--memory-limit',
+        metavar='SIZE',
+        help="Budget for accumulated matches and join build sides, e.g. 512M or 2G; "
+             "past it they spill to partitioned run files on disk (default: unlimited)"
+    )
+    group.add_argument(
+        '--spill-dir',
+        metavar='DIR',
+        help="Directory for spilled run files (default: the system temp directory)"
+    )
+
+
+def memory_budget(args) -> Optional[MemoryBudget]:
+    """The MemoryBudget given on the command line, None if unlimited (ValueError if invalid)."""
+    if args.memory_limit is None:
+        return None
+    try:
+        limit = parse_size(args.memory_limit)
+    except ValueError as e:
+        raise ValueError(f"--memory-limit: {e}") from None
+    return MemoryBudget(limit, Path(args.spill_dir) if args.spill_dir else None)
@@ -0,0 +1,178 @@
+"""
+Single-pass, resumable JSON-LD filter shared by the stream_filter_* scripts.
+
+filter_jsonld() reads one input entry at a time, keeps the entries a
+predicate accepts and writes them straight to the output file. When a
+CheckpointStore is given, progress is saved periodically (and on Ctrl-C)
+so an interrupted pass can be resumed with identical output.
+
+Reading, decoding and the predicate run as concurrent pipeline stages
+(af_common/pipeline.py); the caller's thread writes and checkpoints.
+
+Given a StageMetrics, the pass records its read/decode/predicate/write
+times, entries scanned and kept, input bytes consumed and the occupancy
+of the pipeline queues. With concurrent stages, each time is the time
+spent in that stage's own thread, so they no longer add up to the wall
+time.
+"""
+
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from af_common.checkpoint import CheckpointStore
+from af_common.jsonld_stream import JsonLdReader, JsonLdWriter
+from af_common.metrics import StageMetrics
+from af_common.pipeline import Pipeline, PipelineConfig, default_config
+
+# How often (in scanned entries) the wall clock is consulted for checkpoints
+_CHECKPOINT_POLL = 1000
+
+
+def filter_jsonld(
+    input_file: Path,
+    output_file: Path,
+    predicate: Callable[[Dict[str, Any]], bool],
+    *,
+    bare_list_without_context: bool = False,
+    checkpoints: Optional[CheckpointStore] = None,
+    on_progress: Optional[Callable[[int, int, float], None]] = None,
+    progress_every: int = 10000,
+    metrics: Optional[StageMetrics] = None,
+    pipeline: Optional[PipelineConfig] = None,
+) -> Tuple[int, int]:
+    """
+    Stream entries from input_file to output_file, keeping those where
+    predicate(entry) is true.
+
+    Args:
+        bare_list_without_context: write a bare array instead of
+            {"@context": {}, "@graph": [...]} when the input has no @context
+        checkpoints: enables periodic checkpointing / resuming of this pass
+        on_progress: called as (scanned, matched, fraction_of_input_read)
+        metrics: receives this pass's per-operation timings and counters
+        pipeline: queue depths of the read/decode/predicate stages
+            (default: af_common.pipeline.default_config())
+
+    Returns:
+        (total_entries, filtered_entries)
+    """
+    state = checkpoints.lookup(input_file, output_file) if checkpoints else None
+
+    if state and state['complete']:
+        print(f"  Resuming: pass already complete "
+              f"({state['matched']:,} / {state['total']:,} entries)")
+        if metrics:
+            metrics.extra['skipped'] = True
+        return state['total'], state['matched']
+
+    total = state['total'] if state else 0
+    matched = state['matched'] if state else 0
+    start_offset = state['input_offset'] if state else None
+
+    if state:
+        print(f"  Resuming from checkpoint at byte {start_offset:,} "
+              f"({total:,} scanned, {matched:,} kept)")
+
+    config = pipeline or default_config()
+    with JsonLdReader(input_file, start_offset=start_offset,
+                      canonical_keys=True) as reader, \
+            Pipeline(config) as stages:
+        context = reader.context
+        if bare_list_without_context and not context:
+            header = None
+        else:
+            header = {'@context': context if context is not None else {}}
+
+        writer = JsonLdWriter(
+            output_file,
+            header,
+            resume_position=state['output_position'] if state else None,
+            written=matched,
+        )
+
+        def save(offset: int, scanned: int, kept: int, position: int):
+            writer.flush(durable=True)
+            checkpoints.save(input_file, output_file,
+                             input_offset=offset, total=scanned, matched=kept,
+                             output_position=position)
+
+        # Consistent snapshot after the last fully processed entry, so an
+        # interrupt mid-entry never records a half-written state.
+        last_offset = start_offset if start_offset is not None else reader.graph_offset
+        last_total, last_matched, last_position = total, matched, writer.position
+        last_save = time.monotonic()
+
+        # Per-entry timing costs a few perf_counter() calls, well under 1%
+        # of decoding an entry, so it is always on
+        clock = time.perf_counter
+        iterate_seconds = predicate_seconds = write_seconds = 0.0
+        first_offset, first_total, first_matched = last_offset, total, matched
+
+        def decoded():
+            nonlocal iterate_seconds
+            t0 = clock()
+            for entry, offset in reader:
+                iterate_seconds += clock() - t0
+                yield entry, offset
+                t0 = clock()
+
+        def judged(entries):
+            nonlocal predicate_seconds
+            for entry, offset in entries:
+                t0 = clock()
+                keep = predicate(entry)
+                predicate_seconds += clock() - t0
+                yield entry, offset, keep
+
+        try:
+            if config.read_ahead:
+                reader.read_ahead(stages)
+            entries = stages.stage('decode', decoded(), config.decode_queue)
+            for entry, offset, keep in stages.stage('predicate', judged(entries),
+                                                    config.predicate_queue):
+                total += 1
+                if keep:
+                    t0 = clock()
+                    writer.write(entry)
+                    matched += 1
+                    write_seconds += clock() - t0
+                last_offset, last_total, last_matched = offset, total, matched
+                last_position = writer.position
+
+                if checkpoints and total % _CHECKPOINT_POLL == 0:
+                    now = time.monotonic()
+                    if now - last_save >= checkpoints.interval:
+                        save(offset, total, matched, writer.position)
+                        last_save = now
+
+                if on_progress and total % progress_every == 0:
+                    on_progress(total, matched, offset / reader.size if reader.size else 1.0)
+        except KeyboardInterrupt:
+            if checkpoints:
+                save(last_offset, last_total, last_matched, last_position)
+                print(f"\n  Interrupted: checkpoint saved at byte {last_offset:,}; "
+                      f"rerun with --resume to continue")
+            writer.abandon()
+            raise
+        except BaseException:
+            writer.abandon()
+            raise
+
+        writer.close()
+        if metrics:
+            metrics.add('read', reader.read_seconds)
+            metrics.add('decode', max(iterate_seconds - reader.read_seconds, 0.0))
+            metrics.add('predicate', predicate_seconds)
+            metrics.add('write', write_seconds)
+            metrics.records += total - first_total
+            metrics.matched = (metrics.matched or 0) + matched - first_matched
+            metrics.bytes += reader.offset - first_offset
+            if stages.queues:
+                metrics.extra['queues'] = stages.stats()
+        if checkpoints:
+            checkpoints.save(input_file, output_file,
+                             input_offset=reader.offset, total=total, matched=matched,
+                             output_position=writer.position, complete=True)
+
+    return total, matched
@@ -0,0 +1,551 @@
+"""
+Cross-artifact super-timeline: build once, query by time range.
+
+Each detector reasons about the timestamps of its own sources. The
+timeline puts every timestamp of every source on one time axis:
+
+    USN updateTimestamp, EVTX startTime, MFT created/modified/accessed/
+    record change 0x10 and 0x30, LNK target created/modified/accessed,
+    Office dcterms created/modified, History visitTime
+
+build_timeline() streams each JSON-LD input (JsonLdReader, one entry at a
+time) and turns every such timestamp into an event:
+
+    (time, source, property, node @id, subject, detail)
+
+subject is the file name, target file name, event ID or URL the time
+belongs to, and detail the USN update reasons or event log channel.
+Events are buffered up to run_size, sorted and written to a run file on
+disk. The runs are k-way merged (heapq.merge, at most MAX_FAN_IN files at
+a time) into the timeline. Memory therefore stays bounded by run_size
+whatever the number of events, and 100M+ events only cost disk space.
+Ties keep input order, so a build is deterministic.
+
+File layout (little endian):
+    MAGIC, u32 header length, JSON header (source and property tables)
+    records: <q time_ns, u8 source, u8 property, u16 lengths of node,
+             subject, detail> + their UTF-8 bytes, in time order
+    index:   <q time_ns, Q offset> for every INDEX_STRIDE-th record
+    footer:  <Q records, Q index offset, Q index entries> + MAGIC
+
+Times are nanoseconds since the epoch, UTC; times without a zone are taken
+as UTC, as rdflib compares them. Timeline.query(start, end) bisects the
+sparse index and reads only the records in the range:
+
+    with Timeline('case.aftl') as timeline:
+        for event in timeline.query('2025-09-11T05:56:00Z', '2025-09-11T05:58:00Z'):
+            print(event.iso, event.source, event.property, event.subject)
+"""
+
+import heapq
+import json
+import re
+import struct
+import tempfile
+import time
+from bisect import bisect_left
+from datetime import date, datetime, timedelta, timezone
+from operator import itemgetter
+from pathlib import Path
+from typing import (Any, Dict, Iterable, Iterator, List, NamedTuple, Optional,
+                    Sequence, Tuple, Union)
+
+from af_common.jsonld_stream import JsonLdReader
+from af_common.metrics import RunMetrics
+
+MAGIC = b'AFTL\x01\r\n\x00'
+FORMAT = 1
+
+# Timestamp properties put on the timeline, by local name (any prefix)
+TIME_PROPERTIES = (
+    'updateTimestamp',                                   # USN
+    'startTime',                                         # EVTX
+    'created0x10', 'lastModified0x10', 'lastAccess0x10', 'lastRecordChange0x10',
+    'created0x30', 'lastModified0x30', 'lastAccess0x30', 'lastRecordChange0x30',
+    'targetCreatedTime', 'targetModifiedTime', 'targetAccessedTime',  # LNK
+    'dctermsCreated', 'dctermsModified',                 # Office
+    'visitTime',                                         # History
+)
+# What a time belongs to, first found in the facet holding it, then anywhere
+SUBJECT_PROPERTIES = ('targetFileName', 'fileName', 'eventID', 'fullValue')
+DETAIL_PROPERTIES = ('updateReasons', 'channel')
+
+DEFAULT_RUN_SIZE = 250_000
+MAX_FAN_IN = 64
+INDEX_STRIDE = 256
+
+_RECORD = struct.Struct('<qBBHHH')
+_INDEX = struct.Struct('<qQ')
+_FOOTER = struct.Struct('<QQQ8s')
+_LENGTH = struct.Struct('<I')
+_MAX_FIELD = 0xFFFF
+_BUFFER = 1 << 20
+
+_ISO_TIME = re.compile(
+    r'\s*(\d{4})-(\d{2})-(\d{2})[T ](\d{2}):(\d{2}):(\d{2})(?:[.,](\d+))?'
+    r'\s*(Z|[+-]\d{2}:?\d{2})?\s*$')
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+TimeLike = Union[int, str, datetime]
+
+
+def parse_time_ns(text: str) -> Optional[int]:
+    """ISO 8601 date-time to nanoseconds since the epoch (UTC), or None."""
+    match = _ISO_TIME.match(text)
+    if not match:
+        return None
+    year, month, day, hour, minute, second, fraction, zone = match.groups()
+    try:
+        days = date(int(year), int(month), int(day)).toordinal() - _EPOCH_ORDINAL
+    except ValueError:
+        return None
+    seconds = days * 86400 + int(hour) * 3600 + int(minute) * 60 + int(second)
+    if zone and zone != 'Z':
+        sign = -1 if zone[0] == '-' else 1
+        zone = zone[1:].replace(':', '')
+        seconds -= sign * (int(zone[:2]) * 3600 + int(zone[2:]) * 60)
+    return seconds * 1_000_000_000 + int((fraction or '')[:9].ljust(9, '0'))
+
+
+def format_ns(value: int) -> str:
+    """Nanoseconds since the epoch as ISO 8601 UTC (fraction only as needed)."""
+    seconds, nanos = divmod(value, 1_000_000_000)
+    text = (datetime(1970, 1, 1) + timedelta(seconds=seconds)).strftime('%Y-%m-%dT%H:%M:%S')
+    if nanos:
+        text += '.' + f'{nanos:09d}'.rstrip('0')
+    return text + 'Z'
+
+
+def to_ns(value: TimeLike) -> int:
+    """A query bound (ns int, ISO string or datetime) as nanoseconds UTC."""
+    if isinstance(value, int):
+        return value
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        delta = value - datetime(1970, 1, 1, tzinfo=timezone.utc)
+        return (delta.days * 86400 + delta.seconds) * 1_000_000_000 + delta.microseconds * 1000
+    parsed = parse_time_ns(value)
+    if parsed is None:
+        raise ValueError(f"not an ISO 8601 date-time: {value!r}")
+    return parsed
+
+
+class TimelineEvent(NamedTuple):
+    time_ns: int
+    source: str
+    property: str
+    node: str
+    subject: str
+    detail: str
+
+    @property
+    def iso(self) -> str:
+        return format_ns(self.time_ns)
+
+
+# -- extraction ----------------------------------------------------------------
+
+_IGNORED, _TIME, _SUBJECT, _DETAIL = range(4)
+
+
+def _text(value: Any) -> Optional[str]:
+    if isinstance(value, dict):
+        value = value.get('@value')
+    elif isinstance(value, list):
+        value = value[0] if value else None
+        if isinstance(value, dict):
+            value = value.get('@value')
+    if value is None or isinstance(value, (dict, list)):
+        return None
+    return str(value)
+
+
+class EventExtractor:
+    """
+    Turns entries into events. What a JSON key is (time property, subject,
+    detail or neither) is worked out once per distinct key, so an entry
+    costs one dict lookup per member.
+    """
+
+    def __init__(self, properties: Sequence[str] = TIME_PROPERTIES):
+        self._prop_ids = {name: i for i, name in enumerate(properties)}
+        self._roles: Dict[str, Tuple[int, int]] = {}
+
+    def _role(self, key: str) -> Tuple[int, int]:
+        name = re.split(r'[:/#]', key)[-1]
+        if name in self._prop_ids:
+            role = (_TIME, self._prop_ids[name])
+        elif name in SUBJECT_PROPERTIES:
+            role = (_SUBJECT, SUBJECT_PROPERTIES.index(name))
+        elif name in DETAIL_PROPERTIES:
+            role = (_DETAIL, DETAIL_PROPERTIES.index(name))
+        else:
+            role = (_IGNORED, 0)
+        self._roles[key] = role
+        return role
+
+    def events(self, entry: Dict[str, Any]) -> List[Tuple[int, int, str, str, str]]:
+        """(time_ns, property id, node, subject, detail) for each timestamp of an entry."""
+        facets = entry.get('core:hasFacet', [])
+        if not isinstance(facets, list):
+            facets = [facets]
+        roles = self._roles
+
+        # Per node: its timestamps and its best-ranked subject and detail
+        nodes = []
+        entry_subject = entry_detail = None
+        for node in [entry] + facets:
+            if not isinstance(node, dict):
+                continue
+            times = []
+            subject = detail = None
+            for key, value in node.items():
+                kind, rank = roles.get(key) or self._role(key)
+                if kind == _IGNORED:
+                    continue
+                if kind == _TIME:
+                    times.append((rank, value))
+                    continue
+                text = _text(value)
+                if not text:
+                    continue
+                if kind == _SUBJECT and (subject is None or rank < subject[0]):
+                    subject = (rank, text)
+                elif kind == _DETAIL and (detail is None or rank < detail[0]):
+                    detail = (rank, text)
+            if subject and entry_subject is None:
+                entry_subject = subject[1]
+            if detail and entry_detail is None:
+                entry_detail = detail[1]
+            if times:
+                nodes.append((times, subject))
+
+        events = []
+        node_id = str(entry.get('@id', ''))
+        for times, subject in nodes:
+            subject = subject[1] if subject else entry_subject or ''
+            for prop, value in times:
+                for item in value if isinstance(value, list) else [value]:
+                    text = _text(item)
+                    stamp = parse_time_ns(text) if text else None
+                    if stamp is not None:
+                        events.append((stamp, prop, node_id, subject, entry_detail or ''))
+        return events
+
+
+# -- build -------------------------------------------------------------------
+
+def _encode(stamp: int, source: int, prop: int, node: str, subject: str, detail: str) -> bytes:
+    fields = [text.encode('utf-8')[:_MAX_FIELD] for text in (node, subject, detail)]
+    return _RECORD.pack(stamp, source, prop, *map(len, fields)) + b''.join(fields)
+
+
+def _read_records(f, end: Optional[int] = None) -> Iterator[Tuple[int, bytes]]:
+    """(time_ns, raw record) from the current position up to byte offset end."""
+    read = f.read
+    position = f.tell()
+    while end is None or position < end:
+        head = read(_RECORD.size)
+        if len(head) < _RECORD.size:
+            return
+        stamp, _, _, a, b, c = _RECORD.unpack(head)
+        body = read(a + b + c)
+        position += _RECORD.size + len(body)
+        yield stamp, head + body
+
+
+def _merge(runs: List[Path], output, on_record=None) -> int:
+    """k-way merge sorted run files into output (stable: earlier runs first)."""
+    files = [open(run, 'rb', buffering=_BUFFER) for run in runs]
+    try:
+        count = 0
+        for stamp, record in heapq.merge(*map(_read_records, files), key=itemgetter(0)):
+            if on_record:
+                on_record(stamp, record)
+            output.write(record)
+            count += 1
+        return count
+    finally:
+        for f in files:
+            f.close()
+
+
+class _TimelineWriter:
+    def __init__(self, path: Path, sources: Sequence[str], properties: Sequence[str]):
+        self.path = Path(path)
+        self._tmp = self.path.with_name(self.path.name + '.tmp')
+        self._file = open(self._tmp, 'wb', buffering=_BUFFER)
+        header = json.dumps({'format': FORMAT, 'sources': list(sources),
+                             'properties': list(properties)}).encode()
+        self._file.write(MAGIC + _LENGTH.pack(len(header)) + header)
+        self._offset = len(MAGIC) + _LENGTH.size + len(header)
+        self.count = 0
+        self._index: List[bytes] = []
+
+    def add(self, stamp: int, record: bytes):
+        if self.count % INDEX_STRIDE == 0:
+            self._index.append(_INDEX.pack(stamp, self._offset))
+        self._offset += len(record)
+        self.count += 1
+
+    def write(self, record: bytes):
+        self._file.write(record)
+
+    def close(self):
+        index_offset = self._offset
+        self._file.write(b''.join(self._index))
+        self._file.write(_FOOTER.pack(self.count, index_offset, len(self._index), MAGIC))
+        self._file.close()
+        self._tmp.replace(self.path)
+
+    def abandon(self):
+        self._file.close()
+        self._tmp.unlink(missing_ok=True)
+
+
+def build_timeline(inputs: Sequence[Tuple[str, Path]], output: Path,
+                   run_size: int = DEFAULT_RUN_SIZE, tmp_dir: Optional[Path] = None,
+                   run_metrics: Optional[RunMetrics] = None,
+                   properties: Sequence[str] = TIME_PROPERTIES) -> int:
+    """
+    Build a timeline file from (source name, JSON-LD path) inputs. A
+    'history' input may also be the Chrome History SQLite database, whose
+    urls.last_visit_time become visitTime events.
+
+    Args:
+        run_size: events held in memory before a sorted run is spilled
+        tmp_dir: where runs are spilled (default: next to output)
+        run_metrics: gets a stage per input (records = entries, matched =
+            events) and a 'merge' stage
+
+    Returns:
+        Number of events on the timeline
+    """
+    sources = [name for name, _ in inputs]
+    if len(set(sources)) != len(sources) or len(sources) > 255:
+        raise ValueError("timeline inputs need distinct source names (at most 255)")
+    from af_common.history_db import is_history_db, iter_visit_times
+
+    extractor = EventExtractor(properties)
+    visit_prop = properties.index('visitTime') if 'visitTime' in properties else None
+    run_metrics = run_metrics or RunMetrics('timeline')
+
+    with tempfile.TemporaryDirectory(prefix='aftl-', dir=tmp_dir or Path(output).parent) as tmp:
+        runs: List[Path] = []
+        buffer: List[Tuple[int, bytes]] = []
+
+        def spill():
+            buffer.sort(key=itemgetter(0))
+            run = Path(tmp) / f'run-{len(runs):06d}'
+            with open(run, 'wb', buffering=_BUFFER) as f:
+                f.write(b''.join(record for _, record in buffer))
+            runs.append(run)
+            buffer.clear()
+
+        for source_id, (source, path) in enumerate(inputs):
+            if source == 'history' and visit_prop is not None and is_history_db(path):
+                with run_metrics.stage(source) as stage:
+                    events = 0
+                    for row_id, url, stamp in iter_visit_times(path, stage):
+                        buffer.append((stamp, _encode(stamp, source_id, visit_prop,
+                                                      f'urls/{row_id}', url, '')))
+                        events += 1
+                        if len(buffer) >= run_size:
+                            with stage.timed('write'):
+                                spill()
+                    stage.matched = events
+                continue
+            with run_metrics.stage(source) as stage, \
+                    JsonLdReader(path, canonical_keys=True) as reader:
+                events = 0
+                start = time.perf_counter()
+                for entry, _ in reader:
+                    stage.records += 1
+                    for stamp, prop, node, subject, detail in extractor.events(entry):
+                        buffer.append((stamp, _encode(stamp, source_id, prop, node,
+                                                      subject, detail)))
+                        events += 1
+                        if len(buffer) >= run_size:
+                            with stage.timed('write'):
+                                spill()
+                stage.add('decode', time.perf_counter() - start
+                          - stage.seconds.get('write', 0.0) - reader.read_seconds)
+                stage.add('read', reader.read_seconds)
+                stage.bytes, stage.matched = reader.offset, events
+
+        writer = _TimelineWriter(output, sources, properties)
+        try:
+            with run_metrics.stage('merge') as stage, stage.timed('merge'):
+                stage.extra['spilled_runs'] = len(runs) + bool(buffer and runs)
+                if not runs:
+                    # Everything fitted in memory: no run files needed
+                    buffer.sort(key=itemgetter(0))
+                    for stamp, record in buffer:
+                        writer.add(stamp, record)
+                        writer.write(record)
+                else:
+                    if buffer:
+                        spill()
+                    # Bounded fan-in: merge consecutive groups until one pass is left
+                    level = 0
+                    while len(runs) > MAX_FAN_IN:
+                        merged = []
+                        for i in range(0, len(runs), MAX_FAN_IN):
+                            group = runs[i:i + MAX_FAN_IN]
+                            target = Path(tmp) / f'merge-{level}-{i:06d}'
+                            with open(target, 'wb', buffering=_BUFFER) as f:
+                                _merge(group, f)
+                            for run in group:
+                                run.unlink()
+                            merged.append(target)
+                        runs, level = merged, level + 1
+                    _merge(runs, writer, on_record=writer.add)
+                stage.records = writer.count
+        except BaseException:
+            writer.abandon()
+            raise
+        writer.close()
+    return writer.count
+
+
+# -- query -------------------------------------------------------------------
+
+class Timeline:
+    """
+    Read access to a timeline file.
+
+    Attributes:
+        sources, properties: the names records refer to
+        count: number of events; start_ns / end_ns: first and last time
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._file = open(self.path, 'rb', buffering=1 << 16)
+        try:
+            self._open()
+        except BaseException:
+            self._file.close()
+            raise
+
+    def _open(self):
+        f = self._file
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{self.path.name}: not a timeline file")
+        (length,) = _LENGTH.unpack(f.read(_LENGTH.size))
+        header = json.loads(f.read(length))
+        if header.get('format') != FORMAT:
+            raise ValueError(f"{self.path.name}: unsupported timeline format {header.get('format')}")
+        self.sources: List[str] = header['sources']
+        self.properties: List[str] = header['properties']
+        self._data_offset = len(MAGIC) + _LENGTH.size + length
+
+        f.seek(-_FOOTER.size, 2)
+        self.count, index_offset, entries, magic = _FOOTER.unpack(f.read(_FOOTER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{self.path.name}: truncated timeline file")
+        self._end_offset = index_offset
+        f.seek(index_offset)
+        index = list(_INDEX.iter_unpack(f.read(entries * _INDEX.size)))
+        self._index_times = [stamp for stamp, _ in index]
+        self._index_offsets = [offset for _, offset in index]
+
+        self.start_ns = self._index_times[0] if index else None
+        self.end_ns = None
+        if index:
+            for stamp, _ in self._scan(self._index_offsets[-1]):
+                self.end_ns = stamp
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _scan(self, offset: int) -> Iterator[Tuple[int, bytes]]:
+        self._file.seek(offset)
+        return _read_records(self._file, self._end_offset)
+
+    def _decode(self, record: bytes) -> TimelineEvent:
+        stamp, source, prop, a, b, c = _RECORD.unpack_from(record)
+        body = record[_RECORD.size:]
+        return TimelineEvent(stamp, self.sources[source], self.properties[prop],
+                             body[:a].decode('utf-8', 'replace'),
+                             body[a:a + b].decode('utf-8', 'replace'),
+                             body[a + b:a + b + c].decode('utf-8', 'replace'))
+
+    def query(self, start: Optional[TimeLike] = None, end: Optional[TimeLike] = None,
+              sources: Optional[Iterable[str]] = None,
+              properties: Optional[Iterable[str]] = None,
+              limit: Optional[int] = None) -> Iterator[TimelineEvent]:
+        """
+        Events with start <= time <= end (either bound optional), in time
+        order, optionally only from the given sources / properties.
+        """
+        if not self._index_offsets:
+            return
+        low = to_ns(start) if start is not None else None
+        high = to_ns(end) if end is not None else None
+        source_ids = {self.sources.index(s) for s in sources if s in self.sources} \
+            if sources is not None else None
+        prop_ids = {self.properties.index(p) for p in properties if p in self.properties} \
+            if properties is not None else None
+
+        # The index point before the first one >= low may still hold
+        # records >= low, so the scan starts there
+        point = 0 if low is None else max(bisect_left(self._index_times, low) - 1, 0)
+        produced = 0
+        for stamp, record in self._scan(self._index_offsets[point]):
+            if low is not None and stamp < low:
+                continue
+            if high is not None and stamp > high:
+                return
+            if source_ids is not None and record[8] not in source_ids:
+                continue
+            if prop_ids is not None and record[9] not in prop_ids:
+                continue
+            yield self._decode(record)
+            produced += 1
+            if limit is not None and produced >= limit:
+                return
+
+    def window(self, center: TimeLike, seconds: float, **filters) -> Iterator[TimelineEvent]:
+        """Events within +/- seconds of center."""
+        middle = to_ns(center)
+        margin = int(seconds * 1_000_000_000)
+        return self.query(middle - margin, middle + margin, **filters)
+
+
+def print_context(path: Path, windows: Sequence[Tuple[str, TimeLike, TimeLike]],
+                  limit: int = 40):
+    """
+    Print the events of each (title, start, end) window of a timeline:
+    the cross-artifact context the detectors show with --timeline.
+    """
+    print("=" * 70)
+    print(f"Timeline Context ({Path(path).name})")
+    print("=" * 70)
+    with Timeline(path) as timeline:
+        for title, start, end in windows:
+            start, end = to_ns(start), to_ns(end)
+            events = list(timeline.query(start, end, limit=limit + 1))
+            print()
+            print(f"{title}: {format_ns(start)} .. {format_ns(end)}")
+            for event in events[:limit]:
+                detail = f" [{event.detail}]" if event.detail else ''
+                print(f"  {event.iso:<31} {event.source:<10} {event.property:<20} "
+                      f"{event.subject}{detail}")
+            if len(events) > limit:
+                print(f"  ... first {limit} shown (af_timeline.py query {path} "
+                      f"--start {format_ns(start)} --end {format_ns(end)})")
+            if not events:
+                print("  (no events)")
+    print("=" * 70)
@@ -0,0 +1,294 @@
+"""
+Streaming USN record coalescing.
+
+A single file operation leaves many USN records: Windows appends one
+record each time a new reason bit is set on an open file, and one more
+(with the accumulated reasons plus Close) when the last handle closes.
+A History or Security.evtx write therefore shows up as a run like
+
+    DataExtend
+    DataOverwrite|DataExtend
+    DataOverwrite|DataExtend|DataTruncation|Close
+
+and every one of those records is carried into the graph, where it
+multiplies the join cardinality of the rules that look at USN.
+
+UsnCoalescer merges the records of one file change into one span entry.
+Records are keyed by the file reference (entryNumber, sequenceNumber).
+A record joins the open span of its key, and a span ends at the record
+that carries Close. It also ends early when the record's name or parent
+differs, since a rename must stay visible to filename filters, and when
+the record is more than max_span seconds after the span's first one:
+files such as Security.evtx stay open for days, and a single span would
+hide when within it a truncation happened. For the same reason, a record
+that brings a reason the rules compare times on (TIMED_REASONS: AF-007
+orders DataTruncation against the Event 1102 log clear) starts a new
+span unless the span already has it. The span holding the reason then
+begins at the record where it first appeared, and its updateTimestamp is
+that record's time. Each span is written as its first record, with:
+
+    dfc-ext:updateReasons          every reason of the span (OR'ed), in
+                                   order of first appearance
+    dfc-ext:updateTimestamp        first record's timestamp
+    dfc-ext:lastUpdateTimestamp    last record's timestamp
+    dfc-ext:lastUpdateSequenceNumber
+    dfc-ext:coalescedRecords       number of records merged
+
+A span is written when it closes, so output follows close order rather
+than journal order. Entries without a single plain UsnFacet (other
+evidence, multi-valued or @id-referenced facets) pass through unchanged.
+Memory is bounded by the files open at once; past max_open, the oldest
+open span is written as it stands.
+"""
+
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from af_common.jsonld_stream import JsonLdReader, JsonLdWriter
+from af_common.metrics import StageMetrics
+
+USN_FACET = 'dfc-ext:UsnFacet'
+FILE_FACET = 'observable:FileFacet'
+
+# Open spans kept before the oldest is written unfinished
+DEFAULT_MAX_OPEN = 100_000
+# Longest time from a span's first record to its last
+DEFAULT_MAX_SPAN = 60.0
+# Reasons (and reasons containing them, e.g. NamedDataTruncation) that a
+# span may only gain at its first record, so updateTimestamp times them
+TIMED_REASONS = ('DataTruncation',)
+
+
+def _has_type(facet: Dict[str, Any], type_name: str) -> bool:
+    types = facet.get('@type')
+    return types == type_name or (isinstance(types, list) and type_name in types)
+
+
+def _scalar(value: Any) -> Any:
+    """Plain value of a literal ({"@value": ...} or bare), None if not a single value."""
+    if isinstance(value, dict):
+        if set(value) - {'@type', '@value'}:
+            return None
+        value = value.get('@value')
+    if isinstance(value, (list, dict)):
+        return None
+    return value
+
+
+class _Span:
+    __slots__ = ('entry', 'facet', 'identity', 'start_ns', 'reasons',
+                 'last_timestamp', 'last_usn', 'count')
+
+    def __init__(self, entry, facet, identity, start_ns, reasons):
+        self.entry = entry
+        self.facet = facet
+        self.identity = identity
+        self.start_ns = start_ns
+        self.reasons = dict.fromkeys(reasons)
+        self.last_timestamp = facet.get('dfc-ext:updateTimestamp')
+        self.last_usn = facet.get('dfc-ext:updateSequenceNumber')
+        self.count = 1
+
+    def add(self, facet, reasons):
+        for reason in reasons:
+            self.reasons.setdefault(reason)
+        self.last_timestamp = facet.get('dfc-ext:updateTimestamp', self.last_timestamp)
+        self.last_usn = facet.get('dfc-ext:updateSequenceNumber', self.last_usn)
+        self.count += 1
+
+    def finish(self) -> Dict[str, Any]:
+        """The span's entry: the first record with the span's fields set on its UsnFacet."""
+        merged = {}
+        for key, value in self.facet.items():
+            if key == 'dfc-ext:updateReasons':
+                value = '|'.join(self.reasons)
+            merged[key] = value
+            if key == 'dfc-ext:updateTimestamp' and self.last_timestamp is not None:
+                merged['dfc-ext:lastUpdateTimestamp'] = self.last_timestamp
+        if self.last_usn is not None:
+            merged['dfc-ext:lastUpdateSequenceNumber'] = self.last_usn
+        # Typed like the record's own integers, so no prefix is assumed in @context
+        number = self.facet['dfc-ext:entryNumber']
+        merged['dfc-ext:coalescedRecords'] = (
+            {'@type': number['@type'], '@value': str(self.count)}
+            if isinstance(number, dict) and '@type' in number else self.count)
+        facets = self.entry['core:hasFacet']
+        self.entry['core:hasFacet'] = [merged if facet is self.facet else facet for facet in facets]
+        return self.entry
+
+
+class UsnCoalescer:
+    """
+    Merge the USN records of each file change into one span entry.
+
+    feed() takes entries in journal order and returns the entries that are
+    complete (closed spans and passed-through entries); flush() returns the
+    spans still open at the end of the input.
+    """
+
+    def __init__(self, max_open: int = DEFAULT_MAX_OPEN, max_span: float = DEFAULT_MAX_SPAN,
+                 timed_reasons=TIMED_REASONS):
+        self.max_open = max_open
+        self.max_span_ns = int(max_span * 1_000_000_000)
+        self.timed_reasons = tuple(timed_reasons)
+        # Imported here: the timeline module's imports would slow every CLI's startup
+        from af_common.timeline import parse_time_ns
+        self._parse_time = parse_time_ns
+        self.records = 0
+        self.spans = 0
+        self._open: Dict[Tuple[Any, Any], _Span] = {}
+
+    def _adds_timed_reason(self, span: _Span, reasons: List[str]) -> bool:
+        """Does the record bring a TIMED_REASONS reason the span does not have?"""
+        return any(reason not in span.reasons and any(timed in reason for timed in self.timed_reasons)
+                   for reason in reasons)
+
+    def _record(self, entry: Dict[str, Any]):
+        """(key, identity, time in ns, UsnFacet, reasons) of a coalescable record, or None."""
+        facets = entry.get('core:hasFacet')
+        if not isinstance(facets, list):
+            return None
+        usn_facets = [f for f in facets if isinstance(f, dict) and _has_type(f, USN_FACET)]
+        if len(usn_facets) != 1:
+            return None
+        facet = usn_facets[0]
+        reasons = facet.get('dfc-ext:updateReasons')
+        entry_number = _scalar(facet.get('dfc-ext:entryNumber'))
+        sequence_number = _scalar(facet.get('dfc-ext:sequenceNumber'))
+        if not isinstance(reasons, str) or entry_number is None or sequence_number is None:
+            return None
+
+        names = tuple(f.get('observable:fileName') for f in facets
+                      if isinstance(f, dict) and _has_type(f, FILE_FACET))
+        identity = (entry.get('@type'), names,
+                    _scalar(facet.get('dfc-ext:parentEntryNumber')),
+                    _scalar(facet.get('dfc-ext:parentSequenceNumber')),
+                    facet.get('dfc-ext:parentPath'))
+        timestamp = _scalar(facet.get('dfc-ext:updateTimestamp'))
+        stamp = self._parse_time(timestamp) if isinstance(timestamp, str) else None
+        return (entry_number, sequence_number), identity, stamp, facet, reasons.split('|')
+
+    def feed(self, entry: Dict[str, Any]) -> List[Dict[str, Any]]:
+        record = self._record(entry)
+        if record is None:
+            return [entry]
+        self.records += 1
+        key, identity, stamp, facet, reasons = record
+
+        done = []
+        span = self._open.get(key)
+        if span is not None and (
+                span.identity != identity
+                or (stamp is None) != (span.start_ns is None)
+                or (stamp is not None and stamp - span.start_ns > self.max_span_ns)
+                or self._adds_timed_reason(span, reasons)):
+            done.append(self._close(key))
+            span = None
+        if span is None:
+            span = self._open[key] = _Span(entry, facet, identity, stamp, reasons)
+            if len(self._open) > self.max_open:
+                done.append(self._close(next(iter(self._open))))
+        else:
+            span.add(facet, reasons)
+
+        if 'Close' in reasons and key in self._open:
+            done.append(self._close(key))
+        return done
+
+    def flush(self) -> List[Dict[str, Any]]:
+        return [self._close(key) for key in list(self._open)]
+
+    def _close(self, key) -> Dict[str, Any]:
+        self.spans += 1
+        return self._open.pop(key).finish()
+
+
+def coalesce_jsonld(input_file: Path, output_file: Path,
+                    max_span: float = DEFAULT_MAX_SPAN,
+                    max_open: int = DEFAULT_MAX_OPEN,
+                    metrics: Optional[StageMetrics] = None) -> Tuple[int, int]:
+    """
+    Stream a USN JSON-LD file into its coalesced view.
+
+    Returns:
+        (usn_records_read, spans_written)
+    """
+    coalescer = UsnCoalescer(max_open, max_span)
+    clock = time.perf_counter
+    iterate_seconds = coalesce_seconds = write_seconds = 0.0
+    entries = 0
+
+    with JsonLdReader(input_file, canonical_keys=True) as reader:
+        context = reader.context
+        writer = JsonLdWriter(output_file, {'@context': context} if context is not None else None)
+        try:
+            t0 = clock()
+            for entry, _ in reader:
+                t1 = clock()
+                entries += 1
+                done = coalescer.feed(entry)
+                t2 = clock()
+                for item in done:
+                    writer.write(item)
+                t3 = clock()
+                iterate_seconds += t1 - t0
+                coalesce_seconds += t2 - t1
+                write_seconds += t3 - t2
+                t0 = clock()
+            for item in coalescer.flush():
+                writer.write(item)
+        except BaseException:
+            writer.abandon()
+            raise
+        writer.close()
+
+    if metrics:
+        metrics.add('read', reader.read_seconds)
+        metrics.add('decode', max(iterate_seconds - reader.read_seconds, 0.0))
+        metrics.add('coalesce', coalesce_seconds)
+        metrics.add('write', write_seconds)
+        metrics.records += entries
+        metrics.bytes += reader.size
+        metrics.matched = (metrics.matched or 0) + writer.written
+        metrics.extra['usn_records'] = coalescer.records
+        metrics.extra['spans'] = coalescer.spans
+    return coalescer.records, coalescer.spans
+
+
+def add_coalesce_arguments(parser):
+    """Add --coalesce-usn and --coalesce-span to an argparse parser."""
+    parser.add_argument(
+        '--coalesce-usn',
+        action='store_true',
+        help="Merge the USN records of each file change into one span "
+             "(first/last timestamp, OR'ed reasons) before the rules see them"
+    )
+    parser.add_argument(
+        '--coalesce-span',
+        type=float,
+        default=DEFAULT_MAX_SPAN,
+        metavar='SECONDS',
+        help=f"Longest USN span when coalescing (default: {DEFAULT_MAX_SPAN:g})"
+    )
+
+
+def coalesce_usn_file(input_file: Path, output_file: Path, max_span: float = DEFAULT_MAX_SPAN,
+                      metrics: Optional[StageMetrics] = None) -> Path:
+    """
+    Write the coalesced view of a USN file, reporting the reduction.
+
+    output_file may be input_file: the view is written next to it first
+    and then replaces it.
+    """
+    print(f"Coalescing USN records: {input_file.name}...")
+    start = time.perf_counter()
+    partial = output_file.with_name(output_file.name + '.coalescing')
+    try:
+        records, spans = coalesce_jsonld(input_file, partial, max_span=max_span, metrics=metrics)
+        partial.replace(output_file)
+    finally:
+        partial.unlink(missing_ok=True)
+    print(f"  ✓ {records:,} USN records → {spans:,} spans "
+          f"({time.perf_counter() - start:.2f}s) → {output_file}")
+    return output_file
@@ -0,0 +1,292 @@
+"""
+SQLite work queue for distributing AF jobs across nodes.
+
+af_batch.py --queue submits one job per filter pass and per detector run
+(e.g. AF-007's USN, Security and System passes, then detect_af007); any
+number of af_worker.py processes, on this or other nodes, lease jobs from
+the same queue file, run them and record the result.
+
+- Leases: a leased job belongs to its worker until lease_expires; workers
+  heartbeat to extend it, and a job whose worker died is leased again once
+  the lease runs out
+- Retries: a job that fails transiently (killed, could not start, lease
+  expired) is retried until it has been attempted max_attempts times,
+  then marked failed; exit code 1 (bad input, missing file) would fail
+  the same way again and fails the job at once
+- Dependencies: a job is only leased once every job in depends_on is done;
+  if one of them failed, the job is cancelled
+- Results: exit code, worker, attempts and timings (including the run
+  time of every attempt, run_seconds) stay in the queue for the
+  submitter to collect
+
+Job commands are stored as argument lists whose first element is the
+script path relative to the repository root, so workers can have the
+repository checked out anywhere. Evidence and output paths are used as
+given and must be on storage every worker can reach. The queue file itself
+must be on a filesystem with working POSIX locks (local disk or NFSv4 with
+locking; not SMB or eventually consistent object storage).
+"""
+
+import json
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Set
+
+# Detector/filter exit codes that count as success (2 = detection positive)
+SUCCESS_EXIT_CODES = (0, 2)
+# Exit codes a rerun would repeat (1 = error: missing or invalid input)
+PERMANENT_EXIT_CODES = (1,)
+
+STATUSES = ('queued', 'leased', 'done', 'failed', 'cancelled')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id            TEXT PRIMARY KEY,
+    batch         TEXT NOT NULL,
+    host          TEXT NOT NULL,
+    rule          TEXT NOT NULL,
+    step          TEXT NOT NULL,
+    command       TEXT NOT NULL,
+    depends_on    TEXT NOT NULL DEFAULT '[]',
+    log           TEXT,
+    status        TEXT NOT NULL DEFAULT 'queued',
+    attempts      INTEGER NOT NULL DEFAULT 0,
+    max_attempts  INTEGER NOT NULL DEFAULT 3,
+    worker        TEXT,
+    lease_expires REAL,
+    exit_code     INTEGER,
+    error         TEXT,
+    submitted     REAL NOT NULL,
+    started       REAL,
+    finished      REAL,
+    run_seconds   REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, submitted);
+CREATE INDEX IF NOT EXISTS jobs_batch ON jobs (batch);
+"""
+
+
+class Job(NamedTuple):
+    id: str
+    batch: str
+    host: str
+    rule: str
+    step: str
+    command: List[str]
+    depends_on: List[str]
+    log: Optional[str]
+    status: str
+    attempts: int
+    max_attempts: int
+    worker: Optional[str]
+    lease_expires: Optional[float]
+    exit_code: Optional[int]
+    error: Optional[str]
+    submitted: float
+    started: Optional[float]
+    finished: Optional[float]
+    run_seconds: float
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> 'Job':
+        values = dict(row)
+        values['command'] = json.loads(values['command'])
+        values['depends_on'] = json.loads(values['depends_on'])
+        return cls(**values)
+
+
+class WorkQueue:
+    """A job queue in a single SQLite file shared by submitters and workers."""
+
+    def __init__(self, path: Path, timeout: float = 30.0):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Autocommit; writes that must be atomic use explicit BEGIN IMMEDIATE
+        self._db = sqlite3.connect(str(self.path), timeout=timeout, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.executescript(_SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        """Add the columns a queue file created by an older version lacks."""
+        self._transaction()
+        try:
+            columns = {row['name'] for row in self._db.execute("PRAGMA table_info(jobs)")}
+            if 'run_seconds' not in columns:
+                self._db.execute("ALTER TABLE jobs ADD COLUMN run_seconds REAL NOT NULL DEFAULT 0")
+            self._db.execute('COMMIT')
+        except BaseException:
+            self._db.execute('ROLLBACK')
+            raise
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _transaction(self):
+        # Take the write lock up front so two workers never lease the same job
+        self._db.execute('BEGIN IMMEDIATE')
+
+    @staticmethod
+    def job_id(batch: str, host: str, rule: str, step: str) -> str:
+        return f"{batch}:{host}/{rule}/{step}"
+
+    def submit(self, batch: str, host: str, rule: str, step: str, command: Sequence[str],
+               depends_on: Sequence[str] = (), log: Optional[str] = None,
+               max_attempts: int = 3) -> str:
+        """
+        Queue a job and return its id (see job_id()).
+
+        Resubmitting an existing id leaves the job as it is, so a batch can
+        be submitted again after an interruption without rerunning work.
+        """
+        job_id = self.job_id(batch, host, rule, step)
+        self._db.execute(
+            "INSERT OR IGNORE INTO jobs (id, batch, host, rule, step, command, depends_on,"
+            " log, max_attempts, submitted) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, batch, host, rule, step, json.dumps(list(command)),
+             json.dumps(list(depends_on)), log, max_attempts, time.time()))
+        return job_id
+
+    def lease(self, worker: str, lease_seconds: float) -> Optional[Job]:
+        """
+        Take the oldest runnable job for worker, or None if nothing is runnable.
+
+        Runnable means queued, or leased by a worker whose lease expired,
+        with every dependency done. Jobs whose dependencies failed are
+        cancelled on the way.
+        """
+        now = time.time()
+        self._transaction()
+        try:
+            self._settle(now)
+            for row in self._db.execute(
+                    "SELECT * FROM jobs WHERE status = 'queued' ORDER BY submitted, id").fetchall():
+                if self._dependency_statuses(row) - {'done'}:
+                    continue
+                self._db.execute(
+                    "UPDATE jobs SET status = 'leased', worker = ?, lease_expires = ?,"
+                    " attempts = attempts + 1, started = ?, error = NULL WHERE id = ?",
+                    (worker, now + lease_seconds, now, row['id']))
+                job = self._db.execute("SELECT * FROM jobs WHERE id = ?", (row['id'],)).fetchone()
+                self._db.execute('COMMIT')
+                return Job.from_row(job)
+
+            self._db.execute('COMMIT')
+            return None
+        except BaseException:
+            self._db.execute('ROLLBACK')
+            raise
+
+    def _dependency_statuses(self, row: sqlite3.Row) -> Set[str]:
+        statuses = set()
+        for dep in json.loads(row['depends_on']):
+            found = self._db.execute("SELECT status FROM jobs WHERE id = ?", (dep,)).fetchone()
+            statuses.add(found['status'] if found else 'missing')
+        return statuses
+
+    def _settle(self, now: float):
+        """Requeue or fail expired leases, then cancel jobs that can never run."""
+        # The attempt is charged up to its lease expiry, the latest it can have run
+        self._db.execute(
+            "UPDATE jobs SET status = CASE WHEN attempts >= max_attempts"
+            " THEN 'failed' ELSE 'queued' END,"
+            " error = 'lease expired on ' || COALESCE(worker, '?'),"
+            " finished = CASE WHEN attempts >= max_attempts THEN ? ELSE NULL END,"
+            " run_seconds = run_seconds + MAX(lease_expires - started, 0),"
+            " worker = NULL, lease_expires = NULL"
+            " WHERE status = 'leased' AND lease_expires < ?", (now, now))
+
+        # Repeat so cancellations propagate down dependency chains
+        changed = True
+        while changed:
+            changed = False
+            for row in self._db.execute(
+                    "SELECT id, depends_on FROM jobs WHERE status = 'queued'"
+                    " AND depends_on != '[]'").fetchall():
+                if self._dependency_statuses(row) & {'failed', 'cancelled', 'missing'}:
+                    self._db.execute(
+                        "UPDATE jobs SET status = 'cancelled', finished = ?,"
+                        " error = 'a dependency failed' WHERE id = ?", (now, row['id']))
+                    changed = True
+
+    def heartbeat(self, job_id: str, worker: str, lease_seconds: float) -> bool:
+        """Extend a lease; False if the job is no longer leased by worker."""
+        cursor = self._db.execute(
+            "UPDATE jobs SET lease_expires = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+            (time.time() + lease_seconds, job_id, worker))
+        return cursor.rowcount == 1
+
+    def finish(self, job_id: str, worker: str, exit_code: Optional[int],
+               error: Optional[str] = None) -> str:
+        """
+        Record a finished attempt and return the job's new status.
+
+        Success exit codes mark the job done, and permanent ones failed;
+        anything else requeues it until max_attempts is reached. A worker
+        that lost its lease cannot overwrite the result of whoever holds it
+        now.
+        """
+        now = time.time()
+        self._transaction()
+        try:
+            row = self._db.execute(
+                "SELECT status, worker, attempts, max_attempts, started FROM jobs WHERE id = ?",
+                (job_id,)).fetchone()
+            if row is None or row['status'] != 'leased' or row['worker'] != worker:
+                self._db.execute('COMMIT')
+                return row['status'] if row else 'missing'
+
+            if exit_code in SUCCESS_EXIT_CODES:
+                status = 'done'
+            elif exit_code in PERMANENT_EXIT_CODES or row['attempts'] >= row['max_attempts']:
+                status = 'failed'
+            else:
+                status = 'queued'
+            if exit_code not in SUCCESS_EXIT_CODES and error is None:
+                error = f"exit code {exit_code}"
+
+            self._db.execute(
+                "UPDATE jobs SET status = ?, exit_code = ?, error = ?, lease_expires = NULL,"
+                " finished = ?, run_seconds = run_seconds + ? WHERE id = ?",
+                (status, exit_code, error, now if status != 'queued' else None,
+                 max(now - (row['started'] or now), 0.0), job_id))
+            self._db.execute('COMMIT')
+            return status
+        except BaseException:
+            self._db.execute('ROLLBACK')
+            raise
+
+    def jobs(self, batch: Optional[str] = None) -> List[Job]:
+        """All jobs (of one batch), in submission order."""
+        if batch is None:
+            rows = self._db.execute("SELECT * FROM jobs ORDER BY submitted, id")
+        else:
+            rows = self._db.execute(
+                "SELECT * FROM jobs WHERE batch = ? ORDER BY submitted, id", (batch,))
+        return [Job.from_row(row) for row in rows]
+
+    def counts(self, batch: Optional[str] = None) -> Dict[str, int]:
+        """Number of jobs per status (of one batch)."""
+        self._transaction()
+        try:
+            self._settle(time.time())
+            self._db.execute('COMMIT')
+        except BaseException:
+            self._db.execute('ROLLBACK')
+            raise
+        query = "SELECT status, COUNT(*) AS n FROM jobs"
+        params: Any = ()
+        if batch is not None:
+            query += " WHERE batch = ?"
+            params = (batch,)
+        counts = {status: 0 for status in STATUSES}
+        for row in self._db.execute(query + " GROUP BY status", params):
+            counts[row['status']] = row['n']
+        return counts
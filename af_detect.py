@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+"""
+Unified AF Detection: run any subset of the AF rules in one process
+
+Loads each evidence source once into a shared RDF Dataset (named graph
+urn:graph:<source>; sources are parsed concurrently) and runs every selected rule against it, reusing each
+rule's own RULE file and detect_*.py reporting. Per-source load times and
+per-rule query times are summarised at the end.
+
+Usage:
+    # All rules whose evidence is available
+    python3 af_detect.py \
+      --mft AF-002/stream_output/mft_indexeddb_filtered.jsonld \
+      --usn AF-002/stream_output/usn_history_filtered.jsonld \
+      --history AF-002/stream_output/history_all.jsonld
+
+    # Selected rules on raw exports: prefilter every source once for all
+    # selected rules before loading
+    python3 af_detect.py --rules AF-004,AF-TIMESTOMPING \
+      --mft mft_case.jsonld --usn usn_case.jsonld --lnk lnk_case.jsonld \
+      --prefilter-dir /tmp/af_prefiltered/
+
+    # Fleet triage: stop at the first positive rule, loading (and
+    # prefiltering) each source only when a rule first needs it
+    python3 af_detect.py --first-hit --mft mft.jsonld --usn usn.jsonld ...
+
+    # Coalesce the USN records of each file change into one span before
+    # loading (af_common/usn_coalesce.py); fewer USN rows to join
+    python3 af_detect.py --coalesce-usn --mft mft.jsonld --usn usn.jsonld ...
+
+    # List registered rules
+    python3 af_detect.py --list
+
+A rule whose query or report fails is shown as ERROR in the summary, and
+the remaining rules still run.
+
+Exit codes: 0 = no detection, 1 = error (also when a rule failed and another
+was positive; the summary and --metrics-json show each rule's result),
+2 = at least one rule positive
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from af_common.graph_load import Source, add_load_arguments, load_graphs
+from af_common.metrics import RunMetrics, StageMetrics, add_metrics_arguments, profiled
+from af_common.pipeline import add_pipeline_arguments, configure, pipeline_config
+from af_common.query import run_query
+from af_common.registry import RULES, SOURCES, RuleSpec, load_plugin, load_script
+from af_common.stream_filter import filter_jsonld
+from af_common.usn_coalesce import add_coalesce_arguments, coalesce_usn_file
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Run AF detection rules against shared evidence in one process"
+    )
+    for source in SOURCES:
+        parser.add_argument(
+            f"--{source.replace('_', '-')}",
+            dest=source,
+            help=f"Path to {source} evidence (JSON-LD, N-Triples or Turtle"
+                 + (", or the Chrome History SQLite database)" if source == 'history' else ")")
+        )
+    parser.add_argument(
+        '--rules',
+        help="Comma-separated rule IDs (default: every rule whose sources are given)"
+    )
+    parser.add_argument(
+        '--prefilter-dir',
+        help="Stream-filter each JSON-LD source once for all selected rules into this directory"
+    )
+    parser.add_argument(
+        '--first-hit',
+        action='store_true',
+        help="Stop at the first confirmed positive of the first positive rule (triage)"
+    )
+    parser.add_argument(
+        '--plugin',
+        action='append',
+        default=[],
+        help="Python file registering additional rules (repeatable)"
+    )
+    parser.add_argument(
+        '--list',
+        action='store_true',
+        help="List registered rules and exit"
+    )
+    add_coalesce_arguments(parser)
+    add_load_arguments(parser)
+    add_pipeline_arguments(parser)
+    add_metrics_arguments(parser)
+
+    return parser.parse_args()
+
+
+def detect_format(file_path: Path) -> str:
+    """Auto-detect RDF format from file extension."""
+    format_map = {
+        '.nt': 'nt',
+        '.ntriples': 'nt',
+        '.ttl': 'ttl',
+        '.turtle': 'ttl'
+    }
+    return format_map.get(file_path.suffix.lower(), 'json-ld')
+
+
+def select_rules(requested, sources: Dict[str, Path]) -> List[RuleSpec]:
+    """Resolve --rules, or pick every rule whose required sources are present."""
+    if requested:
+        selected = []
+        for rule_id in requested.split(','):
+            rule_id = rule_id.strip()
+            if rule_id not in RULES:
+                raise ValueError(f"Unknown rule: {rule_id} (see --list)")
+            spec = RULES[rule_id]
+            missing = [s for s in spec.sources if s not in sources]
+            if missing:
+                raise ValueError(f"{rule_id} needs --{' --'.join(m.replace('_', '-') for m in missing)}")
+            selected.append(spec)
+        return selected
+
+    return [spec for spec in RULES.values()
+            if all(s in sources for s in spec.sources)]
+
+
+def plan_prefilter(rules: List[RuleSpec], sources: Dict[str, Path]) -> Dict[str, list]:
+    """
+    Collect, per JSON-LD source, the predicates of every selected rule.
+
+    A source is left out (not filtered) if some rule that uses it has no
+    predicate for it (e.g. History, System), since that rule needs every entry.
+    """
+    predicates: Dict[str, list] = {}
+    unfiltered = set()
+
+    for spec in rules:
+        rule_predicates = {}
+        if spec.filter_path:
+            module = load_script(spec.filter_path)
+            if hasattr(module, 'source_predicates'):
+                rule_predicates = module.source_predicates(sources)
+        for source in spec.sources + spec.optional_sources:
+            if source not in sources:
+                continue
+            if source in rule_predicates:
+                predicates.setdefault(source, []).append(rule_predicates[source])
+            else:
+                unfiltered.add(source)
+
+    return {source: funcs for source, funcs in predicates.items()
+            if source not in unfiltered and detect_format(sources[source]) == 'json-ld'}
+
+
+def prefilter_source(source: str, input_file: Path, funcs: list, output_dir: Path,
+                     metrics: Optional[StageMetrics] = None) -> Path:
+    """Stream one source once, keeping entries any of the predicates match."""
+    output_dir.mkdir(parents=True, exist_ok=True)
+    output_file = output_dir / f"{source}_prefiltered.jsonld"
+    print(f"Prefiltering {source}: {input_file.name} "
+          f"({input_file.stat().st_size / (1024**2):.1f} MB)")
+    start = time.perf_counter()
+    total, matched = filter_jsonld(
+        input_file,
+        output_file,
+        lambda entry: any(f(entry) for f in funcs),
+        metrics=metrics
+    )
+    print(f"  ✓ {matched:,} / {total:,} entries kept "
+          f"({time.perf_counter() - start:.2f}s) → {output_file}")
+    return output_file
+
+
+def prefilter_sources(rules: List[RuleSpec], sources: Dict[str, Path],
+                      output_dir: Path, run_metrics: RunMetrics) -> Dict[str, Path]:
+    """Stream each JSON-LD source once, keeping entries any selected rule needs."""
+    filtered = dict(sources)
+    for source, funcs in plan_prefilter(rules, sources).items():
+        with run_metrics.stage(f"prefilter:{source}") as stage:
+            filtered[source] = prefilter_source(source, sources[source], funcs, output_dir, stage)
+    return filtered
+
+
+def coalesce_source(input_file: Path, output_dir: Path, max_span: float,
+                    metrics: Optional[StageMetrics] = None) -> Path:
+    """Write the coalesced view of a USN source into output_dir."""
+    output_dir.mkdir(parents=True, exist_ok=True)
+    return coalesce_usn_file(input_file, output_dir / "usn_coalesced.jsonld", max_span, metrics)
+
+
+def run_rules(args, rules: List[RuleSpec], sources: Dict[str, Path],
+              run_metrics: RunMetrics):
+    """
+    Load the evidence and run every selected rule.
+
+    Returns:
+        (summary rows as (rule_id, exit_code, rows, query_seconds), load_times)
+    """
+    prefilter_plan = {}
+    if args.prefilter_dir:
+        if args.first_hit:
+            # Filter each source only when the first rule needing it runs
+            prefilter_plan = plan_prefilter(rules, sources)
+        else:
+            sources = prefilter_sources(rules, sources, Path(args.prefilter_dir), run_metrics)
+            print()
+
+    coalesce_dir = None
+    if args.coalesce_usn and 'usn' in sources and detect_format(sources['usn']) == 'json-ld':
+        if args.prefilter_dir:
+            coalesce_dir = Path(args.prefilter_dir)
+        else:
+            import atexit
+            import shutil
+            import tempfile
+            coalesce_dir = Path(tempfile.mkdtemp(prefix='af_coalesce_'))
+            atexit.register(shutil.rmtree, coalesce_dir, True)
+        if 'usn' not in prefilter_plan:
+            sources = dict(sources)
+            with run_metrics.stage('coalesce:usn') as stage:
+                sources['usn'] = coalesce_source(sources['usn'], coalesce_dir,
+                                                 args.coalesce_span, stage)
+            print()
+
+    needed = [s for s in SOURCES
+              if s in sources and any(s in spec.sources + spec.optional_sources for spec in rules)]
+
+    # A Chrome History SQLite database is not parsed: AF-002's detector builds
+    # urn:graph:history from it once the MFT graph is loaded
+    from af_common.history_db import is_history_db
+    databases = {s for s in needed if s == 'history' and is_history_db(sources[s])}
+
+    from rdflib import Dataset, Graph, URIRef
+
+    ds = Dataset()
+    graphs = {}
+    load_times = {}
+
+    def load_database(source):
+        """Build the history graph from the History database (needs urn:graph:mft)."""
+        path = sources[source]
+        print(f"Reading {source} database (SQLite) from {path.name}...")
+        detector = load_script(RULES['AF-002'].detector_path)
+        with run_metrics.stage(f"load:{source}") as stage:
+            detector.load_history_db(path, ds, stage)
+        load_times[source] = stage.wall_seconds
+        graphs[source] = ds.graph(URIRef(f"urn:graph:{source}"))
+        print(f"  ✓ {len(graphs[source]):,} triples ({load_times[source]:.2f}s, "
+              f"{stage.records:,} URLs read)")
+
+    def load_source(source):
+        """Load one source into its own named graph."""
+        if source in databases:
+            return load_database(source)
+        path = sources[source]
+        if source in prefilter_plan:
+            with run_metrics.stage(f"prefilter:{source}") as stage:
+                path = prefilter_source(source, path, prefilter_plan[source],
+                                        Path(args.prefilter_dir), stage)
+            if source == 'usn' and coalesce_dir:
+                with run_metrics.stage('coalesce:usn') as stage:
+                    path = coalesce_source(path, coalesce_dir, args.coalesce_span, stage)
+        print(f"Loading {source} from {path.name}...")
+        with run_metrics.stage(f"load:{source}") as stage, stage.timed('parse'):
+            graph = ds.graph(URIRef(f"urn:graph:{source}"))
+            graph.parse(path, format=detect_format(path))
+        stage.records, stage.bytes = len(graph), path.stat().st_size
+        load_times[source] = stage.wall_seconds
+        graphs[source] = graph
+        print(f"  ✓ {len(graph):,} triples ({load_times[source]:.2f}s)")
+
+    if not args.first_hit:
+        # Load every needed source once into its own named graph, parsing
+        # the sources concurrently
+        print("=" * 70)
+        print("Loading Evidence")
+        print("=" * 70)
+        print()
+        parsed = [source for source in needed if source not in databases]
+        for source in parsed:
+            graphs[source] = ds.graph(URIRef(f"urn:graph:{source}"))
+            print(f"Loading {source} from {sources[source].name}...")
+        counts = load_graphs([Source(f"load:{source}", sources[source],
+                                     detect_format(sources[source]), graphs[source])
+                              for source in parsed], run_metrics, args.load_workers)
+        stages = {stage.name: stage for stage in run_metrics.stages}
+        for source in parsed:
+            load_times[source] = stages[f"load:{source}"].wall_seconds
+            print(f"  ✓ {source}: {counts[f'load:{source}']:,} triples ({load_times[source]:.2f}s)")
+        for source in databases:
+            load_database(source)
+        print()
+
+    summary = []
+
+    for spec in rules:
+        rule_sources = [s for s in spec.sources + spec.optional_sources if s in sources]
+
+        print("=" * 70)
+        print(f"Running {spec.rule_id} ({spec.rule_file})")
+        print("=" * 70)
+
+        if any(s not in graphs for s in rule_sources):
+            for source in rule_sources:
+                if source not in graphs:
+                    load_source(source)
+            print()
+
+        results = []
+        with run_metrics.stage(f"rule:{spec.rule_id}") as stage:
+            try:
+                detector = load_script(spec.detector_path)
+                query = spec.rule_path.read_text()
+
+                if spec.named_graphs:
+                    target = ds
+                else:
+                    # Default-graph rules see only their own sources
+                    target = Graph()
+                    for source in rule_sources:
+                        for triple in graphs[source]:
+                            target.add(triple)
+
+                with stage.timed('query'):
+                    results = run_query(target, query, first_hit=args.first_hit,
+                                        is_positive=getattr(detector, 'is_positive', None))
+                stage.records = len(results)
+
+                exit_code = detector.report(results, {s: len(graphs[s]) for s in rule_sources})
+            except Exception as e:
+                print(f"ERROR: {spec.rule_id} failed: {type(e).__name__}: {e}", file=sys.stderr)
+                exit_code = 1
+        stage.extra['exit_code'] = exit_code
+        print()
+
+        summary.append((spec.rule_id, exit_code, len(results), stage.wall_seconds))
+
+        if args.first_hit and exit_code == 2:
+            skipped = rules[len(summary):]
+            if skipped:
+                print(f"First-hit mode: skipping {', '.join(r.rule_id for r in skipped)}")
+                print()
+            break
+
+    return summary, load_times
+
+
+def main():
+    args = parse_args()
+
+    for plugin in args.plugin:
+        load_plugin(Path(plugin))
+
+    if args.list:
+        print("Registered rules:")
+        for spec in RULES.values():
+            optional = f" [+{', '.join(spec.optional_sources)}]" if spec.optional_sources else ""
+            print(f"  {spec.rule_id:<20} {', '.join(spec.sources)}{optional}")
+            print(f"  {'':<20} {spec.description} ({spec.rule_path.relative_to(spec.directory.parent)})")
+        return 0
+
+    try:
+        configure(pipeline_config(args))
+    except ValueError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+
+    sources = {}
+    for source in SOURCES:
+        value = getattr(args, source)
+        if value:
+            path = Path(value)
+            if not path.exists():
+                print(f"ERROR: {source} file not found: {path}", file=sys.stderr)
+                return 1
+            sources[source] = path
+
+    try:
+        rules = select_rules(args.rules, sources)
+    except ValueError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+
+    if not rules:
+        print("ERROR: No rule has all of its evidence sources; see --list", file=sys.stderr)
+        return 1
+
+    print("=" * 70)
+    print("AF Unified Detection")
+    print("=" * 70)
+    print()
+    print(f"Rules: {', '.join(spec.rule_id for spec in rules)}")
+    print()
+
+    run_metrics = RunMetrics('af_detect')
+    with profiled(args.profile):
+        summary, load_times = run_rules(args, rules, sources, run_metrics)
+    exit_codes = [exit_code for _, exit_code, _, _ in summary]
+    if any(exit_code not in (0, 2) for exit_code in exit_codes):
+        overall_exit = 1
+    else:
+        overall_exit = max(exit_codes, default=0)
+
+    print("=" * 70)
+    print("Summary")
+    print("=" * 70)
+    print()
+    print("Load times:")
+    for source, elapsed in load_times.items():
+        print(f"  {source:<12} {elapsed:8.2f}s")
+    print()
+    print(f"{'Rule':<22}{'Result':<12}{'Rows':>6}{'Time':>10}")
+    for rule_id, exit_code, rows, elapsed in summary:
+        result = {0: "clean", 2: "ALERT"}.get(exit_code, "ERROR")
+        print(f"{rule_id:<22}{result:<12}{rows:>6}{elapsed:>9.2f}s")
+    for spec in rules[len(summary):]:
+        print(f"{spec.rule_id:<22}{'skipped':<12}{'-':>6}{'-':>10}")
+    print()
+    print(f"Total: {sum(load_times.values()) + sum(s[3] for s in summary):.2f}s")
+    print("=" * 70)
+
+    run_metrics.emit(args.metrics_json, args.metrics_prom)
+
+    return overall_exit
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+AF MFT Store: MFT records sorted by entry number, for joins without a rescan
+
+build streams an MFT JSON-LD export once and writes its records (entry
+and sequence number, parent entry, file name, parent path and where the
+entry is in the export) sorted by entry number, with a fence index (see
+af_common/mft_store.py); memory stays bounded by --run-size. lookup
+prints the records of the given entry numbers, probing the store instead
+of scanning the export.
+
+stream_filter_timestomp.py --mft-store fetches the LNK-referenced MFT
+entries through a store.
+
+Usage:
+    python3 af_mftstore.py build -o mft_case.afms --mft mft_case.jsonld
+
+    python3 af_mftstore.py lookup mft_case.afms 1234 5678
+    python3 af_mftstore.py lookup mft_case.afms 1234 --sequence 3 --entries
+
+Exit codes: 0 = success, 1 = error
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from af_common.metrics import RunMetrics, add_metrics_arguments, profiled
+from af_common.mft_store import DEFAULT_RUN_SIZE, MftStore, build_store
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Build and query an MFT store sorted by entry number"
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build', help="Build an MFT store from an MFT JSON-LD export")
+    build.add_argument('--mft', type=Path, required=True, help="MFT JSON-LD file")
+    build.add_argument(
+        '-o', '--output',
+        type=Path,
+        required=True,
+        help="MFT store file to write"
+    )
+    build.add_argument(
+        '--run-size',
+        type=int,
+        default=DEFAULT_RUN_SIZE,
+        help=f"Records sorted in memory per run; bounds memory (default: {DEFAULT_RUN_SIZE:,})"
+    )
+    build.add_argument(
+        '--tmp-dir',
+        type=Path,
+        help="Directory for the sorted runs (default: next to the output)"
+    )
+    add_metrics_arguments(build)
+
+    lookup = commands.add_parser('lookup', help="Print the records of MFT entry numbers")
+    lookup.add_argument('store', type=Path, help="MFT store file")
+    lookup.add_argument('entry_numbers', type=int, nargs='+', metavar='ENTRY',
+                        help="MFT entry numbers")
+    lookup.add_argument('--sequence', type=int,
+                        help="Only records with this sequence number")
+    lookup.add_argument('--entries', action='store_true',
+                        help="Also print each entry from the MFT export (JSON)")
+
+    return parser.parse_args()
+
+
+def build(args) -> int:
+    if not args.mft.exists():
+        print(f"ERROR: MFT file not found: {args.mft}", file=sys.stderr)
+        return 1
+    if args.run_size < 1:
+        print("ERROR: --run-size must be positive", file=sys.stderr)
+        return 1
+
+    print("=" * 70)
+    print("AF MFT Store Build")
+    print("=" * 70)
+    print()
+
+    run_metrics = RunMetrics('af_mftstore')
+    start = time.perf_counter()
+    with profiled(args.profile):
+        with run_metrics.stage('build') as stage:
+            count = build_store(args.mft, args.output, run_size=args.run_size,
+                                tmp_dir=args.tmp_dir, metrics=stage)
+    elapsed = time.perf_counter() - start
+
+    runs = stage.extra['spilled_runs']
+    print(f"✓ {count:,} records from {stage.records:,} MFT entries, "
+          + (f"{runs} sorted run(s) merged" if runs else "sorted in memory"))
+    print(f"  Written to {args.output} ({args.output.stat().st_size:,} bytes) in {elapsed:.2f}s")
+    if stage.extra['unindexed']:
+        print(f"  {stage.extra['unindexed']:,} entry numbers are not plain integers "
+              f"and were not indexed")
+    print("=" * 70)
+
+    run_metrics.emit(args.metrics_json, args.metrics_prom)
+    return 0
+
+
+def lookup(args) -> int:
+    if not args.store.exists():
+        print(f"ERROR: MFT store not found: {args.store}", file=sys.stderr)
+        return 1
+    try:
+        with MftStore(args.store) as store:
+            records = [r for r in store.probe(args.entry_numbers)
+                       if args.sequence is None or r.sequence_number == args.sequence]
+            for record in records:
+                print(f"{record.entry_number:>10} {record.sequence_number:>5}  "
+                      f"parent {record.parent_entry_number}/{record.parent_sequence_number}  "
+                      f"{record.path}")
+            if args.entries:
+                for record, entry in store.entries(records):
+                    print(json.dumps(entry, indent=2))
+    except (OSError, ValueError) as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def main():
+    args = parse_args()
+    return build(args) if args.command == 'build' else lookup(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
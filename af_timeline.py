@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+AF Super-timeline: every timestamp of every evidence source on one axis
+
+build streams the given sources into sorted runs on disk and k-way merges
+them into one compact, time-ordered timeline file (see
+af_common/timeline.py); memory stays bounded by --run-size however many
+events there are. query prints the events of a time range, using the
+file's sparse index to read only that range.
+
+The AF-007 and AF-TIMESTOMPING detectors take the file with --timeline
+and print the cross-artifact events around their findings.
+
+Usage:
+    python3 af_timeline.py build -o case.aftl \
+      --mft mft_case.jsonld --usn usn_case.jsonld --security security.jsonld \
+      --system system.jsonld --lnk lnk_case.jsonld --history History
+
+    python3 af_timeline.py query case.aftl \
+      --start 2025-09-11T05:56:00Z --end 2025-09-11T05:58:00Z --source usn,security
+
+Exit codes: 0 = success, 1 = error
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from af_common.metrics import RunMetrics, add_metrics_arguments, profiled
+from af_common.registry import SOURCES
+from af_common.timeline import DEFAULT_RUN_SIZE, Timeline, build_timeline, format_ns
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Build and query a cross-artifact super-timeline"
+    )
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build = commands.add_parser('build', help="Build a timeline file from evidence sources")
+    for source in SOURCES:
+        build.add_argument(
+            f"--{source.replace('_', '-')}",
+            dest=source,
+            type=Path,
+            help=f"Path to {source} evidence (JSON-LD"
+                 + (", or the Chrome History SQLite database)" if source == 'history' else ")")
+        )
+    build.add_argument(
+        '-o', '--output',
+        type=Path,
+        required=True,
+        help="Timeline file to write"
+    )
+    build.add_argument(
+        '--run-size',
+        type=int,
+        default=DEFAULT_RUN_SIZE,
+        help=f"Events sorted in memory per run; bounds memory (default: {DEFAULT_RUN_SIZE:,})"
+    )
+    build.add_argument(
+        '--tmp-dir',
+        type=Path,
+        help="Directory for the sorted runs (default: next to the output)"
+    )
+    add_metrics_arguments(build)
+
+    query = commands.add_parser('query', help="Print the events of a time range")
+    query.add_argument('timeline', type=Path, help="Timeline file")
+    query.add_argument('--start', help="First time (ISO 8601, inclusive; default: beginning)")
+    query.add_argument('--end', help="Last time (ISO 8601, inclusive; default: end)")
+    query.add_argument('--source', help="Comma-separated sources to show (default: all)")
+    query.add_argument('--limit', type=int, help="Print at most this many events")
+
+    return parser.parse_args()
+
+
+def build(args) -> int:
+    inputs = []
+    for source in SOURCES:
+        path = getattr(args, source)
+        if path:
+            if not path.exists():
+                print(f"ERROR: {source} file not found: {path}", file=sys.stderr)
+                return 1
+            inputs.append((source, path))
+    if not inputs:
+        print("ERROR: no evidence sources given (--mft, --usn, ...)", file=sys.stderr)
+        return 1
+    if args.run_size < 1:
+        print("ERROR: --run-size must be positive", file=sys.stderr)
+        return 1
+
+    print("=" * 70)
+    print("AF Super-timeline Build")
+    print("=" * 70)
+    print()
+
+    run_metrics = RunMetrics('af_timeline')
+    start = time.perf_counter()
+    with profiled(args.profile):
+        count = build_timeline(inputs, args.output, run_size=args.run_size,
+                               tmp_dir=args.tmp_dir, run_metrics=run_metrics)
+    elapsed = time.perf_counter() - start
+
+    for stage in run_metrics.stages:
+        if stage.name == 'merge':
+            continue
+        print(f"  {stage.name:<12} {stage.records:>10,} entries  {stage.matched or 0:>10,} events")
+    runs = next(s.extra['spilled_runs'] for s in run_metrics.stages if s.name == 'merge')
+    print()
+    print(f"✓ {count:,} events from {len(inputs)} source(s), "
+          + (f"{runs} sorted run(s) merged" if runs else "sorted in memory"))
+    print(f"  Written to {args.output} ({args.output.stat().st_size:,} bytes) in {elapsed:.2f}s")
+    if count:
+        with Timeline(args.output) as timeline:
+            print(f"  Range: {format_ns(timeline.start_ns)} .. {format_ns(timeline.end_ns)}")
+    print("=" * 70)
+
+    run_metrics.emit(args.metrics_json, args.metrics_prom)
+    return 0
+
+
+def query(args) -> int:
+    if not args.timeline.exists():
+        print(f"ERROR: timeline file not found: {args.timeline}", file=sys.stderr)
+        return 1
+    sources = args.source.split(',') if args.source else None
+    try:
+        with Timeline(args.timeline) as timeline:
+            for event in timeline.query(args.start, args.end, sources=sources, limit=args.limit):
+                detail = f" [{event.detail}]" if event.detail else ''
+                print(f"{event.iso:<31} {event.source:<10} {event.property:<20} "
+                      f"{event.subject}{detail}")
+    except ValueError as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def main():
+    args = parse_args()
+    return build(args) if args.command == 'build' else query(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
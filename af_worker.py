@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+AF Worker: run filter and detector jobs from a shared work queue
+
+Leases jobs submitted by af_batch.py --queue, runs each one (a single
+stream filter pass or detector run) with this node's Python and repository
+checkout, and records its exit code back in the queue. Start as many
+workers as a node has cores to spare, on as many nodes as can reach the
+queue file and the evidence.
+
+- A background heartbeat extends the lease while a job runs; if the worker
+  dies, the job is leased again by another worker once --lease runs out
+- Jobs that failed transiently (killed, could not start) are retried, up
+  to the attempts set at submission, on whichever worker leases them
+  next; exit code 1 (missing or invalid input) fails the job at once
+- Job output goes to the log path recorded in the job (next to its outputs)
+
+Usage:
+    python3 af_worker.py --queue /shared/af/queue.db
+    python3 af_worker.py --queue /shared/af/queue.db --worker-id node7-1 --idle-exit 300
+
+Exit codes: 0 = stopped (idle or interrupted), 1 = error
+"""
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent
+sys.path.insert(0, str(REPO_ROOT))
+from af_common.workqueue import Job, WorkQueue
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Run AF filter/detector jobs leased from a shared work queue"
+    )
+    parser.add_argument(
+        '--queue',
+        required=True,
+        help="Work queue file (SQLite) written by af_batch.py --queue"
+    )
+    parser.add_argument(
+        '--worker-id',
+        default=f"{socket.gethostname()}-{os.getpid()}",
+        help="Name recorded on leased jobs (default: HOSTNAME-PID)"
+    )
+    parser.add_argument(
+        '--lease',
+        type=float,
+        default=60.0,
+        help="Lease length in seconds, renewed every third of it (default: 60)"
+    )
+    parser.add_argument(
+        '--poll',
+        type=float,
+        default=2.0,
+        help="Seconds between polls when no job is runnable (default: 2)"
+    )
+    parser.add_argument(
+        '--idle-exit',
+        type=float,
+        help="Exit after this many seconds without a runnable job (default: run forever)"
+    )
+    parser.add_argument(
+        '--max-jobs',
+        type=int,
+        help="Exit after running this many jobs"
+    )
+
+    return parser.parse_args()
+
+
+def job_command(job: Job) -> list:
+    """The job's argument list with this node's interpreter and checkout."""
+    script = Path(job.command[0])
+    if not script.is_absolute():
+        script = REPO_ROOT / script
+    return [sys.executable, str(script)] + job.command[1:]
+
+
+def run_job(job: Job, queue_path: Path, worker: str, lease: float) -> int:
+    """Run one leased job, heartbeating until it exits. Returns its exit code."""
+    stop = threading.Event()
+
+    def heartbeat():
+        # sqlite3 connections must stay on the thread that opened them
+        with WorkQueue(queue_path) as queue:
+            while not stop.wait(lease / 3):
+                if not queue.heartbeat(job.id, worker, lease):
+                    print(f"  ! lost lease on {job.id}", file=sys.stderr)
+                    return
+
+    log_path = Path(job.log) if job.log else None
+    if log_path:
+        log_path.parent.mkdir(parents=True, exist_ok=True)
+    log = open(log_path, 'a') if log_path else subprocess.DEVNULL
+
+    beat = threading.Thread(target=heartbeat, daemon=True)
+    beat.start()
+    try:
+        if log_path:
+            log.write(f"--- {worker} attempt {job.attempts}: {' '.join(job.command)}\n")
+            log.flush()
+        process = subprocess.Popen(job_command(job), cwd=REPO_ROOT,
+                                   stdout=log, stderr=subprocess.STDOUT)
+        try:
+            return process.wait()
+        except KeyboardInterrupt:
+            process.kill()
+            process.wait()
+            raise
+    finally:
+        stop.set()
+        beat.join()
+        if log_path:
+            log.close()
+
+
+def main():
+    args = parse_args()
+
+    queue_path = Path(args.queue)
+    if not queue_path.exists():
+        print(f"ERROR: Work queue not found: {queue_path}", file=sys.stderr)
+        return 1
+
+    print("=" * 60)
+    print(f"AF Worker {args.worker_id}")
+    print("=" * 60)
+    print(f"Queue: {queue_path}")
+    print()
+
+    queue = WorkQueue(queue_path)
+    ran = 0
+    idle_since = time.monotonic()
+
+    try:
+        while args.max_jobs is None or ran < args.max_jobs:
+            job = queue.lease(args.worker_id, args.lease)
+            if job is None:
+                if args.idle_exit is not None and time.monotonic() - idle_since >= args.idle_exit:
+                    print(f"Idle for {args.idle_exit:.0f}s, exiting")
+                    break
+                time.sleep(args.poll)
+                continue
+
+            print(f"→ {job.id} (attempt {job.attempts}/{job.max_attempts})")
+            start = time.perf_counter()
+            try:
+                exit_code = run_job(job, queue_path, args.worker_id, args.lease)
+                error = None
+            except OSError as e:
+                exit_code, error = None, f"could not start: {e}"
+            status = queue.finish(job.id, args.worker_id, exit_code, error)
+            mark = '✓' if status == 'done' else '✗'
+            print(f"  {mark} {job.id}: exit {exit_code}, {status} "
+                  f"({time.perf_counter() - start:.1f}s)")
+
+            ran += 1
+            idle_since = time.monotonic()
+    except KeyboardInterrupt:
+        # The lease of an interrupted job simply expires and it is retried
+        print("\nInterrupted", file=sys.stderr)
+    finally:
+        queue.close()
+
+    print(f"Jobs run: {ran}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
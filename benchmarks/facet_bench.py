@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Facet Access Benchmark for the filter predicates
+
+Decodes JSON-LD inputs into memory once, then runs each stream filter
+predicate that dispatches on facet @type over every entry, two ways:
+- former: the inline loops the predicates used, which wrap a single
+  facet in a list, build str(@type) per facet and test each type name on it
+- typed: the predicates as the filters now run them, dispatching on
+  facet_kinds() bits (af_common/facets.py), memoised per @type value
+
+Both must return the same result for every entry before timings are
+reported. The table shows entries per second for each predicate (median
+of --runs). Decoding is not timed.
+
+Usage:
+    python3 benchmarks/facet_bench.py
+    python3 benchmarks/facet_bench.py mft.jsonld usn.jsonld security.jsonld --runs 9
+"""
+
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+from af_common.jsonld_stream import JsonLdReader
+from af_common.multimatch import FIELD_PATTERNS
+from af_common.registry import load_script
+
+
+# -- the former inline predicates, kept as the reference ----------------------
+
+def former_vss_mft(vss, entry: Dict[str, Any]) -> bool:
+    facets = entry.get('core:hasFacet', [])
+    if not isinstance(facets, list):
+        facets = [facets]
+    has_svi_path = has_vss_file = False
+    for facet in facets:
+        facet_type = facet.get('@type', '')
+        if 'MftFacet' in str(facet_type):
+            if FIELD_PATTERNS.scan(facet.get('dfc-ext:parentPath', '')) & vss.SVI_PATH:
+                has_svi_path = True
+        if 'FileFacet' in str(facet_type):
+            if FIELD_PATTERNS.scan(facet.get('observable:fileName', '')) & vss.VSS_FILE_INDICATORS:
+                has_vss_file = True
+    return has_svi_path and has_vss_file
+
+
+def former_vss_usn(vss, entry: Dict[str, Any]) -> bool:
+    facets = entry.get('core:hasFacet', [])
+    if not isinstance(facets, list):
+        facets = [facets]
+    has_guid = has_deletion = False
+    for facet in facets:
+        facet_type = facet.get('@type', '')
+        if 'FileFacet' in str(facet_type):
+            if FIELD_PATTERNS.scan(facet.get('observable:fileName', '')) & vss.GUID_PATTERN:
+                has_guid = True
+        if 'UsnFacet' in str(facet_type):
+            if FIELD_PATTERNS.scan(facet.get('dfc-ext:updateReasons', '')) & vss.DELETION_INDICATORS:
+                has_deletion = True
+    return has_guid and has_deletion
+
+
+def former_facets(entry: Dict[str, Any]) -> list:
+    facets = entry.get('core:hasFacet', entry.get('uco-core:hasFacet', []))
+    if not isinstance(facets, list):
+        facets = [facets]
+    return facets
+
+
+def former_event_1102(evtx, entry: Dict[str, Any]) -> bool:
+    has_1102 = has_security = False
+    for facet in former_facets(entry):
+        facet_type = facet.get('@type', '')
+        if 'EventRecordFacet' in str(facet_type):
+            event_id = facet.get('observable:eventID', '')
+            if event_id == '1102' or event_id == 1102:
+                has_1102 = True
+        if 'EventLogFacet' in str(facet_type):
+            if FIELD_PATTERNS.scan(facet.get('dfc-ext:channel', '')) & evtx.SECURITY:
+                has_security = True
+    return has_1102 and has_security
+
+
+def former_security_usn(evtx, entry: Dict[str, Any]) -> bool:
+    has_security_file = has_usn_facet = False
+    for facet in former_facets(entry):
+        facet_type = facet.get('@type', '')
+        if 'FileFacet' in str(facet_type):
+            found = FIELD_PATTERNS.scan(facet.get('observable:fileName', ''))
+            if found & evtx.SECURITY_EVTX == evtx.SECURITY_EVTX:
+                has_security_file = True
+        if 'UsnFacet' in str(facet_type):
+            has_usn_facet = True
+    return has_security_file and has_usn_facet
+
+
+def former_system_context(evtx, entry: Dict[str, Any]) -> bool:
+    for facet in former_facets(entry):
+        if 'EventRecordFacet' not in str(facet.get('@type', '')):
+            continue
+        event_id = str(facet.get('observable:eventID', ''))
+        provider = str(facet.get('observable:eventRecordServiceName', '')).lower()
+        if (provider, event_id) not in evtx.SYSTEM_EVENTS:
+            continue
+        if event_id == '7036':
+            text = f"{facet.get('observable:eventRecordText', '')} " \
+                   f"{facet.get('observable:eventRecordRaw', '')}"
+            return 'stopped' in text.lower()
+        return True
+    return former_event_1102(evtx, entry) or former_security_usn(evtx, entry)
+
+
+def former_mft_entry_numbers(item: Dict[str, Any]):
+    if item.get('@type') != 'observable:File' or 'core:hasFacet' not in item:
+        return
+    facets = item['core:hasFacet']
+    if not isinstance(facets, list):
+        facets = [facets]
+    for facet in facets:
+        if isinstance(facet, dict):
+            if 'MftFacet' in str(facet.get('@type', '')):
+                entry_num = facet.get('dfc-ext:entryNumber')
+                if isinstance(entry_num, dict):
+                    entry_num = str(entry_num.get('@value', ''))
+                else:
+                    entry_num = str(entry_num) if entry_num else ''
+                if entry_num:
+                    yield entry_num
+
+
+# -----------------------------------------------------------------------------
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark typed facet access against the former inline predicate loops"
+    )
+    parser.add_argument('inputs', nargs='*', type=Path,
+                        help="JSON-LD files whose entries every predicate runs on "
+                             "(default: the sample files in the repository)")
+    parser.add_argument('--runs', type=int, default=5,
+                        help="Timed runs per predicate and method; the median is reported "
+                             "(default: 5)")
+    return parser.parse_args()
+
+
+def median_seconds(func, entries: List[Dict[str, Any]], runs: int) -> float:
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        for entry in entries:
+            func(entry)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+
+def main():
+    args = parse_args()
+    vss = load_script(REPO_ROOT / 'AF-004' / 'stream_filter_vss.py')
+    evtx = load_script(REPO_ROOT / 'AF-007' / 'stream_filter_evtx.py')
+    timestomp = load_script(REPO_ROOT / 'AF-TIMESTOMPING' / 'stream_filter_timestomp.py')
+
+    inputs = args.inputs or sorted(
+        p for p in REPO_ROOT.glob('AF-*/**/*.jsonld') if p.stat().st_size)
+    entries = []
+    for path in inputs:
+        with JsonLdReader(path, canonical_keys=True) as reader:
+            entries.extend(entry for entry, _ in reader)
+    # The former loops call facet.get() on every facet; keep inputs they can run on
+    entries = [e for e in entries
+               if all(isinstance(f, dict) for f in former_facets(e))]
+    if not entries:
+        print("ERROR: no entries found in the inputs", file=sys.stderr)
+        return 1
+
+    no_refs: set = set()
+    predicates = [
+        ('AF-004 mft', lambda e: former_vss_mft(vss, e), vss.is_vss_relevant_mft),
+        ('AF-004 usn', lambda e: former_vss_usn(vss, e), vss.is_vss_relevant_usn),
+        ('AF-007 1102', lambda e: former_event_1102(evtx, e), evtx.is_event_1102),
+        ('AF-007 usn', lambda e: former_security_usn(evtx, e), evtx.is_security_evtx_usn),
+        ('AF-007 system', lambda e: former_system_context(evtx, e),
+         evtx.is_system_context_event),
+        ('TIMESTOMP mft', lambda e: any(n in no_refs for n in former_mft_entry_numbers(e)),
+         lambda e: timestomp.is_lnk_referenced_mft(e, no_refs)),
+    ]
+
+    print("=" * 70)
+    print("Facet Access Benchmark (filter predicates)")
+    print("=" * 70)
+    print()
+    print(f"Inputs: {len(inputs)} file(s); {len(entries):,} entries")
+    print()
+
+    # Every predicate must agree with its former loop on every entry
+    for name, former, typed in predicates:
+        mismatches = sum(former(e) != typed(e) for e in entries)
+        if not mismatches and name == 'TIMESTOMP mft':
+            mismatches = sum(list(former_mft_entry_numbers(e)) !=
+                             list(timestomp.mft_entry_numbers(e)) for e in entries)
+        if mismatches:
+            print(f"🚨 {name}: {mismatches:,} entries where the typed predicate differs")
+            return 1
+
+    print(f"{'Predicate':<16}{'Former':>14}{'Typed':>14}{'Speedup':>10}")
+    total_former = total_typed = 0.0
+    for name, former, typed in predicates:
+        before = median_seconds(former, entries, args.runs)
+        after = median_seconds(typed, entries, args.runs)
+        total_former += before
+        total_typed += after
+        print(f"{name:<16}{len(entries) / before:>10,.0f} r/s{len(entries) / after:>10,.0f} r/s"
+              f"{before / after:>9.2f}x")
+    print(f"{'all':<16}{len(predicates) * len(entries) / total_former:>10,.0f} r/s"
+          f"{len(predicates) * len(entries) / total_typed:>10,.0f} r/s"
+          f"{total_former / total_typed:>9.2f}x")
+
+    print()
+    print("✓ Identical predicate results")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
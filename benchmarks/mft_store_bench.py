@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+MFT Store Benchmark: entry number lookups against a rescan
+
+Builds an MFT store (af_common/mft_store.py) from an MFT JSON-LD export,
+then fetches the records of k random entry numbers three ways:
+- rescan: stream the export and keep the entries with one of the numbers,
+  as a filter pass does (its cost hardly depends on k, so it is timed
+  once, for the largest k)
+- lookup: MftStore.lookup() once per number (bisect the fences, read a block)
+- probe:  MftStore.probe() on all numbers (one merge join)
+
+All three must return the same records before timings are reported. The
+table shows the median time of --runs for each k, and the speedup of the
+probe over the rescan.
+
+Usage:
+    python3 benchmarks/mft_store_bench.py mft.jsonld
+    python3 benchmarks/mft_store_bench.py mft.jsonld --keys 1,100,10000 --run-size 50000 --runs 5
+"""
+
+import argparse
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+from af_common.jsonld_stream import JsonLdReader
+from af_common.metrics import StageMetrics
+from af_common.mft_store import DEFAULT_RUN_SIZE, MftStore, build_store, mft_records
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark MFT store lookups and probes against a rescan of the export"
+    )
+    parser.add_argument('mft', type=Path, help="MFT JSON-LD file")
+    parser.add_argument('--keys', default='1,10,100,1000',
+                        help="Comma-separated numbers of entry numbers to fetch "
+                             "(default: 1,10,100,1000)")
+    parser.add_argument('--run-size', type=int, default=DEFAULT_RUN_SIZE,
+                        help=f"Records per sorted run of the build (default: {DEFAULT_RUN_SIZE:,})")
+    parser.add_argument('--runs', type=int, default=3,
+                        help="Timed runs per method; the median is reported (default: 3)")
+    parser.add_argument('--seed', type=int, default=1, help="Random seed (default: 1)")
+    return parser.parse_args()
+
+
+def rescan(mft_file: Path, numbers: set) -> list:
+    found = []
+    with JsonLdReader(mft_file, canonical_keys=True) as reader:
+        previous = reader.graph_offset
+        for entry, offset in reader:
+            records, _ = mft_records(entry, previous, offset)
+            found.extend(r for r in records if r.entry_number in numbers)
+            previous = offset
+    return found
+
+
+def median_seconds(func, runs: int):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = func()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples), result
+
+
+def key(record):
+    return record.entry_number, record.sequence_number, record.start
+
+
+def main():
+    args = parse_args()
+    if not args.mft.exists():
+        print(f"ERROR: MFT file not found: {args.mft}", file=sys.stderr)
+        return 1
+    ks = [int(k) for k in args.keys.split(',')]
+
+    print("=" * 70)
+    print("MFT Store Benchmark")
+    print("=" * 70)
+    print()
+    print(f"MFT: {args.mft.name} ({args.mft.stat().st_size / (1024**2):.1f} MB)")
+
+    with tempfile.TemporaryDirectory(prefix='af_mftstore_bench_') as tmp:
+        path = Path(tmp) / 'mft.afms'
+        stage = StageMetrics('build')
+        start = time.perf_counter()
+        count = build_store(args.mft, path, run_size=args.run_size, metrics=stage)
+        elapsed = time.perf_counter() - start
+        print(f"Build: {count:,} records in {elapsed:.2f}s "
+              f"({stage.extra['spilled_runs']} run(s)), {path.stat().st_size / (1024**2):.1f} MB")
+        print()
+
+        with MftStore(path) as store:
+            numbers = sorted({r.entry_number for r in store})
+            random.Random(args.seed).shuffle(numbers)
+            # Prefixes of one shuffle, so the largest k's rescan holds every k's records
+            wanted = {k: numbers[:k] for k in ks}
+
+            largest = set(wanted[max(ks)])
+            rescan_seconds, rescanned = median_seconds(
+                lambda: rescan(args.mft, largest), min(args.runs, 3))
+
+            print(f"{'Keys':>7}{'Rescan':>11}{'Lookup':>11}{'Probe':>11}{'Speedup':>10}")
+            for k in ks:
+                expected = sorted(key(r) for r in rescanned if r.entry_number in set(wanted[k]))
+                lookup_seconds, looked_up = median_seconds(
+                    lambda: [r for n in wanted[k] for r in store.lookup(n)], args.runs)
+                probe_seconds, probed = median_seconds(
+                    lambda: list(store.probe(wanted[k])), args.runs)
+                for name, result in (('lookup', looked_up), ('probe', probed)):
+                    if sorted(map(key, result)) != expected:
+                        print(f"🚨 k={k}: {name} records differ from the rescan")
+                        return 1
+                print(f"{k:>7,}{rescan_seconds * 1000:>9.1f}ms{lookup_seconds * 1000:>9.2f}ms"
+                      f"{probe_seconds * 1000:>9.2f}ms{rescan_seconds / probe_seconds:>9.0f}x")
+
+    print()
+    print("✓ Identical records")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
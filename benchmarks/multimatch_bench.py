@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Multi-pattern Matcher Benchmark for the filter predicates
+
+Collects the field values the stream filter predicates test (fileName,
+filePath, parentPath, updateReasons, channel) from JSON-LD inputs and
+times, per value:
+- per-literal: the former predicate loops, one `in` test per literal and
+  per rule (`any(indicator in filename for indicator in vss_indicators)`)
+- scan: one FIELD_PATTERNS scan for all rules' literals, then a mask test
+  per rule, without the per-value memo
+- scan+memo: the same with the memo, as the filters run it
+
+All three must agree on every value and rule check before timings are
+reported.
+
+Usage:
+    python3 benchmarks/multimatch_bench.py
+    python3 benchmarks/multimatch_bench.py mft.jsonld usn.jsonld --runs 5
+"""
+
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+from af_common.jsonld_stream import JsonLdReader
+from af_common.multimatch import FIELD_PATTERNS, PatternSet
+from af_common.registry import RULES, load_script
+
+# The per-literal checks the predicates made on each field, per rule
+FIELD_CHECKS: Dict[str, List[Tuple[str, List[str]]]] = {
+    'observable:fileName': [
+        ('AF-002', ['History']),
+        ('AF-004', ['tracking.log', 'IndexerVolumeGuid', '_OnDiskSnapshotProp', '{']),
+        ('AF-004', ['{']),
+        ('AF-007', ['Security', '.evtx']),
+    ],
+    'observable:filePath': [('AF-002', ['IndexedDB'])],
+    'dfc-ext:parentPath': [
+        ('AF-002', ['IndexedDB']),
+        ('AF-004', ['System Volume Information']),
+    ],
+    'dfc-ext:updateReasons': [
+        ('AF-002', ['DataTruncation', 'DataOverwrite', 'DataExtend']),
+        ('AF-004', ['FileDelete', 'FileDeleteClose', 'DataTruncation']),
+    ],
+    'dfc-ext:channel': [('AF-007', ['Security'])],
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the shared multi-pattern matcher against per-literal loops"
+    )
+    parser.add_argument('inputs', nargs='*', type=Path,
+                        help="JSON-LD files to take field values from "
+                             "(default: the sample files in the repository)")
+    parser.add_argument('--runs', type=int, default=5,
+                        help="Timed runs per method; the median is reported (default: 5)")
+    return parser.parse_args()
+
+
+def collect_values(paths: List[Path]) -> List[Tuple[str, str]]:
+    """(field, value) for every checked field of every facet in the inputs."""
+    values = []
+    for path in paths:
+        with JsonLdReader(path) as reader:
+            for entry, _ in reader:
+                facets = entry.get('core:hasFacet', entry.get('uco-core:hasFacet', []))
+                for facet in facets if isinstance(facets, list) else [facets]:
+                    if not isinstance(facet, dict):
+                        continue
+                    for field in FIELD_CHECKS:
+                        if field in facet:
+                            values.append((field, str(facet[field])))
+    return values
+
+
+def per_literal(values, checks) -> int:
+    hits = 0
+    for field, value in values:
+        for _, literals in checks[field]:
+            if any(literal in value for literal in literals):
+                hits += 1
+    return hits
+
+
+def scanned(values, checks, matcher: PatternSet) -> int:
+    hits = 0
+    scan = matcher.scan
+    for field, value in values:
+        found = scan(value)
+        for mask in checks[field]:
+            if found & mask:
+                hits += 1
+    return hits
+
+
+def median_ms(func, runs: int) -> Tuple[float, int]:
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), result
+
+
+def main():
+    args = parse_args()
+
+    # Importing the filters registers every rule's literals
+    for spec in RULES.values():
+        if spec.filter_path:
+            load_script(spec.filter_path)
+
+    inputs = args.inputs or sorted(
+        p for p in REPO_ROOT.glob('AF-*/**/*.jsonld') if p.stat().st_size)
+    values = collect_values(inputs)
+    if not values:
+        print("ERROR: no checked fields found in the inputs", file=sys.stderr)
+        return 1
+
+    mask_checks = {field: [FIELD_PATTERNS.mask(*literals) for _, literals in checks]
+                   for field, checks in FIELD_CHECKS.items()}
+
+    print("=" * 70)
+    print("Multi-pattern Matcher Benchmark (filter predicate literals)")
+    print("=" * 70)
+    print()
+    print(f"Inputs: {len(inputs)} file(s); {len(values):,} field values, "
+          f"{len({v for _, v in values}):,} distinct")
+    print(f"Literals: {len(FIELD_PATTERNS.patterns)} registered, "
+          f"{sum(len(c) for c in FIELD_CHECKS.values())} rule checks per field set")
+    print()
+
+    # Every literal bitset must equal the one-`in`-per-literal reference
+    reference = PatternSet(FIELD_PATTERNS.patterns)
+    mismatches = sum(reference.scan(v) != reference.naive_scan(v) for _, v in values)
+    if mismatches:
+        print(f"🚨 {mismatches:,} value(s) where the scan differs from per-literal tests")
+        return 1
+
+    methods = [
+        ('per-literal', lambda: per_literal(values, FIELD_CHECKS)),
+        ('scan', lambda: scanned(values, mask_checks,
+                                 PatternSet(FIELD_PATTERNS.patterns, cache_limit=0))),
+        ('scan+memo', lambda: scanned(values, mask_checks,
+                                      PatternSet(FIELD_PATTERNS.patterns))),
+    ]
+
+    print(f"{'Method':<14}{'Total':>11}{'Per value':>12}{'Speedup':>10}")
+    baseline = None
+    expected = None
+    for name, func in methods:
+        elapsed, hits = median_ms(func, args.runs)
+        if expected is None:
+            baseline, expected = elapsed, hits
+        elif hits != expected:
+            print(f"🚨 {name}: {hits:,} rule check hits, per-literal found {expected:,}")
+            return 1
+        per_value_ns = elapsed * 1e6 / len(values)
+        print(f"{name:<14}{elapsed:>9.1f}ms{per_value_ns:>10.0f}ns{baseline / elapsed:>9.2f}x")
+
+    print()
+    print(f"✓ Identical results ({expected:,} rule check hits)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
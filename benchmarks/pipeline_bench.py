@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Pipelined Input Benchmark for the stream filters
+
+Runs one filter pass (every rule's predicate for --source, as af_detect.py
+prefilters) over a JSON-LD input with the pipeline stages set three ways:
+- inline: read, decode, predicate and write in one thread
+- read-ahead: blocks read in a background thread, the rest inline
+- pipelined: read-ahead, decode and predicate threads (the default)
+
+Slow evidence storage is simulated with --read-mbps/--read-latency-ms:
+every read sleeps as a network share would block, which releases the
+GIL like a real read. All configurations must write byte-identical
+outputs before timings are reported. The queue occupancy of the
+pipelined run shows where it waits.
+
+Usage:
+    python3 benchmarks/pipeline_bench.py usn.jsonld
+    python3 benchmarks/pipeline_bench.py usn.jsonld --read-mbps 50 --read-latency-ms 2
+    python3 benchmarks/pipeline_bench.py mft.jsonld --source mft --runs 5
+"""
+
+import argparse
+import filecmp
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+from af_common import jsonld_stream
+from af_common.metrics import StageMetrics
+from af_common.pipeline import DEFAULT, INLINE
+from af_common.registry import RULES, load_script
+from af_common.stream_filter import filter_jsonld
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark inline against pipelined stream filter input"
+    )
+    parser.add_argument('input', type=Path, help="JSON-LD input file")
+    parser.add_argument('--source', default='usn',
+                        help="Evidence source whose rule predicates to apply (default: usn)")
+    parser.add_argument('--read-mbps', type=float, default=0.0,
+                        help="Simulated storage bandwidth in MB/s (default: local disk speed)")
+    parser.add_argument('--read-latency-ms', type=float, default=0.0,
+                        help="Simulated latency per read call in ms (default: 0)")
+    parser.add_argument('--runs', type=int, default=3,
+                        help="Timed runs per configuration; the median is reported (default: 3)")
+    return parser.parse_args()
+
+
+class SlowFile:
+    """A binary file whose reads block as on remote storage."""
+
+    def __init__(self, file, mbps: float, latency: float):
+        self._file = file
+        self._seconds_per_byte = 1 / (mbps * 1024 * 1024) if mbps else 0.0
+        self._latency = latency
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._file.read(size)
+        time.sleep(self._latency + len(data) * self._seconds_per_byte)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+def source_predicate(source: str):
+    predicates = []
+    for spec in RULES.values():
+        if spec.filter_path:
+            module = load_script(spec.filter_path)
+            try:
+                predicate = module.source_predicates({}).get(source)
+            except KeyError:
+                # Needs another source first (e.g. AF-TIMESTOMPING's LNK references)
+                continue
+            if predicate:
+                predicates.append(predicate)
+    return lambda entry: any(p(entry) for p in predicates)
+
+
+def main():
+    args = parse_args()
+    if not args.input.exists():
+        print(f"ERROR: input not found: {args.input}", file=sys.stderr)
+        return 1
+
+    if args.read_mbps or args.read_latency_ms:
+        # The reader opens its input through the module's open()
+        def slow_open(path, mode='r', *rest, **kwargs):
+            file = open(path, mode, *rest, **kwargs)
+            if 'r' in mode:
+                return SlowFile(file, args.read_mbps, args.read_latency_ms / 1000)
+            return file
+        jsonld_stream.open = slow_open
+
+    predicate = source_predicate(args.source)
+    configs = [
+        ('inline', INLINE),
+        ('read-ahead', INLINE._replace(read_ahead=DEFAULT.read_ahead)),
+        ('pipelined', DEFAULT),
+    ]
+
+    print("=" * 70)
+    print("Pipelined Input Benchmark (stream filter pass)")
+    print("=" * 70)
+    print()
+    print(f"Input: {args.input.name} ({args.input.stat().st_size / (1024**2):.1f} MB), "
+          f"{args.source} predicates")
+    storage = "local"
+    if args.read_mbps or args.read_latency_ms:
+        storage = (f"{args.read_mbps:g} MB/s" if args.read_mbps else "unthrottled") \
+                  + f", {args.read_latency_ms:g} ms per read"
+    print(f"Storage: {storage}")
+    print()
+
+    with tempfile.TemporaryDirectory(prefix='af_pipeline_bench_') as tmp:
+        outputs = {}
+        results = []
+        for name, config in configs:
+            samples = []
+            for _ in range(args.runs):
+                metrics = StageMetrics(name)
+                output = Path(tmp) / f"{name}.jsonld"
+                start = time.perf_counter()
+                filter_jsonld(args.input, output, predicate, metrics=metrics, pipeline=config)
+                samples.append(time.perf_counter() - start)
+            outputs[name] = output
+            results.append((name, statistics.median(samples), metrics))
+
+        reference = outputs['inline']
+        for name, output in outputs.items():
+            if not filecmp.cmp(reference, output, shallow=False):
+                print(f"🚨 {name}: output differs from the inline pass")
+                return 1
+
+        baseline = results[0][1]
+        print(f"{'Configuration':<16}{'Time':>10}{'MB/s':>9}{'Speedup':>10}")
+        size_mb = args.input.stat().st_size / (1024**2)
+        for name, elapsed, _ in results:
+            print(f"{name:<16}{elapsed:>9.2f}s{size_mb / elapsed:>9.1f}{baseline / elapsed:>9.2f}x")
+
+        print()
+        print("Pipelined queue occupancy (mean batches or blocks queued / depth):")
+        for queue_name, stats in results[-1][2].extra.get('queues', {}).items():
+            print(f"  {queue_name:<10} {stats['mean_occupancy']:>6.2f} / {stats['depth']:<3} "
+                  f"producer waited {stats['full_wait_seconds']:.2f}s, "
+                  f"consumer waited {stats['empty_wait_seconds']:.2f}s")
+
+    print()
+    print("✓ Identical outputs")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Memory Budget Benchmark: in-memory against spilled joins
+
+Runs one rule's spilling stage as its command-line script would, once
+without a budget and once per --memory-limit, each in a fresh process:
+- timestomp: stream_filter_timestomp.py (LNK references, grace semi-join)
+- af004:     detect_af004_optimized.py --engine native (distinct deletions)
+- af007:     detect_af007_optimized.py --engine native (distinct bindings)
+
+Every run must produce the same output as the unlimited one (the filtered
+MFT file, or the detector's report) before timings are reported. The
+table shows the median wall time, its cost relative to the unlimited run,
+peak RSS, and what the budget spilled (from --metrics-json).
+
+Usage:
+    python3 benchmarks/spill_bench.py timestomp --mft mft.jsonld --lnk lnk.jsonld
+    python3 benchmarks/spill_bench.py af007 --usn usn.jsonld --security security.jsonld
+    python3 benchmarks/spill_bench.py af004 --mft mft.jsonld --usn usn.jsonld \
+        --limits 1M,64K --runs 5
+"""
+
+import argparse
+import filecmp
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the in-memory path against spilled joins under --memory-limit"
+    )
+    parser.add_argument('rule', choices=['timestomp', 'af004', 'af007'],
+                        help="Which spilling stage to run")
+    parser.add_argument('--mft', type=Path, help="MFT JSON-LD file (timestomp, af004)")
+    parser.add_argument('--lnk', type=Path, help="LNK JSON-LD file (timestomp)")
+    parser.add_argument('--usn', type=Path, help="USN JSON-LD file (af004, af007)")
+    parser.add_argument('--security', type=Path, help="Security JSON-LD file (af007)")
+    parser.add_argument('--limits', default='16M,1M,64K',
+                        help="Comma-separated --memory-limit values (default: 16M,1M,64K)")
+    parser.add_argument('--runs', type=int, default=3,
+                        help="Runs per configuration; the median is reported (default: 3)")
+    return parser.parse_args()
+
+
+def command(args, output_dir: Path):
+    """(script directory, argv, output file to compare or None for stdout)."""
+    if args.rule == 'timestomp':
+        return (REPO_ROOT / 'AF-TIMESTOMPING',
+                ['stream_filter_timestomp.py', '--mft', args.mft, '--lnk', args.lnk,
+                 '--output-dir', output_dir],
+                output_dir / 'mft_lnk_filtered.jsonld')
+    if args.rule == 'af004':
+        return (REPO_ROOT / 'AF-004',
+                ['detect_af004_optimized.py', args.mft, args.usn,
+                 '--engine', 'native', '--no-cache'], None)
+    return (REPO_ROOT / 'AF-007',
+            ['detect_af007_optimized.py', '--usn', args.usn, '--security', args.security,
+             '--engine', 'native', '--no-cache'], None)
+
+
+def run(args, tmp: Path, name: str, limit):
+    """One run: (output path, metrics dict)."""
+    output_dir = tmp / name
+    output_dir.mkdir(exist_ok=True)
+    cwd, argv, output = command(args, output_dir)
+    metrics_file = output_dir / 'metrics.json'
+    argv = [sys.executable] + [str(a) for a in argv] + ['--metrics-json', str(metrics_file)]
+    if limit:
+        argv += ['--memory-limit', limit, '--spill-dir', str(tmp / 'spill')]
+    result = subprocess.run(argv, cwd=cwd, capture_output=True, text=True)
+    if result.returncode not in (0, 2):
+        sys.stderr.write(result.stdout + result.stderr)
+        raise SystemExit(f"🚨 {name}: exit code {result.returncode}")
+    if output is None:
+        output = output_dir / 'report.txt'
+        # The metrics line names this run's own file
+        output.write_text('\n'.join(line for line in result.stdout.splitlines()
+                                    if not line.startswith('Metrics written to:')))
+    return output, json.loads(metrics_file.read_text())
+
+
+def spilled(metrics):
+    """The budget's counters after the run's last stage that reports them."""
+    memory = {}
+    for stage in metrics['stages']:
+        memory = stage.get('memory', memory)
+    return memory
+
+
+def main():
+    args = parse_args()
+    needed = {'timestomp': ('mft', 'lnk'), 'af004': ('mft', 'usn'),
+              'af007': ('usn', 'security')}[args.rule]
+    for name in needed:
+        path = getattr(args, name)
+        if path is None or not path.exists():
+            print(f"ERROR: --{name} file required for {args.rule}: {path}", file=sys.stderr)
+            return 1
+        setattr(args, name, path.resolve())
+
+    configs = [('unlimited', None)] + [(limit, limit) for limit in args.limits.split(',')]
+
+    print("=" * 70)
+    print(f"Memory Budget Benchmark ({args.rule})")
+    print("=" * 70)
+    print()
+    for name in needed:
+        path = getattr(args, name)
+        print(f"{name.upper():<9} {path.name} ({path.stat().st_size / (1024**2):.1f} MB)")
+    print()
+
+    with tempfile.TemporaryDirectory(prefix='af_spill_bench_') as tmp:
+        results = []
+        for name, limit in configs:
+            samples = []
+            for _ in range(args.runs):
+                output, metrics = run(args, Path(tmp), name, limit)
+                samples.append(metrics['wall_seconds'])
+            results.append((name, output, statistics.median(samples), metrics))
+
+        reference = results[0][1]
+        for name, output, _, _ in results[1:]:
+            if not filecmp.cmp(reference, output, shallow=False):
+                print(f"🚨 {name}: output differs from the unlimited run")
+                return 1
+
+        baseline = results[0][2]
+        print(f"{'Limit':<12}{'Time':>9}{'Cost':>9}{'Peak RSS':>11}{'Spills':>8}{'Spilled':>11}")
+        for name, _, elapsed, metrics in results:
+            memory = spilled(metrics)
+            rss = metrics.get('peak_rss_bytes')
+            print(f"{name:<12}{elapsed:>8.2f}s{elapsed / baseline:>8.2f}x"
+                  f"{(f'{rss / (1024**2):.0f} MB' if rss else 'n/a'):>11}"
+                  f"{memory.get('spills', 0):>8}"
+                  f"{memory.get('spilled_bytes', 0) / (1024**2):>8.1f} MB")
+
+    print()
+    print("✓ Identical outputs")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
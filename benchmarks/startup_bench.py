@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Startup Benchmark for the detection and filter CLIs
+
+Measures the no-detection fast path (--help and the missing-argument error)
+of every detect_*/stream_filter_* script and af_detect.py:
+- wall time per invocation (median of --runs), including interpreter start
+- total import time and the slowest imports, from `python -X importtime`
+
+Flags any script whose median wall time exceeds the target, so heavy
+imports (rdflib, numpy, ...) creeping back to module level are caught.
+
+Usage:
+    python3 benchmarks/startup_bench.py
+    python3 benchmarks/startup_bench.py --runs 20 --target-ms 100 --top 5
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+SCRIPTS = [
+    'af_detect.py',
+    'AF-002/detect_af002.py',
+    'AF-002/stream_filter_af002.py',
+    'AF-004/detect_af004_optimized.py',
+    'AF-004/stream_filter_vss.py',
+    'AF-007/detect_af007_optimized.py',
+    'AF-007/stream_filter_evtx.py',
+    'AF-TIMESTOMPING/detect_timestomp_optimized.py',
+    'AF-TIMESTOMPING/stream_filter_timestomp.py',
+    'AF-TIMESTOMPING/AF-timestomping-xml/detect_xml_timestomp.py',
+]
+
+# Arguments that exercise the fast path without touching any evidence
+FAST_PATHS = {
+    'help': ['--help'],
+    'arg-error': [],
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark CLI startup time on the no-detection fast path"
+    )
+    parser.add_argument('--runs', type=int, default=10,
+                        help="Invocations per script and path (default: 10)")
+    parser.add_argument('--target-ms', type=float, default=100.0,
+                        help="Startup budget in milliseconds (default: 100)")
+    parser.add_argument('--top', type=int, default=3,
+                        help="Slowest imports to list per script (default: 3)")
+    return parser.parse_args()
+
+
+def wall_time_ms(cmd, runs: int) -> float:
+    """Median wall time of running cmd, in milliseconds."""
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(cmd, cwd=REPO_ROOT, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def import_profile(cmd):
+    """
+    Run cmd under -X importtime.
+
+    Returns:
+        (total_import_ms, [(cumulative_ms, module), ...] for top-level imports)
+    """
+    result = subprocess.run([cmd[0], '-X', 'importtime'] + cmd[1:], cwd=REPO_ROOT,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    top_level = []
+    total_us = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        # "import time:  self_us | cumulative_us | <indent>module"
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        total_us += int(self_us)
+        # Nested imports are indented by two spaces per level
+        if not name.startswith('   '):
+            top_level.append((int(cumulative_us) / 1000, name.strip()))
+    top_level.sort(reverse=True)
+    return total_us / 1000, top_level
+
+
+def main():
+    args = parse_args()
+
+    baseline = wall_time_ms([sys.executable, '-c', 'pass'], args.runs)
+
+    print("=" * 78)
+    print("CLI Startup Benchmark (no-detection fast path)")
+    print("=" * 78)
+    print()
+    print(f"Interpreter: {sys.executable}")
+    print(f"Bare interpreter startup: {baseline:.1f} ms (median of {args.runs})")
+    print(f"Target: {args.target_ms:.0f} ms")
+    print()
+    print(f"{'Script':<62}{'Path':<11}{'Wall':>9}")
+
+    failures = 0
+    for script in SCRIPTS:
+        for label, extra in FAST_PATHS.items():
+            cmd = [sys.executable, str(REPO_ROOT / script)] + extra
+            elapsed = wall_time_ms(cmd, args.runs)
+            flag = '' if elapsed <= args.target_ms else '  OVER'
+            failures += bool(flag)
+            print(f"{script:<62}{label:<11}{elapsed:>7.1f}ms{flag}")
+
+        total_ms, top_level = import_profile([sys.executable, str(REPO_ROOT / script), '--help'])
+        slowest = ', '.join(f"{name} {ms:.1f}ms" for ms, name in top_level[:args.top])
+        print(f"    imports: {total_ms:.1f} ms total; slowest: {slowest}")
+
+    print()
+    if failures:
+        print(f"✗ {failures} fast-path invocation(s) over {args.target_ms:.0f} ms")
+        return 1
+    print(f"✓ All fast paths under {args.target_ms:.0f} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,88 @@
+"""
+Shared fixtures for the tests.
+
+The af_common package and the AF-* scripts are imported from the
+repository root, as the scripts themselves do.
+"""
+
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+CONTEXT = {
+    'core': 'https://ontology.unifiedcyberontology.org/uco/core/',
+    'observable': 'https://ontology.unifiedcyberontology.org/uco/observable/',
+    'dfc-ext': 'https://www.w3.org/dfc-ext/',
+    'xsd': 'http://www.w3.org/2001/XMLSchema#',
+    'kb': 'http://example.org/kb/',
+}
+
+
+def write_jsonld(path: Path, graph, context=None) -> Path:
+    """Write entries as a JSON-LD export in the exporters' layout."""
+    path.write_text(json.dumps({'@context': context or CONTEXT, '@graph': graph}, indent=2))
+    return path
+
+
+def integer(value: int):
+    return {'@type': 'xsd:integer', '@value': str(value)}
+
+
+def mft_entry(entry_number: int, file_name: str, parent_path: str, sequence_number: int = 1,
+              parent_entry_number: int = 5, parent_sequence_number: int = 5,
+              created: str = '2024-01-01T00:00:00Z'):
+    """An MFT export entry: a File with a FileFacet and an MftFacet."""
+    uid = f'{entry_number}-{sequence_number}'
+    return {
+        '@id': f'kb:mft-entry--{uid}', '@type': 'observable:File',
+        'core:hasFacet': [
+            {'@id': f'kb:mft-entry-file-facet--{uid}', '@type': 'observable:FileFacet',
+             'observable:fileName': file_name},
+            {'@id': f'kb:mft-entry-custom-facet--{uid}', '@type': ['dfc-ext:MftFacet', 'core:Facet'],
+             'dfc-ext:entryNumber': integer(entry_number),
+             'dfc-ext:sequenceNumber': integer(sequence_number),
+             'dfc-ext:parentEntryNumber': integer(parent_entry_number),
+             'dfc-ext:parentSequenceNumber': integer(parent_sequence_number),
+             'dfc-ext:parentPath': parent_path,
+             'dfc-ext:fileName': file_name,
+             'dfc-ext:created0x10': {'@type': 'xsd:dateTime', '@value': created}},
+        ],
+    }
+
+
+def usn_entry(usn: int, entry_number: int, file_name: str, reasons: str, timestamp: str,
+              sequence_number: int = 2, parent_entry_number: int = 100):
+    """A USN export entry: a File with a FileFacet and a UsnFacet."""
+    return {
+        '@id': f'kb:usn-entry--{usn}', '@type': 'observable:File',
+        'core:hasFacet': [
+            {'@id': f'kb:usn-entry-file-facet--{usn}', '@type': 'observable:FileFacet',
+             'observable:fileName': file_name},
+            {'@id': f'kb:usn-entry-custom-facet--{usn}', '@type': ['dfc-ext:UsnFacet', 'core:Facet'],
+             'dfc-ext:entryNumber': integer(entry_number),
+             'dfc-ext:sequenceNumber': integer(sequence_number),
+             'dfc-ext:parentEntryNumber': integer(parent_entry_number),
+             'dfc-ext:parentSequenceNumber': integer(2),
+             'dfc-ext:parentPath': '',
+             'dfc-ext:updateSequenceNumber': integer(usn),
+             'dfc-ext:updateTimestamp': {'@type': 'xsd:dateTime', '@value': timestamp},
+             'dfc-ext:updateReasons': reasons},
+        ],
+    }
+
+
+def run_script(script: Path, *args, cwd=None) -> subprocess.CompletedProcess:
+    """Run one of the repository's scripts with the current interpreter."""
+    return subprocess.run([sys.executable, str(script), *map(str, args)],
+                          cwd=cwd or script.parent, capture_output=True, text=True)
+
+
+@pytest.fixture
+def repo_root() -> Path:
+    return REPO_ROOT
@@ -0,0 +1,33 @@
+"""AF-007 verdict on query rows in any order (first-hit mode has no ORDER BY)."""
+
+from collections import namedtuple
+from itertools import permutations
+
+from conftest import REPO_ROOT
+from af_common.registry import load_script
+
+AF007 = load_script(REPO_ROOT / 'AF-007' / 'detect_af007_optimized.py')
+row = namedtuple('Row', ['event_type', 'time'])
+
+
+def test_latest_clear_decides_in_any_order():
+    rows = [row('Event 1102 - Log Cleared', '2024-01-05T00:00:00Z'),
+            row('Event 1102 - Log Cleared', '2024-01-01T00:00:00Z'),
+            row('USN DataTruncation', '2024-01-03T00:00:00Z')]
+    for order in permutations(rows):
+        event_1102, truncations = AF007.categorize(order)
+        assert event_1102['time'] == '2024-01-05T00:00:00Z'
+        assert AF007.is_positive(order)
+
+
+def test_no_truncation_before_the_clear():
+    rows = [row('Event 1102 - Log Cleared', '2024-01-02T00:00:00Z'),
+            row('USN DataTruncation', '2024-01-03T00:00:00Z'),
+            row('USN DataTruncation', '2024-01-04T00:00:00+00:00')]
+    for order in permutations(rows):
+        assert not AF007.is_positive(order)
+
+
+def test_missing_side_is_negative():
+    assert not AF007.is_positive([row('USN DataTruncation', '2024-01-03T00:00:00Z')])
+    assert not AF007.is_positive([row('Event 1102 - Log Cleared', '2024-01-03T00:00:00Z')])
@@ -0,0 +1,62 @@
+"""af_detect.py (and af_batch.py) with a failing rule next to a positive one."""
+
+import json
+
+from conftest import REPO_ROOT, mft_entry, run_script, write_jsonld
+from af_common.registry import load_script
+
+PLUGIN = '''
+from pathlib import Path
+from af_common.registry import RuleSpec, register
+
+for rule_id in ('BROKEN', 'POSITIVE'):
+    register(RuleSpec(
+        rule_id=rule_id,
+        directory=Path(__file__).parent,
+        detector=f'detect_{rule_id.lower()}.py',
+        rule_file='any.rq',
+        sources=('mft',),
+        named_graphs=False,
+    ))
+'''
+
+DETECTORS = {
+    'detect_broken.py': "def report(results, triple_counts):\n"
+                        "    raise KeyError('missing binding')\n",
+    'detect_positive.py': "def report(results, triple_counts):\n"
+                          "    return 2\n",
+}
+
+
+def test_failed_rule_is_reported_and_sets_the_exit_code(tmp_path):
+    (tmp_path / 'plugin.py').write_text(PLUGIN)
+    for name, code in DETECTORS.items():
+        (tmp_path / name).write_text(code)
+    (tmp_path / 'any.rq').write_text('SELECT ?s WHERE { ?s ?p ?o } LIMIT 1')
+    mft = write_jsonld(tmp_path / 'mft.jsonld', [mft_entry(10, 'a.txt', '.\\Users')])
+    metrics = tmp_path / 'metrics.json'
+
+    result = run_script(REPO_ROOT / 'af_detect.py', '--plugin', tmp_path / 'plugin.py',
+                        '--rules', 'BROKEN,POSITIVE', '--mft', mft,
+                        '--metrics-json', metrics)
+
+    assert result.returncode == 1
+    assert 'BROKEN failed: KeyError' in result.stderr
+    summary = result.stdout[result.stdout.index('Summary'):].splitlines()
+    assert [line.split()[:2] for line in summary if line.startswith(('BROKEN', 'POSITIVE'))] \
+        == [['BROKEN', 'ERROR'], ['POSITIVE', 'ALERT']]
+    stages = {stage['name']: stage for stage in json.loads(metrics.read_text())['stages']}
+    assert stages['rule:BROKEN']['exit_code'] == 1
+    assert stages['rule:POSITIVE']['exit_code'] == 2
+
+
+def test_batch_keeps_the_rule_results_of_a_failed_case(tmp_path):
+    batch = load_script(REPO_ROOT / 'af_batch.py')
+    (tmp_path / 'metrics.json').write_text(json.dumps({'stages': [
+        {'name': 'load:mft'},
+        {'name': 'rule:BROKEN', 'exit_code': 1},
+        {'name': 'rule:POSITIVE', 'exit_code': 2},
+    ]}))
+    result = batch.case_result(batch.Case('ws-17', {}), tmp_path, 1, 1.0)
+    assert result['status'] == 'error'
+    assert result['rules'] == {'BROKEN': 'error', 'POSITIVE': 'ALERT'}
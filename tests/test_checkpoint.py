@@ -0,0 +1,76 @@
+"""CheckpointStore: saved progress, resume checks and clearing."""
+
+import pytest
+
+from af_common.checkpoint import CHECKPOINT_FILENAME, CheckpointError, CheckpointStore
+
+
+@pytest.fixture
+def files(tmp_path):
+    input_file = tmp_path / 'input.jsonld'
+    input_file.write_text('{"@graph": []}')
+    output_file = tmp_path / 'out' / 'output.jsonld'
+    output_file.parent.mkdir()
+    output_file.write_bytes(b'x' * 100)
+    return input_file, output_file
+
+
+def save(store, input_file, output_file, position=60, **kwargs):
+    store.save(input_file, output_file, input_offset=10, total=5, matched=2,
+               output_position=position, **kwargs)
+
+
+def test_resume_returns_saved_state(files):
+    input_file, output_file = files
+    save(CheckpointStore(output_file.parent), input_file, output_file, extra_field=7)
+
+    state = CheckpointStore(output_file.parent, resume=True).lookup(input_file, output_file)
+    assert state['input_offset'] == 10
+    assert (state['total'], state['matched'], state['output_position']) == (5, 2, 60)
+    assert state['complete'] is False
+    assert state['extra_field'] == 7
+
+
+def test_without_resume_starts_from_scratch(files):
+    input_file, output_file = files
+    save(CheckpointStore(output_file.parent), input_file, output_file)
+    assert CheckpointStore(output_file.parent).lookup(input_file, output_file) is None
+
+
+def test_unknown_pass_starts_from_scratch(files):
+    input_file, output_file = files
+    save(CheckpointStore(output_file.parent), input_file, output_file)
+    store = CheckpointStore(output_file.parent, resume=True)
+    assert store.lookup(input_file, output_file.with_name('other.jsonld')) is None
+
+
+def test_changed_input_is_refused(files):
+    input_file, output_file = files
+    save(CheckpointStore(output_file.parent), input_file, output_file)
+    input_file.write_text('{"@graph": [{}]}')
+    with pytest.raises(CheckpointError, match='Input changed'):
+        CheckpointStore(output_file.parent, resume=True).lookup(input_file, output_file)
+
+
+def test_truncated_output_is_refused(files):
+    input_file, output_file = files
+    save(CheckpointStore(output_file.parent), input_file, output_file, position=200)
+    with pytest.raises(CheckpointError, match='truncated'):
+        CheckpointStore(output_file.parent, resume=True).lookup(input_file, output_file)
+
+
+def test_unsupported_version_is_refused(files):
+    _, output_file = files
+    (output_file.parent / CHECKPOINT_FILENAME).write_text('{"version": 99, "passes": {}}')
+    with pytest.raises(CheckpointError, match='version'):
+        CheckpointStore(output_file.parent, resume=True)
+
+
+def test_clear_removes_state(files):
+    input_file, output_file = files
+    store = CheckpointStore(output_file.parent)
+    save(store, input_file, output_file)
+    assert (output_file.parent / CHECKPOINT_FILENAME).exists()
+    store.clear()
+    assert not (output_file.parent / CHECKPOINT_FILENAME).exists()
+    assert CheckpointStore(output_file.parent, resume=True).lookup(input_file, output_file) is None
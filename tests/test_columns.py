@@ -0,0 +1,85 @@
+"""Column tables: extraction, loading and the unsupported-input marker."""
+
+import pytest
+
+from conftest import mft_entry, write_jsonld
+from af_common.columns import (
+    TIME_MISSING, ColumnCache, ColumnsUnsupported, ColumnTable, extract, numpy_available,
+)
+from af_common.metrics import StageMetrics
+
+pytestmark = pytest.mark.skipif(not numpy_available(), reason="NumPy is not installed")
+
+
+def test_extract_and_load(tmp_path):
+    source = write_jsonld(tmp_path / 'mft.jsonld', [
+        mft_entry(5, 'History', '.\\Users\\a\\Chrome'),
+        mft_entry(9, 'Security.evtx', '.\\Windows\\Logs'),
+        {'@id': 'kb:no-facets', '@type': 'observable:File'},
+    ])
+    assert extract(source, tmp_path / 'table') == 2
+
+    table = ColumnTable(tmp_path / 'table')
+    assert (table.rows, table.entries) == (2, 3)
+    assert table.ints('entryNumber').tolist() == [5, 9]
+    assert table.value('fileName', 1) == 'Security.evtx'
+    assert table.value('node', 0) == 'http://example.org/kb/mft-entry--5-1'
+    assert table.ns('created0x10')[0] != TIME_MISSING
+    assert table.mask('parentPath', table.codes_containing('parentPath', 'Chrome')).tolist() \
+        == [True, False]
+
+
+def test_unsupported_input(tmp_path):
+    entry = mft_entry(1, 'a', 'b')
+    entry['core:hasFacet'].append(dict(entry['core:hasFacet'][1], **{'@id': 'kb:second'}))
+    source = write_jsonld(tmp_path / 'mft.jsonld', [entry])
+    with pytest.raises(ColumnsUnsupported):
+        extract(source, tmp_path / 'table')
+    assert not (tmp_path / 'table').exists()
+
+
+def test_cache_builds_then_loads(tmp_path):
+    source = write_jsonld(tmp_path / 'mft.jsonld', [mft_entry(1, 'a', 'b')])
+    cache = ColumnCache(tmp_path / 'columns', lambda path: 'digest')
+
+    stage = StageMetrics('columns')
+    assert cache.table(source, stage).rows == 1
+    assert stage.extra['columns'] == 'built'
+    stage = StageMetrics('columns')
+    assert cache.table(source, stage).rows == 1
+    assert stage.extra['columns'] == 'loaded'
+
+
+def test_cache_remembers_unsupported_inputs(tmp_path):
+    source = write_jsonld(tmp_path / 'mft.jsonld', [
+        {'@id': 'kb:f', 'core:hasFacet': [{'@id': 'kb:facet'}]}])
+    cache = ColumnCache(tmp_path / 'columns', lambda path: 'digest')
+
+    stage = StageMetrics('columns')
+    assert cache.table(source, stage) is None
+    assert stage.extra['columns'].startswith('unsupported')
+    stage = StageMetrics('columns')
+    assert cache.table(source, stage) is None
+    assert stage.extra['columns'].startswith('unsupported')
+
+
+def test_unsupported_marker_is_per_format(tmp_path, monkeypatch):
+    from af_common import columns
+
+    source = write_jsonld(tmp_path / 'mft.jsonld', [mft_entry(1, 'a', 'b')])
+    cache = ColumnCache(tmp_path / 'columns', lambda path: 'digest')
+    (tmp_path / 'columns').mkdir()
+    (tmp_path / 'columns' / f'digest.unsupported-{columns.COLUMNS_FORMAT - 1}').write_text('old')
+
+    stage = StageMetrics('columns')
+    assert cache.table(source, stage).rows == 1
+    assert stage.extra['columns'] == 'built'
+
+    # An input unsupported by this format is retried by the next one
+    (tmp_path / 'columns' / 'digest').rename(tmp_path / 'columns' / 'old-table')
+    (tmp_path / 'columns' / f'digest.unsupported-{columns.COLUMNS_FORMAT}').write_text('reason')
+    assert cache.table(source) is None
+    monkeypatch.setattr(columns, 'COLUMNS_FORMAT', columns.COLUMNS_FORMAT + 1)
+    stage = StageMetrics('columns')
+    assert cache.table(source, stage).rows == 1
+    assert stage.extra['columns'] == 'built'
@@ -0,0 +1,66 @@
+"""Facet @type bitsets: every @type shape and the bounded memos."""
+
+from af_common.facets import FacetTypes, facet_list
+
+
+def facet_types(cache_limit=16):
+    types = FacetTypes(cache_limit)
+    return types, types.register('MftFacet'), types.register('FileFacet')
+
+
+def test_type_shapes():
+    types, mft, file = facet_types()
+    assert types.kinds({'@type': 'dfc-ext:MftFacet'}) == mft
+    assert types.kinds({'@type': ['dfc-ext:MftFacet']}) == mft
+    assert types.kinds({'@type': ['dfc-ext:MftFacet', 'core:Facet']}) == mft
+    assert types.kinds({'@type': ['core:Facet', 'observable:FileFacet']}) == file
+    assert types.kinds({'@type': ['dfc-ext:MftFacet', 'core:Facet', 'observable:FileFacet']}) == mft | file
+    assert types.kinds({'@type': []}) == 0
+    assert types.kinds({}) == 0
+    assert types.kinds('dfc-ext:MftFacet') == 0
+    # Names match within a member, not across two
+    assert types.kinds({'@type': ['Mft', 'Facet']}) == 0
+
+
+def test_repeated_lookups_agree():
+    types, mft, file = facet_types()
+    # Fresh lists each time, as the decoder builds them
+    for _ in range(3):
+        assert types.kinds({'@type': ['dfc-ext:MftFacet', 'core:Facet']}) == mft
+        assert types.kinds({'@type': ['dfc-ext:MftFacet', 'observable:FileFacet']}) == mft | file
+        assert types.kinds({'@type': ['observable:FileFacet', 'dfc-ext:MftFacet']}) == mft | file
+
+
+def test_unhashable_types():
+    types, mft, _ = facet_types()
+    assert types.kinds({'@type': {'@id': 'dfc-ext:MftFacet'}}) == 0
+    assert types.kinds({'@type': [['dfc-ext:MftFacet'], 'core:Facet']}) == 0
+    assert types.kinds({'@type': ['dfc-ext:MftFacet', ['core:Facet']]}) == 0
+    assert types.kinds({'@type': ['dfc-ext:MftFacet', 'core:Facet', ['x']]}) == 0
+    assert types.kinds({'@type': ['dfc-ext:MftFacet', 'core:Facet']}) == mft
+
+
+def test_register_resets_the_memos():
+    types, mft, _ = facet_types()
+    assert types.kinds({'@type': ['dfc-ext:UsnFacet', 'core:Facet']}) == 0
+    assert types.kinds({'@type': 'dfc-ext:UsnFacet'}) == 0
+    usn = types.register('UsnFacet')
+    assert types.kinds({'@type': ['dfc-ext:UsnFacet', 'core:Facet']}) == usn
+    assert types.kinds({'@type': 'dfc-ext:UsnFacet'}) == usn
+
+
+def test_memos_are_bounded():
+    types, mft, _ = facet_types(cache_limit=8)
+    for i in range(100):
+        assert types.kinds({'@type': [f'x:MftFacet{i}', f'core:Facet{i % 3}']}) == mft
+        assert types.kinds({'@type': f'x:MftFacet{i}'}) == mft
+    assert types._pair_count <= 8
+    assert sum(map(len, types._pairs.values())) <= 8
+    assert len(types._memo) <= 8
+
+
+def test_facet_list():
+    facets = [{'@type': 'a'}]
+    assert facet_list(facets) is facets
+    assert facet_list({'@type': 'a'}) == ({'@type': 'a'},)
+    assert facet_list(None) == ()
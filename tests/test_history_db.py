@@ -0,0 +1,100 @@
+"""AF-002 on a Chrome History SQLite database against its JSON-LD export."""
+
+import json
+import sqlite3
+
+from conftest import REPO_ROOT, run_script, write_jsonld
+from af_common.history_db import is_history_db, iter_urls
+
+AF002 = REPO_ROOT / 'AF-002'
+SAMPLES = AF002 / 'stream_output'
+MFT = SAMPLES / 'mft_indexeddb_filtered.jsonld'
+USN = SAMPLES / 'usn_history_filtered.jsonld'
+HISTORY_JSONLD = SAMPLES / 'history_all.jsonld'
+
+
+def export_urls(path):
+    """The URLFacet fullValues of a History JSON-LD export, in export order."""
+    graph = json.loads(path.read_text())['@graph']
+    return [facet['observable:fullValue']
+            for node in graph for facet in node.get('uco-core:hasFacet', [])
+            if 'observable:fullValue' in facet]
+
+
+def write_history_db(path, urls):
+    """A History database with Chrome's urls table holding urls."""
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE urls (id INTEGER PRIMARY KEY AUTOINCREMENT, url LONGVARCHAR, "
+                 "title LONGVARCHAR, visit_count INTEGER DEFAULT 0 NOT NULL, "
+                 "last_visit_time INTEGER NOT NULL)")
+    conn.executemany("INSERT INTO urls (url, title, last_visit_time) VALUES (?, '', 0)",
+                     [(url,) for url in urls])
+    conn.commit()
+    conn.close()
+    return path
+
+
+def write_history_jsonld(path, urls):
+    """A History JSON-LD export with one URL object per url."""
+    graph = [{'@id': f'kb:url--{i}', '@type': 'observable:URL',
+              'core:hasFacet': [{'@id': f'kb:url-facet--{i}', '@type': 'observable:URLFacet',
+                                 'observable:fullValue': url}]}
+             for i, url in enumerate(urls)]
+    return write_jsonld(path, graph)
+
+
+def detect(history, tmp_path, name):
+    metrics = tmp_path / f'{name}.json'
+    result = run_script(AF002 / 'detect_af002.py', MFT, history, USN,
+                        '--no-cache', '--metrics-json', metrics)
+    # The report, without the line naming the metrics file
+    report = [line for line in result.stdout[result.stdout.index('Running AF-002'):].splitlines()
+              if str(metrics) not in line]
+    stages = {stage['name']: stage for stage in json.loads(metrics.read_text())['stages']}
+    return result.returncode, report, stages
+
+
+def test_is_history_db(tmp_path):
+    assert is_history_db(write_history_db(tmp_path / 'History', ['https://a.example/']))
+    assert not is_history_db(HISTORY_JSONLD)
+    assert not is_history_db(tmp_path / 'missing')
+
+
+def test_iter_urls_stops_early(tmp_path):
+    db = write_history_db(tmp_path / 'History', [f'https://{i}.example/' for i in range(50)])
+    urls = iter_urls(db, batch_size=8)
+    assert [next(urls) for _ in range(3)] == [f'https://{i}.example/' for i in range(3)]
+    urls.close()
+    assert list(iter_urls(db)) == [f'https://{i}.example/' for i in range(50)]
+
+
+def test_database_matches_export(tmp_path):
+    db = write_history_db(tmp_path / 'History', export_urls(HISTORY_JSONLD))
+
+    exit_jsonld, report_jsonld, _ = detect(HISTORY_JSONLD, tmp_path, 'jsonld')
+    exit_db, report_db, stages = detect(db, tmp_path, 'db')
+
+    assert exit_jsonld == exit_db == 2
+    assert report_db == report_jsonld
+    # youtube.com is never found, so every URL is read
+    assert stages['history']['records'] == len(export_urls(HISTORY_JSONLD))
+    assert (stages['history']['domains'], stages['history']['domains_found']) == (2, 1)
+
+
+def test_database_matches_export_all_domains_found(tmp_path):
+    # The MFT names IndexedDB folders of youtube.com and reddit.com
+    urls = (['https://www.youtube.com/watch?v=1', 'https://www.google.com/',
+             'https://www.reddit.com/']
+            + [f'https://www.site{i}.example/' for i in range(200)])
+    jsonld = write_history_jsonld(tmp_path / 'history.jsonld', urls)
+    db = write_history_db(tmp_path / 'History', urls)
+
+    exit_jsonld, report_jsonld, _ = detect(jsonld, tmp_path, 'jsonld')
+    exit_db, report_db, stages = detect(db, tmp_path, 'db')
+
+    assert exit_jsonld == exit_db == 0
+    assert report_db == report_jsonld
+    assert '✓ No selective deletion detected' in report_db
+    # The scan stops at the URL that holds the last MFT domain
+    assert stages['history']['domains'] == stages['history']['domains_found'] == 2
+    assert stages['history']['records'] == 3
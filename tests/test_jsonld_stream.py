@@ -0,0 +1,81 @@
+"""JsonLdReader on the top-level key orders JSON-LD allows."""
+
+import json
+
+import pytest
+
+from conftest import mft_entry
+from af_common.jsonld_stream import JsonLdFormatError, JsonLdReader
+from af_common.stream_filter import filter_jsonld
+
+UCO_CONTEXT = {
+    'uco-core': 'https://ontology.unifiedcyberontology.org/uco/core/',
+    'uco-observable': 'https://ontology.unifiedcyberontology.org/uco/observable/',
+    'dfc-ext': 'https://www.w3.org/dfc-ext/',
+    'xsd': 'http://www.w3.org/2001/XMLSchema#',
+    'kb': 'http://example.org/kb/',
+}
+
+
+def uco_entry(n):
+    """An MFT entry spelled with the uco-* prefixes, which the reader rewrites."""
+    return json.loads(json.dumps(mft_entry(n, f'file{n}.txt', '.\\Users'))
+                      .replace('"core:', '"uco-core:').replace('"observable:', '"uco-observable:'))
+
+
+def write(path, document):
+    path.write_text(json.dumps(document, indent=2))
+    return path
+
+
+@pytest.mark.parametrize('order', ['context_first', 'context_last'])
+def test_context_in_either_position(tmp_path, order):
+    graph = [uco_entry(n) for n in range(3)]
+    members = [('@context', UCO_CONTEXT), ('@graph', graph)]
+    if order == 'context_last':
+        members.reverse()
+    path = write(tmp_path / 'in.jsonld', dict(members))
+
+    with JsonLdReader(path, canonical_keys=True) as reader:
+        assert reader.source_context == UCO_CONTEXT
+        entries = [entry for entry, _ in reader]
+    assert [entry['core:hasFacet'][0]['observable:fileName'] for entry in entries] \
+        == ['file0.txt', 'file1.txt', 'file2.txt']
+
+    output = tmp_path / 'out.jsonld'
+    assert filter_jsonld(path, output, lambda entry: True) == (3, 3)
+    filtered = json.loads(output.read_text())
+    assert filtered['@context']['uco-core'] == UCO_CONTEXT['uco-core']
+    assert filtered['@context']['core'] == UCO_CONTEXT['uco-core']
+    assert [entry['@id'] for entry in filtered['@graph']] == [entry['@id'] for entry in graph]
+    assert 'core:hasFacet' in filtered['@graph'][0]
+
+
+def test_context_last_resumes_at_an_offset(tmp_path):
+    path = write(tmp_path / 'in.jsonld', {'@graph': [uco_entry(n) for n in range(4)],
+                                          '@context': UCO_CONTEXT})
+    with JsonLdReader(path) as reader:
+        offsets = [offset for _, offset in reader]
+    with JsonLdReader(path, start_offset=offsets[1], canonical_keys=True) as reader:
+        assert reader.source_context == UCO_CONTEXT
+        assert [entry['@id'] for entry, _ in reader] == ['kb:mft-entry--2-1', 'kb:mft-entry--3-1']
+
+
+def test_other_trailing_members(tmp_path):
+    path = write(tmp_path / 'in.jsonld', {'@context': UCO_CONTEXT,
+                                          '@graph': [uco_entry(1)], 'note': [1, 2]})
+    with JsonLdReader(path) as reader:
+        assert len(list(reader)) == 1
+        assert reader.trailer == {'note': [1, 2]}
+
+
+def test_missed_trailing_context_is_refused(tmp_path):
+    # A trailing @context outside the tail checked up front, behind a member
+    # whose value ends like the @graph array
+    context = {**UCO_CONTEXT, **{f'p{i}': f'http://example.org/{i:06}/' for i in range(3000)}}
+    path = write(tmp_path / 'in.jsonld', {'@graph': [uco_entry(1)], '@context': context,
+                                          'note': [1]})
+    with JsonLdReader(path) as reader:
+        assert reader.context is None
+        with pytest.raises(JsonLdFormatError, match='@context after @graph'):
+            list(reader)
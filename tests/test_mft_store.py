@@ -0,0 +1,75 @@
+"""MFT store: build, lookups, probes and export entries."""
+
+import os
+import random
+
+import pytest
+
+from conftest import mft_entry, write_jsonld
+from af_common.metrics import StageMetrics
+from af_common.mft_store import FENCE_STRIDE, MftStore, build_store
+
+
+@pytest.fixture
+def mft_file(tmp_path):
+    # Shuffled entry numbers, a reused entry (two sequence numbers) and
+    # enough records for several fence blocks
+    numbers = list(range(10, 10 + 3 * FENCE_STRIDE))
+    random.Random(1).shuffle(numbers)
+    entries = [mft_entry(n, f'file{n}.txt', f'.\\dir{n % 7}') for n in numbers]
+    entries.append(mft_entry(20, 'reused.txt', '.\\Users', sequence_number=2))
+    entries.append(mft_entry(100, 'Logs', '.\\Windows\\System32\\winevt', sequence_number=4))
+    entries.append({'@id': 'kb:event', '@type': 'observable:EventRecord'})
+    return write_jsonld(tmp_path / 'mft.jsonld', entries)
+
+
+@pytest.mark.parametrize('run_size', [100_000, 50])
+def test_build_sorts_by_entry_number(tmp_path, mft_file, run_size):
+    stage = StageMetrics('build')
+    count = build_store(mft_file, tmp_path / 'mft.afms', run_size=run_size, metrics=stage)
+    assert count == 3 * FENCE_STRIDE + 2
+    assert stage.extra['spilled_runs'] == (0 if run_size == 100_000 else 8)
+    with MftStore(tmp_path / 'mft.afms') as store:
+        records = list(store)
+        assert len(store) == count
+        assert store.source_entries == count + 1
+    keys = [r.entry_number for r in records]
+    assert keys == sorted(keys)
+
+
+def test_lookup_and_probe(tmp_path, mft_file):
+    build_store(mft_file, tmp_path / 'mft.afms')
+    with MftStore(tmp_path / 'mft.afms') as store:
+        assert [r.path for r in store.lookup(20)] == ['.\\dir6\\file20.txt', '.\\Users\\reused.txt']
+        assert [r.file_name for r in store.lookup(20, 2)] == ['reused.txt']
+        assert store.lookup(5) == [] and store.lookup(10_000) == []
+
+        wanted = [300, 11, 20, 11, 10_000, 10 + 3 * FENCE_STRIDE - 1]
+        probed = [(r.entry_number, r.sequence_number) for r in store.probe(wanted)]
+        looked_up = [(r.entry_number, r.sequence_number)
+                     for n in sorted(set(wanted)) for r in store.lookup(n)]
+        assert probed == looked_up
+        assert [n for n, _ in probed] == [11, 20, 20, 300, 10 + 3 * FENCE_STRIDE - 1]
+
+
+def test_entries_come_from_the_export(tmp_path, mft_file):
+    build_store(mft_file, tmp_path / 'mft.afms')
+    with MftStore(tmp_path / 'mft.afms') as store:
+        found = list(store.entries(store.lookup(20)))
+    assert [entry['@id'] for _, entry in found] == ['kb:mft-entry--20-1', 'kb:mft-entry--20-2']
+
+
+def test_changed_export_is_refused(tmp_path, mft_file):
+    build_store(mft_file, tmp_path / 'mft.afms')
+    with open(mft_file, 'a') as f:
+        f.write('\n')
+    with MftStore(tmp_path / 'mft.afms') as store:
+        with pytest.raises(ValueError, match='rebuild'):
+            store.check_source(mft_file)
+
+
+def test_not_a_store(tmp_path):
+    (tmp_path / 'other.afms').write_bytes(os.urandom(64))
+    with pytest.raises(ValueError, match='not an MFT store'):
+        MftStore(tmp_path / 'other.afms')
+
@@ -0,0 +1,52 @@
+"""ParentPaths: USN parent references resolved through an MFT store."""
+
+import pytest
+
+from conftest import mft_entry, usn_entry, write_jsonld
+from af_common.mft_store import MftStore, build_store
+from af_common.parent_paths import ParentPaths
+
+
+@pytest.fixture
+def paths(tmp_path):
+    entries = [mft_entry(100, 'Logs', '.\\Windows\\System32\\winevt', sequence_number=4),
+               mft_entry(200, 'Default', '.\\Users\\a\\AppData\\Local\\Google\\Chrome\\User Data')]
+    build_store(write_jsonld(tmp_path / 'mft.jsonld', entries), tmp_path / 'mft.afms')
+    paths = ParentPaths(MftStore(tmp_path / 'mft.afms'))
+    yield paths
+    paths.close()
+
+
+def usn_facet(file_name, parent_entry_number):
+    return usn_entry(1, 500, file_name, 'DataTruncation', '2024-01-01T00:00:00Z',
+                     parent_entry_number=parent_entry_number)['core:hasFacet'][1]
+
+
+def test_resolves_matching_sequence_numbers_only(paths):
+    security = usn_facet('Security.evtx', 100)
+    assert paths.file_path(security, 'Security.evtx') is None   # sequence 2, not 4
+    security['dfc-ext:parentSequenceNumber']['@value'] = '4'
+    assert paths.file_path(security, 'Security.evtx') \
+        == '.\\Windows\\System32\\winevt\\Logs\\Security.evtx'
+    assert paths.stats()['resolved'] == 1 and paths.stats()['unresolved'] == 1
+
+
+def test_export_parent_path_wins(paths):
+    history = usn_facet('History', 300)
+    history['dfc-ext:parentPath'] = 'C:\\Profile'
+    assert paths.file_path(history, 'History') == 'C:\\Profile\\History'
+    assert paths.stats()['resolved'] == paths.stats()['unresolved'] == 0
+
+
+def test_unknown_parent_is_unresolved(paths):
+    assert paths.file_path(usn_facet('History', 300), 'History') is None
+    assert paths.stats()['unresolved'] == 1
+
+
+def test_lookups_are_cached(paths):
+    for _ in range(3):
+        facet = usn_facet('History', 200)
+        facet['dfc-ext:parentSequenceNumber']['@value'] = '1'
+        assert paths.file_path(facet, 'History').endswith('\\User Data\\Default\\History')
+    stats = paths.stats()
+    assert (stats['resolved'], stats['cache_misses'], stats['cache_hits']) == (3, 1, 2)
@@ -0,0 +1,64 @@
+"""Pipeline stages: order, errors, early exit and configuration."""
+
+import argparse
+
+import pytest
+
+from af_common.pipeline import (
+    INLINE, Pipeline, PipelineConfig, add_pipeline_arguments, pipeline_config,
+)
+
+
+def test_stage_keeps_order():
+    with Pipeline(PipelineConfig(batch_size=7)) as pipeline:
+        squares = pipeline.stage('square', (i * i for i in range(1000)), depth=2)
+        assert list(squares) == [i * i for i in range(1000)]
+        assert pipeline.stats()['square']['items'] > 0
+
+
+def test_depth_zero_is_inline():
+    items = iter(range(5))
+    with Pipeline(INLINE) as pipeline:
+        assert pipeline.stage('inline', items, depth=0) is items
+        assert pipeline.stats() == {}
+
+
+def test_stage_error_reaches_consumer():
+    def failing():
+        yield 1
+        raise KeyError('boom')
+
+    with Pipeline(PipelineConfig(batch_size=1)) as pipeline:
+        stage = pipeline.stage('failing', failing(), depth=1)
+        assert next(stage) == 1
+        with pytest.raises(KeyError):
+            list(stage)
+
+
+def test_consumer_may_stop_early():
+    with Pipeline(PipelineConfig(batch_size=1)) as pipeline:
+        stage = pipeline.stage('endless', iter(int, 1), depth=1)
+        assert next(stage) == 0
+    # Leaving the block stopped the producer thread
+    assert all(not thread.is_alive() for thread in pipeline._threads)
+
+
+def test_read_ahead_returns_the_file(tmp_path):
+    data = bytes(range(256)) * 1000
+    path = tmp_path / 'data.bin'
+    path.write_bytes(data)
+    with Pipeline(PipelineConfig(block_size=4096)) as pipeline, open(path, 'rb') as f:
+        reader = pipeline.read_ahead(f)
+        blocks = iter(lambda: reader.read(4096), b'')
+        assert b''.join(blocks) == data
+
+
+def test_pipeline_config_from_arguments():
+    parser = argparse.ArgumentParser()
+    add_pipeline_arguments(parser)
+    config = pipeline_config(parser.parse_args(['--read-ahead', '0', '--block-size', '4096']))
+    assert config.read_ahead == 0 and config.block_size == 4096
+    with pytest.raises(ValueError):
+        pipeline_config(parser.parse_args(['--decode-queue', '-1']))
+    with pytest.raises(ValueError):
+        pipeline_config(parser.parse_args(['--block-size', '0']))
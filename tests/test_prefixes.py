@@ -0,0 +1,132 @@
+"""KeyRewriter: canonical compact keys whatever prefixes a document uses."""
+
+import json
+
+from conftest import write_jsonld
+from af_common.jsonld_stream import JsonLdReader
+from af_common.prefixes import KeyRewriter
+
+UCO_CORE = 'https://ontology.unifiedcyberontology.org/uco/core/'
+OBSERVABLE = 'https://ontology.unifiedcyberontology.org/uco/observable/'
+
+
+def test_canonical_context_needs_no_rewriter():
+    assert KeyRewriter.from_context({'core': UCO_CORE, 'observable': OBSERVABLE}) is None
+
+
+def test_alias_prefix_is_rewritten():
+    rewriter = KeyRewriter.from_context({'core': UCO_CORE, 'uco-core': UCO_CORE})
+    assert rewriter.markers == ('uco-core:',)
+    entry = {'@type': 'uco-core:Action',
+             'uco-core:hasFacet': [{'@type': ['uco-core:Facet', 'other:Thing'],
+                                    'uco-core:name': 'x'}]}
+    assert rewriter.rewrite(entry) == {
+        '@type': 'core:Action',
+        'core:hasFacet': [{'@type': ['core:Facet', 'other:Thing'], 'core:name': 'x'}]}
+
+
+def test_vocab_terms_and_keyword_aliases():
+    rewriter = KeyRewriter.from_context({'@vocab': OBSERVABLE, 'type': '@type',
+                                         'hasFacet': {'@id': UCO_CORE + 'hasFacet'}})
+    assert rewriter.markers is None
+    entry = rewriter.rewrite({'type': 'URL', 'hasFacet': [{'type': 'URLFacet',
+                                                           'fullValue': 'https://a/'}]})
+    assert entry == {'@type': 'observable:URL',
+                     'core:hasFacet': [{'@type': 'observable:URLFacet',
+                                        'observable:fullValue': 'https://a/'}]}
+
+
+def test_redefined_canonical_prefix_is_not_used():
+    # "uco-core:" cannot become "core:", so there is nothing to rewrite
+    assert KeyRewriter.from_context({'core': 'http://example.org/core/',
+                                     'uco-core': UCO_CORE}) is None
+
+
+def test_two_spellings_of_one_property_merge():
+    rewriter = KeyRewriter.from_context({'core': UCO_CORE, 'uco-core': UCO_CORE})
+    entry = rewriter.rewrite({'core:hasFacet': [{'@id': 'a'}], 'uco-core:hasFacet': {'@id': 'b'}})
+    assert entry == {'core:hasFacet': [{'@id': 'a'}, {'@id': 'b'}]}
+
+
+def test_context_gains_the_canonical_prefixes():
+    rewriter = KeyRewriter.from_context({'uco-core': UCO_CORE})
+    assert rewriter.context({'uco-core': UCO_CORE})['core'] == UCO_CORE
+
+
+def test_reader_yields_canonical_keys(tmp_path):
+    source = write_jsonld(tmp_path / 'events.jsonld', [
+        {'@id': 'kb:a', '@type': 'uco-core:Action', 'uco-core:name': 'one'},
+        {'@id': 'kb:b', '@type': 'core:Action', 'core:name': 'two'},
+    ], context={'core': UCO_CORE, 'uco-core': UCO_CORE, 'kb': 'http://example.org/kb/'})
+    with JsonLdReader(source, canonical_keys=True) as reader:
+        entries = [entry for entry, _ in reader]
+    assert [(e['@type'], e['core:name']) for e in entries] \
+        == [('core:Action', 'one'), ('core:Action', 'two')]
+    with JsonLdReader(source) as reader:
+        assert json.dumps([entry for entry, _ in reader]).count('uco-core:') == 2
+
+
+
+TYPED_CONTEXT = {
+    'core': UCO_CORE, 'uco-core': UCO_CORE, 'kb': 'http://example.org/kb/',
+    'dfc-ext': 'https://www.w3.org/dfc-ext/', 'xsd': 'http://www.w3.org/2001/XMLSchema#',
+    'created': {'@id': 'dfc-ext:created0x10', '@type': 'xsd:dateTime'},
+    'uco-core:object': {'@type': '@id'},
+    'label': {'@id': 'uco-core:name', '@language': 'en'},
+    'steps': {'@id': 'uco-core:step', '@container': '@list'},
+}
+
+
+def test_renamed_terms_take_their_coercion_into_the_values():
+    rewriter = KeyRewriter.from_context(TYPED_CONTEXT)
+    entry = rewriter.rewrite({'created': '2024-01-01T00:00:00Z', 'uco-core:object': 'kb:b',
+                              'label': ['x', {'@value': 'y', '@language': 'fr'}],
+                              'steps': ['a', 'b']})
+    assert entry == {
+        'dfc-ext:created0x10': {'@value': '2024-01-01T00:00:00Z', '@type': 'xsd:dateTime'},
+        'core:object': {'@id': 'kb:b'},
+        'core:name': [{'@value': 'x', '@language': 'en'}, {'@value': 'y', '@language': 'fr'}],
+        'core:step': {'@list': ['a', 'b']},
+    }
+    # The context is not changed for them
+    assert 'core:name' not in rewriter.context(TYPED_CONTEXT)
+
+
+def test_terms_that_cannot_be_moved_are_kept():
+    rewriter = KeyRewriter.from_context({
+        'core': UCO_CORE, 'uco-core': UCO_CORE,
+        'core:name': {'@language': 'de'},
+        'parent': {'@reverse': 'uco-core:hasChild'},
+        'titles': {'@id': 'uco-core:title', '@container': '@language'},
+        'kind': {'@id': 'uco-core:kind', '@type': '@vocab'},
+    })
+    entry = rewriter.rewrite({'uco-core:name': 'x', 'parent': {'@id': 'kb:p'},
+                              'titles': {'en': 't'}, 'kind': 'Thing', 'uco-core:tag': 't'})
+    # uco-core:name would take on the @language of the core:name term
+    assert list(entry) == ['uco-core:name', 'parent', 'titles', 'kind', 'core:tag']
+
+
+def test_filtered_output_expands_to_the_same_triples(tmp_path):
+    from rdflib import Graph, Literal, URIRef
+    from rdflib.compare import isomorphic
+    from rdflib.namespace import XSD
+    from af_common.stream_filter import filter_jsonld
+
+    source = write_jsonld(tmp_path / 'in.jsonld', [
+        {'@id': 'kb:a', '@type': 'uco-core:Action', 'created': '2024-01-01T00:00:00Z',
+         'uco-core:object': 'kb:b', 'label': 'x', 'steps': ['one', 'two'],
+         'uco-core:hasFacet': [{'@id': 'kb:a-facet', '@type': 'uco-core:Facet',
+                                'created': '2024-01-02T00:00:00Z'}]},
+        # The canonical spellings, used without coercion
+        {'@id': 'kb:b', '@type': 'core:Action', 'core:name': 'plain', 'core:step': 'one'},
+    ], context=TYPED_CONTEXT)
+    output = tmp_path / 'out.jsonld'
+    assert filter_jsonld(source, output, lambda entry: True) == (2, 2)
+    assert 'dfc-ext:created0x10' in json.loads(output.read_text())['@graph'][0]
+
+    expanded = [Graph().parse(path, format='json-ld') for path in (source, output)]
+    assert isomorphic(*expanded)
+    objects = set(expanded[1].objects(URIRef('http://example.org/kb/a')))
+    assert Literal('2024-01-01T00:00:00Z', datatype=XSD.dateTime) in objects
+    assert URIRef('http://example.org/kb/b') in objects
+    assert Literal('x', lang='en') in objects
@@ -0,0 +1,55 @@
+"""run_query(): full, first-hit and row-by-row evaluation."""
+
+from rdflib import Graph, Literal, URIRef
+
+from af_common.query import run_query, without_order_by
+
+EX = 'http://example.org/'
+QUERY = f"SELECT ?s ?n WHERE {{ ?s <{EX}n> ?n }}"
+
+
+def graph(count):
+    g = Graph()
+    for i in range(count):
+        g.add((URIRef(f'{EX}s{i}'), URIRef(f'{EX}n'), Literal(i)))
+    return g
+
+
+def test_without_order_by():
+    assert without_order_by(QUERY + ' ORDER BY ?n') == QUERY + ' '
+    assert without_order_by(QUERY + ' ORDER BY ?n LIMIT 5') == QUERY + ' LIMIT 5'
+    assert without_order_by(QUERY) == QUERY
+
+
+def test_first_hit_stops_at_the_first_positive():
+    g = graph(10)
+    assert len(run_query(g, QUERY + ' ORDER BY ?n')) == 10
+    assert len(run_query(g, QUERY + ' ORDER BY ?n', first_hit=True)) == 1
+    assert len(run_query(g, QUERY, first_hit=True, is_positive=lambda rows: len(rows) == 3)) == 3
+
+
+class LoggedTarget:
+    """A query target whose rows are produced one at a time, logging each."""
+
+    def __init__(self, count, log):
+        self.count = count
+        self.log = log
+
+    def query(self, query):
+        for i in range(self.count):
+            self.log.append(('yielded', i))
+            yield i
+
+
+def test_on_row_sees_each_row_before_the_next_is_evaluated():
+    log = []
+    rows = run_query(LoggedTarget(3, log), QUERY, on_row=lambda row: log.append(('row', row)))
+    assert rows == [0, 1, 2]
+    assert log == [('yielded', 0), ('row', 0), ('yielded', 1), ('row', 1),
+                   ('yielded', 2), ('row', 2)]
+
+
+def test_on_row_in_first_hit_mode():
+    seen = []
+    rows = run_query(graph(10), QUERY, first_hit=True, on_row=seen.append)
+    assert rows == seen and len(rows) == 1
@@ -0,0 +1,97 @@
+"""ResultCache keys, stored rows and engine ids."""
+
+from collections import namedtuple
+
+from af_common.metrics import RunMetrics
+from af_common.result_cache import ResultCache, engine_id, lookup
+
+Row = namedtuple('Row', ['domain', 'evidence'])
+
+
+def test_rows_round_trip(tmp_path):
+    cache = ResultCache(tmp_path / 'cache')
+    evidence = tmp_path / 'evidence.jsonld'
+    evidence.write_text('{}')
+    key = cache.key('SELECT ?x {}', [evidence], 'sparql/x')
+    assert cache.load(key) is None
+
+    cache.store(key, [Row('a.com', 'DataTruncation'), Row('b.com', None)], {'mft': 3})
+    hit = cache.load(key)
+    assert [tuple(row) for row in hit.rows] == [('a.com', 'DataTruncation'), ('b.com', None)]
+    assert hit.rows[0].domain == 'a.com'
+    assert hit.counts == {'mft': 3}
+
+
+def test_key_follows_rule_inputs_engine_and_options(tmp_path):
+    cache = ResultCache(tmp_path / 'cache')
+    evidence = tmp_path / 'evidence.jsonld'
+    evidence.write_text('{}')
+    key = cache.key('rule', [evidence], 'engine', {'first_hit': False})
+    assert key == cache.key('rule', [evidence], 'engine', {'first_hit': False})
+    assert key != cache.key('other rule', [evidence], 'engine', {'first_hit': False})
+    assert key != cache.key('rule', [evidence], 'other engine', {'first_hit': False})
+    assert key != cache.key('rule', [evidence], 'engine', {'first_hit': True})
+    evidence.write_text('{"@graph": []}')
+    assert key != cache.key('rule', [evidence], 'engine', {'first_hit': False})
+
+
+def test_unchanged_inputs_are_not_rehashed(tmp_path):
+    evidence = tmp_path / 'evidence.jsonld'
+    evidence.write_text('{}')
+    cache = ResultCache(tmp_path / 'cache')
+    digest = cache.file_digest(evidence)
+    assert cache.hashed_bytes == 2
+
+    again = ResultCache(tmp_path / 'cache')
+    assert again.file_digest(evidence) == digest
+    assert again.hashed_bytes == 0
+
+
+def test_damaged_result_is_recomputed(tmp_path):
+    cache = ResultCache(tmp_path / 'cache')
+    cache.store('k', [Row('a.com', 'x')], {})
+    (tmp_path / 'cache' / 'results' / 'k.json').write_text('{not json')
+    assert cache.load('k') is None
+
+
+def test_engine_id_follows_sources(tmp_path):
+    source = tmp_path / 'engine.py'
+    source.write_text('A = 1\n')
+    first = engine_id('native', source)
+    assert first.startswith('native/')
+    assert engine_id('sparql', source).startswith('sparql/rdflib-')
+    source.write_text('A = 2\n')
+    assert engine_id('native', source) != first
+
+
+def test_lookup_records_a_cache_stage(tmp_path):
+    cache = ResultCache(tmp_path / 'cache')
+    evidence = tmp_path / 'evidence.jsonld'
+    evidence.write_text('{}')
+    metrics = RunMetrics('test')
+    key, hit = lookup(cache, metrics, 'rule', [evidence], 'engine')
+    assert hit is None
+    cache.store(key, [Row('a.com', 'x')], {})
+    assert lookup(cache, metrics, 'rule', [evidence], 'engine')[1].rows[0].domain == 'a.com'
+    assert lookup(None, metrics, 'rule', [evidence], 'engine') == (None, None)
+
+
+def test_engine_id_covers_the_shared_engine_code(tmp_path, monkeypatch):
+    from af_common import result_cache
+
+    source = tmp_path / 'detector.py'
+    source.write_text('A = 1\n')
+    shared = tmp_path / 'query.py'
+    shared.write_text('B = 1\n')
+    monkeypatch.setitem(result_cache.ENGINE_SOURCES, 'sparql', (shared,))
+    first = engine_id('sparql', source)
+    shared.write_text('B = 2\n')
+    assert engine_id('sparql', source) != first
+
+
+def test_engine_sources_exist():
+    from af_common.result_cache import ENGINE_SOURCES
+
+    names = {path.name for paths in ENGINE_SOURCES.values() for path in paths}
+    assert {'query.py', 'graph_load.py', 'native.py', 'jsonld_stream.py', 'prefixes.py'} <= names
+    assert all(path.exists() for paths in ENGINE_SOURCES.values() for path in paths)
@@ -0,0 +1,57 @@
+"""Sampled triage estimates against exact counts."""
+
+import argparse
+
+import pytest
+
+from conftest import usn_entry, write_jsonld
+from af_common.sampling import SampleConfig, add_sampling_arguments, sample_jsonld, sampling_config
+
+
+def is_history(entry):
+    return entry['core:hasFacet'][0]['observable:fileName'] == 'History'
+
+
+@pytest.fixture
+def usn_file(tmp_path):
+    # One History record in ten
+    entries = [usn_entry(i, i, 'History' if i % 10 == 0 else f'file{i}.tmp', 'DataExtend',
+                         '2024-01-01T00:00:00Z') for i in range(2000)]
+    return write_jsonld(tmp_path / 'usn.jsonld', entries)
+
+
+def test_ranges_covering_the_input_are_exact(usn_file):
+    result = sample_jsonld(usn_file, is_history, SampleConfig(ranges=4, span=1 << 30))
+    assert result.exact
+    assert (result.entries, result.matched) == (2000, 200)
+    assert result.total.value == 2000 and result.matches.value == 200
+    assert result.fraction == 1.0
+
+
+def test_estimate_bounds_hold_the_count(usn_file):
+    config = SampleConfig(ranges=20, span=4096, seed=3)
+    result = sample_jsonld(usn_file, is_history, config)
+    assert not result.exact
+    assert 0 < result.entries < 2000
+    assert result.matches.low <= 200 <= result.matches.high
+    assert result.total.low <= 2000 <= result.total.high
+    assert result.matches.low >= result.matched
+    # The same seed reads the same ranges
+    assert sample_jsonld(usn_file, is_history, config) == result
+
+
+def test_no_match_still_bounds_the_count(usn_file):
+    result = sample_jsonld(usn_file, lambda entry: False, SampleConfig(ranges=10, span=4096))
+    assert result.matched == 0
+    assert result.matches.value == 0 and result.matches.high > 0
+
+
+def test_sampling_config_from_arguments():
+    parser = argparse.ArgumentParser()
+    add_sampling_arguments(parser)
+    assert sampling_config(parser.parse_args([])) is None
+    assert sampling_config(parser.parse_args(['--sample', '8', '--sample-seed', '2'])) \
+        == SampleConfig(8, seed=2)
+    for bad in (['--sample', '-1'], ['--sample', '8', '--confidence', '1']):
+        with pytest.raises(ValueError):
+            sampling_config(parser.parse_args(bad))
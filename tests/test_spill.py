@@ -0,0 +1,54 @@
+"""Memory budget, SpillingSet semi-joins and SpillingDistinct."""
+
+import pytest
+
+from af_common.spill import (
+    MemoryBudget, SpillingDistinct, SpillingSet, parse_size, semi_join_positions,
+)
+
+
+def test_parse_size():
+    assert parse_size('1048576') == 1 << 20
+    assert parse_size('64K') == 64 << 10
+    assert parse_size('512mb') == 512 << 20
+    assert parse_size('1.5G') == 3 << 29
+    with pytest.raises(ValueError):
+        parse_size('lots')
+
+
+def test_budget_reserve_and_release():
+    budget = MemoryBudget(100)
+    assert budget.reserve(60)
+    assert not budget.reserve(60)
+    budget.release(60)
+    assert budget.reserve(60)
+
+
+@pytest.mark.parametrize('limit', [1 << 30, 4096])
+def test_semi_join_matches_set_semantics(tmp_path, limit):
+    budget = MemoryBudget(limit, tmp_path)
+    build = SpillingSet(budget, 'refs')
+    for i in range(0, 3000, 3):
+        build.add(('ref', i))
+    assert build.spilled == (limit == 4096)
+
+    probe = [(position, [('ref', position), ('ref', position + 1)])
+             for position in range(0, 3000, 2)]
+    expected = [position for position, keys in probe
+                if any(key[1] % 3 == 0 for key in keys)]
+    assert list(semi_join_positions(build, iter(probe))) == expected
+
+
+@pytest.mark.parametrize('limit', [None, 1 << 30, 4096])
+def test_distinct_keeps_first_seen_order(tmp_path, limit):
+    budget = MemoryBudget(limit, tmp_path) if limit else None
+    distinct = SpillingDistinct(budget)
+    keys = [i * 7919 % 500 for i in range(2000)]
+    for position, key in enumerate(keys):
+        distinct.add(key, (key, position))
+    assert distinct.spilled == (limit == 4096)
+
+    first = {}
+    for position, key in enumerate(keys):
+        first.setdefault(key, (key, position))
+    assert list(distinct) == list(first.values())
@@ -0,0 +1,106 @@
+"""af_timeline.py build (spilled runs vs in-memory) and Timeline.query()."""
+
+import pytest
+
+from conftest import REPO_ROOT, mft_entry, run_script, usn_entry, write_jsonld
+from af_common.timeline import INDEX_STRIDE, MAX_FAN_IN, Timeline, format_ns, parse_time_ns
+
+BASE = parse_time_ns('2025-09-11T05:00:00Z')
+MFT_ENTRIES = 500
+USN_ENTRIES = 400
+
+
+def stamp(seconds):
+    """BASE + seconds, written as Timeline events print their time."""
+    return format_ns(BASE + int(seconds * 1_000_000_000))
+
+
+@pytest.fixture
+def sources(tmp_path):
+    # Out of time order, with equal times within and across sources, so the
+    # merge has to interleave runs and keep ties in input order
+    mft = write_jsonld(tmp_path / 'mft.jsonld', [
+        mft_entry(i, f'file{i}.txt', '.\\Users', created=stamp(i * 37 % 300))
+        for i in range(MFT_ENTRIES)])
+    usn = write_jsonld(tmp_path / 'usn.jsonld', [
+        usn_entry(1000 + i, i, f'file{i}.txt', 'DataExtend', stamp(i * 53 % 400 + 0.5))
+        for i in range(USN_ENTRIES)])
+    return mft, usn
+
+
+def build(tmp_path, sources, name, *args):
+    mft, usn = sources
+    output = tmp_path / name
+    result = run_script(REPO_ROOT / 'af_timeline.py', 'build', '-o', output,
+                        '--mft', mft, '--usn', usn, *args)
+    assert result.returncode == 0, result.stderr
+    return output, result.stdout
+
+
+def test_spilled_runs_merge_to_the_in_memory_file(tmp_path, sources):
+    in_memory, stdout = build(tmp_path, sources, 'memory.aftl')
+    assert 'sorted in memory' in stdout
+    # More runs than MAX_FAN_IN, so the runs are merged in two levels
+    run_size = 7
+    assert (MFT_ENTRIES + USN_ENTRIES) // run_size > MAX_FAN_IN
+    spilled, stdout = build(tmp_path, sources, 'spilled.aftl', '--run-size', run_size)
+    assert 'sorted run(s) merged' in stdout
+
+    assert spilled.read_bytes() == in_memory.read_bytes()
+    with Timeline(spilled) as timeline:
+        events = list(timeline.query())
+    assert len(events) == MFT_ENTRIES + USN_ENTRIES
+    assert [event.time_ns for event in events] == sorted(event.time_ns for event in events)
+    # Equal times keep input order
+    first = [event.node for event in events if event.iso == stamp(0)]
+    assert first == ['kb:mft-entry--0-1', 'kb:mft-entry--300-1']
+
+
+def test_query_ranges_and_filters(tmp_path, sources):
+    path, _ = build(tmp_path, sources, 'case.aftl', '--run-size', 100)
+    with Timeline(path) as timeline:
+        assert len(timeline) > 3 * INDEX_STRIDE
+        assert timeline.start_ns == parse_time_ns(stamp(0))
+        assert timeline.end_ns == parse_time_ns(stamp(399.5))
+        events = list(timeline.query())
+
+        def expected(low, high, sources=None, properties=None):
+            return [event for event in events
+                    if parse_time_ns(low) <= event.time_ns <= parse_time_ns(high)
+                    and (sources is None or event.source in sources)
+                    and (properties is None or event.property in properties)]
+
+        # Ranges starting before, on and between index points; bounds inclusive
+        for low, high in [(stamp(0), stamp(10)), (stamp(120), stamp(121.5)),
+                          (stamp(199.7), stamp(250)), (stamp(333.5), stamp(399.5)),
+                          (stamp(-60), stamp(1000))]:
+            found = list(timeline.query(low, high))
+            assert found == expected(low, high), (low, high)
+        assert [event.iso for event in timeline.query(stamp(121.5), stamp(121.5))] \
+            == [stamp(121.5)]
+        assert list(timeline.query(stamp(400), stamp(500))) == []
+
+        low, high = stamp(50), stamp(350)
+        usn = list(timeline.query(low, high, sources=['usn']))
+        assert usn and usn == expected(low, high, sources={'usn'})
+        assert all(event.detail == 'DataExtend' for event in usn)
+        created = list(timeline.query(low, high, properties=['created0x10']))
+        assert created and created == expected(low, high, sources={'mft'})
+        assert list(timeline.query(low, high, properties=['updateTimestamp'])) == usn
+        assert list(timeline.query(low, high, sources=['mft'],
+                                   properties=['updateTimestamp'])) == []
+        assert list(timeline.query(low, high, sources=['lnk'])) == []
+        assert list(timeline.query(low, high, sources=['usn'], limit=5)) == usn[:5]
+
+        assert list(timeline.window(stamp(200), 10)) == expected(stamp(190), stamp(210))
+
+
+def test_query_command(tmp_path, sources):
+    path, _ = build(tmp_path, sources, 'case.aftl')
+    result = run_script(REPO_ROOT / 'af_timeline.py', 'query', path, '--start', stamp(10),
+                        '--end', stamp(12), '--source', 'usn')
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.splitlines() == [
+        f"{stamp(10.5):<31} usn        updateTimestamp      file370.txt [DataExtend]",
+        f"{stamp(11.5):<31} usn        updateTimestamp      file287.txt [DataExtend]",
+    ]
@@ -0,0 +1,117 @@
+"""USN record coalescing into one span per file change."""
+
+import json
+
+from conftest import usn_entry, write_jsonld
+from af_common.usn_coalesce import UsnCoalescer, coalesce_jsonld
+
+
+def usn_facet(entry):
+    return entry['core:hasFacet'][1]
+
+
+def feed_all(coalescer, entries):
+    done = []
+    for entry in entries:
+        done.extend(coalescer.feed(entry))
+    return done + coalescer.flush()
+
+
+def test_one_span_per_file_change():
+    entries = [
+        usn_entry(1, 7, 'History', 'DataExtend', '2024-01-01T00:00:00Z'),
+        usn_entry(2, 7, 'History', 'DataOverwrite|DataExtend', '2024-01-01T00:00:01Z'),
+        usn_entry(3, 7, 'History', 'DataOverwrite|DataExtend|Close', '2024-01-01T00:00:02Z'),
+        usn_entry(4, 7, 'History', 'DataExtend', '2024-01-01T00:00:03Z'),
+    ]
+    coalescer = UsnCoalescer()
+    spans = feed_all(coalescer, entries)
+
+    assert (coalescer.records, coalescer.spans) == (4, 2)
+    first = usn_facet(spans[0])
+    assert spans[0]['@id'] == 'kb:usn-entry--1'
+    assert first['dfc-ext:updateReasons'] == 'DataExtend|DataOverwrite|Close'
+    assert first['dfc-ext:updateTimestamp']['@value'] == '2024-01-01T00:00:00Z'
+    assert first['dfc-ext:lastUpdateTimestamp']['@value'] == '2024-01-01T00:00:02Z'
+    assert first['dfc-ext:lastUpdateSequenceNumber']['@value'] == '3'
+    assert first['dfc-ext:coalescedRecords'] == {'@type': 'xsd:integer', '@value': '3'}
+    assert usn_facet(spans[1])['dfc-ext:coalescedRecords']['@value'] == '1'
+
+
+def test_files_are_kept_apart():
+    entries = [
+        usn_entry(1, 7, 'History', 'DataExtend', '2024-01-01T00:00:00Z'),
+        usn_entry(2, 8, 'Cookies', 'DataExtend', '2024-01-01T00:00:00Z'),
+        usn_entry(3, 7, 'History', 'Close', '2024-01-01T00:00:01Z'),
+        usn_entry(4, 8, 'Cookies', 'Close', '2024-01-01T00:00:01Z'),
+    ]
+    spans = feed_all(UsnCoalescer(), entries)
+    assert [span['@id'] for span in spans] == ['kb:usn-entry--1', 'kb:usn-entry--2']
+
+
+def test_rename_ends_the_span():
+    entries = [
+        usn_entry(1, 7, 'History', 'RenameOldName', '2024-01-01T00:00:00Z'),
+        usn_entry(2, 7, 'History.bak', 'RenameNewName|Close', '2024-01-01T00:00:00Z'),
+    ]
+    spans = feed_all(UsnCoalescer(), entries)
+    assert [usn_facet(span)['dfc-ext:updateReasons'] for span in spans] \
+        == ['RenameOldName', 'RenameNewName|Close']
+
+
+def test_long_spans_are_cut():
+    entries = [usn_entry(i, 7, 'Security.evtx', 'DataExtend', f'2024-01-01T00:0{i}:00Z')
+               for i in range(4)]
+    spans = feed_all(UsnCoalescer(max_span=90), entries)
+    assert [usn_facet(span)['dfc-ext:coalescedRecords']['@value'] for span in spans] == ['2', '2']
+
+
+def test_other_entries_pass_through():
+    other = {'@id': 'kb:event', '@type': 'observable:EventRecord'}
+    assert UsnCoalescer().feed(other) == [other]
+
+
+def test_open_spans_are_bounded():
+    coalescer = UsnCoalescer(max_open=2)
+    done = []
+    for i in range(5):
+        done.extend(coalescer.feed(usn_entry(i, i, f'f{i}', 'DataExtend', '2024-01-01T00:00:00Z')))
+    assert [span['@id'] for span in done] == ['kb:usn-entry--0', 'kb:usn-entry--1',
+                                              'kb:usn-entry--2']
+
+
+def test_coalesce_jsonld(tmp_path):
+    source = write_jsonld(tmp_path / 'usn.jsonld', [
+        usn_entry(1, 7, 'History', 'DataExtend', '2024-01-01T00:00:00Z'),
+        usn_entry(2, 7, 'History', 'DataOverwrite|Close', '2024-01-01T00:00:01Z'),
+    ])
+    assert coalesce_jsonld(source, tmp_path / 'out.jsonld') == (2, 1)
+    graph = json.loads((tmp_path / 'out.jsonld').read_text())['@graph']
+    assert [usn_facet(entry)['dfc-ext:updateReasons'] for entry in graph] \
+        == ['DataExtend|DataOverwrite|Close']
+
+
+def test_truncation_starts_its_own_span():
+    # Security.evtx: written at 00:00, truncated (log cleared) at 00:50
+    entries = [
+        usn_entry(1, 7, 'Security.evtx', 'DataExtend', '2024-01-01T00:00:00Z'),
+        usn_entry(2, 7, 'Security.evtx', 'DataExtend|DataTruncation', '2024-01-01T00:00:50Z'),
+        usn_entry(3, 7, 'Security.evtx', 'DataExtend|DataTruncation|Close',
+                  '2024-01-01T00:00:55Z'),
+    ]
+    spans = feed_all(UsnCoalescer(), entries)
+    facets = [usn_facet(span) for span in spans]
+    assert [f['dfc-ext:updateReasons'] for f in facets] \
+        == ['DataExtend', 'DataExtend|DataTruncation|Close']
+    # The truncation is timed by the record where it first appeared
+    assert facets[1]['dfc-ext:updateTimestamp']['@value'] == '2024-01-01T00:00:50Z'
+    assert facets[1]['dfc-ext:coalescedRecords']['@value'] == '2'
+
+
+def test_named_truncation_is_timed_too():
+    entries = [
+        usn_entry(1, 7, 'Security.evtx', 'NamedDataExtend', '2024-01-01T00:00:00Z'),
+        usn_entry(2, 7, 'Security.evtx', 'NamedDataTruncation', '2024-01-01T00:00:10Z'),
+    ]
+    assert len(feed_all(UsnCoalescer(), entries)) == 2
+    assert len(feed_all(UsnCoalescer(timed_reasons=()), entries)) == 1
@@ -0,0 +1,123 @@
+"""WorkQueue: leases, retries, dependencies, expired leases and timings."""
+
+import sqlite3
+import time
+
+import pytest
+
+from conftest import REPO_ROOT
+from af_common.registry import load_script
+
+from af_common.workqueue import WorkQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    with WorkQueue(tmp_path / 'queue.db') as queue:
+        yield queue
+
+
+def submit(queue, step, depends_on=(), max_attempts=3):
+    return queue.submit('b1', 'host1', 'AF-007', step, ['AF-007/x.py', step],
+                        depends_on=depends_on, max_attempts=max_attempts)
+
+
+def test_lease_runs_dependencies_first(queue):
+    filter_id = submit(queue, 'filter')
+    detect_id = submit(queue, 'detect', depends_on=[filter_id])
+    assert submit(queue, 'filter') == filter_id   # resubmitting is a no-op
+
+    job = queue.lease('w1', 60)
+    assert job.id == filter_id and job.command == ['AF-007/x.py', 'filter']
+    assert queue.lease('w2', 60) is None
+    assert queue.finish(filter_id, 'w1', 0) == 'done'
+
+    job = queue.lease('w2', 60)
+    assert job.id == detect_id
+    assert queue.finish(detect_id, 'w2', 2) == 'done'
+    assert queue.counts('b1')['done'] == 2
+
+
+def test_failed_job_is_retried_then_failed(queue):
+    job_id = submit(queue, 'filter', max_attempts=2)
+    dependent = submit(queue, 'detect', depends_on=[job_id])
+    assert queue.finish(queue.lease('w1', 60).id, 'w1', None, 'killed') == 'queued'
+    job = queue.lease('w1', 60)
+    assert job.attempts == 2
+    assert queue.finish(job.id, 'w1', None, 'killed') == 'failed'
+
+    assert queue.lease('w1', 60) is None
+    statuses = {job.id: (job.status, job.error) for job in queue.jobs('b1')}
+    assert statuses[job_id] == ('failed', 'killed')
+    assert statuses[dependent] == ('cancelled', 'a dependency failed')
+
+
+def test_expired_lease_is_leased_again(queue):
+    job_id = submit(queue, 'filter')
+    queue.lease('w1', -1)
+    job = queue.lease('w2', 60)
+    assert (job.id, job.worker, job.attempts) == (job_id, 'w2', 2)
+    # The first worker lost the job and cannot record a result
+    assert not queue.heartbeat(job_id, 'w1', 60)
+    assert queue.finish(job_id, 'w1', 0) == 'leased'
+    assert queue.heartbeat(job_id, 'w2', 60)
+    assert queue.finish(job_id, 'w2', 0) == 'done'
+
+
+def test_error_exit_code_is_not_retried(queue):
+    job_id = submit(queue, 'filter')
+    job = queue.lease('w1', 60)
+    assert queue.finish(job.id, 'w1', 1) == 'failed'
+    assert queue.lease('w1', 60) is None
+    (job,) = queue.jobs('b1')
+    assert (job.id, job.attempts, job.error) == (job_id, 1, 'exit code 1')
+
+
+def test_killed_job_is_retried(queue):
+    submit(queue, 'filter')
+    job = queue.lease('w1', 60)
+    assert queue.finish(job.id, 'w1', -9) == 'queued'
+
+
+def test_run_seconds_add_up_over_attempts(queue):
+    job_id = submit(queue, 'filter')
+    queue.lease('w1', 60)
+    time.sleep(0.05)
+    queue.finish(job_id, 'w1', None, 'killed')
+    queue.lease('w1', 60)
+    time.sleep(0.05)
+    queue.finish(job_id, 'w1', 0)
+    (job,) = queue.jobs('b1')
+    assert job.run_seconds >= 0.1
+    assert job.finished - job.started < job.run_seconds
+
+
+def test_older_queue_file_gains_run_seconds(tmp_path):
+    path = tmp_path / 'queue.db'
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE jobs (id TEXT PRIMARY KEY, batch TEXT NOT NULL, host TEXT NOT NULL,"
+               " rule TEXT NOT NULL, step TEXT NOT NULL, command TEXT NOT NULL,"
+               " depends_on TEXT NOT NULL DEFAULT '[]', log TEXT,"
+               " status TEXT NOT NULL DEFAULT 'queued', attempts INTEGER NOT NULL DEFAULT 0,"
+               " max_attempts INTEGER NOT NULL DEFAULT 3, worker TEXT, lease_expires REAL,"
+               " exit_code INTEGER, error TEXT, submitted REAL NOT NULL, started REAL,"
+               " finished REAL)")
+    db.execute("INSERT INTO jobs (id, batch, host, rule, step, command, submitted)"
+               " VALUES ('b1:h/r/s', 'b1', 'h', 'r', 's', '[]', 1.0)")
+    db.commit()
+    db.close()
+    with WorkQueue(path) as queue:
+        assert queue.jobs('b1')[0].run_seconds == 0
+
+
+def test_batch_elapsed_spans_the_batch(queue):
+    af_batch = load_script(REPO_ROOT / 'af_batch.py')
+    assert af_batch.batch_elapsed(queue, 'b1') == 0.0
+    job_id = submit(queue, 'filter')
+    queue.lease('w1', 60)
+    time.sleep(0.05)
+    queue.finish(job_id, 'w1', 0)
+    # Collected later (af_batch.py --no-wait, then rerun), the time is the same
+    time.sleep(0.05)
+    elapsed = af_batch.batch_elapsed(queue, 'b1')
+    assert 0.05 <= elapsed < 0.1